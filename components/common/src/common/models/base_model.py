@@ -15,8 +15,12 @@
 FireO BaseModel to be inherited by all other objects in ORM
 """
 import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 import fireo
+from google.api_core import exceptions as api_exceptions
 from fireo.models import Model
 from fireo.fields import DateTime, TextField
 from fireo.fields.errors import (RequiredField,
@@ -26,6 +30,24 @@ from fireo.fields.errors import (RequiredField,
 from common.utils.errors import ResourceNotFoundException
 import common.config
 
+# maximum number of values in a single Firestore "in" filter
+MAX_IN_QUERY_VALUES = 30
+
+# maximum number of writes in a single Firestore batch
+MAX_BATCH_WRITES = 500
+
+# number of batches committed in parallel by save_many
+SAVE_MANY_MAX_WORKERS = 8
+
+# number of times a failed batch commit is retried by save_many
+SAVE_MANY_MAX_RETRIES = 3
+
+# transient errors on which batch commits are retried
+RETRYABLE_COMMIT_ERRORS = (api_exceptions.Aborted,
+                           api_exceptions.DeadlineExceeded,
+                           api_exceptions.ResourceExhausted,
+                           api_exceptions.ServiceUnavailable,
+                           api_exceptions.InternalServerError)
 
 # pylint: disable = too-few-public-methods, arguments-renamed
 class BaseModel(Model):
@@ -68,6 +90,97 @@ class BaseModel(Model):
     self.last_modified_time = date_timestamp
     return super().save(transaction, batch, merge, no_return)
 
+  @classmethod
+  def save_many(cls, objects, input_datetime=None,
+                batch_size=MAX_BATCH_WRITES,
+                max_workers=SAVE_MANY_MAX_WORKERS):
+    """Saves many new objects with batched writes, stamping created and
+       last modified times as save does. Objects may be of different types.
+       Objects without an id are assigned one client-side, so ids are
+       available before the writes are committed.
+
+       Batches of up to batch_size writes are committed in parallel, and
+       retried with backoff on transient errors. Batches are not atomic
+       with each other: if a batch still fails after retries the exception
+       is raised, and other batches may have been written.
+    Args:
+      objects (list): objects to save
+      input_datetime (datetime, optional): timestamp to save objects with.
+        Defaults to now.
+      batch_size (int, optional): writes per batch, at most 500.
+      max_workers (int, optional): batches committed in parallel.
+    Returns:
+      list: the saved objects
+    """
+    objects = list(objects)
+    for obj in objects:
+      if not obj.id:
+        obj.id = obj.generate_id()
+    cls._write_many(objects, input_datetime, False, batch_size, max_workers)
+    return objects
+
+  @classmethod
+  def update_many(cls, objects, input_datetime=None,
+                  batch_size=MAX_BATCH_WRITES,
+                  max_workers=SAVE_MANY_MAX_WORKERS):
+    """Updates many existing objects with batched writes, stamping last
+       modified times as update does. Batching and retries are as for
+       save_many.
+    Args:
+      objects (list): objects to update
+      input_datetime (datetime, optional): last modified time to set.
+        Defaults to now.
+      batch_size (int, optional): writes per batch, at most 500.
+      max_workers (int, optional): batches committed in parallel.
+    Returns:
+      list: the updated objects
+    """
+    objects = list(objects)
+    cls._write_many(objects, input_datetime, True, batch_size, max_workers)
+    return objects
+
+  @classmethod
+  def _write_many(cls, objects, input_datetime, is_update, batch_size,
+                  max_workers):
+    if not objects:
+      return
+    if input_datetime is None:
+      input_datetime = datetime.datetime.utcnow()
+    object_batches = [objects[i:i + batch_size]
+                      for i in range(0, len(objects), batch_size)]
+    if len(object_batches) == 1:
+      cls._commit_batch(object_batches[0], input_datetime, is_update)
+    else:
+      with ThreadPoolExecutor(
+          max_workers=min(max_workers, len(object_batches))) as executor:
+        futures = [executor.submit(cls._commit_batch, object_batch,
+                                   input_datetime, is_update)
+                   for object_batch in object_batches]
+        for future in futures:
+          future.result()
+
+  @classmethod
+  def _commit_batch(cls, objects, input_datetime, is_update=False):
+    """Commits a batch of writes for objects, retrying transient errors.
+       Writes set whole documents or fields so a batch can safely be
+       retried.
+    """
+    for attempt in range(SAVE_MANY_MAX_RETRIES + 1):
+      batch = fireo.batch()
+      for obj in objects:
+        if is_update:
+          obj.update(input_datetime=input_datetime, batch=batch)
+        else:
+          obj.save(input_datetime=input_datetime, batch=batch)
+      try:
+        batch.commit()
+        return
+      except RETRYABLE_COMMIT_ERRORS:
+        if attempt == SAVE_MANY_MAX_RETRIES:
+          raise
+        # jittered exponential backoff
+        time.sleep(random.uniform(0, 2 ** attempt))
+
   def update(self,
              input_datetime=None,
              key=None,
@@ -146,6 +259,38 @@ class BaseModel(Model):
           f"{cls.collection_name} with id {doc_id} is not found")
     return obj
 
+  @classmethod
+  def generate_id(cls):
+    """Generates a new document id for this type client-side, without a
+       round-trip to the database. Useful when an id is needed before the
+       object is saved, e.g. for batched writes.
+        Returns:
+            str: a new unique document id
+        """
+    return fireo.db.conn.collection(cls.collection_name).document().id
+
+  @classmethod
+  def find_by_ids(cls, doc_ids):
+    """Looks up multiple objects of this type by id, using batched "in"
+       queries instead of one round-trip per id.
+        Args:
+            doc_ids (list): the document ids without collection_name
+        Returns:
+            dict: map of doc id to object, for the ids that were found and
+            are not soft deleted
+        """
+    objects = {}
+    doc_ids = list(dict.fromkeys(doc_ids))
+    for i in range(0, len(doc_ids), MAX_IN_QUERY_VALUES):
+      id_batch = doc_ids[i:i + MAX_IN_QUERY_VALUES]
+      batch_objects = cls.collection.filter("id", "in",
+                                            id_batch).filter(
+                                                "deleted_at_timestamp",
+                                                "==", None).fetch()
+      for obj in batch_objects:
+        objects[obj.id] = obj
+    return objects
+
   @classmethod
   def delete_by_id(cls, doc_id):
     """Deletes from the Database the object of this type by id (not key)
@@ -0,0 +1,167 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Unit tests for BaseModel batched writes and lookups
+"""
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=unused-argument,redefined-outer-name,unused-import,use-implicit-booleaness-not-comparison
+import datetime
+from unittest import mock
+import fireo
+import pytest
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1.batch import WriteBatch
+from common.models import QueryDocumentChunk
+from common.models.base_model import MAX_BATCH_WRITES, MAX_IN_QUERY_VALUES
+from common.testing.firestore_emulator import firestore_emulator, clean_firestore
+
+QUERY_ENGINE_ID = "fake-query-engine-id"
+QUERY_DOCUMENT_ID = "fake-query-document-id"
+
+
+def make_chunks(count):
+  return [QueryDocumentChunk(query_engine_id=QUERY_ENGINE_ID,
+                             query_document_id=QUERY_DOCUMENT_ID,
+                             index=i,
+                             text=f"chunk {i}")
+          for i in range(count)]
+
+def utc(dt):
+  """ naive UTC datetime as returned by Firestore """
+  return dt.replace(tzinfo=datetime.timezone.utc)
+
+def fetch_chunks():
+  return list(QueryDocumentChunk.collection.filter(
+      "query_engine_id", "==", QUERY_ENGINE_ID).fetch())
+
+@pytest.fixture
+def count_batches():
+  """ count batches committed, by wrapping fireo.batch """
+  batches = []
+  real_batch = fireo.batch
+  def batch():
+    batches.append(real_batch())
+    return batches[-1]
+  with mock.patch("fireo.batch", side_effect=batch):
+    yield batches
+
+
+def test_generate_id(firestore_emulator, clean_firestore):
+  ids = {QueryDocumentChunk.generate_id() for _ in range(100)}
+  assert len(ids) == 100, "generated ids are unique"
+  assert all(ids), "generated ids are not empty"
+
+
+def test_save_many(firestore_emulator, clean_firestore, count_batches):
+  num_chunks = MAX_BATCH_WRITES * 2 + 1
+  chunks = make_chunks(num_chunks)
+  saved_chunks = QueryDocumentChunk.save_many(chunks)
+
+  assert len(count_batches) == 3, "objects split into batches of 500"
+  assert saved_chunks == chunks
+  ids = [chunk.id for chunk in saved_chunks]
+  assert all(ids), "ids assigned client-side"
+  assert len(set(ids)) == num_chunks, "ids are unique"
+
+  stored_chunks = fetch_chunks()
+  assert len(stored_chunks) == num_chunks, "all objects written"
+  stored_chunk = QueryDocumentChunk.find_by_id(ids[-1])
+  assert stored_chunk.index == num_chunks - 1
+  assert stored_chunk.text == f"chunk {num_chunks - 1}"
+
+
+def test_save_many_timestamps(firestore_emulator, clean_firestore):
+  # timestamps match those set by save
+  saved_chunk = make_chunks(1)[0]
+  saved_chunk.save()
+  chunk = QueryDocumentChunk.save_many(make_chunks(1))[0]
+  assert chunk.created_time == chunk.last_modified_time
+  assert chunk.created_time >= saved_chunk.created_time
+
+  input_datetime = datetime.datetime(2024, 1, 2, 3, 4, 5)
+  chunks = QueryDocumentChunk.save_many(make_chunks(3),
+                                        input_datetime=input_datetime)
+  for chunk in chunks:
+    stored_chunk = QueryDocumentChunk.find_by_id(chunk.id)
+    assert stored_chunk.created_time == utc(input_datetime)
+    assert stored_chunk.last_modified_time == utc(input_datetime)
+
+
+def test_update_many(firestore_emulator, clean_firestore, count_batches):
+  created_datetime = datetime.datetime(2024, 1, 2, 3, 4, 5)
+  chunks = QueryDocumentChunk.save_many(make_chunks(MAX_BATCH_WRITES + 1),
+                                        input_datetime=created_datetime)
+  count_batches.clear()
+
+  chunks = fetch_chunks()
+  for chunk in chunks:
+    chunk.clean_text = f"clean {chunk.index}"
+  updated_datetime = datetime.datetime(2024, 2, 3, 4, 5, 6)
+  QueryDocumentChunk.update_many(chunks, input_datetime=updated_datetime)
+
+  assert len(count_batches) == 2, "objects split into batches of 500"
+  stored_chunks = fetch_chunks()
+  assert len(stored_chunks) == MAX_BATCH_WRITES + 1, "no objects added"
+  for chunk in stored_chunks:
+    assert chunk.clean_text == f"clean {chunk.index}", "object updated"
+    assert chunk.created_time == utc(created_datetime), \
+      "created time unchanged"
+    assert chunk.last_modified_time == utc(updated_datetime)
+
+
+def test_save_many_retry(firestore_emulator, clean_firestore, count_batches):
+  real_commit = WriteBatch.commit
+  commits = []
+  def commit(batch, *args, **kwargs):
+    commits.append(batch)
+    if len(commits) == 1:
+      raise api_exceptions.Aborted("transaction aborted")
+    return real_commit(batch, *args, **kwargs)
+
+  with mock.patch.object(WriteBatch, "commit", autospec=True,
+                         side_effect=commit), \
+       mock.patch("common.models.base_model.time.sleep") as mock_sleep:
+    chunks = QueryDocumentChunk.save_many(make_chunks(3))
+
+  assert len(commits) == 2, "failed batch retried"
+  assert len(count_batches) == 2, "batch rebuilt for retry"
+  mock_sleep.assert_called_once()
+  stored_ids = {chunk.id for chunk in fetch_chunks()}
+  assert stored_ids == {chunk.id for chunk in chunks}, "objects written once"
+
+
+def test_save_many_retries_exhausted(firestore_emulator, clean_firestore):
+  with mock.patch.object(WriteBatch, "commit",
+                         side_effect=api_exceptions.Aborted("aborted")), \
+       mock.patch("common.models.base_model.time.sleep"):
+    with pytest.raises(api_exceptions.Aborted):
+      QueryDocumentChunk.save_many(make_chunks(3))
+  assert fetch_chunks() == [], "nothing written"
+
+
+def test_find_by_ids(firestore_emulator, clean_firestore):
+  num_chunks = MAX_IN_QUERY_VALUES * 2 + 5
+  chunks = QueryDocumentChunk.save_many(make_chunks(num_chunks))
+  ids = [chunk.id for chunk in chunks]
+  deleted_ids = ids[:2] + ids[-2:]
+  for doc_id in deleted_ids:
+    QueryDocumentChunk.soft_delete_by_id(doc_id)
+
+  found = QueryDocumentChunk.find_by_ids(ids + ["missing-id", ids[10]])
+
+  expected_ids = set(ids) - set(deleted_ids)
+  assert set(found.keys()) == expected_ids, \
+    "found all ids, skipping soft deleted and missing ids"
+  assert found[ids[10]].index == 10
+  assert QueryDocumentChunk.find_by_ids([]) == {}
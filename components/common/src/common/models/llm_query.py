@@ -17,7 +17,7 @@ Models for LLM Query Engines
 from typing import List
 from fireo.fields import (TextField, ListField, IDField,
                           BooleanField, NumberField, MapField)
-from common.models import BaseModel
+from common.models import BaseModel, MAX_IN_QUERY_VALUES
 
 # constants used as tags for query history
 QUERY_HUMAN = "HumanQuestion"
@@ -252,6 +252,7 @@ class QueryDocument(BaseModel):
   index_file = TextField(required=False)
   index_start = NumberField(required=False)
   index_end = NumberField(required=False)
+  content_hash = TextField(required=False)
 
   class Meta:
     ignore_none_field = False
@@ -358,3 +359,48 @@ class QueryDocumentChunk(BaseModel):
             "deleted_at_timestamp", "==",
             None).get()
     return q_chunk
+
+  @classmethod
+  def find_by_query_document_id(cls, query_document_id):
+    """
+    Fetch all chunks of a query document
+
+    Args:
+        query_document_id (str): QueryDocument id
+
+    Returns:
+        List[QueryDocumentChunk]: chunks of the document
+
+    """
+    q_chunks = cls.collection.filter(
+        "query_document_id", "==", query_document_id).filter(
+            "deleted_at_timestamp", "==",
+            None).fetch()
+    return list(q_chunks)
+
+  @classmethod
+  def find_by_indexes(cls, query_engine_id, indexes):
+    """
+    Fetch document chunks for a query engine by a list of indexes, using
+    batched "in" queries instead of one query per index.
+
+    Args:
+        query_engine_id (str): Query engine id
+        indexes (List[int]): QueryDocumentChunk indexes
+
+    Returns:
+        dict: map of index to QueryDocumentChunk for chunks that were found
+
+    """
+    q_chunks = {}
+    indexes = list(dict.fromkeys(indexes))
+    for i in range(0, len(indexes), MAX_IN_QUERY_VALUES):
+      index_batch = indexes[i:i + MAX_IN_QUERY_VALUES]
+      batch_chunks = cls.collection.filter(
+          "query_engine_id", "==", query_engine_id).filter(
+              "index", "in", index_batch).filter(
+              "deleted_at_timestamp", "==",
+              None).fetch()
+      for q_chunk in batch_chunks:
+        q_chunks[q_chunk.index] = q_chunk
+    return q_chunks
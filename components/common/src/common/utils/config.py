@@ -15,6 +15,7 @@
 """Config file for utils"""
 # pylint: disable=logging-fstring-interpolation
 import json
+import math
 import os
 from enum import Enum
 from typing import List
@@ -39,6 +40,42 @@ def get_env_setting(env_var_str, default):
   return env_val
 
 
+def get_cpu_limit(cgroup_path: str = "/sys/fs/cgroup") -> int:
+  """
+  Number of CPUs available to this process: the container CPU limit from
+  the cgroup CPU quota if one is set, otherwise the CPUs the process may
+  run on. In a Kubernetes job os.cpu_count() is the node CPU count, not
+  the job CPU limit.
+  """
+  try:
+    cpus = len(os.sched_getaffinity(0))
+  except AttributeError:
+    cpus = os.cpu_count() or 1
+  quota, period = None, None
+  try:
+    # cgroup v2: "<quota> <period>", quota is "max" if unlimited
+    with open(os.path.join(cgroup_path, "cpu.max"), "r",
+              encoding="utf-8") as f:
+      quota_str, period_str = f.read().split()
+    if quota_str != "max":
+      quota, period = int(quota_str), int(period_str)
+  except (OSError, ValueError):
+    try:
+      # cgroup v1: quota is -1 if unlimited
+      with open(os.path.join(cgroup_path, "cpu", "cpu.cfs_quota_us"), "r",
+                encoding="utf-8") as f:
+        quota = int(f.read())
+      with open(os.path.join(cgroup_path, "cpu", "cpu.cfs_period_us"), "r",
+                encoding="utf-8") as f:
+        period = int(f.read())
+    except (OSError, ValueError):
+      pass
+  if quota is not None and quota > 0 and period:
+    # round up, so a limit of 0.5 CPU is 1
+    cpus = min(cpus, max(1, math.ceil(quota / period)))
+  return cpus
+
+
 def load_config_json(file_path: str):
   """ load a config JSON file """
   try:
@@ -71,11 +108,13 @@ DEFAULT_JOB_REQUESTS = {
 }
 
 JOB_TYPE_QUERY_ENGINE_BUILD = "query_engine_build"
+JOB_TYPE_QUERY_ENGINE_UPDATE = "query_engine_update"
 JOB_TYPE_AGENT_PLAN_EXECUTE = "agent_plan_execute"
 JOB_TYPE_ROUTING_AGENT = "agent_run_dispatch"
 
 JOB_TYPES_WITH_PREDETERMINED_TITLES = [
     JOB_TYPE_QUERY_ENGINE_BUILD,
+    JOB_TYPE_QUERY_ENGINE_UPDATE,
     JOB_TYPE_AGENT_PLAN_EXECUTE,
     JOB_TYPE_ROUTING_AGENT
 ]
@@ -87,6 +126,7 @@ class JobTypes(Enum):
   in Jobs Service
   """
   JOB_TYPE_QUERY_ENGINE_BUILD = "query_engine_build"
+  JOB_TYPE_QUERY_ENGINE_UPDATE = "query_engine_update"
   JOB_TYPE_AGENT_PLAN_EXECUTE = "agent_plan_execute"
   JOB_TYPE_ROUTING_AGENT = "agent_run_dispatch"
 
@@ -0,0 +1,45 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Unit test for config.py
+"""
+import os
+from common.utils.config import get_cpu_limit
+
+
+def _write(path, text):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w", encoding="utf-8") as f:
+    f.write(text)
+
+def test_get_cpu_limit_cgroup_v2(tmp_path):
+  _write(os.path.join(tmp_path, "cpu.max"), "400000 100000\n")
+  assert get_cpu_limit(str(tmp_path)) == min(4, len(os.sched_getaffinity(0)))
+
+  # fractional limits round up
+  _write(os.path.join(tmp_path, "cpu.max"), "50000 100000\n")
+  assert get_cpu_limit(str(tmp_path)) == 1
+
+def test_get_cpu_limit_cgroup_v1(tmp_path):
+  _write(os.path.join(tmp_path, "cpu", "cpu.cfs_quota_us"), "200000\n")
+  _write(os.path.join(tmp_path, "cpu", "cpu.cfs_period_us"), "100000\n")
+  assert get_cpu_limit(str(tmp_path)) == min(2, len(os.sched_getaffinity(0)))
+
+def test_get_cpu_limit_unlimited(tmp_path):
+  _write(os.path.join(tmp_path, "cpu.max"), "max 100000\n")
+  assert get_cpu_limit(str(tmp_path)) == len(os.sched_getaffinity(0))
+
+  # no cgroup files
+  assert get_cpu_limit(str(tmp_path / "missing")) == \
+    len(os.sched_getaffinity(0))
@@ -63,6 +63,51 @@ from config.config import (
 
     # query engine and other defaults
     DEFAULT_WEB_DEPTH_LIMIT,
+
+    # web crawler throughput
+    WEB_CRAWL_CONCURRENT_REQUESTS,
+    WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN,
+    WEB_CRAWL_AUTOTHROTTLE,
+    WEB_CRAWL_AUTOTHROTTLE_TARGET_CONCURRENCY,
+    WEB_CRAWL_HTTPCACHE_DIR,
+    WEB_CRAWL_HTTPCACHE_EXPIRATION_SECS,
+    WEB_CRAWL_UPLOAD_WORKERS,
+
+    # query embedding cache
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    ENABLE_EMBEDDING_CACHE_REDIS,
+
+    # embedding generation concurrency and retries
+    EMBEDDING_MAX_WORKERS,
+    EMBEDDING_MAX_RETRIES,
+
+    # query engine build pipeline
+    QUERY_ENGINE_PARSE_WORKERS,
+    QUERY_ENGINE_INDEX_WORKERS,
+    SENTENCE_SEGMENT_BATCH_SIZE,
+    SENTENCE_SEGMENT_PROCESSES,
+    GCS_DOWNLOAD_WORKERS,
+    GCS_DOWNLOAD_MAX_FILE_SIZE,
+    PDF_EXTRACT_WORKERS,
+    PDF_EXTRACT_PAGES_PER_TASK,
+    PDF_EXTRACT_PAGE_TIMEOUT,
+    PDF_PARALLEL_MIN_PAGES,
+
+    # hybrid lexical and vector retrieval
+    QUERY_ENGINE_LEXICAL_INDEX,
+    LEXICAL_INDEX_PATH,
+    LEXICAL_INDEX_MAX_OPEN_INDEXES,
+    HYBRID_RRF_K,
+    DEFAULT_LEXICAL_WEIGHT,
+    DEFAULT_VECTOR_WEIGHT,
+
+    # reference reranking
+    RERANKER_WARM_UP,
+    RERANK_BATCH_WINDOW_MS,
+    RERANK_MAX_BATCH_SIZE,
+    RERANK_CACHE_SIZE,
+    RERANK_CACHE_TTL,
     )
 
 from config.model_config import (
@@ -97,6 +142,8 @@ from config.model_config import (
     KEY_MODEL_PATH,
     KEY_MODEL_ENDPOINT,
     KEY_VENDOR,
+    KEY_BATCH_SIZE,
+    KEY_REQUESTS_PER_MINUTE,
 
     # model providers
     PROVIDER_VERTEX,
@@ -19,7 +19,8 @@
 import os
 import json
 from common.config import REGION
-from common.utils.config import get_environ_flag, load_config_json
+from common.utils.config import (get_environ_flag, load_config_json,
+                                 get_cpu_limit)
 from common.utils.logging_handler import Logger
 from common.utils.secrets import get_secret
 from common.utils.gcs_adapter import get_blob_from_gcs_path
@@ -122,6 +123,89 @@ DEFAULT_QUERY_EMBEDDING_MODEL = VERTEX_LLM_TYPE_GECKO_EMBEDDING
 # other defaults
 DEFAULT_WEB_DEPTH_LIMIT = 1
 
+# web crawler throughput: concurrent requests in total and per domain,
+# AutoThrottle target concurrency per domain, and threads uploading crawled
+# pages to GCS. Responses are cached in WEB_CRAWL_HTTPCACHE_DIR if set.
+WEB_CRAWL_CONCURRENT_REQUESTS = int(
+    os.getenv("WEB_CRAWL_CONCURRENT_REQUESTS", "64"))
+WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN = int(
+    os.getenv("WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN", "16"))
+WEB_CRAWL_AUTOTHROTTLE = get_environ_flag("WEB_CRAWL_AUTOTHROTTLE", True)
+WEB_CRAWL_AUTOTHROTTLE_TARGET_CONCURRENCY = float(
+    os.getenv("WEB_CRAWL_AUTOTHROTTLE_TARGET_CONCURRENCY", "8.0"))
+WEB_CRAWL_HTTPCACHE_DIR = os.getenv("WEB_CRAWL_HTTPCACHE_DIR")
+WEB_CRAWL_HTTPCACHE_EXPIRATION_SECS = int(
+    os.getenv("WEB_CRAWL_HTTPCACHE_EXPIRATION_SECS", "86400"))
+WEB_CRAWL_UPLOAD_WORKERS = int(os.getenv("WEB_CRAWL_UPLOAD_WORKERS", "8"))
+
+# query embedding cache
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+ENABLE_EMBEDDING_CACHE_REDIS = get_environ_flag(
+    "ENABLE_EMBEDDING_CACHE_REDIS", False)
+
+# embedding generation concurrency and retries
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "8"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# CPUs available to this container, from the cgroup CPU limit
+CPU_LIMIT = get_cpu_limit()
+
+# query engine build pipeline: processes used to parse documents, and
+# documents embedded and indexed concurrently. Each parse worker loads
+# spacy en_core_web_md and the document parsers, about 1 GB of memory. The
+# default leaves a CPU of the build job's 4 CPU limit for the main process,
+# which embeds and indexes parsed documents.
+QUERY_ENGINE_PARSE_WORKERS = int(
+    os.getenv("QUERY_ENGINE_PARSE_WORKERS", str(min(3, CPU_LIMIT))))
+QUERY_ENGINE_INDEX_WORKERS = int(os.getenv("QUERY_ENGINE_INDEX_WORKERS", "4"))
+
+# sentence segmentation of parsed documents: texts per spacy batch, and
+# spacy worker processes (documents are already parsed in worker processes)
+SENTENCE_SEGMENT_BATCH_SIZE = int(
+    os.getenv("SENTENCE_SEGMENT_BATCH_SIZE", "64"))
+SENTENCE_SEGMENT_PROCESSES = int(os.getenv("SENTENCE_SEGMENT_PROCESSES", "1"))
+
+# GCS document download: files downloaded concurrently, and the largest
+# file size in bytes downloaded for indexing (0 for no limit)
+GCS_DOWNLOAD_WORKERS = int(os.getenv("GCS_DOWNLOAD_WORKERS", "8"))
+GCS_DOWNLOAD_MAX_FILE_SIZE = int(
+    os.getenv("GCS_DOWNLOAD_MAX_FILE_SIZE", str(200 * 1024 * 1024)))
+
+# PDF text extraction: PDFs of at least PDF_PARALLEL_MIN_PAGES pages are
+# extracted by PDF_EXTRACT_WORKERS processes, PDF_EXTRACT_PAGES_PER_TASK
+# pages at a time. Pages taking longer than PDF_EXTRACT_PAGE_TIMEOUT
+# seconds to extract are skipped.
+PDF_EXTRACT_WORKERS = int(
+    os.getenv("PDF_EXTRACT_WORKERS", str(min(4, CPU_LIMIT))))
+PDF_EXTRACT_PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "25"))
+PDF_EXTRACT_PAGE_TIMEOUT = float(os.getenv("PDF_EXTRACT_PAGE_TIMEOUT", "30"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "100"))
+
+# hybrid retrieval: BM25 lexical indexes of query engine chunks are built
+# with the vector index, and fused with vector matches at query time by
+# reciprocal rank fusion
+QUERY_ENGINE_LEXICAL_INDEX = get_environ_flag("QUERY_ENGINE_LEXICAL_INDEX",
+                                              True)
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "/tmp/lexical_indexes")
+LEXICAL_INDEX_MAX_OPEN_INDEXES = int(
+    os.getenv("LEXICAL_INDEX_MAX_OPEN_INDEXES", "16"))
+# rank constant of reciprocal rank fusion
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# default fusion weights, set per engine with the lexical_weight and
+# vector_weight query engine params
+DEFAULT_LEXICAL_WEIGHT = float(os.getenv("DEFAULT_LEXICAL_WEIGHT", "1.0"))
+DEFAULT_VECTOR_WEIGHT = float(os.getenv("DEFAULT_VECTOR_WEIGHT", "1.0"))
+
+# reference reranking: the reranker model is loaded in the background at
+# startup if RERANKER_WARM_UP is set, otherwise on first use. Concurrent
+# requests are collected for RERANK_BATCH_WINDOW_MS and scored together.
+RERANKER_WARM_UP = get_environ_flag("RERANKER_WARM_UP", True)
+RERANK_BATCH_WINDOW_MS = float(os.getenv("RERANK_BATCH_WINDOW_MS", "10"))
+RERANK_MAX_BATCH_SIZE = int(os.getenv("RERANK_MAX_BATCH_SIZE", "64"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", "3600"))
+
 # config for agents and datasets
 AGENT_CONFIG_PATH = os.environ.get("AGENT_CONFIG_PATH")
 if not AGENT_CONFIG_PATH:
@@ -55,6 +55,8 @@ KEY_MODEL_PATH = "model_path"
 KEY_MODEL_ENDPOINT = "model_endpoint"
 KEY_VENDOR = "vendor"
 KEY_DIMENSION = "dimension"
+KEY_BATCH_SIZE = "batch_size"
+KEY_REQUESTS_PER_MINUTE = "requests_per_minute"
 
 MODEL_CONFIG_KEYS = [
   KEY_ENABLED,
@@ -73,7 +75,9 @@ MODEL_CONFIG_KEYS = [
   KEY_MODEL_PATH,
   KEY_MODEL_ENDPOINT,
   KEY_VENDOR,
-  KEY_DIMENSION
+  KEY_DIMENSION,
+  KEY_BATCH_SIZE,
+  KEY_REQUESTS_PER_MINUTE
 ]
 
 # model providers
@@ -18,7 +18,7 @@ Vector Store Config
 
 from common.utils.logging_handler import Logger
 from common.utils.secrets import get_secret
-from common.utils.config import get_env_setting
+from common.utils.config import get_env_setting, get_environ_flag
 from google.cloud import secretmanager
 
 Logger = Logger.get_logger(__file__)
@@ -26,12 +26,14 @@ Logger = Logger.get_logger(__file__)
 # vector store types
 VECTOR_STORE_MATCHING_ENGINE = "matching_engine"
 VECTOR_STORE_LANGCHAIN_PGVECTOR = "langchain_pgvector"
+VECTOR_STORE_LOCAL_NUMPY = "local_numpy"
 PG_VECTOR_DEFAULT_DBNAME = "pgvector"
 LOCAL_HOST = "127.0.0.1"
 
 VECTOR_STORES = [
   VECTOR_STORE_MATCHING_ENGINE,
-  VECTOR_STORE_LANGCHAIN_PGVECTOR
+  VECTOR_STORE_LANGCHAIN_PGVECTOR,
+  VECTOR_STORE_LOCAL_NUMPY
 ]
 
 # default vector store used for query engines
@@ -39,6 +41,26 @@ DEFAULT_VECTOR_STORE = get_env_setting("DEFAULT_VECTOR_STORE",
                                        VECTOR_STORE_MATCHING_ENGINE)
 Logger.info(f"Default vector store = [{DEFAULT_VECTOR_STORE}]")
 
+# seconds a Matching Engine index endpoint handle is reused by queries
+# before the endpoint resource is fetched again
+MATCHING_ENGINE_ENDPOINT_CACHE_TTL = int(
+    get_env_setting("MATCHING_ENGINE_ENDPOINT_CACHE_TTL", "600"))
+
+# Matching Engine embedding file uploads: concurrent uploads per indexing
+# thread, and chunk size of resumable uploads (a multiple of 256 KB)
+MATCHING_ENGINE_UPLOAD_WORKERS = int(
+    get_env_setting("MATCHING_ENGINE_UPLOAD_WORKERS", "4"))
+MATCHING_ENGINE_UPLOAD_CHUNK_SIZE = int(
+    get_env_setting("MATCHING_ENGINE_UPLOAD_CHUNK_SIZE",
+                    str(8 * 1024 * 1024)))
+
+# local numpy vector store: directory for index files, and number of
+# indexes kept open (memory mapped) per process
+LOCAL_VECTOR_STORE_PATH = get_env_setting("LOCAL_VECTOR_STORE_PATH",
+                                          "/tmp/vector_stores")
+LOCAL_VECTOR_STORE_MAX_OPEN_INDEXES = int(
+    get_env_setting("LOCAL_VECTOR_STORE_MAX_OPEN_INDEXES", "16"))
+
 # postgres
 # TODO: create secrets for this
 PG_HOST = get_env_setting("PG_HOST", LOCAL_HOST)
@@ -57,21 +79,24 @@ except Exception as e:
   Logger.warning("Can't access postgres user password secret")
   PG_PASSWD = None
 
-# test postgres connection
-if PG_PASSWD and PG_HOST:
-  import sqlalchemy
-  from langchain.vectorstores.pgvector import PGVector as LangchainPGVector
-  try:
-    connection_string = LangchainPGVector.connection_string_from_db_params(
-        driver="psycopg2",
-        host=PG_HOST,
-        port=PG_PORT,
-        database=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWD
-    )
-    engine = sqlalchemy.create_engine(connection_string)
-    conn = engine.connect()
-    Logger.info(f"Connected successfully to pgvector instance at {PG_HOST}")
-  except Exception as e:
-    Logger.error(f"Cannot connect to pgvector instance at {PG_HOST}: {str(e)}")
+# postgres connection pool, shared by all pgvector stores in a process
+PG_POOL_SIZE = int(get_env_setting("PG_POOL_SIZE", "10"))
+PG_MAX_OVERFLOW = int(get_env_setting("PG_MAX_OVERFLOW", "20"))
+PG_POOL_TIMEOUT = int(get_env_setting("PG_POOL_TIMEOUT", "30"))
+# seconds after which pooled connections are replaced
+PG_POOL_RECYCLE = int(get_env_setting("PG_POOL_RECYCLE", "1800"))
+# check pooled connections are alive before use
+PG_POOL_PRE_PING = get_environ_flag("PG_POOL_PRE_PING", True)
+
+# pgvector ANN indexes, created per collection when a query engine is
+# deployed. Query engine params override these defaults:
+#   pg_index_type: "hnsw", "ivfflat" or "none" for exact search
+#   hnsw_m, hnsw_ef_construction, hnsw_ef_search: HNSW build/search params
+#   ivfflat_lists, ivfflat_probes: IVFFlat build/search params
+PG_INDEX_HNSW = "hnsw"
+PG_INDEX_IVFFLAT = "ivfflat"
+PG_INDEX_NONE = "none"
+PG_INDEX_TYPE = get_env_setting("PG_INDEX_TYPE", PG_INDEX_HNSW)
+PG_HNSW_M = int(get_env_setting("PG_HNSW_M", "16"))
+PG_HNSW_EF_CONSTRUCTION = int(get_env_setting("PG_HNSW_EF_CONSTRUCTION", "64"))
+PG_HNSW_EF_SEARCH = int(get_env_setting("PG_HNSW_EF_SEARCH", "40"))
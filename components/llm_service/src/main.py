@@ -29,9 +29,17 @@ from fastapi import FastAPI, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import llm, chat, query, agent, agent_plan
+from services.vertex_models import warm_up_models
+from services.query.pg_pool import warm_up_pool
+from services.query.reranker import warm_up_reranker
+from config import RERANKER_WARM_UP
+from config.vector_store_config import PG_HOST, PG_PASSWD
 from common.utils.http_exceptions import add_exception_handlers
 from common.utils.auth_service import validate_token
 from common.config import CORS_ALLOW_ORIGINS
+from common.utils.logging_handler import Logger
+
+Logger = Logger.get_logger(__file__)
 
 # Basic API config
 service_title = "LLM Service API's"
@@ -47,6 +55,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def startup_event():
+  """ create shared model clients and connections before serving requests """
+  creation_times = warm_up_models()
+  for model, creation_time in creation_times.items():
+    Logger.info(f"model client {model} created in {creation_time:.3f}s")
+  if PG_PASSWD and PG_HOST:
+    warm_up_pool()
+  if RERANKER_WARM_UP:
+    # the reranker model takes a while to load, so serve requests meanwhile
+    warm_up_reranker()
+
 @app.get("/ping")
 def health_check():
   """Health Check API
@@ -32,7 +32,9 @@ from schemas.llm_schema import (ChatUpdateModel,
                                 LLMUserChatResponse,
                                 LLMUserAllChatsResponse,
                                 LLMGetTypesResponse)
-from services.llm_generate import llm_chat
+from services.llm_generate import llm_chat, llm_chat_stream
+from utils.stream_helper import (ndjson_event, ndjson_response,
+                                 EVENT_TOKEN, EVENT_DONE, EVENT_ERROR)
 
 
 Logger = Logger.get_logger(__file__)
@@ -238,7 +240,8 @@ async def create_user_chat(gen_config: LLMGenerateModel,
         including prompt(str) and llm_type(str) type for model
 
   Returns:
-      LLMUserChatResponse
+      LLMUserChatResponse, or if stream is set a streamed NDJSON response
+      (see utils.stream_helper)
   """
   genconfig_dict = {**gen_config.dict()}
   Logger.info("Creating new chat using "
@@ -251,6 +254,10 @@ async def create_user_chat(gen_config: LLMGenerateModel,
 
   llm_type = genconfig_dict.get("llm_type")
 
+  if genconfig_dict.get("stream"):
+    user = User.find_by_email(user_data.get("email"))
+    return ndjson_response(chat_stream(prompt, llm_type, user=user))
+
   try:
     user = User.find_by_email(user_data.get("email"))
 
@@ -291,7 +298,8 @@ async def user_chat_generate(chat_id: str, gen_config: LLMGenerateModel):
         including prompt(str) and llm_type(str) type for model
 
   Returns:
-      LLMUserChatResponse
+      LLMUserChatResponse, or if stream is set a streamed NDJSON response
+      (see utils.stream_helper)
   """
   genconfig_dict = {**gen_config.dict()}
   Logger.info(f"Generating new chat response for chat_id={chat_id},"
@@ -308,6 +316,9 @@ async def user_chat_generate(chat_id: str, gen_config: LLMGenerateModel):
     raise ResourceNotFoundException(f"Chat {chat_id} not found ")
   llm_type = user_chat.llm_type
 
+  if genconfig_dict.get("stream"):
+    return ndjson_response(chat_stream(prompt, llm_type, user_chat=user_chat))
+
   try:
     response = await llm_chat(prompt, llm_type, user_chat)
 
@@ -326,3 +337,34 @@ async def user_chat_generate(chat_id: str, gen_config: LLMGenerateModel):
     Logger.error(e)
     Logger.error(traceback.print_exc())
     raise InternalServerError(str(e)) from e
+
+
+async def chat_stream(prompt: str, llm_type: str, user: User = None,
+                      user_chat: UserChat = None):
+  """
+  Stream a chat response as NDJSON events. The chat is saved once the full
+  response has been generated: a new chat is created for user, or the
+  history of an existing user_chat is updated.
+  """
+  try:
+    response_chunks = []
+    async for chunk in llm_chat_stream(prompt, llm_type, user_chat):
+      response_chunks.append(chunk)
+      yield ndjson_event(EVENT_TOKEN, chunk)
+    response = "".join(response_chunks)
+
+    if user_chat is None:
+      user_chat = UserChat(user_id=user.user_id, llm_type=llm_type,
+                           prompt=prompt)
+      user_chat.history = UserChat.get_history_entry(prompt, response)
+      user_chat.save()
+    else:
+      user_chat.update_history(prompt, response)
+
+    chat_data = user_chat.get_fields(reformat_datetime=True)
+    chat_data["id"] = user_chat.id
+    yield ndjson_event(EVENT_DONE, chat_data)
+  except Exception as e:
+    Logger.error(e)
+    Logger.error(traceback.print_exc())
+    yield ndjson_event(EVENT_ERROR, str(e))
@@ -18,6 +18,7 @@
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,unused-import,unused-variable,ungrouped-imports
 import os
+import json
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -149,6 +150,37 @@ def test_create_chat(create_user, client_with_emulator):
     "retrieved user chat response"
 
 
+def test_create_chat_stream(create_user, client_with_emulator):
+  userid = CHAT_EXAMPLE["user_id"]
+  url = f"{api_url}"
+
+  async def fake_llm_chat_stream(prompt, llm_type, user_chat=None):
+    for chunk in ["test ", "generation"]:
+      yield chunk
+
+  with mock.patch("routes.chat.llm_chat_stream", new=fake_llm_chat_stream):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_GENERATE_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  assert resp.headers["content-type"] == "application/x-ndjson"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == ["token", "token", "done"]
+  assert "".join(event["data"] for event in events[:2]) == \
+    FAKE_GENERATE_RESPONSE, "streamed generated text"
+  chat_data = events[-1]["data"]
+  assert chat_data["history"][1] == \
+    {CHAT_AI: FAKE_GENERATE_RESPONSE}, \
+    "returned chat data generated text"
+
+  # chat is saved after the stream completes
+  user_chats = UserChat.find_by_user(userid)
+  assert len(user_chats) == 1, "retrieved new user chat"
+  assert user_chats[0].history[1] == \
+    {CHAT_AI: FAKE_GENERATE_RESPONSE}, \
+    "retrieved user chat response"
+
+
 def test_delete_chat(create_user, create_chat, client_with_emulator):
   userid = CHAT_EXAMPLE["user_id"]
   chatid = CHAT_EXAMPLE["id"]
@@ -19,6 +19,7 @@ from fastapi import APIRouter
 
 from common.utils.errors import (PayloadTooLargeError)
 from common.utils.http_exceptions import (InternalServerError, BadRequest)
+from common.utils.logging_handler import Logger
 from config import (PAYLOAD_FILE_SIZE,
                     ERROR_RESPONSES, get_model_config)
 from schemas.llm_schema import (LLMGenerateModel,
@@ -27,9 +28,12 @@ from schemas.llm_schema import (LLMGenerateModel,
                                 LLMGenerateResponse,
                                 LLMEmbeddingsResponse,
                                 LLMEmbeddingsModel)
-from services.llm_generate import llm_generate
+from services.llm_generate import llm_generate, llm_generate_stream
 from services.embeddings import get_embeddings
+from utils.stream_helper import (ndjson_event, ndjson_response,
+                                 EVENT_TOKEN, EVENT_DONE, EVENT_ERROR)
 
+Logger = Logger.get_logger(__file__)
 router = APIRouter(prefix="/llm", tags=["LLMs"], responses=ERROR_RESPONSES)
 
 
@@ -125,7 +129,8 @@ async def generate(gen_config: LLMGenerateModel):
         including prompt(str) and llm_type(str) type for model
 
   Returns:
-      LLMGenerateResponse
+      LLMGenerateResponse, or if stream is set a streamed NDJSON response
+      (see utils.stream_helper)
   """
   genconfig_dict = {**gen_config.dict()}
 
@@ -139,6 +144,9 @@ async def generate(gen_config: LLMGenerateModel):
 
   llm_type = genconfig_dict.get("llm_type")
 
+  if genconfig_dict.get("stream"):
+    return ndjson_response(generate_stream(prompt, llm_type))
+
   try:
     result = await llm_generate(prompt, llm_type)
 
@@ -149,3 +157,14 @@ async def generate(gen_config: LLMGenerateModel):
     }
   except Exception as e:
     raise InternalServerError(str(e)) from e
+
+
+async def generate_stream(prompt: str, llm_type: str):
+  """ stream generated text as NDJSON token events """
+  try:
+    async for chunk in llm_generate_stream(prompt, llm_type):
+      yield ndjson_event(EVENT_TOKEN, chunk)
+    yield ndjson_event(EVENT_DONE, {})
+  except Exception as e:
+    Logger.error(e)
+    yield ndjson_event(EVENT_ERROR, str(e))
@@ -17,6 +17,7 @@
 """
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,unused-import,unused-variable,ungrouped-imports
+import json
 import os
 import pytest
 from fastapi import FastAPI
@@ -126,3 +127,41 @@ def test_llm_generate(client_with_emulator):
   assert resp.status_code == 200, "Status 200"
   assert json_response.get("content") == FAKE_GENERATE_RESPONSE, \
     "returned generated text"
+
+
+def test_llm_generate_stream(client_with_emulator):
+  url = f"{api_url}/generate"
+
+  async def fake_llm_generate_stream(prompt, llm_type):
+    for chunk in ["test ", "generation"]:
+      yield chunk
+
+  with mock.patch("routes.llm.llm_generate_stream",
+                  new=fake_llm_generate_stream):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_GENERATE_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  assert resp.headers["content-type"] == "application/x-ndjson"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == ["token", "token", "done"]
+  assert "".join(event["data"] for event in events[:2]) == \
+    FAKE_GENERATE_RESPONSE, "streamed generated text"
+
+
+def test_llm_generate_stream_error(client_with_emulator):
+  url = f"{api_url}/generate"
+
+  async def fake_llm_generate_stream(prompt, llm_type):
+    yield "test "
+    raise RuntimeError("generation failed")
+
+  with mock.patch("routes.llm.llm_generate_stream",
+                  new=fake_llm_generate_stream):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_GENERATE_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == ["token", "error"]
+  assert events[-1]["data"] == "generation failed"
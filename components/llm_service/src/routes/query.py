@@ -16,6 +16,7 @@
 
 """ Query endpoints """
 import traceback
+from typing import Optional
 from fastapi import APIRouter, Depends
 
 from common.models import (QueryEngine,
@@ -24,12 +25,13 @@ from common.models.llm_query import QE_TYPE_INTEGRATED_SEARCH
 from common.schemas.batch_job_schemas import BatchJobModel
 from common.utils.auth_service import validate_token
 from common.utils.batch_jobs import initiate_batch_job
-from common.utils.config import JOB_TYPE_QUERY_ENGINE_BUILD
+from common.utils.config import (JOB_TYPE_QUERY_ENGINE_BUILD,
+                                 JOB_TYPE_QUERY_ENGINE_UPDATE)
 from common.utils.errors import (ResourceNotFoundException,
                                  ValidationError,
                                  PayloadTooLargeError)
 from common.utils.http_exceptions import (InternalServerError, BadRequest,
-                                          ResourceNotFound)
+                                          ResourceNotFound, Conflict)
 from common.utils.logging_handler import Logger
 from config import (PROJECT_ID, DATABASE_PREFIX, PAYLOAD_FILE_SIZE,
                     ERROR_RESPONSES, ENABLE_OPENAI_LLM, ENABLE_COHERE_LLM,
@@ -40,12 +42,21 @@ from schemas.llm_schema import (LLMQueryModel,
                                 LLMUserQueryResponse,
                                 UserQueryUpdateModel,
                                 LLMQueryEngineModel,
+                                LLMQueryEngineDocumentsModel,
                                 LLMGetQueryEnginesResponse,
                                 LLMQueryEngineURLResponse,
                                 LLMQueryResponse,
-                                LLMGetVectorStoreTypesResponse)
+                                LLMGetVectorStoreTypesResponse,
+                                LLMGetVectorStoreStatsResponse)
 from services.query.query_service import (query_generate,
-                                          delete_engine)
+                                          query_generate_stream,
+                                          delete_engine,
+                                          active_update_jobs)
+from services.query.vector_store import (SearchFilter,
+                                         pg_vector_store_stats)
+from utils.stream_helper import (ndjson_event, ndjson_response,
+                                 EVENT_REFERENCES, EVENT_TOKEN,
+                                 EVENT_DONE, EVENT_ERROR)
 Logger = Logger.get_logger(__file__)
 router = APIRouter(prefix="/query", tags=["Query"], responses=ERROR_RESPONSES)
 
@@ -105,6 +116,27 @@ def get_vector_store_list():
     raise InternalServerError(str(e)) from e
 
 
+@router.get(
+    "/vectorstore/stats",
+    name="Get vector store connection stats",
+    response_model=LLMGetVectorStoreStatsResponse)
+def get_vector_store_stats():
+  """
+  Get pgvector connection pool and store cache stats for this process
+
+  Returns:
+      LLMGetVectorStoreStatsResponse
+  """
+  try:
+    return {
+      "success": True,
+      "message": "Successfully retrieved vector store stats",
+      "data": pg_vector_store_stats()
+    }
+  except Exception as e:
+    raise InternalServerError(str(e)) from e
+
+
 @router.get(
   "/urls/{query_engine_id}",
   name="Get all URLs for a query engine",
@@ -456,17 +488,60 @@ async def query_engine_create(gen_config: LLMQueryEngineModel,
       "description": genconfig_dict.get("description", None),
       "params": params,
     }
-    env_vars = {
-      "DATABASE_PREFIX": DATABASE_PREFIX,
-      "PROJECT_ID": PROJECT_ID,
-      "ENABLE_OPENAI_LLM": str(ENABLE_OPENAI_LLM),
-      "ENABLE_COHERE_LLM": str(ENABLE_COHERE_LLM),
-      "DEFAULT_VECTOR_STORE": str(DEFAULT_VECTOR_STORE),
-      "PG_HOST": PG_HOST,
-      "ONEDRIVE_CLIENT_ID": ONEDRIVE_CLIENT_ID,
-      "ONEDRIVE_TENANT_ID": ONEDRIVE_TENANT_ID,
+    response = initiate_batch_job(data, JOB_TYPE_QUERY_ENGINE_BUILD,
+                                  query_engine_job_env_vars())
+    Logger.info(f"Batch job response: {response}")
+    return response
+  except Exception as e:
+    Logger.error(e)
+    Logger.error(traceback.print_exc())
+    raise InternalServerError(str(e)) from e
+
+
+@router.post(
+    "/engine/{query_engine_id}/documents",
+    name="Add, update or remove query engine documents",
+    response_model=BatchJobModel)
+async def query_engine_update_documents(
+    query_engine_id: str, docs_config: LLMQueryEngineDocumentsModel):
+  """
+  Start a job to add new and changed documents at doc_url to a query
+  engine, and remove the documents in remove_doc_urls. Documents that
+  are unchanged since they were indexed are skipped. Only one update
+  job of a query engine runs at a time.
+
+  Args:
+      query_engine_id (str)
+      docs_config (LLMQueryEngineDocumentsModel)
+  Returns:
+      BatchJobModel
+  """
+  docs_dict = {**docs_config.dict()}
+  doc_url = docs_dict.get("doc_url")
+  remove_doc_urls = docs_dict.get("remove_doc_urls") or []
+
+  if not doc_url and not remove_doc_urls:
+    raise BadRequest(
+        "Missing or invalid payload parameters: doc_url or remove_doc_urls")
+
+  try:
+    q_engine = QueryEngine.find_by_id(query_engine_id)
+  except ResourceNotFoundException as e:
+    raise ResourceNotFound(str(e)) from e
+
+  if active_update_jobs(q_engine.id):
+    raise Conflict(f"Query engine {q_engine.name} is already being updated")
+
+  Logger.info(f"Update documents of q_engine=[{q_engine.name}] "
+              f"with {docs_dict}")
+  try:
+    data = {
+      "query_engine_id": q_engine.id,
+      "doc_url": doc_url,
+      "remove_doc_urls": remove_doc_urls,
     }
-    response = initiate_batch_job(data, JOB_TYPE_QUERY_ENGINE_BUILD, env_vars)
+    response = initiate_batch_job(data, JOB_TYPE_QUERY_ENGINE_UPDATE,
+                                  query_engine_job_env_vars())
     Logger.info(f"Batch job response: {response}")
     return response
   except Exception as e:
@@ -475,6 +550,42 @@ async def query_engine_create(gen_config: LLMQueryEngineModel,
     raise InternalServerError(str(e)) from e
 
 
+def query_engine_job_env_vars() -> dict:
+  """ environment of query engine build and update jobs """
+  return {
+    "DATABASE_PREFIX": DATABASE_PREFIX,
+    "PROJECT_ID": PROJECT_ID,
+    "ENABLE_OPENAI_LLM": str(ENABLE_OPENAI_LLM),
+    "ENABLE_COHERE_LLM": str(ENABLE_COHERE_LLM),
+    "DEFAULT_VECTOR_STORE": str(DEFAULT_VECTOR_STORE),
+    "PG_HOST": PG_HOST,
+    "ONEDRIVE_CLIENT_ID": ONEDRIVE_CLIENT_ID,
+    "ONEDRIVE_TENANT_ID": ONEDRIVE_TENANT_ID,
+  }
+
+
+def query_search_params(genconfig_dict: dict) -> Optional[dict]:
+  """
+  Vector store search params of a query, with the number of references
+  and metadata filters of the query added.
+  """
+  search_params = genconfig_dict.get("search_params")
+  k = genconfig_dict.get("k")
+  filters = genconfig_dict.get("filters")
+  if k is None and filters is None:
+    return search_params
+  search_params = dict(search_params or {})
+  if k is not None:
+    if k < 1:
+      raise ValidationError("k must be a positive integer")
+    search_params["k"] = k
+  if filters is not None:
+    # validated here, to fail the request before any search
+    SearchFilter.from_dict(filters)
+    search_params["filter"] = filters
+  return search_params
+
+
 @router.post(
     "/engine/{query_engine_id}",
     name="Make a query to a query engine",
@@ -491,7 +602,8 @@ async def query(query_engine_id: str,
       user_data (dict):
 
   Returns:
-      LLMQueryResponse
+      LLMQueryResponse, or if stream is set a streamed NDJSON response
+      (see utils.stream_helper)
   """
   Logger.info(f"Using query engine with "
               f"query_engine_id=[{query_engine_id}] and {gen_config}")
@@ -510,12 +622,23 @@ async def query(query_engine_id: str,
       f"Prompt must be less than {PAYLOAD_FILE_SIZE}")
 
   llm_type = genconfig_dict.get("llm_type")
+  rerank = genconfig_dict.get("rerank")
+  try:
+    search_params = query_search_params(genconfig_dict)
+  except ValidationError as e:
+    raise BadRequest(str(e)) from e
 
   user = User.find_by_email(user_data.get("email"))
 
+  if genconfig_dict.get("stream"):
+    return ndjson_response(
+        query_stream(user.id, prompt, q_engine, llm_type,
+                     search_params=search_params, rerank=rerank))
+
   try:
     query_result, query_references = await query_generate(
-          user.id, prompt, q_engine, llm_type)
+          user.id, prompt, q_engine, llm_type, search_params=search_params,
+          rerank=rerank)
     Logger.info(f"Query response="
                 f"[{query_result.response}]")
     query_reference_dicts = [
@@ -563,7 +686,8 @@ async def query_continue(user_query_id: str, gen_config: LLMQueryModel):
       gen_config (LLMQueryModel)
 
   Returns:
-      LLMQueryResponse
+      LLMQueryResponse, or if stream is set a streamed NDJSON response
+      (see utils.stream_helper)
   """
   Logger.info("Using query engine based on a prior user query "
               f"user_query_id={user_query_id}, gen_config={gen_config}")
@@ -582,6 +706,17 @@ async def query_continue(user_query_id: str, gen_config: LLMQueryModel):
       f"Prompt must be less than {PAYLOAD_FILE_SIZE}")
 
   llm_type = genconfig_dict.get("llm_type")
+  rerank = genconfig_dict.get("rerank")
+  try:
+    search_params = query_search_params(genconfig_dict)
+  except ValidationError as e:
+    raise BadRequest(str(e)) from e
+
+  if genconfig_dict.get("stream"):
+    q_engine = QueryEngine.find_by_id(user_query.query_engine_id)
+    return ndjson_response(
+        query_stream(user_query.user_id, prompt, q_engine, llm_type,
+                     user_query, search_params, rerank))
 
   try:
     q_engine = QueryEngine.find_by_id(user_query.query_engine_id)
@@ -590,7 +725,9 @@ async def query_continue(user_query_id: str, gen_config: LLMQueryModel):
                                                           prompt,
                                                           q_engine,
                                                           llm_type,
-                                                          user_query)
+                                                          user_query,
+                                                          search_params,
+                                                          rerank)
     query_reference_dicts = [
       ref.get_fields(reformat_datetime=True) for ref in query_references
     ]
@@ -618,3 +755,45 @@ async def query_continue(user_query_id: str, gen_config: LLMQueryModel):
     Logger.error(e)
     Logger.error(traceback.print_exc())
     raise InternalServerError(str(e)) from e
+
+
+async def query_stream(user_id: str, prompt: str, q_engine: QueryEngine,
+                       llm_type: str, user_query: UserQuery = None,
+                       search_params: dict = None,
+                       rerank: bool = None):
+  """
+  Stream a query response as NDJSON events: query references first, then
+  the generated response. The query result and user query history are
+  saved once the full response has been generated; a new user query is
+  created unless continuing an existing user_query.
+  """
+  try:
+    query_reference_dicts = []
+    async for event_type, data in query_generate_stream(
+        user_id, prompt, q_engine, llm_type, user_query, search_params,
+        rerank):
+      if event_type == EVENT_REFERENCES:
+        query_reference_dicts = [
+          ref.get_fields(reformat_datetime=True) for ref in data
+        ]
+        yield ndjson_event(EVENT_REFERENCES, query_reference_dicts)
+      elif event_type == EVENT_TOKEN:
+        yield ndjson_event(EVENT_TOKEN, data)
+      elif event_type == EVENT_DONE:
+        query_result = data
+        if user_query is None:
+          user_query = UserQuery(user_id=user_id,
+                                 query_engine_id=q_engine.id,
+                                 prompt=prompt)
+          user_query.save()
+        user_query.update_history(prompt,
+                                  query_result.response,
+                                  query_reference_dicts)
+        yield ndjson_event(EVENT_DONE, {
+          "user_query_id": user_query.id,
+          "query_result": query_result.get_fields(reformat_datetime=True)
+        })
+  except Exception as e:
+    Logger.error(e)
+    Logger.error(traceback.print_exc())
+    yield ndjson_event(EVENT_ERROR, str(e))
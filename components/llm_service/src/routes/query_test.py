@@ -17,6 +17,7 @@
 """
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,unused-import,unused-variable,ungrouped-imports,use-implicit-booleaness-not-comparison
+import json
 import os
 import pytest
 from fastapi import FastAPI
@@ -38,8 +39,9 @@ from schemas.schema_examples import (QUERY_EXAMPLE,
                                      QUERY_REFERENCE_EXAMPLE_1)
 from common.models import (UserQuery, QueryResult, QueryEngine,
                            User, QueryDocument, QueryDocumentChunk,
-                           QueryReference)
+                           QueryReference, BatchJobModel)
 from common.models.llm_query import QE_TYPE_INTEGRATED_SEARCH
+from common.utils.config import JOB_TYPE_QUERY_ENGINE_UPDATE
 from common.utils.http_exceptions import add_exception_handlers
 from common.utils.auth_service import validate_user
 from common.utils.auth_service import validate_token
@@ -224,6 +226,76 @@ def test_create_query_engine(create_user, client_with_emulator):
   assert query_engine_data == FAKE_QE_BUILD_RESPONSE["data"]
 
 
+def test_query_engine_update_documents(create_user, create_engine,
+                                       client_with_emulator):
+  q_engine_id = QUERY_ENGINE_EXAMPLE["id"]
+  url = f"{api_url}/engine/{q_engine_id}/documents"
+  params = {
+    "doc_url": "gs://fake-bucket/updated-docs",
+    "remove_doc_urls": ["gs://fake-bucket/old-doc.pdf"]
+  }
+  with mock.patch("routes.query.initiate_batch_job",
+                  return_value=FAKE_QE_BUILD_RESPONSE) as mock_initiate:
+    resp = client_with_emulator.post(url, json=params)
+
+  json_response = resp.json()
+  assert resp.status_code == 200, "Status 200"
+  assert json_response.get("data") == FAKE_QE_BUILD_RESPONSE["data"]
+  data, job_type, env_vars = mock_initiate.call_args.args
+  assert data == {
+    "query_engine_id": q_engine_id,
+    "doc_url": params["doc_url"],
+    "remove_doc_urls": params["remove_doc_urls"]
+  }, "job payload"
+  assert job_type == JOB_TYPE_QUERY_ENGINE_UPDATE
+  assert env_vars["PROJECT_ID"] == "fake-project"
+
+  # documents may only be removed
+  params = {"remove_doc_urls": ["gs://fake-bucket/old-doc.pdf"]}
+  with mock.patch("routes.query.initiate_batch_job",
+                  return_value=FAKE_QE_BUILD_RESPONSE) as mock_initiate:
+    resp = client_with_emulator.post(url, json=params)
+  assert resp.status_code == 200, "Status 200"
+  assert mock_initiate.call_args.args[0]["doc_url"] is None
+
+
+def test_query_engine_update_documents_invalid(create_user, create_engine,
+                                               client_with_emulator):
+  q_engine_id = QUERY_ENGINE_EXAMPLE["id"]
+  url = f"{api_url}/engine/{q_engine_id}/documents"
+  with mock.patch("routes.query.initiate_batch_job") as mock_initiate:
+    # missing doc_url and remove_doc_urls
+    resp = client_with_emulator.post(url, json={})
+    assert resp.status_code == 400, "Status 400"
+    resp = client_with_emulator.post(
+        url, json={"doc_url": "", "remove_doc_urls": []})
+    assert resp.status_code == 400, "Status 400"
+
+    # unknown engine
+    resp = client_with_emulator.post(
+        f"{api_url}/engine/unknown-engine-id/documents",
+        json={"doc_url": "gs://fake-bucket/updated-docs"})
+    assert resp.status_code == 404, "Status 404"
+
+  mock_initiate.assert_not_called()
+
+
+def test_query_engine_update_documents_conflict(create_user, create_engine,
+                                                client_with_emulator):
+  q_engine_id = QUERY_ENGINE_EXAMPLE["id"]
+  url = f"{api_url}/engine/{q_engine_id}/documents"
+  BatchJobModel(name="update-job", uuid="update-job",
+                type=JOB_TYPE_QUERY_ENGINE_UPDATE, status="active",
+                input_data=json.dumps({"query_engine_id": q_engine_id})).save()
+
+  # an engine is not updated while an update job for it is running
+  with mock.patch("routes.query.initiate_batch_job") as mock_initiate:
+    resp = client_with_emulator.post(
+        url, json={"doc_url": "gs://fake-bucket/updated-docs"})
+  assert resp.status_code == 409, "Status 409"
+  mock_initiate.assert_not_called()
+
+
 @mock.patch("services.query.query_service.vector_store_from_query_engine")
 def test_delete_query_engine_soft(mock_vector_store, create_user,
                                   create_engine, create_query_docs,
@@ -347,6 +419,110 @@ def test_query_generate(create_user, create_engine, create_user_query,
     "returned query references"
 
 
+def fake_query_generate_stream(query_result, query_references, chunks):
+  """ fake query_generate_stream yielding references, chunks and result """
+  async def query_generate_stream(user_id, prompt, q_engine, llm_type,
+                                  user_query=None, search_params=None,
+                                  rerank=None):
+    yield "references", query_references
+    for chunk in chunks:
+      yield "token", chunk
+    yield "done", query_result
+  return query_generate_stream
+
+
+def test_query_stream(create_user, create_engine,
+                      create_query_result, create_query_reference,
+                      client_with_emulator):
+  q_engine_id = QUERY_ENGINE_EXAMPLE["id"]
+  url = f"{api_url}/engine/{q_engine_id}"
+
+  query_result = QueryResult.find_by_id(QUERY_RESULT_EXAMPLE["id"])
+  with mock.patch("routes.query.query_generate_stream",
+                  new=fake_query_generate_stream(
+                      query_result, [create_query_reference],
+                      ["test ", "response"])):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_QUERY_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  assert resp.headers["content-type"] == "application/x-ndjson"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == \
+    ["references", "token", "token", "done"], "streamed events in order"
+  test_query_ref_fields = create_query_reference.get_fields(remove_meta=True)
+  QueryReference.remove_field_meta(events[0]["data"][0])
+  assert events[0]["data"] == [test_query_ref_fields], \
+    "streamed query references"
+  assert "".join(event["data"] for event in events[1:3]) == \
+    QUERY_RESULT_EXAMPLE["response"], "streamed generated text"
+  done_data = events[-1]["data"]
+  assert done_data["query_result"]["id"] == QUERY_RESULT_EXAMPLE["id"], \
+    "returned query result"
+
+  # user query is saved after the stream completes
+  user_query = UserQuery.find_by_id(done_data["user_query_id"])
+  assert user_query.query_engine_id == q_engine_id
+  assert user_query.history[1]["AIResponse"] == \
+    QUERY_RESULT_EXAMPLE["response"], "saved query response"
+
+
+def test_query_generate_stream(create_user, create_engine, create_user_query,
+                               create_query_result, create_query_reference,
+                               client_with_emulator):
+  query_id = USER_QUERY_EXAMPLE["id"]
+  url = f"{api_url}/{query_id}"
+
+  query_result = QueryResult.find_by_id(QUERY_RESULT_EXAMPLE["id"])
+  with mock.patch("routes.query.query_generate_stream",
+                  new=fake_query_generate_stream(
+                      query_result, [create_query_reference],
+                      ["test ", "response"])):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_QUERY_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == \
+    ["references", "token", "token", "done"], "streamed events in order"
+  assert events[-1]["data"]["user_query_id"] == query_id, \
+    "continued existing user query"
+
+  user_query = UserQuery.find_by_id(query_id)
+  prior_history = USER_QUERY_EXAMPLE["history"]
+  assert len(user_query.history) == len(prior_history) + 2
+  assert user_query.history[-2] == \
+    {"HumanQuestion": FAKE_QUERY_PARAMS["prompt"]}, "saved query prompt"
+  assert user_query.history[-1]["AIResponse"] == \
+    QUERY_RESULT_EXAMPLE["response"], "saved query response"
+
+
+def test_query_stream_error(create_user, create_engine,
+                            create_query_reference, client_with_emulator):
+  q_engine_id = QUERY_ENGINE_EXAMPLE["id"]
+  url = f"{api_url}/engine/{q_engine_id}"
+
+  async def failing_query_generate_stream(*args, **kwargs):
+    yield "references", [create_query_reference]
+    yield "token", "test "
+    raise RuntimeError("generation failed")
+
+  with mock.patch("routes.query.query_generate_stream",
+                  new=failing_query_generate_stream):
+    resp = client_with_emulator.post(
+        url, json={**FAKE_QUERY_PARAMS, "stream": True})
+
+  assert resp.status_code == 200, "Status 200"
+  events = [json.loads(line) for line in resp.text.splitlines()]
+  assert [event["type"] for event in events] == \
+    ["references", "token", "error"], "error event ends the stream"
+  assert events[-1]["data"] == "generation failed"
+
+  # nothing is saved when generation fails
+  user_queries = UserQuery.find_by_user(FAKE_USER_DATA["user_id"])
+  assert user_queries == [], "no user query saved"
+
+
 def test_get_query(create_user, create_engine, create_user_query,
                    client_with_emulator):
   query_id = USER_QUERY_EXAMPLE["id"]
@@ -18,12 +18,14 @@ import json
 import asyncio
 from absl import flags, app
 from common.utils.config import (JOB_TYPE_QUERY_ENGINE_BUILD,
+                                 JOB_TYPE_QUERY_ENGINE_UPDATE,
                                  JOB_TYPE_AGENT_PLAN_EXECUTE,
                                  JOB_TYPE_ROUTING_AGENT)
 from common.utils.logging_handler import Logger
 from common.utils.kf_job_app import kube_delete_job
 from common.models.batch_job import BatchJobModel, JobStatus
-from services.query.query_service import batch_build_query_engine
+from services.query.query_service import (batch_build_query_engine,
+                                          batch_update_query_engine)
 from services.agents.routing_agent import batch_run_dispatch
 from services.agents.agent_service import batch_execute_plan
 from config import JOB_NAMESPACE
@@ -47,6 +49,8 @@ def main(argv):
     request_body = json.loads(job.input_data)
     if job.type == JOB_TYPE_QUERY_ENGINE_BUILD:
       _ = batch_build_query_engine(request_body, job)
+    elif job.type == JOB_TYPE_QUERY_ENGINE_UPDATE:
+      _ = batch_update_query_engine(request_body, job)
     elif job.type == JOB_TYPE_AGENT_PLAN_EXECUTE:
       _ = batch_execute_plan(request_body, job)
     elif job.type == JOB_TYPE_ROUTING_AGENT:
@@ -0,0 +1,50 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for batch job dispatch
+"""
+# pylint: disable=wrong-import-position,unused-argument
+import json
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from common.utils.config import JOB_TYPE_QUERY_ENGINE_UPDATE
+import run_batch_job
+
+
+@mock.patch("run_batch_job.kube_delete_job")
+@mock.patch("run_batch_job.batch_build_query_engine")
+@mock.patch("run_batch_job.batch_update_query_engine")
+@mock.patch("run_batch_job.BatchJobModel")
+def test_query_engine_update_job(mock_batch_job_model, mock_update,
+                                 mock_build, mock_delete_job):
+  request_body = {
+    "query_engine_id": "fake-engine-id",
+    "doc_url": "gs://fake-bucket/updated-docs",
+    "remove_doc_urls": []
+  }
+  job = mock.Mock(type=JOB_TYPE_QUERY_ENGINE_UPDATE,
+                  input_data=json.dumps(request_body))
+  mock_batch_job_model.find_by_uuid.return_value = job
+  with mock.patch.object(run_batch_job, "FLAGS",
+                         SimpleNamespace(container_name="fake-job")):
+    run_batch_job.main([])
+
+  mock_batch_job_model.find_by_uuid.assert_called_with("fake-job")
+  mock_update.assert_called_once_with(request_body, job)
+  mock_build.assert_not_called()
+  assert job.status == "succeeded"
@@ -70,6 +70,28 @@ class LLMGetVectorStoreTypesResponse(BaseModel):
         }
     }
 
+class LLMGetVectorStoreStatsResponse(BaseModel):
+  """LLM Get vector store connection stats model"""
+  success: Optional[bool] = True
+  message: Optional[str] = "Successfully retrieved vector store stats"
+  data: Optional[dict] = {}
+
+  class Config():
+    orm_mode = True
+    schema_extra = {
+        "example": {
+            "success": True,
+            "message": "Successfully retrieved vector store stats",
+            "data": {
+              "pool_size": 10,
+              "checked_in": 8,
+              "checked_out": 2,
+              "overflow": -8,
+              "cached_stores": 3
+            }
+        }
+    }
+
 class LLMGetEmbeddingTypesResponse(BaseModel):
   """LLM Get embedding types model"""
   success: Optional[bool] = True
@@ -107,6 +129,7 @@ class LLMGenerateModel(BaseModel):
   """LLM Generate request model"""
   prompt: str
   llm_type: Optional[str] = None
+  stream: Optional[bool] = False
 
   class Config():
     orm_mode = True
@@ -130,6 +153,16 @@ class LLMQueryModel(BaseModel):
   """LLM Query model"""
   prompt: str
   llm_type: Optional[str]
+  stream: Optional[bool] = False
+  # vector store search params, e.g. {"ef_search": 100} for pgvector
+  search_params: Optional[dict] = None
+  # rerank references by relevance, defaults to the engine rerank param
+  rerank: Optional[bool] = None
+  # number of references to retrieve
+  k: Optional[int] = None
+  # metadata filters, e.g. {"document_ids": [...],
+  # "document_url_prefix": "gs://bucket/dir/", "indexed_after": <time>}
+  filters: Optional[dict] = None
 
   class Config():
     orm_mode = True
@@ -156,6 +189,21 @@ class LLMQueryEngineModel(BaseModel):
     }
 
 
+class LLMQueryEngineDocumentsModel(BaseModel):
+  """LLM Query Engine add/remove documents model"""
+  doc_url: Optional[str]
+  remove_doc_urls: Optional[List[str]] = []
+
+  class Config():
+    orm_mode = True
+    schema_extra = {
+        "example": {
+            "doc_url": "gs://query-engine-test/updated-docs",
+            "remove_doc_urls": ["gs://query-engine-test/old-doc.pdf"]
+        }
+    }
+
+
 class LLMQueryEngineResponse(BaseModel):
   """LLM Generate Response model"""
   success: Optional[bool] = True
@@ -152,10 +152,8 @@ async def agent_plan(agent_name:str,
                description=step_description,
                agent_name=agent_name)
       for step_description in raw_plan_steps]
-  plan_step_ids = []
-  for step in plan_steps:
-    step.save()
-    plan_step_ids.append(step.id)
+  PlanStep.save_many(plan_steps)
+  plan_step_ids = [step.id for step in plan_steps]
 
   # save plan steps
   user_plan.plan_steps = plan_step_ids
@@ -14,34 +14,238 @@
 """
 Generate Query embeddings. Currently, using Vertex TextEmbedding model.
 """
+import hashlib
 import json
+import random
+import threading
 import time
+from collections import OrderedDict
+from functools import partial
 from typing import List, Optional, Generator, Tuple
 from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from vertexai.preview.language_models import TextEmbeddingModel
+from google.api_core import exceptions as api_exceptions
+from common.utils import cache_service
 from common.utils.http_exceptions import InternalServerError
 from common.utils.logging_handler import Logger
 from common.utils.request_handler import post_method
 from common.utils.token_handler import UserCredentials
 from config import (get_model_config, get_provider_embedding_types,
                     KEY_MODEL_NAME, KEY_MODEL_CLASS, KEY_MODEL_ENDPOINT,
+                    KEY_BATCH_SIZE, KEY_REQUESTS_PER_MINUTE,
                     PROVIDER_VERTEX, PROVIDER_LANGCHAIN, PROVIDER_LLM_SERVICE,
-                    DEFAULT_QUERY_EMBEDDING_MODEL)
+                    DEFAULT_QUERY_EMBEDDING_MODEL,
+                    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL,
+                    ENABLE_EMBEDDING_CACHE_REDIS,
+                    EMBEDDING_MAX_WORKERS, EMBEDDING_MAX_RETRIES)
 from langchain.schema.embeddings import Embeddings
+from services.vertex_models import get_embedding_model
 
 # pylint: disable=broad-exception-caught
 
-# Create a rate limit of 300 requests per minute.
-API_CALLS_PER_SECOND = int(300 / 60)
+# Default rate limit of 300 requests per minute, used for embedding models
+# that do not set requests_per_minute in their model config.
+DEFAULT_REQUESTS_PER_MINUTE = 300
 
-# According to the docs, each request can process 5 instances per request
+# According to the docs, each request can process 5 instances per request.
+# Used for embedding models that do not set batch_size in their model config.
 ITEMS_PER_REQUEST = 5
 
+# backoff between retries of rate limited or failed requests, in seconds
+RETRY_INITIAL_BACKOFF = 1.0
+RETRY_MAX_BACKOFF = 32.0
+
+# http status codes of errors that are retried
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
 Logger = Logger.get_logger(__file__)
 
+
+class EmbeddingCache():
+  """
+  Cache of embedding vectors keyed by (embedding_type, normalized text).
+
+  Vectors are held in a size-bounded, in-process LRU tier with a TTL, and
+  optionally in a shared Redis tier (see common.utils.cache_service) so that
+  cached embeddings are reused across pods. Vectors are stored as float32
+  bytes in both tiers.
+  """
+
+  KEY_PREFIX = "embedding"
+
+  def __init__(self,
+               max_size: int = EMBEDDING_CACHE_SIZE,
+               ttl: int = EMBEDDING_CACHE_TTL,
+               use_redis: bool = ENABLE_EMBEDDING_CACHE_REDIS):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.use_redis = use_redis
+    self._cache = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.redis_hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @classmethod
+  def cache_key(cls, embedding_type: str, text: str) -> str:
+    """ key for the embedding of text, ignoring case and whitespace runs """
+    normalized_text = " ".join(text.split()).casefold()
+    digest = hashlib.sha256(normalized_text.encode("utf-8")).hexdigest()
+    return f"{cls.KEY_PREFIX}:{embedding_type}:{digest}"
+
+  def get(self, embedding_type: str, text: str) -> Optional[np.ndarray]:
+    """ return cached embedding for text, or None on a miss """
+    key = self.cache_key(embedding_type, text)
+    with self._lock:
+      entry = self._cache.get(key)
+      if entry is not None:
+        expiry, value = entry
+        if expiry > time.monotonic():
+          self._cache.move_to_end(key)
+          self.hits += 1
+          return np.frombuffer(value, dtype=np.float32)
+        del self._cache[key]
+
+    if self.use_redis:
+      try:
+        value = cache_service.get_key_normal(key)
+      except Exception as e:
+        Logger.warning(f"embedding cache redis get failed: {e}")
+        value = None
+      if value is not None:
+        self._set_local(key, value)
+        with self._lock:
+          self.redis_hits += 1
+        return np.frombuffer(value, dtype=np.float32)
+
+    with self._lock:
+      self.misses += 1
+    return None
+
+  def set(self, embedding_type: str, text: str, embedding) -> None:
+    """ cache the embedding for text in all tiers """
+    key = self.cache_key(embedding_type, text)
+    value = np.asarray(embedding, dtype=np.float32).tobytes()
+    self._set_local(key, value)
+    if self.use_redis:
+      try:
+        cache_service.set_key_normal(key, value, expiry_time=self.ttl)
+      except Exception as e:
+        Logger.warning(f"embedding cache redis set failed: {e}")
+
+  def _set_local(self, key: str, value: bytes) -> None:
+    with self._lock:
+      self._cache[key] = (time.monotonic() + self.ttl, value)
+      self._cache.move_to_end(key)
+      while len(self._cache) > self.max_size:
+        self._cache.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self) -> None:
+    with self._lock:
+      self._cache.clear()
+
+  def stats(self) -> dict:
+    """ cache hit/miss counters """
+    with self._lock:
+      lookups = self.hits + self.redis_hits + self.misses
+      return {
+        "size": len(self._cache),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "redis_hits": self.redis_hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0
+      }
+
+_embedding_cache = None
+
+
+class RateLimiter():
+  """
+  Thread-safe token bucket rate limiter.
+
+  Tokens refill continuously at the current rate, up to a burst of one
+  second of requests. The rate is adaptive: it is halved each time the
+  backend rate limits a request, and recovers additively on success back to
+  the configured maximum.
+  """
+
+  def __init__(self, requests_per_minute: int):
+    self.max_rate = requests_per_minute / 60
+    self.min_rate = self.max_rate / 16
+    self.rate = self.max_rate
+    self.capacity = max(1.0, self.max_rate)
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def _refill(self, now: float) -> None:
+    self._tokens = min(self.capacity,
+                       self._tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  def acquire(self) -> None:
+    """ block until a request may be sent """
+    while True:
+      with self._lock:
+        self._refill(time.monotonic())
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait_time = (1 - self._tokens) / self.rate
+      time.sleep(wait_time)
+
+  def throttle(self) -> None:
+    """ reduce the rate after the backend rate limited a request """
+    with self._lock:
+      self._refill(time.monotonic())
+      self.rate = max(self.min_rate, self.rate / 2)
+      Logger.warning(f"embedding rate reduced to {self.rate * 60:.0f}/min")
+
+  def recover(self) -> None:
+    """ increase the rate after a successful request """
+    with self._lock:
+      if self.rate < self.max_rate:
+        self._refill(time.monotonic())
+        self.rate = min(self.max_rate, self.rate + self.min_rate)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(embedding_type: str) -> RateLimiter:
+  """ get the process-wide rate limiter for an embedding model """
+  with _rate_limiters_lock:
+    rate_limiter = _rate_limiters.get(embedding_type)
+    if rate_limiter is None:
+      requests_per_minute = get_model_config().get_config_value(
+          embedding_type, KEY_REQUESTS_PER_MINUTE,
+          DEFAULT_REQUESTS_PER_MINUTE)
+      rate_limiter = RateLimiter(requests_per_minute)
+      _rate_limiters[embedding_type] = rate_limiter
+    return rate_limiter
+
+def get_batch_size(embedding_type: str) -> int:
+  """ get the number of text chunks sent per request for a model """
+  return get_model_config().get_config_value(
+      embedding_type, KEY_BATCH_SIZE, ITEMS_PER_REQUEST)
+
+def get_embedding_cache() -> EmbeddingCache:
+  global _embedding_cache
+  if _embedding_cache is None:
+    _embedding_cache = EmbeddingCache()
+  return _embedding_cache
+
+def set_embedding_cache(embedding_cache: Optional[EmbeddingCache]) -> None:
+  """ replace the process embedding cache, e.g. with a custom tiering """
+  global _embedding_cache
+  _embedding_cache = embedding_cache
+
 def get_embeddings(
-    text_chunks: List[str], embedding_type: str = None) -> (
+    text_chunks: List[str], embedding_type: str = None,
+    use_cache: bool = False) -> (
     Tuple)[List[bool], np.ndarray]:
   """
   Get embeddings for a list of text strings.
@@ -49,6 +253,8 @@ def get_embeddings(
   Args:
     text_chunks: list of text chunks to generate embeddings for
     embedding_type: embedding model id
+    use_cache: look up and store embeddings in the embedding cache. Intended
+      for query-time text (prompts, sentences) that is likely to repeat.
   Returns:
     Tuple of (list of booleans for chunk true if embeddings were generated,
               numpy array of embeddings indexed by chunks)
@@ -56,6 +262,9 @@ def get_embeddings(
   if embedding_type is None or embedding_type == "":
     embedding_type = DEFAULT_QUERY_EMBEDDING_MODEL
 
+  if use_cache:
+    return _get_cached_embeddings(embedding_type, text_chunks)
+
   Logger.info(f"generating embeddings with {embedding_type}")
 
   is_successful, embeddings = _generate_embeddings_batched(
@@ -64,34 +273,68 @@ def get_embeddings(
 
   return is_successful, embeddings
 
+def _get_cached_embeddings(embedding_type: str,
+                           text_chunks: List[str]) -> \
+                           Tuple[List[bool], np.ndarray]:
+  """
+  Get embeddings from the embedding cache, generating and caching only
+  the embeddings for text chunks that miss.
+  """
+  embedding_cache = get_embedding_cache()
+  embeddings_list = [embedding_cache.get(embedding_type, text)
+                     for text in text_chunks]
+  miss_indexes = [i for i, embedding in enumerate(embeddings_list)
+                  if embedding is None]
+
+  if miss_indexes:
+    Logger.info(f"generating embeddings with {embedding_type} for "
+                f"{len(miss_indexes)} of {len(text_chunks)} cache misses")
+    miss_chunks = [text_chunks[i] for i in miss_indexes]
+    miss_successful, miss_embeddings = _generate_embeddings_batched(
+        embedding_type,
+        miss_chunks)
+    successful_indexes = [i for i, success
+                          in zip(miss_indexes, miss_successful) if success]
+    for i, embedding in zip(successful_indexes, miss_embeddings):
+      embedding_cache.set(embedding_type, text_chunks[i], embedding)
+      embeddings_list[i] = embedding
+
+  is_successful = [embedding is not None for embedding in embeddings_list]
+  return is_successful, _stack_embeddings(embeddings_list)
+
 def _generate_embeddings_batched(embedding_type,
                                  text_chunks):
   embeddings_list: List[List[float]] = []
 
   # Prepare the batches using a generator
-  batches = _generate_batches(text_chunks, ITEMS_PER_REQUEST)
-
-  seconds_per_job = 1 / API_CALLS_PER_SECOND
-
-  with ThreadPoolExecutor() as executor:
-    futures = []
-    for batch in batches:
-      futures.append(
-          executor.submit(generate_embeddings, batch, embedding_type)
-      )
-      time.sleep(seconds_per_job)
+  batches = _generate_batches(text_chunks, get_batch_size(embedding_type))
+  rate_limiter = get_rate_limiter(embedding_type)
 
-    for future in futures:
-      embeddings_list.extend(future.result())
+  with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+    # executor.map preserves batch order
+    for batch_embeddings in executor.map(
+        partial(_generate_embeddings_with_retry,
+                embedding_type=embedding_type, rate_limiter=rate_limiter),
+        batches):
+      embeddings_list.extend(batch_embeddings)
 
   is_successful = [
       embedding is not None for sentence, embedding in zip(
         text_chunks, embeddings_list)
   ]
-  embeddings_list_successful = np.stack(
-    [embedding for embedding in embeddings_list if embedding is not None]
-  )
-  return is_successful, embeddings_list_successful
+  return is_successful, _stack_embeddings(embeddings_list)
+
+def _stack_embeddings(embeddings_list: List[Optional[List[float]]]) -> \
+    np.ndarray:
+  """
+  Stack the successful embeddings into an array, one row per embedding.
+  An empty (0, 0) array is returned if no embedding was generated.
+  """
+  embeddings_list_successful = [embedding for embedding in embeddings_list
+                                if embedding is not None]
+  if not embeddings_list_successful:
+    return np.empty((0, 0))
+  return np.stack(embeddings_list_successful)
 
 # Generator function to yield batches of text_chunks
 def _generate_batches(text_chunks: List[str],
@@ -102,6 +345,58 @@ def _generate_batches(text_chunks: List[str],
   for i in range(0, len(text_chunks), batch_size):
     yield text_chunks[i: i + batch_size]
 
+def _is_retryable(e: Exception) -> bool:
+  """ true for rate limit (429) and server (5xx) errors """
+  if isinstance(e, (api_exceptions.TooManyRequests,
+                    api_exceptions.ResourceExhausted,
+                    api_exceptions.ServerError)):
+    return True
+  # e.g. openai errors carry the http status code
+  return getattr(e, "status_code", None) in RETRYABLE_STATUS_CODES
+
+def _is_rate_limited(e: Exception) -> bool:
+  if isinstance(e, (api_exceptions.TooManyRequests,
+                    api_exceptions.ResourceExhausted)):
+    return True
+  return getattr(e, "status_code", None) == 429
+
+def _generate_embeddings_with_retry(batch: List[str], embedding_type: str,
+                                    rate_limiter: RateLimiter) -> \
+    List[Optional[List[float]]]:
+  """
+  Generate embeddings for a batch, rate limited, retrying rate limit and
+  server errors with jittered exponential backoff.
+
+  Returns a list of None (one per text chunk) if the batch still fails after
+  EMBEDDING_MAX_RETRIES retries, so the caller can report the chunks as
+  unsuccessful. Other errors, e.g. a missing model config, are raised.
+  """
+  backoff = RETRY_INITIAL_BACKOFF
+  for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+    rate_limiter.acquire()
+    try:
+      embeddings = generate_embeddings(batch, embedding_type)
+      rate_limiter.recover()
+      return embeddings
+    except InternalServerError:
+      # unsupported embedding types and service errors are not retried
+      raise
+    except Exception as e:
+      if not _is_retryable(e):
+        raise
+      if attempt == EMBEDDING_MAX_RETRIES:
+        Logger.error(f"failed to generate {len(batch)} embeddings with "
+                     f"{embedding_type} after {attempt + 1} attempts: {e}")
+        return [None for _ in range(len(batch))]
+      if _is_rate_limited(e):
+        rate_limiter.throttle()
+      # full jitter: sleep a random time up to the current backoff
+      sleep_time = random.uniform(0, backoff)
+      Logger.warning(f"retrying embeddings with {embedding_type} in "
+                     f"{sleep_time:.2f}s after error: {e}")
+      time.sleep(sleep_time)
+      backoff = min(RETRY_MAX_BACKOFF, backoff * 2)
+
 def generate_embeddings(batch: List[str], embedding_type: str) -> \
     List[Optional[List[float]]]:
   """
@@ -140,15 +435,9 @@ def get_vertex_embeddings(embedding_type: str,
   if google_llm is None:
     raise RuntimeError(
         f"Vertex model name not found for embedding type {embedding_type}")
-  vertex_model = TextEmbeddingModel.from_pretrained(google_llm)
-  try:
-    embeddings = vertex_model.get_embeddings(sentence_list)
-
-    return_value = [embedding.values for embedding in embeddings]
-
-    return return_value
-  except Exception:
-    return [None for _ in range(len(sentence_list))]
+  vertex_model = get_embedding_model(google_llm)
+  embeddings = vertex_model.get_embeddings(sentence_list)
+  return [embedding.values for embedding in embeddings]
 
 def get_langchain_embeddings(embedding_type: str,
     sentence_list: List[str]) -> List[Optional[List[float]]]:
@@ -197,6 +486,9 @@ def get_llm_service_embeddings(embedding_type: str,
     resp = post_method(api_url,
                        request_body=request_body,
                        token=auth_token)
+    if resp.status_code in RETRYABLE_STATUS_CODES:
+      raise api_exceptions.from_http_status(
+        resp.status_code, f"LLM service embedding request failed: {str(resp)}")
     if resp.status_code != 200:
       raise InternalServerError(
         f"Error status {resp.status_code}: {str(resp)}")
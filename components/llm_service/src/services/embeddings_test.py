@@ -0,0 +1,160 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for embeddings service
+"""
+# disabling pylint rules that conflict with pytest fixtures
+# pylint: disable=unused-argument,redefined-outer-name,wrong-import-position
+import os
+import pytest
+from unittest import mock
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.embeddings import (EmbeddingCache, RateLimiter,
+                                 get_embeddings, set_embedding_cache,
+                                 _generate_embeddings_with_retry)
+
+FAKE_EMBEDDING_TYPE = "fake-embedding"
+
+
+@pytest.fixture
+def embedding_cache():
+  cache = EmbeddingCache(max_size=2, ttl=60, use_redis=False)
+  set_embedding_cache(cache)
+  yield cache
+  set_embedding_cache(None)
+
+
+def test_embedding_cache_normalizes_text(embedding_cache):
+  embedding_cache.set(FAKE_EMBEDDING_TYPE, "What is  the Form 1040?",
+                      [0.5, 0.25])
+  embedding = embedding_cache.get(FAKE_EMBEDDING_TYPE,
+                                  " what is the form 1040? ")
+  assert embedding.dtype == np.float32
+  assert list(embedding) == [0.5, 0.25]
+  assert embedding_cache.get("other-embedding",
+                             "what is the form 1040?") is None
+  assert embedding_cache.stats()["hits"] == 1
+  assert embedding_cache.stats()["misses"] == 1
+
+
+def test_embedding_cache_eviction_and_ttl(embedding_cache):
+  embedding_cache.set(FAKE_EMBEDDING_TYPE, "a", [1.0])
+  embedding_cache.set(FAKE_EMBEDDING_TYPE, "b", [2.0])
+  # touch "a" so "b" is least recently used
+  assert embedding_cache.get(FAKE_EMBEDDING_TYPE, "a") is not None
+  embedding_cache.set(FAKE_EMBEDDING_TYPE, "c", [3.0])
+  assert embedding_cache.get(FAKE_EMBEDDING_TYPE, "b") is None
+  assert embedding_cache.stats()["evictions"] == 1
+
+  embedding_cache.ttl = -1
+  embedding_cache.set(FAKE_EMBEDDING_TYPE, "d", [4.0])
+  assert embedding_cache.get(FAKE_EMBEDDING_TYPE, "d") is None
+
+
+@mock.patch("services.embeddings._generate_embeddings_batched")
+def test_get_embeddings_with_cache(mock_generate, embedding_cache):
+  mock_generate.return_value = [True], np.array([[1.0, 2.0]])
+  is_successful, embeddings = get_embeddings(["prompt"], FAKE_EMBEDDING_TYPE,
+                                             use_cache=True)
+  assert is_successful == [True]
+  assert embeddings.tolist() == [[1.0, 2.0]]
+
+  # second call is served from the cache; only the miss is generated
+  mock_generate.return_value = [True], np.array([[3.0, 4.0]])
+  is_successful, embeddings = get_embeddings(["Prompt", "other prompt"],
+                                             FAKE_EMBEDDING_TYPE,
+                                             use_cache=True)
+  assert is_successful == [True, True]
+  assert embeddings.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+  mock_generate.assert_called_with(FAKE_EMBEDDING_TYPE, ["other prompt"])
+
+
+def test_rate_limiter_adapts_rate():
+  rate_limiter = RateLimiter(requests_per_minute=600)
+  assert rate_limiter.rate == 10
+  # a full bucket allows a burst without blocking
+  for _ in range(10):
+    rate_limiter.acquire()
+  rate_limiter.throttle()
+  rate_limiter.throttle()
+  assert rate_limiter.rate == 2.5
+  for _ in range(100):
+    rate_limiter.recover()
+  assert rate_limiter.rate == rate_limiter.max_rate
+
+
+@mock.patch("services.embeddings.time.sleep")
+@mock.patch("services.embeddings.generate_embeddings")
+def test_generate_embeddings_retries_rate_limit(mock_generate, mock_sleep):
+  mock_generate.side_effect = [
+    api_exceptions.TooManyRequests("quota exceeded"),
+    api_exceptions.ServiceUnavailable("unavailable"),
+    [[1.0], [2.0]]
+  ]
+  rate_limiter = RateLimiter(requests_per_minute=6000)
+  embeddings = _generate_embeddings_with_retry(["a", "b"],
+                                               FAKE_EMBEDDING_TYPE,
+                                               rate_limiter)
+  assert embeddings == [[1.0], [2.0]]
+  assert mock_generate.call_count == 3
+  assert mock_sleep.call_count == 2
+  # only the 429 reduces the rate
+  assert rate_limiter.rate < rate_limiter.max_rate
+
+
+@mock.patch("services.embeddings.EMBEDDING_MAX_RETRIES", 2)
+@mock.patch("services.embeddings.time.sleep")
+@mock.patch("services.embeddings.generate_embeddings")
+def test_generate_embeddings_gives_up(mock_generate, mock_sleep):
+  mock_generate.side_effect = api_exceptions.InternalServerError("error")
+  embeddings = _generate_embeddings_with_retry(["a", "b"],
+                                               FAKE_EMBEDDING_TYPE,
+                                               RateLimiter(6000))
+  assert embeddings == [None, None]
+  assert mock_generate.call_count == 3
+
+  # non-retryable errors, e.g. config errors, are raised without retrying
+  mock_generate.reset_mock()
+  mock_generate.side_effect = RuntimeError("Vertex model name not found")
+  with pytest.raises(RuntimeError):
+    _generate_embeddings_with_retry(["a"], FAKE_EMBEDDING_TYPE,
+                                    RateLimiter(6000))
+  assert mock_generate.call_count == 1
+
+
+@mock.patch("services.embeddings.EMBEDDING_MAX_RETRIES", 0)
+@mock.patch("services.embeddings.get_rate_limiter",
+            return_value=RateLimiter(6000))
+@mock.patch("services.embeddings.get_batch_size", return_value=1)
+@mock.patch("services.embeddings.generate_embeddings")
+def test_get_embeddings_failed(mock_generate, mock_batch_size,
+                               mock_rate_limiter):
+  def generate_embeddings(batch, embedding_type):
+    if batch == ["b"]:
+      raise api_exceptions.ServiceUnavailable("unavailable")
+    return [[1.0, 2.0]]
+  mock_generate.side_effect = generate_embeddings
+  is_successful, embeddings = get_embeddings(["a", "b"], FAKE_EMBEDDING_TYPE)
+  assert is_successful == [True, False]
+  assert embeddings.shape == (1, 2)
+
+  # an empty array is returned when no embedding was generated
+  mock_generate.side_effect = api_exceptions.ServiceUnavailable("unavailable")
+  is_successful, embeddings = get_embeddings(["a", "b"], FAKE_EMBEDDING_TYPE)
+  assert is_successful == [False, False]
+  assert len(embeddings) == 0
@@ -15,7 +15,7 @@
 """ Langchain service """
 
 import inspect
-from typing import Optional, Any, List
+from typing import Optional, Any, AsyncGenerator, List
 from common.models import UserChat
 from common.models.agent import AgentType
 from common.utils.errors import ResourceNotFoundException
@@ -78,6 +78,44 @@ async def langchain_llm_generate(prompt: str, llm_type: str,
     raise InternalServerError(str(e)) from e
 
 
+async def langchain_llm_generate_stream(prompt: str, llm_type: str,
+    user_chat: Optional[UserChat] = None) -> AsyncGenerator[str, None]:
+  """
+  Use langchain to generate text with an LLM given a prompt, yielding
+    chunks of the response text as they are generated.
+
+  Args:
+    prompt: the text prompt to pass to the LLM
+
+    llm_type: the type of LLM to use
+
+    user_chat (optional): a user chat to use for context
+
+  Yields:
+    chunks of the response text.
+  """
+  Logger.info(f"Streaming text with langchain llm_type {llm_type}")
+  try:
+    llm = get_model(llm_type)
+    if llm is None:
+      raise ResourceNotFoundException(f"Cannot find llm type '{llm_type}'")
+
+    if llm_type in get_model_config().get_chat_llm_types():
+      if user_chat is not None:
+        msg = langchain_chat_history(user_chat)
+      else:
+        msg = []
+      msg.append(HumanMessage(content=prompt))
+      async for chunk in llm.astream(msg):
+        yield chunk.content
+    else:
+      # text completion models stream a single prompt
+      async for chunk in llm.astream(prompt):
+        yield chunk
+  except Exception as e:
+    raise InternalServerError(str(e)) from e
+
+
 def get_model(llm_type: str) -> Any:
   """ return a langchain model given type """
   llm = get_model_config().get_provider_value(PROVIDER_LANGCHAIN,
@@ -16,10 +16,8 @@ LLM Generation Service
 """
 # pylint: disable=import-outside-toplevel
 import time
-from typing import Optional
+from typing import AsyncGenerator, Optional, Tuple
 import google.cloud.aiplatform
-from vertexai.preview.language_models import (ChatModel, TextGenerationModel)
-from vertexai.preview.generative_models import GenerativeModel
 from vertexai.preview.generative_models import (
     HarmCategory,
     HarmBlockThreshold)
@@ -40,7 +38,9 @@ from config import (get_model_config, get_provider_models,
                     KEY_MODEL_ENDPOINT, KEY_MODEL_NAME,
                     KEY_MODEL_PARAMS, KEY_MODEL_CONTEXT_LENGTH,
                     DEFAULT_LLM_TYPE)
-from services.langchain_service import langchain_llm_generate
+from services.langchain_service import (langchain_llm_generate,
+                                        langchain_llm_generate_stream)
+from services.vertex_models import get_llm_model
 from utils.errors import ContextWindowExceededException
 
 Logger = Logger.get_logger(__file__)
@@ -49,6 +49,26 @@ Logger = Logger.get_logger(__file__)
 # whether prompt length exceeds context window size
 CHARS_PER_TOKEN = 3
 
+# safety settings for gemini models, built once and shared across requests
+GEMINI_SAFETY_SETTINGS = [
+  SafetySetting(
+      category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+      threshold=HarmBlockThreshold.BLOCK_NONE,
+  ),
+  SafetySetting(
+      category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+      threshold=HarmBlockThreshold.BLOCK_NONE,
+  ),
+  SafetySetting(
+      category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+      threshold=HarmBlockThreshold.BLOCK_NONE,
+  ),
+  SafetySetting(
+      category=HarmCategory.HARM_CATEGORY_HARASSMENT,
+      threshold=HarmBlockThreshold.BLOCK_NONE,
+  ),
+]
+
 async def llm_generate(prompt: str, llm_type: str) -> str:
   """
   Generate text with an LLM given a prompt.
@@ -162,6 +182,96 @@ async def llm_chat(prompt: str, llm_type: str,
     Logger.error(traceback.print_exc())
     raise InternalServerError(str(e)) from e
 
+async def llm_generate_stream(prompt: str, llm_type: str) -> \
+    AsyncGenerator[str, None]:
+  """
+  Generate text with an LLM given a prompt, yielding chunks of the response
+  text as they are generated. Providers without a streaming API yield the
+  full response as a single chunk.
+  Args:
+    prompt: the text prompt to pass to the LLM
+    llm_type: the type of LLM to use
+  Yields:
+    chunks of the text response: str
+  """
+  if llm_type is None:
+    llm_type = DEFAULT_LLM_TYPE
+
+  if not is_streaming_supported(llm_type):
+    yield await llm_generate(prompt, llm_type)
+    return
+
+  Logger.info(f"Streaming text with llm_type={llm_type}")
+  try:
+    check_context_length(prompt, llm_type)
+    if llm_type in get_provider_models(PROVIDER_VERTEX):
+      is_chat = llm_type in get_model_config().get_chat_llm_types()
+      responses = google_llm_predict_stream(
+          prompt, is_chat, get_google_llm(llm_type))
+    else:
+      responses = langchain_llm_generate_stream(prompt, llm_type)
+    async for chunk in responses:
+      yield chunk
+  except Exception as e:
+    raise InternalServerError(str(e)) from e
+
+async def llm_chat_stream(prompt: str, llm_type: str,
+                          user_chat: Optional[UserChat] = None,
+                          user_query: Optional[UserQuery] = None) -> \
+                          AsyncGenerator[str, None]:
+  """
+  Send a prompt to a chat model, yielding chunks of the response text as
+  they are generated. Providers without a streaming API yield the full
+  response as a single chunk.
+  Args:
+    prompt: the text prompt to pass to the LLM
+    llm_type: the type of LLM to use
+    user_chat (optional): a user chat to use for context
+    user_query (optional): a user query to use for context
+  Yields:
+    chunks of the text response: str
+  """
+  if llm_type not in get_model_config().get_chat_llm_types():
+    raise ResourceNotFoundException(f"Cannot find chat llm type '{llm_type}'")
+
+  if not is_streaming_supported(llm_type):
+    yield await llm_chat(prompt, llm_type, user_chat, user_query)
+    return
+
+  Logger.info(f"Streaming chat with llm_type=[{llm_type}].")
+  try:
+    # add chat history to prompt if necessary
+    if user_chat is not None or user_query is not None:
+      context_prompt = get_context_prompt(
+          user_chat=user_chat, user_query=user_query)
+      prompt = context_prompt + "\n" + prompt
+
+    check_context_length(prompt, llm_type)
+
+    if llm_type in get_provider_models(PROVIDER_VERTEX):
+      responses = google_llm_predict_stream(
+          prompt, True, get_google_llm(llm_type), user_chat)
+    else:
+      responses = langchain_llm_generate_stream(prompt, llm_type, user_chat)
+    async for chunk in responses:
+      yield chunk
+  except Exception as e:
+    raise InternalServerError(str(e)) from e
+
+def is_streaming_supported(llm_type: str) -> bool:
+  """ true if the provider for llm_type can stream responses """
+  return llm_type in get_provider_models(PROVIDER_VERTEX) or \
+      llm_type in get_provider_models(PROVIDER_LANGCHAIN)
+
+def get_google_llm(llm_type: str) -> str:
+  """ get the vertex model name for llm_type """
+  google_llm = get_provider_value(
+      PROVIDER_VERTEX, KEY_MODEL_NAME, llm_type)
+  if google_llm is None:
+    raise RuntimeError(
+        f"Vertex model name not found for llm type {llm_type}")
+  return google_llm
+
 def get_context_prompt(user_chat=None,
                        user_query=None) -> str:
   """
@@ -353,21 +463,17 @@ async def model_garden_predict(prompt: str,
   return predictions_text
 
 
-async def google_llm_predict(prompt: str, is_chat: bool,
-                             google_llm: str, user_chat=None) -> str:
+def get_google_llm_context(prompt: str, google_llm: str,
+                           user_chat=None) -> Tuple[str, dict]:
   """
-  Generate text with a Google LLM given a prompt.
+  Build the context prompt and generation parameters for a Google LLM.
   Args:
     prompt: the text prompt to pass to the LLM
-    is_chat: true if the model is a chat model
     google_llm: name of the vertex llm model
     user_chat: chat history
   Returns:
-    the text response.
+    tuple of context prompt, model parameters
   """
-  Logger.info(f"Generating text with a Google LLM given a prompt,"
-              f" is_chat=[{is_chat}], google_llm=[{google_llm}]")
-  Logger.debug(f"prompt=[{prompt}].")
   prompt_list = []
   if user_chat is not None:
     history = user_chat.history
@@ -391,40 +497,41 @@ async def google_llm_predict(prompt: str, is_chat: bool,
   else:
     parameters = get_provider_value(PROVIDER_VERTEX,
         KEY_MODEL_PARAMS)
+  return context_prompt, parameters
+
+
+async def google_llm_predict(prompt: str, is_chat: bool,
+                             google_llm: str, user_chat=None) -> str:
+  """
+  Generate text with a Google LLM given a prompt.
+  Args:
+    prompt: the text prompt to pass to the LLM
+    is_chat: true if the model is a chat model
+    google_llm: name of the vertex llm model
+    user_chat: chat history
+  Returns:
+    the text response.
+  """
+  Logger.info(f"Generating text with a Google LLM given a prompt,"
+              f" is_chat=[{is_chat}], google_llm=[{google_llm}]")
+  Logger.debug(f"prompt=[{prompt}].")
+  context_prompt, parameters = get_google_llm_context(
+      prompt, google_llm, user_chat)
 
   try:
+    model = get_llm_model(google_llm, is_chat)
     if is_chat:
       # gemini uses new "GenerativeModel" class and requires different params
       if "gemini" in google_llm:
-        chat_model = GenerativeModel(google_llm)
-        chat = chat_model.start_chat()
-        safety_settings = [
-             SafetySetting(
-                 category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                 threshold=HarmBlockThreshold.BLOCK_NONE,
-             ),
-             SafetySetting(
-                 category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                 threshold=HarmBlockThreshold.BLOCK_NONE,
-             ),
-             SafetySetting(
-                 category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                 threshold=HarmBlockThreshold.BLOCK_NONE,
-             ),
-             SafetySetting(
-                 category=HarmCategory.HARM_CATEGORY_HARASSMENT,
-                 threshold=HarmBlockThreshold.BLOCK_NONE,
-             ),
-        ]
+        chat = model.start_chat()
         response = await chat.send_message_async(context_prompt,
-            generation_config=parameters, safety_settings=safety_settings)
+            generation_config=parameters,
+            safety_settings=GEMINI_SAFETY_SETTINGS)
       else:
-        chat_model = ChatModel.from_pretrained(google_llm)
-        chat = chat_model.start_chat()
+        chat = model.start_chat()
         response = await chat.send_message_async(context_prompt, **parameters)
     else:
-      text_model = TextGenerationModel.from_pretrained(google_llm)
-      response = await text_model.predict_async(
+      response = await model.predict_async(
           context_prompt,
           **parameters,
       )
@@ -436,3 +543,45 @@ async def google_llm_predict(prompt: str, is_chat: bool,
   response = response.text
 
   return response
+
+
+async def google_llm_predict_stream(prompt: str, is_chat: bool,
+                                    google_llm: str, user_chat=None) -> \
+                                    AsyncGenerator[str, None]:
+  """
+  Generate text with a Google LLM given a prompt, yielding chunks of the
+  response text as they are generated.
+  Args:
+    prompt: the text prompt to pass to the LLM
+    is_chat: true if the model is a chat model
+    google_llm: name of the vertex llm model
+    user_chat: chat history
+  Yields:
+    chunks of the text response.
+  """
+  Logger.info(f"Streaming text with a Google LLM given a prompt,"
+              f" is_chat=[{is_chat}], google_llm=[{google_llm}]")
+  Logger.debug(f"prompt=[{prompt}].")
+  context_prompt, parameters = get_google_llm_context(
+      prompt, google_llm, user_chat)
+
+  try:
+    model = get_llm_model(google_llm, is_chat)
+    if is_chat:
+      chat = model.start_chat()
+      if "gemini" in google_llm:
+        responses = await chat.send_message_async(context_prompt,
+            generation_config=parameters,
+            safety_settings=GEMINI_SAFETY_SETTINGS,
+            stream=True)
+      else:
+        responses = chat.send_message_streaming_async(context_prompt,
+                                                      **parameters)
+    else:
+      responses = model.predict_streaming_async(context_prompt, **parameters)
+
+    async for response in responses:
+      yield response.text
+
+  except Exception as e:
+    raise InternalServerError(str(e)) from e
@@ -14,20 +14,22 @@
 """
 Query Data Sources
 """
+import hashlib
 import os
 import re
-from typing import List
-from pathlib import Path
+import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                wait as wait_futures)
+from typing import Generator, Iterable, List, Optional, Tuple
 from common.utils.logging_handler import Logger
 from common.models import QueryEngine
-from config import PROJECT_ID
+from config import (PROJECT_ID, GCS_DOWNLOAD_WORKERS,
+                    GCS_DOWNLOAD_MAX_FILE_SIZE, PDF_EXTRACT_WORKERS)
 from langchain_community.document_loaders import CSVLoader
-from pypdf import PdfReader
 from utils.errors import NoDocumentsIndexedException
 from utils import text_helper
+from utils.pdf_helper import extract_pdf_pages
 from llama_index.core import SimpleDirectoryReader
-from llama_index.core.node_parser import SentenceWindowNodeParser
-from llama_index.core import Document
 
 # pylint: disable=broad-exception-caught
 
@@ -37,6 +39,11 @@ Logger = Logger.get_logger(__file__)
 # sentence when creating chunks (chunks have overlapping text)
 CHUNK_SENTENCE_PADDING = 1
 
+# document extensions read by DataSource.read_doc
+TEXT_DOC_EXTENSIONS = ["txt", "html", "htm"]
+SUPPORTED_DOC_EXTENSIONS = TEXT_DOC_EXTENSIONS + \
+    ["csv", "pdf", "docx", "pptx", "ppt", "pptm"]
+
 class DataSourceFile():
   """ object storing meta data about a data source file """
   def __init__(self,
@@ -50,22 +57,58 @@ class DataSourceFile():
     self.local_path = local_path
     self.gcs_path = gcs_path
     self.doc_id = doc_id
+    self._content_hash = None
+
+  @property
+  def content_hash(self) -> str:
+    """
+    sha256 hex digest of the downloaded file, used to detect unchanged
+    documents when updating a query engine. None if there is no local file.
+    """
+    if self._content_hash is None and self.local_path \
+        and os.path.exists(self.local_path):
+      file_hash = hashlib.sha256()
+      with open(self.local_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+          file_hash.update(block)
+      self._content_hash = file_hash.hexdigest()
+    return self._content_hash
+
+class ParsedDocument():
+  """
+  Text chunks parsed from a data source file, with the clean text and
+  sentence list of each chunk
+  """
+  def __init__(self,
+               data_source_file: DataSourceFile,
+               text_chunks: List[str] = None,
+               clean_texts: List[str] = None,
+               sentences: List[List[str]] = None,
+               docs_not_processed: List[str] = None):
+    self.data_source_file = data_source_file
+    self.text_chunks = text_chunks or []
+    self.clean_texts = clean_texts or []
+    self.sentences = sentences or []
+    self.docs_not_processed = docs_not_processed or []
 
 class DataSource:
   """
   Super class for query data sources. Also implements GCS DataSource.
   """
+  # processes extracting the pages of a large PDF; set to 1 when documents
+  # are already parsed in a pool of worker processes
+  pdf_extract_workers = PDF_EXTRACT_WORKERS
 
   def __init__(self, storage_client):
     self.storage_client = storage_client
     self.docs_not_processed = []
-    # use llama index sentence window parser
-    self.doc_parser = SentenceWindowNodeParser.from_defaults(
-      window_size=CHUNK_SENTENCE_PADDING,
-      include_metadata=True,
-      window_metadata_key="window_text",
-      original_text_metadata_key="text",
-    )
+
+  def __getstate__(self):
+    # data sources are pickled to parse documents in worker processes;
+    # clients are not picklable and are not needed to parse documents
+    state = self.__dict__.copy()
+    state["storage_client"] = None
+    return state
 
   @classmethod
   def downloads_bucket_name(cls, q_engine: QueryEngine) -> str:
@@ -87,38 +130,107 @@ class DataSource:
     return bucket_name
 
   def download_documents(self, doc_url: str, temp_dir: str) -> \
-        List[DataSourceFile]:
+        Generator[DataSourceFile, None, None]:
     """
-    Download files from doc_url source to a local tmp directory
+    Download files from doc_url source to a local tmp directory.
+
+    Only blobs under the doc_url prefix with a supported extension, and no
+    larger than GCS_DOWNLOAD_MAX_FILE_SIZE, are downloaded; other blobs
+    are added to docs_not_processed. Files are downloaded by a pool of
+    GCS_DOWNLOAD_WORKERS threads and yielded as each download completes,
+    so documents can be processed while the rest are downloading.
 
     Args:
-        doc_url: url pointing to container of documents to be indexed
+        doc_url: gs:// url of a bucket or folder of documents to be indexed
         temp_dir: Path to temporary directory to download files to
 
-    Returns:
-        list of DataSourceFile
+    Yields:
+        DataSourceFile of each downloaded file
     """
-    doc_filepaths = []
-    bucket_name = doc_url.split("gs://")[1].split("/")[0]
+    bucket_name, _, prefix = doc_url.split("gs://")[1].partition("/")
     Logger.info(f"downloading {doc_url} from bucket {bucket_name}")
 
-    for blob in self.storage_client.list_blobs(bucket_name):
-      # Download the file to the tmp folder flattening all directories
-      file_name = Path(blob.name).name
-      file_path = os.path.join(temp_dir, file_name)
-      blob.download_to_filename(file_path)
-      gcs_path = blob.path.replace("/b/","")
-      gcs_url = f"gs://{gcs_path}"
-      doc_filepaths.append(DataSourceFile(doc_name=blob.name,
-                                          src_url=blob.public_url,
-                                          local_path=file_path,
-                                          gcs_path=gcs_url))
-
-    if len(doc_filepaths) == 0:
+    blobs = self.storage_client.list_blobs(bucket_name, prefix=prefix or None)
+    num_downloaded = 0
+    for data_source_file in self._download_blobs(blobs, temp_dir):
+      num_downloaded += 1
+      yield data_source_file
+
+    if num_downloaded == 0:
       raise NoDocumentsIndexedException(
           f"No documents can be indexed at url {doc_url}")
 
-    return doc_filepaths
+  def _download_blobs(self, blobs, temp_dir: str) -> \
+        Generator[DataSourceFile, None, None]:
+    """
+    Download document blobs in a thread pool, yielding files in the order
+    downloads complete. At most twice GCS_DOWNLOAD_WORKERS downloads are
+    started ahead of the consumer.
+    """
+    max_pending = GCS_DOWNLOAD_WORKERS * 2
+    with ThreadPoolExecutor(max_workers=GCS_DOWNLOAD_WORKERS) as executor:
+      pending = {}
+      for blob in blobs:
+        if not self._is_document_blob(blob):
+          continue
+        if len(pending) >= max_pending:
+          yield from self._completed_downloads(pending)
+        pending[executor.submit(self._download_blob, blob, temp_dir)] = blob
+      while pending:
+        yield from self._completed_downloads(pending)
+
+  def _completed_downloads(self, pending: dict) -> \
+        Generator[DataSourceFile, None, None]:
+    """
+    Wait for at least one pending download, removing completed downloads
+    from pending and yielding their files. Failed downloads are added to
+    docs_not_processed.
+    """
+    done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+      blob = pending.pop(future)
+      try:
+        yield future.result()
+      except Exception as e:
+        Logger.error(f"error downloading doc {blob.name}: {e}")
+        self.docs_not_processed.append(blob.public_url)
+
+  def _is_document_blob(self, blob) -> bool:
+    """ whether a listed blob should be downloaded for indexing """
+    if blob.name.endswith("/"):
+      # folder placeholder
+      return False
+    doc_extension = blob.name.split(".")[-1].lower()
+    if doc_extension not in SUPPORTED_DOC_EXTENSIONS:
+      Logger.error(
+          f"Cannot read {blob.name}: unsupported extension {doc_extension}")
+      self.docs_not_processed.append(blob.public_url)
+      return False
+    if GCS_DOWNLOAD_MAX_FILE_SIZE and blob.size is not None \
+        and blob.size > GCS_DOWNLOAD_MAX_FILE_SIZE:
+      Logger.error(f"Cannot read {blob.name}: size {blob.size} is larger "
+                   f"than {GCS_DOWNLOAD_MAX_FILE_SIZE}")
+      self.docs_not_processed.append(blob.public_url)
+      return False
+    return True
+
+  @staticmethod
+  def _download_blob(blob, temp_dir: str) -> DataSourceFile:
+    # Download the file to its blob path under the tmp folder, so blobs of
+    # the same name in different folders, downloaded concurrently, are
+    # written to different files
+    file_path = os.path.normpath(
+        os.path.join(temp_dir, blob.name.lstrip("/")))
+    if os.path.commonpath([temp_dir, file_path]) != os.path.normpath(temp_dir):
+      raise ValueError(f"invalid blob name {blob.name}")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    blob.download_to_filename(file_path)
+    gcs_path = blob.path.replace("/b/","")
+    gcs_url = f"gs://{gcs_path}"
+    return DataSourceFile(doc_name=blob.name,
+                          src_url=blob.public_url,
+                          local_path=file_path,
+                          gcs_path=gcs_url)
 
   def chunk_document(self, doc_name: str, doc_url: str,
                      doc_filepath: str) -> List[str]:
@@ -132,16 +244,36 @@ class DataSource:
     Returns:
        list of text chunks or None if the document could not be processed
     """
+    text_chunks, _ = self.chunk_document_sentences(doc_name, doc_url,
+                                                   doc_filepath)
+    return text_chunks
 
-    text_chunks = None
+  def chunk_document_sentences(self, doc_name: str, doc_url: str,
+                               doc_filepath: str) -> \
+        Tuple[Optional[List[str]], Optional[List[List[str]]]]:
+    """
+    Process doc into chunks for embeddings, with the sentences of each
+    chunk. The document is split into sentences in one pass, and each
+    chunk is a window of a sentence and CHUNK_SENTENCE_PADDING sentences
+    before and after it (chunks have overlapping text).
 
+    Args:
+       doc_name: file name of document
+       doc_url: remote url of document
+       doc_filepath: local file path of document
+    Returns:
+       tuple of the list of text chunks and the list of sentences of each
+       chunk, or (None, None) if the document could not be processed
+    """
     Logger.info(f"generating index data for {doc_name}")
 
     # read doc data and split into text chunks
     # skip any file that can't be read or generates an error
     doc_text_list = None
     try:
-      doc_text_list = self.read_doc(doc_name, doc_filepath)
+      doc_text_list = self.read_doc(
+          doc_name, doc_filepath,
+          pdf_extract_workers=self.pdf_extract_workers)
       if doc_text_list is None:
         Logger.error(f"no content read from {doc_name}")
         self.docs_not_processed.append(doc_url)
@@ -149,29 +281,30 @@ class DataSource:
       Logger.error(f"error reading doc {doc_name}: {e}")
       self.docs_not_processed.append(doc_url)
 
-    if doc_text_list is not None:
-      # clean text of escape and other unprintable chars
-      doc_text_list = [self.clean_text(x) for x in doc_text_list]
-      # combine text from all pages to try to avoid small chunks
-      # when there is just title text on a page, for example
-      doc_text = "\n".join(doc_text_list)
-      # llama-index base class that is used by all parsers
-      doc = Document(text=doc_text)
-      # a node = a chunk of a page
-      chunks = self.doc_parser.get_nodes_from_documents([doc])
-      # this is a sentence parser with overlap --
-      # each text chunk will include the specified
-      # number of sentences before and after the current sentence
-      text_chunks = [c.metadata["window_text"] for c in chunks]
-
-      if all(element == "" for element in text_chunks):
-        Logger.warning(f"All extracted pages from {doc_name} are empty.")
-        self.docs_not_processed.append(doc_url)
+    if doc_text_list is None:
+      return None, None
 
-      # clean up text_chunks with empty items.
-      text_chunks = [x for x in text_chunks if x.strip() != ""]
+    # clean text of escape and other unprintable chars, and combine text
+    # from pages to try to avoid small chunks when there is just title
+    # text on a page, for example. Pages are streamed from the reader, so
+    # large documents are not read into memory before segmenting.
+    start_time = time.monotonic()
+    doc_sentences = list(text_helper.iter_sentences(
+        self.clean_text(x) for x in doc_text_list))
+    Logger.info(f"split {doc_name} into {len(doc_sentences)} sentences in "
+                f"{time.monotonic() - start_time:.2f}s")
+    if not doc_sentences:
+      Logger.warning(f"All extracted pages from {doc_name} are empty.")
+      self.docs_not_processed.append(doc_url)
 
-    return text_chunks
+    text_chunks = []
+    chunk_sentences = []
+    for i in range(len(doc_sentences)):
+      sentences = doc_sentences[max(0, i - CHUNK_SENTENCE_PADDING):
+                                i + CHUNK_SENTENCE_PADDING + 1]
+      text_chunks.append(" ".join(sentences))
+      chunk_sentences.append(sentences)
+    return text_chunks, chunk_sentences
 
   @classmethod
   def text_to_sentence_list(cls, text: str) -> List[str]:
@@ -192,39 +325,34 @@ class DataSource:
     return text_helper.clean_text(text)
 
   @staticmethod
-  def read_doc(doc_name: str, doc_filepath: str) -> List[str]:
+  def read_doc(doc_name: str, doc_filepath: str,
+               pdf_extract_workers: int = PDF_EXTRACT_WORKERS) -> \
+      Iterable[str]:
     """
     Read document and return content as a list of strings
 
     Args:
       doc_name: name of document
       doc_filepath: local file path
+      pdf_extract_workers: processes extracting the pages of a large PDF
     Returns:
-      doc content as a list of strings
+      doc content as a list of strings, or a generator of PDF page text
     """
     doc_extension = doc_name.split(".")[-1]
     doc_extension = doc_extension.lower()
     doc_text_list = None
     loader = None
 
-    text_doc_extensions = ["txt", "html", "htm"]
-
-    if doc_extension in text_doc_extensions:
+    if doc_extension in TEXT_DOC_EXTENSIONS:
       with open(doc_filepath, "r", encoding="utf-8") as f:
         doc_text = f.read()
       doc_text_list = [doc_text]
     elif doc_extension == "csv":
       loader = CSVLoader(file_path=doc_filepath)
     elif doc_extension == "pdf":
-      # read PDF into array of pages
-      doc_text_list = []
-      with open(doc_filepath, "rb") as f:
-        reader = PdfReader(f)
-        num_pages = len(reader.pages)
-        Logger.info(f"Reading pdf file {doc_name} with {num_pages} pages")
-        for page in range(num_pages):
-          doc_text_list.append(reader.pages[page].extract_text())
-        Logger.info(f"Finished reading pdf file {doc_name}")
+      # PDF pages are extracted as they are read
+      doc_text_list = extract_pdf_pages(doc_name, doc_filepath,
+                                        workers=pdf_extract_workers)
     elif doc_extension in ["docx", "pptx", "ppt", "pptm"]:
       doc_text_list = []
       docs = SimpleDirectoryReader(
@@ -245,3 +373,43 @@ class DataSource:
       doc_text_list = [section.page_content for section in langchain_document]
 
     return doc_text_list
+
+
+def parse_document(data_source: DataSource,
+                   data_source_file: DataSourceFile) -> ParsedDocument:
+  """
+  Chunk a downloaded document, with the clean text and sentences of each
+  chunk.
+
+  This is the CPU bound stage of a query engine build, and may run in a
+  worker process on a copy of data_source, so docs that could not be
+  processed are returned in the ParsedDocument as well as recorded on
+  data_source.
+  """
+  num_not_processed = len(data_source.docs_not_processed)
+  text_chunks, sentences = data_source.chunk_document_sentences(
+      data_source_file.doc_name,
+      data_source_file.src_url,
+      data_source_file.local_path)
+  docs_not_processed = data_source.docs_not_processed[num_not_processed:]
+  if not text_chunks:
+    return ParsedDocument(data_source_file,
+                          docs_not_processed=docs_not_processed)
+
+  # chunks are joined from sentences of text already cleaned by the data
+  # source, so only line breaks between pages are left to clean
+  clean_texts = [text_helper.clean_text(text) for text in text_chunks]
+  return ParsedDocument(data_source_file, text_chunks, clean_texts,
+                        sentences, docs_not_processed)
+
+def parse_document_in_worker(data_source: DataSource,
+                             data_source_file: DataSourceFile) -> \
+                             ParsedDocument:
+  """
+  Parse a document in a parse pool worker process. The pool already uses
+  the available CPUs, so the pages of large PDFs are extracted in the
+  worker rather than in a nested pool of processes per worker.
+  """
+  # data_source is this worker's unpickled copy
+  data_source.pdf_extract_workers = 1
+  return parse_document(data_source, data_source_file)
@@ -0,0 +1,119 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for query data sources
+"""
+# pylint: disable=wrong-import-position
+import os
+from unittest import mock
+import pytest
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.query.data_source import (DataSource, DataSourceFile,
+                                        parse_document,
+                                        parse_document_in_worker)
+from utils.errors import NoDocumentsIndexedException
+
+
+def fake_blob(name: str, size: int = 100) -> mock.Mock:
+  blob = mock.Mock(size=size, path=f"/b/bucket/o/{name}",
+                   public_url=f"https://storage.googleapis.com/bucket/{name}")
+  blob.name = name
+  def download_to_filename(file_path):
+    if name.startswith("docs/broken"):
+      raise RuntimeError("download failed")
+    with open(file_path, "w", encoding="utf-8") as f:
+      f.write(name)
+  blob.download_to_filename.side_effect = download_to_filename
+  return blob
+
+
+@mock.patch("services.query.data_source.GCS_DOWNLOAD_MAX_FILE_SIZE", 1000)
+def test_download_documents(tmp_path):
+  storage_client = mock.Mock()
+  storage_client.list_blobs.return_value = [
+    fake_blob("docs/"),
+    fake_blob("docs/a.pdf"),
+    fake_blob("docs/sub/b.TXT"),
+    fake_blob("docs/image.png"),
+    fake_blob("docs/large.pdf", size=2000),
+    fake_blob("docs/broken.pdf"),
+  ]
+  data_source = DataSource(storage_client)
+  data_source_files = data_source.download_documents(
+      "gs://bucket/docs", str(tmp_path))
+  # files are downloaded as the generator is consumed
+  storage_client.list_blobs.assert_not_called()
+  data_source_files = list(data_source_files)
+
+  storage_client.list_blobs.assert_called_once_with("bucket", prefix="docs")
+  assert sorted(f.doc_name for f in data_source_files) == \
+      ["docs/a.pdf", "docs/sub/b.TXT"]
+  for data_source_file in data_source_files:
+    with open(data_source_file.local_path, "r", encoding="utf-8") as f:
+      assert f.read() == data_source_file.doc_name
+  assert data_source_files[0].gcs_path.startswith("gs://bucket/o/docs/")
+  # unsupported, oversized and failed files are not processed
+  assert sorted(data_source.docs_not_processed) == [
+    "https://storage.googleapis.com/bucket/docs/broken.pdf",
+    "https://storage.googleapis.com/bucket/docs/image.png",
+    "https://storage.googleapis.com/bucket/docs/large.pdf"
+  ]
+
+  # blobs of the same name in different folders are downloaded to
+  # different files
+  storage_client.list_blobs.return_value = [
+    fake_blob("docs/a/report.pdf"),
+    fake_blob("docs/b/report.pdf"),
+    fake_blob("docs/../../escape.pdf"),
+  ]
+  data_source = DataSource(storage_client)
+  data_source_files = list(data_source.download_documents(
+      "gs://bucket/docs", str(tmp_path)))
+  assert len({f.local_path for f in data_source_files}) == 2
+  for data_source_file in data_source_files:
+    assert data_source_file.local_path == \
+        os.path.join(tmp_path, data_source_file.doc_name)
+    with open(data_source_file.local_path, "r", encoding="utf-8") as f:
+      assert f.read() == data_source_file.doc_name
+  # blob names may not write outside the download folder
+  assert data_source.docs_not_processed == [
+    "https://storage.googleapis.com/bucket/docs/../../escape.pdf"]
+  assert not os.path.exists(os.path.join(tmp_path, "..", "escape.pdf"))
+
+  # a bucket url lists the whole bucket
+  storage_client.list_blobs.return_value = [fake_blob("docs/image.png")]
+  with pytest.raises(NoDocumentsIndexedException):
+    list(data_source.download_documents("gs://bucket", str(tmp_path)))
+  storage_client.list_blobs.assert_called_with("bucket", prefix=None)
+
+
+@mock.patch("services.query.data_source.extract_pdf_pages",
+            return_value=iter(["page one text."]))
+def test_parse_document_pdf_workers(mock_extract_pdf_pages, tmp_path):
+  data_source = DataSource(None)
+  data_source.pdf_extract_workers = 4
+  data_source_file = DataSourceFile(
+      doc_name="doc.pdf", src_url="gs://bucket/doc.pdf",
+      local_path=os.path.join(tmp_path, "doc.pdf"))
+
+  # documents parsed in this process extract PDF pages in a pool
+  parse_document(data_source, data_source_file)
+  assert mock_extract_pdf_pages.call_args.kwargs["workers"] == 4
+
+  # documents parsed in a parse pool worker extract pages in the worker
+  mock_extract_pdf_pages.return_value = iter(["page one text."])
+  parse_document_in_worker(data_source, data_source_file)
+  assert mock_extract_pdf_pages.call_args.kwargs["workers"] == 1
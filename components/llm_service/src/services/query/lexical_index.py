@@ -0,0 +1,361 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+BM25 lexical index of query engine document chunks.
+
+Vector search misses exact identifiers such as form numbers and statute
+codes, so a lexical index of chunk clean text is built with the vector
+index, and its matches are fused with vector matches at query time.
+
+The index is an inverted index in compressed sparse row form: for each
+term, the rows of the chunks containing the term and its frequency in each.
+Each version of an engine's index is saved as one compressed npz file in
+the engine data bucket, and query processes keep up to
+LEXICAL_INDEX_MAX_OPEN_INDEXES indexes loaded.
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional
+import numpy as np
+from google.cloud import storage
+from common.models import QueryEngine
+from common.utils.logging_handler import Logger
+from config import (PROJECT_ID, REGION, LEXICAL_INDEX_PATH,
+                    LEXICAL_INDEX_MAX_OPEN_INDEXES, HYBRID_RRF_K)
+from services.query.vector_store import VectorStoreMatch
+from utils.gcs_helper import create_bucket
+
+Logger = Logger.get_logger(__file__)
+
+LEXICAL_INDEX_VERSION_PARAM = "lexical_index_version"
+LEXICAL_INDEX_PREFIX = "lexical_index/"
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# words, numbers and identifiers joined by "-", "." or "/", e.g. 1040-sr
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-./][^\W_]+)*")
+TOKEN_SEPARATOR_PATTERN = re.compile(r"[-./]")
+# longer tokens (urls, encoded data) are not indexed
+MAX_TOKEN_LENGTH = 64
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str) -> List[str]:
+  """
+  Lower case word tokens of text. Identifiers such as "1040-SR" are
+  indexed whole and by their parts, so a search for "1040" matches too.
+  """
+  tokens = []
+  for token in TOKEN_PATTERN.findall(text.lower()):
+    if len(token) > MAX_TOKEN_LENGTH:
+      continue
+    tokens.append(token)
+    if not token.isalnum():
+      tokens.extend(TOKEN_SEPARATOR_PATTERN.split(token))
+  return tokens
+
+
+class LexicalIndex():
+  """ BM25 inverted index of chunk texts """
+  ARRAYS = ["terms", "offsets", "rows", "term_frequencies",
+            "chunk_indexes", "chunk_lengths"]
+
+  def __init__(self, terms: np.ndarray, offsets: np.ndarray,
+               rows: np.ndarray, term_frequencies: np.ndarray,
+               chunk_indexes: np.ndarray, chunk_lengths: np.ndarray):
+    # postings of term i are rows[offsets[i]:offsets[i + 1]]
+    self.terms = terms
+    self.offsets = offsets
+    self.rows = rows
+    self.term_frequencies = term_frequencies
+    self.chunk_indexes = chunk_indexes
+    self.chunk_lengths = chunk_lengths
+    self.term_ids = {term: i for i, term in enumerate(terms.tolist())}
+    avg_length = float(chunk_lengths.mean()) if len(chunk_lengths) else 1.0
+    self.length_norm = (BM25_K1 * (
+        1 - BM25_B + BM25_B * chunk_lengths / max(avg_length, 1.0))
+        ).astype(np.float32)
+
+  def __len__(self) -> int:
+    return len(self.chunk_indexes)
+
+  def search(self, query: str, k: int) -> List[VectorStoreMatch]:
+    """ top k chunks by BM25 score, as matches with chunk index and score """
+    term_ids = {self.term_ids[term] for term in tokenize(query)
+                if term in self.term_ids}
+    if not term_ids:
+      return []
+
+    num_chunks = len(self)
+    scores = np.zeros(num_chunks, dtype=np.float32)
+    for term_id in term_ids:
+      start, end = self.offsets[term_id], self.offsets[term_id + 1]
+      rows = self.rows[start:end]
+      term_frequencies = self.term_frequencies[start:end].astype(np.float32)
+      idf = np.log(1 + (num_chunks - (end - start) + 0.5) /
+                   (end - start + 0.5))
+      # rows of a term are unique, so scores can be added in place
+      scores[rows] += idf * term_frequencies * (BM25_K1 + 1) / \
+          (term_frequencies + self.length_norm[rows])
+
+    candidates = np.flatnonzero(scores)
+    if len(candidates) > k:
+      candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [VectorStoreMatch(int(self.chunk_indexes[row]), float(scores[row]))
+            for row in candidates]
+
+  def save(self, path: str):
+    with open(path, "wb") as f:
+      np.savez_compressed(f, **{name: getattr(self, name)
+                                for name in self.ARRAYS})
+
+  @classmethod
+  def load(cls, path: str) -> "LexicalIndex":
+    with np.load(path, allow_pickle=False) as index_arrays:
+      return cls(**{name: index_arrays[name] for name in cls.ARRAYS})
+
+
+class LexicalIndexBuilder():
+  """
+  Builds a LexicalIndex from chunk texts. A builder started from an
+  existing index adds and removes chunks for an incremental update.
+  """
+  def __init__(self, lexical_index: LexicalIndex = None):
+    self.term_ids = {}
+    self.num_chunks = 0
+    self.removed_ranges = []
+    self._lock = threading.Lock()
+    self._term_id_arrays = [np.zeros(0, dtype=np.int64)]
+    self._row_arrays = [np.zeros(0, dtype=np.int64)]
+    self._frequency_arrays = [np.zeros(0, dtype=np.uint16)]
+    self._chunk_indexes = [np.zeros(0, dtype=np.int64)]
+    self._chunk_lengths = [np.zeros(0, dtype=np.int32)]
+    if lexical_index is not None:
+      self.term_ids = dict(lexical_index.term_ids)
+      self.num_chunks = len(lexical_index)
+      self._term_id_arrays.append(np.repeat(
+          np.arange(len(lexical_index.terms), dtype=np.int64),
+          np.diff(lexical_index.offsets)))
+      self._row_arrays.append(lexical_index.rows.astype(np.int64))
+      self._frequency_arrays.append(lexical_index.term_frequencies)
+      self._chunk_indexes.append(lexical_index.chunk_indexes)
+      self._chunk_lengths.append(lexical_index.chunk_lengths)
+
+  def add(self, chunk_index: int, text: str):
+    term_counts = Counter(tokenize(text or ""))
+    frequencies = np.minimum(
+        np.fromiter(term_counts.values(), dtype=np.int64,
+                    count=len(term_counts)), MAX_TERM_FREQUENCY)
+    with self._lock:
+      term_ids = [self.term_ids.setdefault(term, len(self.term_ids))
+                  for term in term_counts]
+      self._term_id_arrays.append(np.array(term_ids, dtype=np.int64))
+      self._row_arrays.append(
+          np.full(len(term_ids), self.num_chunks, dtype=np.int64))
+      self._frequency_arrays.append(frequencies.astype(np.uint16))
+      self._chunk_indexes.append(np.array([chunk_index], dtype=np.int64))
+      self._chunk_lengths.append(
+          np.array([sum(term_counts.values())], dtype=np.int32))
+      self.num_chunks += 1
+
+  def remove_range(self, index_start: int, index_end: int):
+    """ remove chunks with indexes in [index_start, index_end) on build """
+    with self._lock:
+      self.removed_ranges.append((index_start, index_end))
+
+  def build(self) -> LexicalIndex:
+    with self._lock:
+      term_ids = np.concatenate(self._term_id_arrays)
+      rows = np.concatenate(self._row_arrays)
+      frequencies = np.concatenate(self._frequency_arrays)
+      chunk_indexes = np.concatenate(self._chunk_indexes)
+      chunk_lengths = np.concatenate(self._chunk_lengths)
+      terms_by_id = np.empty(len(self.term_ids), dtype=object)
+      terms_by_id[list(self.term_ids.values())] = list(self.term_ids.keys())
+      removed_ranges = list(self.removed_ranges)
+
+    # drop postings of removed chunks and renumber the remaining rows
+    keep_chunks = np.ones(len(chunk_indexes), dtype=bool)
+    for index_start, index_end in removed_ranges:
+      keep_chunks &= (chunk_indexes < index_start) | \
+          (chunk_indexes >= index_end)
+    keep_postings = keep_chunks[rows]
+    rows = (np.cumsum(keep_chunks) - 1)[rows[keep_postings]]
+    term_ids = term_ids[keep_postings]
+    frequencies = frequencies[keep_postings]
+
+    # drop terms no longer in any chunk, and sort postings by term
+    used_term_ids, term_ids = np.unique(term_ids, return_inverse=True)
+    order = np.lexsort((rows, term_ids))
+    offsets = np.zeros(len(used_term_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(term_ids,
+                                        minlength=len(used_term_ids)))
+    return LexicalIndex(
+        terms=np.array(terms_by_id[used_term_ids].tolist(), dtype=str),
+        offsets=offsets,
+        rows=rows[order].astype(np.int32),
+        term_frequencies=frequencies[order],
+        chunk_indexes=chunk_indexes[keep_chunks],
+        chunk_lengths=chunk_lengths[keep_chunks])
+
+
+def reciprocal_rank_fusion(ranked_matches: List[List[VectorStoreMatch]],
+                           weights: List[float],
+                           num_results: int,
+                           rank_constant: int = HYBRID_RRF_K) -> \
+                           List[VectorStoreMatch]:
+  """
+  Fuse ranked lists of matches by weighted reciprocal rank fusion. A
+  chunk scores weight / (rank_constant + rank) for each list it is ranked
+  in, so chunks ranked well by several retrievers rise to the top.
+
+  Matches are identified by chunk index. Fused matches keep the metadata
+  of the match that carries reference metadata, if any.
+  """
+  scores = {}
+  fused_matches = {}
+  for matches, weight in zip(ranked_matches, weights):
+    if weight <= 0:
+      continue
+    for rank, match in enumerate(matches, start=1):
+      scores[match.index] = scores.get(match.index, 0.0) + \
+          weight / (rank_constant + rank)
+      fused_match = fused_matches.get(match.index)
+      if fused_match is None or (match.has_reference_metadata and
+                                 not fused_match.has_reference_metadata):
+        fused_matches[match.index] = match
+
+  fused_indexes = sorted(scores, key=scores.get, reverse=True)[:num_results]
+  return [VectorStoreMatch(index, scores[index], fused_matches[index].metadata)
+          for index in fused_indexes]
+
+
+_lexical_indexes = OrderedDict()
+_lexical_indexes_lock = threading.Lock()
+
+
+def lexical_index_version(q_engine: QueryEngine) -> Optional[int]:
+  """ current lexical index version of an engine, None if it has none """
+  version = (q_engine.params or {}).get(LEXICAL_INDEX_VERSION_PARAM)
+  return None if version is None else int(version)
+
+def _bucket_name(q_engine: QueryEngine) -> str:
+  return f"{PROJECT_ID}-{q_engine.name}-data"
+
+def _engine_dir(q_engine: QueryEngine) -> str:
+  return os.path.join(LEXICAL_INDEX_PATH, q_engine.id)
+
+def _index_file_name(version: int) -> str:
+  return f"{version}.npz"
+
+def save_lexical_index(q_engine: QueryEngine, lexical_index: LexicalIndex,
+                       storage_client: storage.Client = None):
+  """
+  Upload a new version of an engine's lexical index and record it in the
+  query engine. The previous version is kept for queries in progress.
+  """
+  storage_client = storage_client or storage.Client(project=PROJECT_ID)
+  version = (lexical_index_version(q_engine) or 0) + 1
+  engine_dir = _engine_dir(q_engine)
+  os.makedirs(engine_dir, exist_ok=True)
+  index_path = os.path.join(engine_dir, _index_file_name(version))
+  lexical_index.save(index_path)
+
+  bucket_name = _bucket_name(q_engine)
+  create_bucket(storage_client, bucket_name, location=REGION, clear=False)
+  bucket = storage_client.bucket(bucket_name)
+  bucket.blob(LEXICAL_INDEX_PREFIX + _index_file_name(version)) \
+      .upload_from_filename(index_path)
+  Logger.info(f"uploaded lexical index version {version} with "
+              f"{len(lexical_index)} chunks, {len(lexical_index.terms)} "
+              f"terms for {q_engine.name}")
+
+  q_engine.params = {**(q_engine.params or {}),
+                     LEXICAL_INDEX_VERSION_PARAM: version}
+  q_engine.update()
+
+  for blob in bucket.list_blobs(prefix=LEXICAL_INDEX_PREFIX):
+    blob_version = os.path.splitext(os.path.basename(blob.name))[0]
+    if blob_version.isdigit() and int(blob_version) < version - 1:
+      blob.delete()
+  os.remove(index_path)
+
+def load_lexical_index(q_engine: QueryEngine,
+                       storage_client: storage.Client = None) -> \
+                       Optional[LexicalIndex]:
+  """
+  Get the loaded lexical index of an engine, downloading it on first use.
+  Returns None for engines built without a lexical index.
+  """
+  version = lexical_index_version(q_engine)
+  if version is None:
+    return None
+  key = (q_engine.id, version)
+  with _lexical_indexes_lock:
+    lexical_index = _lexical_indexes.get(key)
+    if lexical_index is not None:
+      _lexical_indexes.move_to_end(key)
+      return lexical_index
+
+  Logger.info(f"loading lexical index version {version} "
+              f"for {q_engine.name}")
+  storage_client = storage_client or storage.Client(project=PROJECT_ID)
+  engine_dir = _engine_dir(q_engine)
+  os.makedirs(engine_dir, exist_ok=True)
+  with tempfile.TemporaryDirectory(dir=engine_dir) as download_dir:
+    index_path = os.path.join(download_dir, _index_file_name(version))
+    storage_client.bucket(_bucket_name(q_engine)).blob(
+        LEXICAL_INDEX_PREFIX + _index_file_name(version)
+    ).download_to_filename(index_path)
+    lexical_index = LexicalIndex.load(index_path)
+
+  with _lexical_indexes_lock:
+    # drop other versions of this engine's index
+    for cached_key in [cached_key for cached_key in _lexical_indexes
+                       if cached_key[0] == q_engine.id]:
+      _lexical_indexes.pop(cached_key)
+    _lexical_indexes[key] = lexical_index
+    while len(_lexical_indexes) > LEXICAL_INDEX_MAX_OPEN_INDEXES:
+      _lexical_indexes.popitem(last=False)
+  return lexical_index
+
+def lexical_search(q_engine: QueryEngine, query: str,
+                   k: int) -> List[VectorStoreMatch]:
+  """ BM25 search of an engine's lexical index, empty if it has none """
+  lexical_index = load_lexical_index(q_engine)
+  if lexical_index is None:
+    return []
+  return lexical_index.search(query, k)
+
+def delete_lexical_index(q_engine: QueryEngine,
+                         storage_client: storage.Client = None):
+  """ Delete the loaded, local and uploaded lexical indexes of an engine """
+  with _lexical_indexes_lock:
+    for cached_key in [cached_key for cached_key in _lexical_indexes
+                       if cached_key[0] == q_engine.id]:
+      _lexical_indexes.pop(cached_key)
+  shutil.rmtree(_engine_dir(q_engine), ignore_errors=True)
+  if lexical_index_version(q_engine) is None:
+    return
+  storage_client = storage_client or storage.Client(project=PROJECT_ID)
+  bucket = storage_client.bucket(_bucket_name(q_engine))
+  for blob in bucket.list_blobs(prefix=LEXICAL_INDEX_PREFIX):
+    blob.delete()
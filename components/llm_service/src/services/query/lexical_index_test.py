@@ -0,0 +1,98 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for the BM25 lexical index
+"""
+# pylint: disable=wrong-import-position
+import os
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.query.lexical_index import (LexicalIndex, LexicalIndexBuilder,
+                                          tokenize, reciprocal_rank_fusion)
+from services.query.vector_store import VectorStoreMatch
+
+CHUNK_TEXTS = [
+  "File Form 1040-SR if you were born before 1960.",
+  "Report wages from Form W-2 on your tax return.",
+  "Schedule C reports business income and expenses.",
+  "Tax refunds are sent within 21 days. Tax tax tax.",
+]
+
+
+def build_index(chunk_texts, index_base=0) -> LexicalIndex:
+  builder = LexicalIndexBuilder()
+  for i, text in enumerate(chunk_texts):
+    builder.add(index_base + i, text)
+  return builder.build()
+
+
+def test_tokenize():
+  assert tokenize("Form 1040-SR, 26 U.S.C. 501") == \
+      ["form", "1040-sr", "1040", "sr", "26", "u.s.c", "u", "s", "c", "501"]
+
+
+def test_lexical_index_search(tmp_path):
+  lexical_index = build_index(CHUNK_TEXTS, index_base=10)
+
+  # exact identifiers rank the chunk that contains them first
+  matches = lexical_index.search("what is form 1040-SR", 2)
+  assert [match.index for match in matches] == [10, 11]
+  assert matches[0].score > matches[1].score
+  assert [match.index for match in lexical_index.search("w-2", 5)] == [11]
+  assert lexical_index.search("unknown words", 5) == []
+
+  index_path = os.path.join(tmp_path, "index.npz")
+  lexical_index.save(index_path)
+  loaded_index = LexicalIndex.load(index_path)
+  assert [match.index for match in loaded_index.search("tax", 5)] == \
+      [match.index for match in lexical_index.search("tax", 5)]
+
+
+def test_lexical_index_update():
+  builder = LexicalIndexBuilder(build_index(CHUNK_TEXTS))
+  builder.remove_range(1, 2)
+  builder.add(4, "Form W-4 sets tax withholding.")
+  updated_index = builder.build()
+
+  # an updated index is the same as one built from the current chunks
+  builder = LexicalIndexBuilder()
+  for i in [0, 2, 3]:
+    builder.add(i, CHUNK_TEXTS[i])
+  builder.add(4, "Form W-4 sets tax withholding.")
+  rebuilt_index = builder.build()
+  assert "wages" not in updated_index.term_ids
+  for query in ["tax form", "w-4", "income"]:
+    assert [(match.index, round(match.score, 5))
+            for match in updated_index.search(query, 5)] == \
+        [(match.index, round(match.score, 5))
+         for match in rebuilt_index.search(query, 5)]
+
+
+def test_reciprocal_rank_fusion():
+  metadata = {"chunk_id": "chunk-2"}
+  vector_matches = [VectorStoreMatch(1, 0.9),
+                    VectorStoreMatch(2, 0.8, metadata)]
+  lexical_matches = [VectorStoreMatch(3, 7.0), VectorStoreMatch(2, 5.0)]
+
+  # chunks matched by both searches rank first
+  matches = reciprocal_rank_fusion([vector_matches, lexical_matches],
+                                   [1.0, 1.0], 3)
+  assert [match.index for match in matches] == [2, 1, 3]
+  assert matches[0].metadata == metadata
+
+  # a zero weight disables a search
+  matches = reciprocal_rank_fusion([vector_matches, lexical_matches],
+                                   [0.0, 1.0], 2)
+  assert [match.index for match in matches] == [3, 2]
@@ -0,0 +1,267 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Export of embeddings to Matching Engine index data files.
+
+Embeddings are written as Avro files in the Matching Engine input schema.
+Embedding vectors are copied into each record as raw little-endian
+float32 bytes straight from the NumPy array, so a vector is 4 bytes per
+dimension with no float formatting, compared to around 20 bytes per
+dimension as JSON. Files are uploaded to GCS from a thread pool while
+the next files are written.
+"""
+import json
+import os
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, List
+import numpy as np
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from config.vector_store_config import (MATCHING_ENGINE_UPLOAD_WORKERS,
+                                        MATCHING_ENGINE_UPLOAD_CHUNK_SIZE)
+
+AVRO_FILE_EXTENSION = ".avro"
+AVRO_MAGIC = b"Obj\x01"
+
+# Matching Engine Avro input schema
+AVRO_SCHEMA = {
+  "type": "record",
+  "name": "FeatureVector",
+  "fields": [
+    {"name": "id", "type": "string"},
+    {"name": "embedding", "type": {"type": "array", "items": "float"}},
+    {"name": "restricts", "type": ["null", {
+      "type": "array",
+      "items": {
+        "type": "record",
+        "name": "Restrict",
+        "fields": [
+          {"name": "namespace", "type": "string"},
+          {"name": "allow",
+           "type": ["null", {"type": "array", "items": "string"}]},
+          {"name": "deny",
+           "type": ["null", {"type": "array", "items": "string"}]}
+        ]
+      }
+    }]},
+    {"name": "numeric_restricts", "type": ["null", {
+      "type": "array",
+      "items": {
+        "type": "record",
+        "name": "NumericRestrict",
+        "fields": [
+          {"name": "namespace", "type": "string"},
+          {"name": "value_int", "type": ["null", "int"], "default": None},
+          {"name": "value_float", "type": ["null", "float"],
+           "default": None},
+          {"name": "value_double", "type": ["null", "double"],
+           "default": None}
+        ]
+      }
+    }], "default": None},
+    {"name": "crowding_tag", "type": ["null", "string"], "default": None}
+  ]
+}
+
+_NULL = b"\x00"
+_END_OF_ARRAY = b"\x00"
+# union branch 1 of ["null", <type>]
+_NON_NULL = b"\x02"
+
+
+def encode_long(value: int) -> bytes:
+  """ Avro int/long: zigzag encoded variable length integer """
+  value = (value << 1) ^ (value >> 63)
+  encoded = bytearray()
+  while value > 0x7f:
+    encoded.append((value & 0x7f) | 0x80)
+    value >>= 7
+  encoded.append(value)
+  return bytes(encoded)
+
+def encode_string(value: str) -> bytes:
+  encoded = value.encode("utf-8")
+  return encode_long(len(encoded)) + encoded
+
+def encode_restricts(datapoint_restricts: dict) -> bytes:
+  """
+  Encode the restricts and numeric_restricts fields of a record, from
+  restricts in the Matching Engine JSON datapoint format.
+  """
+  encoded = bytearray()
+  restricts = datapoint_restricts.get("restricts")
+  if restricts:
+    encoded += _NON_NULL + encode_long(len(restricts))
+    for restrict in restricts:
+      encoded += encode_string(restrict["namespace"])
+      for tokens in [restrict.get("allow"), restrict.get("deny")]:
+        if tokens:
+          encoded += _NON_NULL + encode_long(len(tokens))
+          for token in tokens:
+            encoded += encode_string(token)
+          encoded += _END_OF_ARRAY
+        else:
+          encoded += _NULL
+    encoded += _END_OF_ARRAY
+  else:
+    encoded += _NULL
+
+  numeric_restricts = datapoint_restricts.get("numeric_restricts")
+  if numeric_restricts:
+    encoded += _NON_NULL + encode_long(len(numeric_restricts))
+    for restrict in numeric_restricts:
+      encoded += encode_string(restrict["namespace"])
+      if restrict.get("value_int") is not None:
+        encoded += _NON_NULL + encode_long(int(restrict["value_int"]))
+      else:
+        encoded += _NULL
+      if restrict.get("value_float") is not None:
+        encoded += _NON_NULL + struct.pack("<f", restrict["value_float"])
+      else:
+        encoded += _NULL
+      if restrict.get("value_double") is not None:
+        encoded += _NON_NULL + struct.pack("<d", restrict["value_double"])
+      else:
+        encoded += _NULL
+    encoded += _END_OF_ARRAY
+  else:
+    encoded += _NULL
+  return bytes(encoded)
+
+
+class AvroEmbeddingWriter():
+  """
+  Streaming writer of an Avro container file of Matching Engine
+  datapoints. Each write_batch call is written as one Avro block, so
+  memory use is bounded by the batch size.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.num_vectors = 0
+    # closed by close, as the writer is used as a context manager
+    # pylint: disable=consider-using-with
+    self._file: BinaryIO = open(path, "wb")
+    self._sync_marker = os.urandom(16)
+    schema = json.dumps(AVRO_SCHEMA).encode("utf-8")
+    header = bytearray(AVRO_MAGIC)
+    header += encode_long(2)
+    header += encode_string("avro.schema") + encode_long(len(schema)) + schema
+    header += encode_string("avro.codec") + encode_string("null")
+    header += encode_long(0)
+    header += self._sync_marker
+    self._file.write(header)
+
+  def write_batch(self, ids: np.ndarray, embeddings: np.ndarray,
+                  restricts: List[dict] = None) -> None:
+    """
+    Write datapoints for rows of an embeddings array.
+
+    Args:
+      ids: datapoint id of each row
+      embeddings: 2D array of embeddings, one per row
+      restricts: datapoint restricts of each row, in the Matching Engine
+        JSON datapoint format (see MatchingEngineVectorStore)
+    """
+    if len(ids) == 0:
+      return
+    embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+    # every embedding has the same array block length
+    embedding_prefix = encode_long(embeddings.shape[1])
+    block = bytearray()
+    for i, (datapoint_id, embedding) in enumerate(zip(ids, embeddings)):
+      block += encode_string(str(datapoint_id))
+      block += embedding_prefix
+      block += embedding.tobytes()
+      block += _END_OF_ARRAY
+      block += encode_restricts(restricts[i] if restricts else {})
+      # crowding_tag
+      block += _NULL
+    self._file.write(encode_long(len(ids)) + encode_long(len(block)))
+    self._file.write(block)
+    self._file.write(self._sync_marker)
+    self.num_vectors += len(ids)
+
+  def close(self) -> None:
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class EmbeddingFileUploader():
+  """
+  Uploads embedding files to a GCS bucket prefix from a thread pool.
+  Uploads are retried on transient errors, and files larger than a single
+  request are sent as resumable uploads in MATCHING_ENGINE_UPLOAD_CHUNK_SIZE
+  chunks, so an error retries a chunk rather than the whole file. Local
+  files are removed once uploaded.
+  """
+
+  def __init__(self, bucket: storage.Bucket, prefix: str = "",
+               max_workers: int = MATCHING_ENGINE_UPLOAD_WORKERS):
+    self.bucket = bucket
+    self.prefix = prefix
+    self._executor = ThreadPoolExecutor(max_workers=max_workers)
+    self._futures: List[Future] = []
+
+  def upload(self, local_path: str) -> Future:
+    """ Start uploading a local file, returning its upload future """
+    future = self._executor.submit(self._upload, local_path)
+    self._futures.append(future)
+    return future
+
+  def _upload(self, local_path: str) -> str:
+    blob_name = self.prefix + os.path.basename(local_path)
+    blob = self.bucket.blob(blob_name,
+                            chunk_size=MATCHING_ENGINE_UPLOAD_CHUNK_SIZE)
+    # files are written once per blob name, so retries are safe
+    blob.upload_from_filename(local_path, retry=DEFAULT_RETRY)
+    os.remove(local_path)
+    return blob_name
+
+  def wait(self) -> List[str]:
+    """
+    Wait for all uploads, raising the first upload error.
+
+    Returns:
+      names of the uploaded blobs
+    """
+    try:
+      return [future.result() for future in self._futures]
+    finally:
+      self._futures = []
+
+  def delete_uploaded(self) -> None:
+    """
+    Wait for all uploads and delete the blobs uploaded so far, e.g. when
+    the files of a partially written document are abandoned.
+    """
+    futures, self._futures = self._futures, []
+    for future in futures:
+      if future.exception() is None:
+        self.bucket.blob(future.result()).delete(retry=DEFAULT_RETRY)
+
+  def close(self) -> None:
+    self._executor.shutdown(wait=True)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
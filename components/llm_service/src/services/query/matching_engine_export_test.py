@@ -0,0 +1,100 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for Matching Engine embedding export
+"""
+# pylint: disable=wrong-import-position
+import os
+from unittest import mock
+import fastavro
+import numpy as np
+import pytest
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.query.matching_engine_export import (AvroEmbeddingWriter,
+                                                   EmbeddingFileUploader)
+
+
+def test_avro_embedding_writer(tmp_path):
+  rng = np.random.default_rng(0)
+  embeddings = rng.normal(size=(5, 8)).astype(np.float32)
+  restricts = [
+    {"restricts": [{"namespace": "document_id", "allow": ["doc1"]}],
+     "numeric_restricts": [{"namespace": "document_time",
+                            "value_int": 1704067200}]},
+    {}
+  ]
+  path = os.path.join(tmp_path, "embeddings.avro")
+  with AvroEmbeddingWriter(path) as writer:
+    writer.write_batch(np.array([10, 11]), embeddings[:2], restricts)
+    writer.write_batch(np.array([12, 13, 14]), embeddings[2:])
+  assert writer.num_vectors == 5
+
+  # the file is read back by a standard Avro reader
+  with open(path, "rb") as f:
+    records = list(fastavro.reader(f))
+  assert [record["id"] for record in records] == \
+      ["10", "11", "12", "13", "14"]
+  assert np.array_equal(
+      np.array([record["embedding"] for record in records],
+               dtype=np.float32), embeddings)
+  assert records[0]["restricts"] == [
+    {"namespace": "document_id", "allow": ["doc1"], "deny": None}]
+  assert records[0]["numeric_restricts"] == [
+    {"namespace": "document_time", "value_int": 1704067200,
+     "value_float": None, "value_double": None}]
+  assert records[1]["restricts"] is None
+  assert records[4]["numeric_restricts"] is None
+
+
+def test_embedding_file_uploader(tmp_path):
+  bucket = mock.Mock()
+  paths = []
+  for i in range(3):
+    path = os.path.join(tmp_path, f"file_{i}.avro")
+    with open(path, "wb") as f:
+      f.write(b"data")
+    paths.append(path)
+
+  with EmbeddingFileUploader(bucket, "updates/1/") as uploader:
+    for path in paths:
+      uploader.upload(path)
+    assert sorted(uploader.wait()) == \
+        ["updates/1/file_0.avro", "updates/1/file_1.avro",
+         "updates/1/file_2.avro"]
+  # uploaded files are removed
+  assert not any(os.path.exists(path) for path in paths)
+
+  # upload errors are raised by wait
+  bucket.blob.return_value.upload_from_filename.side_effect = \
+      RuntimeError("upload failed")
+  with EmbeddingFileUploader(bucket) as uploader:
+    uploader.upload(os.path.join(tmp_path, "missing.avro"))
+    with pytest.raises(RuntimeError):
+      uploader.wait()
+
+
+def test_embedding_file_uploader_delete_uploaded(tmp_path):
+  bucket = mock.Mock()
+  path = os.path.join(tmp_path, "file_0.avro")
+  with open(path, "wb") as f:
+    f.write(b"data")
+
+  with EmbeddingFileUploader(bucket, "updates/1/") as uploader:
+    uploader.upload(path)
+    uploader.delete_uploaded()
+    assert not uploader.wait()
+  bucket.blob.assert_called_with("updates/1/file_0.avro")
+  bucket.blob.return_value.delete.assert_called_once()
@@ -0,0 +1,105 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Process-wide connection pool for the pgvector database.
+
+All pgvector stores in a process share one SQLAlchemy engine, so queries
+check out an open connection instead of paying for a TCP/TLS/auth handshake.
+"""
+# pylint: disable=broad-exception-caught
+import threading
+from typing import Dict
+import sqlalchemy
+from langchain.vectorstores.pgvector import PGVector as LangchainPGVector
+from common.utils.logging_handler import Logger
+from config.vector_store_config import (PG_HOST, PG_PORT,
+                                        PG_DBNAME, PG_USER, PG_PASSWD,
+                                        PG_POOL_SIZE, PG_MAX_OVERFLOW,
+                                        PG_POOL_TIMEOUT, PG_POOL_RECYCLE,
+                                        PG_POOL_PRE_PING)
+
+Logger = Logger.get_logger(__file__)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_connection_string() -> str:
+  # get postgres connection string using LangchainPGVector utility method
+  return LangchainPGVector.connection_string_from_db_params(
+      driver="psycopg2",
+      host=PG_HOST,
+      port=PG_PORT,
+      database=PG_DBNAME,
+      user=PG_USER,
+      password=PG_PASSWD
+  )
+
+def get_pg_engine() -> sqlalchemy.engine.Engine:
+  """ get the shared pgvector engine, creating it on first use """
+  global _engine
+  if _engine is None:
+    with _engine_lock:
+      if _engine is None:
+        _engine = sqlalchemy.create_engine(
+            get_connection_string(),
+            pool_size=PG_POOL_SIZE,
+            max_overflow=PG_MAX_OVERFLOW,
+            pool_timeout=PG_POOL_TIMEOUT,
+            pool_recycle=PG_POOL_RECYCLE,
+            pool_pre_ping=PG_POOL_PRE_PING)
+        Logger.info(f"created pgvector connection pool for {PG_HOST} "
+                    f"pool_size={PG_POOL_SIZE} "
+                    f"max_overflow={PG_MAX_OVERFLOW}")
+  return _engine
+
+def dispose_pg_engine() -> None:
+  """ close all pooled connections and drop the shared engine """
+  global _engine
+  with _engine_lock:
+    if _engine is not None:
+      _engine.dispose()
+      _engine = None
+
+def pool_stats() -> Dict[str, int]:
+  """ connection counts of the shared pool, empty if it is not created """
+  engine = _engine
+  if engine is None:
+    return {}
+  pool = engine.pool
+  return {
+    "pool_size": pool.size(),
+    "checked_in": pool.checkedin(),
+    "checked_out": pool.checkedout(),
+    "overflow": pool.overflow()
+  }
+
+def warm_up_pool() -> bool:
+  """
+  Open pool_size connections to the pgvector database, so the first
+  queries do not pay for connection setup.
+
+  Returns:
+    True if connected, False if the database could not be reached
+  """
+  try:
+    engine = get_pg_engine()
+    connections = [engine.connect() for _ in range(PG_POOL_SIZE)]
+    for conn in connections:
+      conn.close()
+    Logger.info(f"Connected successfully to pgvector instance at {PG_HOST}")
+    return True
+  except Exception as e:
+    Logger.error(f"Cannot connect to pgvector instance at {PG_HOST}: {str(e)}")
+    return False
@@ -14,51 +14,88 @@
 """
 Query Engine Service
 """
+import asyncio
+import datetime
+import json
+import multiprocessing
 import tempfile
+import time
 import traceback
 import os
-from numpy.linalg import norm
 import numpy as np
-import pandas as pd
-from typing import List, Optional, Tuple, Dict
-from google.cloud import storage
-from rerankers import Reranker
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import chain, islice
+from typing import (Any, AsyncGenerator, Generator, Iterable, List, Optional,
+                    Tuple, Dict)
 from common.utils.logging_handler import Logger
-from common.models import (UserQuery, QueryResult, QueryEngine,
+from common.models import (BaseModel, UserQuery, QueryResult, QueryEngine,
                            QueryDocument,
                            QueryReference, QueryDocumentChunk,
                            BatchJobModel)
+from common.models.batch_job import JobStatus
 from common.models.llm_query import (QE_TYPE_VERTEX_SEARCH,
                                      QE_TYPE_LLM_SERVICE,
                                      QE_TYPE_INTEGRATED_SEARCH)
+from common.utils.config import (BATCH_JOB_FETCH_TIME,
+                                 JOB_TYPE_QUERY_ENGINE_UPDATE)
 from common.utils.errors import (ResourceNotFoundException,
-                                 ValidationError)
+                                 ValidationError,
+                                 ConflictError)
 from common.utils.http_exceptions import InternalServerError
 from services import embeddings
 from services.llm_generate import (get_context_prompt,
                                    llm_chat,
+                                   llm_chat_stream,
                                    check_context_length)
 from services.query.query_prompts import (get_question_prompt,
                                           get_summarize_prompt)
 from services.query.vector_store import (VectorStore,
+                                         VectorStoreMatch,
+                                         SearchFilter,
                                          MatchingEngineVectorStore,
                                          PostgresVectorStore,
-                                         NUM_MATCH_RESULTS)
-from services.query.data_source import DataSource
+                                         LocalVectorStore,
+                                         NUM_MATCH_RESULTS,
+                                         METADATA_CHUNK_ID,
+                                         METADATA_DOCUMENT_ID,
+                                         METADATA_DOCUMENT_URL,
+                                         METADATA_DOCUMENT_TIME,
+                                         METADATA_CLEAN_TEXT)
+from services.query.data_source import (DataSource, DataSourceFile,
+                                        ParsedDocument, parse_document,
+                                        parse_document_in_worker)
+from services.query.reranker import rerank_scores
+from services.query.lexical_index import (LexicalIndexBuilder,
+                                          lexical_index_version,
+                                          load_lexical_index,
+                                          save_lexical_index,
+                                          lexical_search,
+                                          delete_lexical_index,
+                                          reciprocal_rank_fusion)
 from services.query.web_datasource import WebDataSource
 from services.query.sharepoint_datasource import SharePointDataSource
 from services.query.vertex_search import (build_vertex_search,
                                           query_vertex_search,
                                           delete_vertex_search)
 from utils.errors import (NoDocumentsIndexedException,
+                          EmbeddingsFailedException,
                           ContextWindowExceededException)
-from utils import text_helper
-from config import (PROJECT_ID, DEFAULT_QUERY_CHAT_MODEL,
+from utils import text_helper, vector_helper
+from utils.gcs_helper import get_storage_client
+from utils.stream_helper import EVENT_REFERENCES, EVENT_TOKEN, EVENT_DONE
+from config import (DEFAULT_QUERY_CHAT_MODEL,
                     DEFAULT_QUERY_EMBEDDING_MODEL,
-                    DEFAULT_WEB_DEPTH_LIMIT)
+                    DEFAULT_WEB_DEPTH_LIMIT,
+                    QUERY_ENGINE_PARSE_WORKERS,
+                    QUERY_ENGINE_INDEX_WORKERS,
+                    QUERY_ENGINE_LEXICAL_INDEX,
+                    DEFAULT_LEXICAL_WEIGHT,
+                    DEFAULT_VECTOR_WEIGHT)
 from config.vector_store_config import (DEFAULT_VECTOR_STORE,
                                         VECTOR_STORE_LANGCHAIN_PGVECTOR,
-                                        VECTOR_STORE_MATCHING_ENGINE)
+                                        VECTOR_STORE_MATCHING_ENGINE,
+                                        VECTOR_STORE_LOCAL_NUMPY)
 
 # pylint: disable=broad-exception-caught,ungrouped-imports
 
@@ -66,23 +103,31 @@ Logger = Logger.get_logger(__file__)
 
 VECTOR_STORES = {
   VECTOR_STORE_MATCHING_ENGINE: MatchingEngineVectorStore,
-  VECTOR_STORE_LANGCHAIN_PGVECTOR: PostgresVectorStore
+  VECTOR_STORE_LANGCHAIN_PGVECTOR: PostgresVectorStore,
+  VECTOR_STORE_LOCAL_NUMPY: LocalVectorStore
 }
 
-RERANK_MODEL_NAME = "colbert"
-reranker = Reranker(RERANK_MODEL_NAME, verbose=0)
-
 # minimum number of references to return
 MIN_QUERY_REFERENCES = 2
 # total number of references to return from integrated search
 NUM_INTEGRATED_QUERY_REFERENCES = 6
+# maximum number of child engines queried concurrently by integrated search
+MAX_CONCURRENT_CHILD_QUERIES = 8
+# seconds to wait for a child engine before dropping its references
+CHILD_QUERY_TIMEOUT = 30
+# lexical searches run in threads, concurrently with vector searches
+LEXICAL_SEARCH_WORKERS = 8
+lexical_search_executor = ThreadPoolExecutor(
+    max_workers=LEXICAL_SEARCH_WORKERS)
 
 async def query_generate(
             user_id: str,
             prompt: str,
             q_engine: QueryEngine,
             llm_type: Optional[str] = None,
-            user_query: Optional[UserQuery] = None) -> \
+            user_query: Optional[UserQuery] = None,
+            search_params: Optional[dict] = None,
+            rerank: Optional[bool] = None) -> \
                 Tuple[QueryResult, List[QueryReference]]:
   """
   Execute a query over a query engine and generate a response.
@@ -98,6 +143,11 @@ async def query_generate(
     q_engine: the name of the query engine to use
     llm_type (optional): chat model to use for query
     user_query (optional): an existing user query for context
+    search_params (optional): vector store search params for this query,
+      e.g. ef_search or probes for pgvector
+    rerank (optional): rerank references by relevance to the prompt.
+      Integrated search engines always rerank; other engines rerank if
+      set, or by default if the rerank query engine param is set.
 
   Returns:
     QueryResult object,
@@ -112,6 +162,70 @@ async def query_generate(
               f"prompt=[{prompt}], q_engine=[{q_engine.name}], "
               f"user_query=[{user_query}]")
 
+  llm_type, question_prompt, query_references = await prepare_query(
+      user_id, prompt, q_engine, llm_type, user_query, search_params, rerank)
+
+  # send prompt to model
+  question_response = await llm_chat(question_prompt, llm_type)
+
+  query_result = save_query_result(q_engine, prompt, question_response,
+                                   query_references)
+
+  return query_result, query_references
+
+async def query_generate_stream(
+            user_id: str,
+            prompt: str,
+            q_engine: QueryEngine,
+            llm_type: Optional[str] = None,
+            user_query: Optional[UserQuery] = None,
+            search_params: Optional[dict] = None,
+            rerank: Optional[bool] = None) -> \
+                AsyncGenerator[Tuple[str, Any], None]:
+  """
+  Execute a query over a query engine and stream the generated response.
+
+  Yields (event type, data) tuples: first the query references, then
+  chunks of the response text as they are generated, and finally the
+  QueryResult, which is saved only once the full response is generated.
+  Event types are the EVENT_* constants in utils.stream_helper.
+
+  Args: see query_generate
+  """
+  Logger.info(f"Executing streaming query: "
+              f"llm_type=[{llm_type}], "
+              f"user_id=[{user_id}], "
+              f"prompt=[{prompt}], q_engine=[{q_engine.name}]")
+
+  llm_type, question_prompt, query_references = await prepare_query(
+      user_id, prompt, q_engine, llm_type, user_query, search_params, rerank)
+  yield EVENT_REFERENCES, query_references
+
+  response_chunks = []
+  async for chunk in llm_chat_stream(question_prompt, llm_type):
+    response_chunks.append(chunk)
+    yield EVENT_TOKEN, chunk
+
+  query_result = save_query_result(q_engine, prompt,
+                                   "".join(response_chunks),
+                                   query_references)
+  yield EVENT_DONE, query_result
+
+async def prepare_query(user_id: str,
+                        prompt: str,
+                        q_engine: QueryEngine,
+                        llm_type: Optional[str] = None,
+                        user_query: Optional[UserQuery] = None,
+                        search_params: Optional[dict] = None,
+                        rerank: Optional[bool] = None) -> \
+                        Tuple[str, str, List[QueryReference]]:
+  """
+  Retrieve references for a query and build the question prompt.
+
+  Returns:
+    tuple of llm type to use for generation, question prompt,
+    list of QueryReference objects
+  """
   # determine question generation model
   if llm_type is None:
     if q_engine.llm_type is not None:
@@ -120,13 +234,20 @@ async def query_generate(
       llm_type = DEFAULT_QUERY_CHAT_MODEL
 
   # perform retrieval
-  query_references = retrieve_references(prompt, q_engine, user_id)
-
-  # Rerank references. Only need to do this if performing integrated search
-  # from multiple child engines.
-  if q_engine.query_engine_type == QE_TYPE_INTEGRATED_SEARCH and \
-      len(query_references) > 1:
-    query_references = rerank_references(prompt, query_references)
+  query_references = await retrieve_references(prompt, q_engine, user_id,
+                                               search_params)
+
+  # Rerank references. Integrated search always reranks, to merge the
+  # references from multiple child engines; other engines opt in.
+  if len(query_references) > 1:
+    if q_engine.query_engine_type == QE_TYPE_INTEGRATED_SEARCH:
+      query_references = await asyncio.to_thread(
+          rerank_references, prompt, query_references,
+          NUM_INTEGRATED_QUERY_REFERENCES)
+    elif rerank or (rerank is None and
+                    (q_engine.params or {}).get("rerank") in (True, "true")):
+      query_references = await asyncio.to_thread(
+          rerank_references, prompt, query_references)
 
   # generate question prompt
   question_prompt, query_references = \
@@ -134,20 +255,19 @@ async def query_generate(
                                      llm_type,
                                      query_references,
                                      user_query)
+  return llm_type, question_prompt, query_references
 
-  # send prompt to model
-  question_response = await llm_chat(question_prompt, llm_type)
-
-  # save query result
+def save_query_result(q_engine: QueryEngine, prompt: str, response: str,
+                      query_references: List[QueryReference]) -> QueryResult:
+  """ save the generated response to a query """
   query_ref_ids = [ref.id for ref in query_references]
   query_result = QueryResult(query_engine_id=q_engine.id,
                              query_engine=q_engine.name,
                              query_refs=query_ref_ids,
                              prompt=prompt,
-                             response=question_response)
+                             response=response)
   query_result.save()
-
-  return query_result, query_references
+  return query_result
 
 async def generate_question_prompt(prompt: str,
                                    llm_type: str,
@@ -228,39 +348,91 @@ async def summarize_history(chat_history: str,
   Logger.info(f"generated summary with LLM {llm_type}: {summary}")
   return summary
 
-def retrieve_references(prompt: str,
-                        q_engine: QueryEngine,
-                        user_id: str) -> List[QueryReference]:
+async def retrieve_references(prompt: str,
+                              q_engine: QueryEngine,
+                              user_id: str,
+                              search_params: Optional[dict] = None) -> \
+                              List[QueryReference]:
   """
   Execute a query over a query engine and retrieve reference documents.
 
+  Blocking retrieval calls (embeddings, vector store and datastore) run in
+  worker threads, so integrated search can query child engines
+  concurrently.
+
   Args:
     prompt: the text prompt to pass to the query engine
     q_engine: the name of the query engine to use
     user_id: user id of user making query
+    search_params: optional vector store search params
   Returns:
     list of QueryReference objects
   """
   # perform retrieval for prompt
   query_references = []
   if q_engine.query_engine_type == QE_TYPE_VERTEX_SEARCH:
-    query_references = query_vertex_search(q_engine, prompt, NUM_MATCH_RESULTS)
+    query_references = await asyncio.to_thread(
+        query_vertex_search, q_engine, prompt, NUM_MATCH_RESULTS)
   elif q_engine.query_engine_type == QE_TYPE_INTEGRATED_SEARCH:
-    child_engines = QueryEngine.find_children(q_engine)
-    for child_engine in child_engines:
-      # make a recursive call to retrieve references for child engine
-      child_query_references = retrieve_references(prompt,
-                                                   child_engine,
-                                                   user_id)
-      query_references += child_query_references
+    query_references = await retrieve_child_references(prompt,
+                                                        q_engine,
+                                                        user_id,
+                                                        search_params)
   elif q_engine.query_engine_type == QE_TYPE_LLM_SERVICE or \
       not q_engine.query_engine_type:
-    query_references = query_search(q_engine, prompt)
+    query_references = await asyncio.to_thread(
+        query_search, q_engine, prompt, search_params=search_params)
+  return query_references
+
+async def retrieve_child_references(prompt: str,
+                                    q_engine: QueryEngine,
+                                    user_id: str,
+                                    search_params: Optional[dict] = None) -> \
+                                    List[QueryReference]:
+  """
+  Retrieve references from all child engines of an integrated search
+  engine. Children are queried concurrently, at most
+  MAX_CONCURRENT_CHILD_QUERIES at a time. A child that fails or takes
+  longer than CHILD_QUERY_TIMEOUT seconds is dropped from the results.
+
+  Args:
+    prompt: the text prompt to pass to the query engine
+    q_engine: the integrated search query engine
+    user_id: user id of user making query
+  Returns:
+    list of QueryReference objects, in child engine order
+  """
+  child_engines = await asyncio.to_thread(QueryEngine.find_children, q_engine)
+  semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHILD_QUERIES)
+
+  async def retrieve_child(child_engine: QueryEngine) -> List[QueryReference]:
+    async with semaphore:
+      try:
+        # make a recursive call to retrieve references for child engine
+        return await asyncio.wait_for(
+            retrieve_references(prompt, child_engine, user_id,
+                                search_params),
+            timeout=CHILD_QUERY_TIMEOUT)
+      except asyncio.TimeoutError:
+        Logger.warning(f"Timed out retrieving references from child engine "
+                       f"[{child_engine.name}] of [{q_engine.name}]")
+      except Exception as e:
+        Logger.error(f"Error retrieving references from child engine "
+                     f"[{child_engine.name}] of [{q_engine.name}]: {e}")
+      return []
+
+  child_query_references = await asyncio.gather(
+      *[retrieve_child(child_engine) for child_engine in child_engines])
+
+  query_references = []
+  for child_references in child_query_references:
+    query_references += child_references
   return query_references
 
 def query_search(q_engine: QueryEngine,
                  query_prompt: str,
-                 rank_sentences=False) -> List[QueryReference]:
+                 rank_sentences=False,
+                 search_params: Optional[dict] = None) -> List[QueryReference]:
   """
   For a query prompt, retrieve text chunks with doc references
   from matching documents.
@@ -269,76 +441,241 @@ def query_search(q_engine: QueryEngine,
     q_engine: QueryEngine to search
     query_prompt (str):  user query
     rank_sentences: rank sentence relevance in retrieved chunks
+    search_params: optional vector store search params. "k" sets the
+      number of matches and "filter" a metadata filter (see
+      SearchFilter.from_dict); other params are passed to the vector store.
 
   Returns:
     list of QueryReference models
 
   """
+  return query_search_many(q_engine, [query_prompt], rank_sentences,
+                           search_params)[0]
+
+def query_search_many(q_engine: QueryEngine,
+                      query_prompts: List[str],
+                      rank_sentences=False,
+                      search_params: Optional[dict] = None) -> \
+                      List[List[QueryReference]]:
+  """
+  Retrieve doc references for several query prompts over one engine, such
+  as rewrites or sub-questions of a user query. The prompts are embedded
+  in one embeddings request and searched in one vector store request,
+  and their references are resolved and saved in batched lookups and
+  writes.
+
+  Args:
+    q_engine: QueryEngine to search
+    query_prompts: user queries
+    rank_sentences: rank sentence relevance in retrieved chunks
+    search_params: optional vector store search params, applied to every
+      prompt (see query_search)
+
+  Returns:
+    list of QueryReference models per query prompt
+  """
   Logger.info(f"Retrieving doc references for q_engine=[{q_engine.name}], "
-              f"query_prompt=[{query_prompt}]")
-  # generate embeddings for prompt
-  _, query_embeddings = embeddings.get_embeddings([query_prompt],
-                                                  q_engine.embedding_type)
-  query_embedding = query_embeddings[0]
+              f"query_prompts={query_prompts}")
+  if not query_prompts:
+    return []
+
+  search_params = dict(search_params or {})
+  k = int(search_params.pop("k", None) or NUM_MATCH_RESULTS)
+  search_filter = search_params.pop("filter", None)
+  if search_filter is not None:
+    search_filter = SearchFilter.from_dict(search_filter)
+
+  # engines with a lexical index are searched by BM25 concurrently with
+  # the vector search, and the matches fused. The lexical index has no
+  # document metadata, so filtered searches are vector searches only.
+  lexical_weight, vector_weight = hybrid_search_weights(q_engine)
+  lexical_futures = None
+  if lexical_weight > 0 and search_filter is None and \
+      lexical_index_version(q_engine) is not None:
+    lexical_futures = [
+      lexical_search_executor.submit(lexical_search, q_engine, prompt, k)
+      for prompt in query_prompts
+    ]
+
+  # generate embeddings for all prompts in one request
+  is_successful, query_embeddings = embeddings.get_embeddings(
+      query_prompts, q_engine.embedding_type, use_cache=True)
+  if not all(is_successful[:len(query_prompts)]):
+    raise InternalServerError(
+        f"Failed to generate embeddings for query prompts of "
+        f"q_engine {q_engine.name}")
 
-  # retrieve indexes of relevant document chunks from vector store
+  # retrieve matching document chunks from vector store
   qe_vector_store = vector_store_from_query_engine(q_engine)
-  match_indexes_list = qe_vector_store.similarity_search(q_engine,
-                                                         query_embedding)
-  query_references = []
+  prompt_matches = qe_vector_store.similarity_search_batch(
+      q_engine, query_embeddings[:len(query_prompts)], search_params,
+      search_filter=search_filter, k=k)
 
-  # Assemble document chunk models from vector store indexes
-  for match in match_indexes_list:
-    doc_chunk = QueryDocumentChunk.find_by_index(q_engine.id, match)
-    if doc_chunk is None:
-      raise ResourceNotFoundException(
-        f"Missing doc chunk match index {match} q_engine {q_engine.name}")
+  if lexical_futures is not None:
+    for i, lexical_future in enumerate(lexical_futures):
+      try:
+        lexical_matches = lexical_future.result()
+      except Exception as e:
+        # fall back to the vector matches
+        Logger.error(
+            f"lexical search failed for q_engine {q_engine.name}: {e}")
+        lexical_matches = []
+      prompt_matches[i] = reciprocal_rank_fusion(
+          [prompt_matches[i], lexical_matches],
+          [vector_weight, lexical_weight], k)
+
+  # Chunk and document details are stored as metadata in the vector store,
+  # so references can be built directly from the matches. Engines built
+  # before that only return indexes, which are resolved from the datastore.
+  # Matches of all prompts are resolved together.
+  all_matches = [match for matches in prompt_matches for match in matches]
+  doc_chunks = resolve_match_metadata(q_engine, all_matches)
+  # drop matches whose chunks no longer exist
+  resolved_matches = set(map(id, all_matches))
+  prompt_matches = [[match for match in matches
+                     if id(match) in resolved_matches]
+                    for matches in prompt_matches]
+
+  if rank_sentences:
+    missing_chunk_ids = list(dict.fromkeys(
+      match.metadata[METADATA_CHUNK_ID] for match in all_matches
+      if match.metadata[METADATA_CHUNK_ID] not in doc_chunks
+    ))
+    doc_chunks.update(QueryDocumentChunk.find_by_ids(missing_chunk_ids))
+
+  prompt_references = []
+  for i, matches in enumerate(prompt_matches):
+    query_references = []
+    for match in matches:
+      chunk_id = match.metadata[METADATA_CHUNK_ID]
+      clean_text = match.metadata[METADATA_CLEAN_TEXT]
+
+      if rank_sentences:
+        doc_chunk = doc_chunks.get(chunk_id)
+        if doc_chunk is None:
+          raise ResourceNotFoundException(
+            f"Missing doc chunk {chunk_id} q_engine {q_engine.name}")
+
+        # Assemble sentences from a document chunk. Currently it gets the
+        # sentences from the top-ranked document chunk.
+        sentences = doc_chunk.sentences
+        # for backwards compatibility with legacy engines break chunks
+        # into sentences here
+        if not sentences or len(sentences) == 0:
+          sentences = text_helper.text_to_sentence_list(doc_chunk.text)
+
+        # Only update clean_text when sentences is not empty.
+        Logger.info(f"Processing {len(sentences)} sentences.")
+        if sentences and len(sentences) > 0:
+          top_sentences = get_top_relevant_sentences(
+              q_engine, query_embeddings[i:i + 1], sentences,
+              expand_neighbors=2, highlight_top_sentence=True)
+          clean_text = " ".join(top_sentences)
+
+      query_reference = QueryReference(
+        query_engine_id=q_engine.id,
+        query_engine=q_engine.name,
+        document_id=match.metadata[METADATA_DOCUMENT_ID],
+        document_url=match.metadata[METADATA_DOCUMENT_URL],
+        chunk_id=chunk_id,
+        document_text=clean_text
+      )
+      query_references.append(query_reference)
+    prompt_references.append(query_references)
 
-    query_doc = QueryDocument.find_by_id(doc_chunk.query_document_id)
+  # save query references of all prompts in one batched write
+  QueryReference.save_many(
+      [ref for query_references in prompt_references
+       for ref in query_references])
+
+  Logger.info(f"Retrieved {[len(refs) for refs in prompt_references]} "
+              f"references for {len(query_prompts)} query prompts")
+  return prompt_references
+
+def hybrid_search_weights(q_engine: QueryEngine) -> Tuple[float, float]:
+  """
+  Lexical and vector match weights for reciprocal rank fusion, set per
+  engine with the lexical_weight and vector_weight params.
+  """
+  params = q_engine.params or {}
+  return (float(params.get("lexical_weight", DEFAULT_LEXICAL_WEIGHT)),
+          float(params.get("vector_weight", DEFAULT_VECTOR_WEIGHT)))
+
+def resolve_match_metadata(q_engine: QueryEngine,
+                           matches: List[VectorStoreMatch]) -> \
+                           Dict[str, QueryDocumentChunk]:
+  """
+  Fill in reference metadata for vector store matches that only carry an
+  index (engines built before chunk metadata was stored in the vector
+  store). Chunks and their parent documents are each resolved in a single
+  batched lookup.
+
+  Args:
+    q_engine: QueryEngine that was searched
+    matches: list of VectorStoreMatch, updated in place
+
+  Returns:
+    dict of chunk id to the QueryDocumentChunk models that were fetched
+  """
+  legacy_indexes = [match.index for match in matches
+                    if not match.has_reference_metadata]
+  if not legacy_indexes:
+    return {}
+
+  doc_chunks = QueryDocumentChunk.find_by_indexes(q_engine.id, legacy_indexes)
+  missing_indexes = [index for index in legacy_indexes
+                     if index not in doc_chunks]
+  if missing_indexes:
+    # removed documents may still be matched until a batch updated index
+    # (matching engine) applies the removal, so skip them
+    Logger.warning(f"Skipping matches for missing doc chunk indexes "
+                   f"{missing_indexes} q_engine {q_engine.name}")
+    matches[:] = [match for match in matches
+                  if match.has_reference_metadata or match.index in doc_chunks]
+    legacy_indexes = [index for index in legacy_indexes
+                      if index in doc_chunks]
+
+  query_docs = QueryDocument.find_by_ids(
+      [doc_chunks[index].query_document_id for index in legacy_indexes])
+
+  for match in matches:
+    if match.has_reference_metadata:
+      continue
+    doc_chunk = doc_chunks[match.index]
+    query_doc = query_docs.get(doc_chunk.query_document_id)
     if query_doc is None:
       raise ResourceNotFoundException(
         f"Query doc {doc_chunk.query_document_id} q_engine {q_engine.name}")
+    match.metadata = chunk_reference_metadata(query_doc, doc_chunk)
 
-    clean_text = doc_chunk.clean_text
-    if not clean_text:
-      # for backwards compatibility with existing query engines
-      clean_text = text_helper.clean_text(doc_chunk.text)
-
-    if rank_sentences:
-      # Assemble sentences from a document chunk. Currently it gets the
-      # sentences from the top-ranked document chunk.
-      sentences = doc_chunk.sentences
-      # for backwards compatibility with legacy engines break chunks
-      # into sentences here
-      if not sentences or len(sentences) == 0:
-        sentences = text_helper.text_to_sentence_list(doc_chunk.text)
-
-      # Only update clean_text when sentences is not empty.
-      Logger.info(f"Processing {len(sentences)} sentences.")
-      if sentences and len(sentences) > 0:
-        top_sentences = get_top_relevant_sentences(
-            q_engine, query_embeddings, sentences,
-            expand_neighbors=2, highlight_top_sentence=True)
-        clean_text = " ".join(top_sentences)
-
-    # save query reference
-    query_reference = QueryReference(
-      query_engine_id=q_engine.id,
-      query_engine=q_engine.name,
-      document_id=query_doc.id,
-      document_url=query_doc.doc_url,
-      chunk_id=doc_chunk.id,
-      document_text=clean_text
-    )
-    query_reference.save()
-    query_references.append(query_reference)
-
-  Logger.info(f"Retrieved {len(query_references)} "
-               f"references={query_references}")
-  return query_references
+  return {doc_chunk.id: doc_chunk for doc_chunk in doc_chunks.values()}
+
+def chunk_reference_metadata(query_doc: QueryDocument,
+                             doc_chunk: QueryDocumentChunk) -> dict:
+  """
+  Build the metadata stored with a chunk embedding in the vector store,
+  from which a QueryReference can be built at query time.
+  """
+  clean_text = doc_chunk.clean_text
+  if not clean_text:
+    # for backwards compatibility with existing query engines
+    clean_text = text_helper.clean_text(doc_chunk.text)
+  # documents are indexed before they are saved
+  if query_doc.created_time:
+    document_time = int(query_doc.created_time.timestamp())
+  else:
+    document_time = int(time.time())
+  return {
+    METADATA_CHUNK_ID: doc_chunk.id,
+    METADATA_DOCUMENT_ID: query_doc.id,
+    METADATA_DOCUMENT_URL: query_doc.doc_url,
+    METADATA_DOCUMENT_TIME: document_time,
+    METADATA_CLEAN_TEXT: clean_text
+  }
 
 def rerank_references(prompt: str,
-                      query_references: List[QueryReference]) -> \
+                      query_references: List[QueryReference],
+                      num_results: Optional[int] = None) -> \
                         List[QueryReference]:
   """
   Return a list of QueryReferences ranked by relevance to the prompt.
@@ -347,6 +684,7 @@ def rerank_references(prompt: str,
     prompt: the text prompt to pass to the query engine
     query_references: list of QueryReference objects (possibly
                       from multiple q_engines)
+    num_results: number of top ranked references to return, all if None
   Returns:
     list of QueryReference objects
   """
@@ -354,38 +692,20 @@ def rerank_references(prompt: str,
   Logger.info(f"Reranking {len(query_references)} references for "
               f"query_prompt=[{prompt}]")
 
-  # reranker function requires text and ids as separate params
-  query_ref_text = []
-  query_ref_ids = []
-  query_ref_lookup = {}
-
-  for query_ref in query_references:
-    query_doc_chunk = QueryDocumentChunk.find_by_id(query_ref.chunk_id)
-    # print(query_ref.id, query_ref_id, query_ref.chunk_id, query_doc_chunk.id)
-    query_ref_text.append(query_doc_chunk.clean_text)
-    query_ref_ids.append(query_ref.id)
-    query_ref_lookup[query_ref.id] = query_ref
-
-  # rerank, passing in QueryReference ids
-  ranked_results = reranker.rank(
-    query=prompt,
-    docs=query_ref_text,
-    doc_ids=query_ref_ids)
-  ranked_results = ranked_results.top_k(NUM_INTEGRATED_QUERY_REFERENCES)
-
-  # order the original references based on the rank
-  ranked_query_refs = []
-  ranked_query_ref_ids = [r.doc_id for r in ranked_results]
-  for i in ranked_query_ref_ids:
-    ranked_query_refs.append(query_ref_lookup[i])
-
-  return ranked_query_refs
+  # references carry their chunk text, scored in a batch with concurrent
+  # requests
+  scores = rerank_scores(prompt, [query_ref.document_text or ""
+                                  for query_ref in query_references])
+  ranked_order = sorted(range(len(query_references)),
+                        key=lambda i: scores[i], reverse=True)
+  return [query_references[i] for i in ranked_order][:num_results]
 
 def get_top_relevant_sentences(q_engine, query_embeddings,
     sentences, expand_neighbors=2, highlight_top_sentence=False) -> list:
 
   _, sentence_embeddings = embeddings.get_embeddings(sentences,
-                                                     q_engine.embedding_type)
+                                                     q_engine.embedding_type,
+                                                     use_cache=True)
   similarity_scores = get_similarity(query_embeddings, sentence_embeddings)
   Logger.info("Similarity scores of query_embeddings and sentence_embeddings: "
               f"{len(similarity_scores)}")
@@ -403,19 +723,12 @@ def get_top_relevant_sentences(q_engine, query_embeddings,
 
   return sentences[start_index:end_index]
 
-def get_similarity(query_embeddings, sentence_embeddings) -> list:
-  query_df = pd.DataFrame(query_embeddings.transpose())
-  sentence_df = pd.DataFrame(sentence_embeddings)
-
-  cos_sim = []
-  for _, row in sentence_df.iterrows():
-    x = row
-    y = query_df
-    # calculate the cosine similarity
-    cosine = np.dot(x, y) / (norm(x) * norm(y))
-    cos_sim.append(cosine[0])
-
-  return cos_sim
+def get_similarity(query_embeddings, sentence_embeddings) -> np.ndarray:
+  """
+  Cosine similarity of the query embedding with each sentence embedding.
+  """
+  return vector_helper.cosine_similarity(query_embeddings[0],
+                                         sentence_embeddings)
 
 def batch_build_query_engine(request_body: Dict, job: BatchJobModel) -> Dict:
   """
@@ -602,7 +915,7 @@ def build_doc_index(doc_url: str, q_engine: QueryEngine,
     Tuple of list of QueryDocument objects of docs processed,
       list of uris of docs not processed
   """
-  storage_client = storage.Client(project=PROJECT_ID)
+  storage_client = get_storage_client()
 
   # initialize the vector store index
   qe_vector_store.init_index()
@@ -632,6 +945,7 @@ def process_documents(doc_url: str, qe_vector_store: VectorStore,
                       Tuple[List[QueryDocument], List[str]]:
   """
   Process docs in data source and upload embeddings to vector store
+
   Returns:
      Tuple of list of QueryDocument objects for docs processed,
         list of doc urls of docs not processed
@@ -639,68 +953,491 @@ def process_documents(doc_url: str, qe_vector_store: VectorStore,
   # get datasource class for doc_url
   data_source = datasource_from_url(doc_url, q_engine, storage_client)
 
-  docs_processed = []
+  # BM25 index of chunk text, for hybrid lexical and vector search
+  lexical_builder = LexicalIndexBuilder() if QUERY_ENGINE_LEXICAL_INDEX \
+      else None
+
   with tempfile.TemporaryDirectory() as temp_dir:
     data_source_files = data_source.download_documents(doc_url, temp_dir)
+    docs_processed = index_documents(data_source, data_source_files,
+                                     qe_vector_store, q_engine,
+                                     IndexAllocator(), lexical_builder)
 
-    # counter for unique index ids
-    index_base = 0
+  if lexical_builder is not None and docs_processed:
+    save_lexical_index(q_engine, lexical_builder.build(), storage_client)
 
-    for data_source_file in data_source_files:
-      doc_name = data_source_file.doc_name
-      index_doc_url = data_source_file.src_url
-      doc_filepath = data_source_file.local_path
-
-      Logger.info(f"processing [{doc_name}]")
+  return docs_processed, data_source.docs_not_processed
 
-      text_chunks = data_source.chunk_document(doc_name,
-                                               index_doc_url,
-                                               doc_filepath)
+def index_documents(data_source: DataSource,
+                    data_source_files: Iterable[DataSourceFile],
+                    qe_vector_store: VectorStore,
+                    q_engine: QueryEngine,
+                    index_allocator: "IndexAllocator",
+                    lexical_builder: LexicalIndexBuilder = None,
+                    unsaved_models: List[BaseModel] = None) -> \
+                    List[QueryDocument]:
+  """
+  Parse downloaded documents, upload their embeddings to the vector store
+  and save document and chunk models. Chunk clean text is added to
+  lexical_builder, if given. If unsaved_models is given, document and
+  chunk models are added to it, to be saved by the caller, instead.
+
+  Documents are processed in a pipeline: documents are parsed into chunks
+  in a pool of QUERY_ENGINE_PARSE_WORKERS processes, while up to
+  QUERY_ENGINE_INDEX_WORKERS previously parsed documents are embedded,
+  indexed in the vector store and saved to Firestore in threads. Each
+  stage holds a bounded number of documents, to bound memory use.
+  Documents whose chunks could not all be embedded are not indexed, and
+  are added to the data source docs_not_processed.
 
-      if text_chunks is None or len(text_chunks) == 0:
+  Returns:
+     list of QueryDocument objects for docs processed
+  """
+  docs_processed = []
+  index_futures = deque()
+  with ThreadPoolExecutor(
+      max_workers=QUERY_ENGINE_INDEX_WORKERS) as index_executor:
+    for parsed_doc in parse_documents(data_source, data_source_files):
+      for doc_url_not_processed in parsed_doc.docs_not_processed:
+        if doc_url_not_processed not in data_source.docs_not_processed:
+          data_source.docs_not_processed.append(doc_url_not_processed)
+
+      if len(parsed_doc.text_chunks) == 0:
         # unable to process this doc; skip
         continue
 
+      doc_name = parsed_doc.data_source_file.doc_name
       Logger.info(f"doc chunks extracted for [{doc_name}]")
 
-      # generate embedding data and store in vector store
-      new_index_base = \
-          qe_vector_store.index_document(doc_name, text_chunks, index_base)
+      # chunk index ranges are assigned in document order, so documents
+      # can be indexed concurrently
+      index_base = index_allocator.allocate(len(parsed_doc.text_chunks))
+      query_doc, doc_chunks = create_document_models(
+          q_engine, parsed_doc, index_base)
+
+      # wait for the oldest document when the indexing stage is full
+      if len(index_futures) >= QUERY_ENGINE_INDEX_WORKERS:
+        _indexed_document_result(index_futures.popleft(), data_source,
+                                 docs_processed, lexical_builder,
+                                 unsaved_models)
+      index_futures.append((query_doc, doc_chunks, index_executor.submit(
+          index_document_models, qe_vector_store, parsed_doc,
+          query_doc, doc_chunks, unsaved_models is None)))
+
+    while index_futures:
+      _indexed_document_result(index_futures.popleft(), data_source,
+                               docs_processed, lexical_builder,
+                               unsaved_models)
+
+  return docs_processed
+
+def _indexed_document_result(index_future, data_source: DataSource,
+                             docs_processed: List[QueryDocument],
+                             lexical_builder: LexicalIndexBuilder = None,
+                             unsaved_models: List[BaseModel] = None):
+  """
+  Add an indexed document to docs_processed, its chunks to lexical_builder
+  and its models to unsaved_models, or the document to the data source
+  docs_not_processed if its embeddings could not be generated.
+  """
+  query_doc, doc_chunks, future = index_future
+  try:
+    docs_processed.append(future.result())
+  except EmbeddingsFailedException as e:
+    Logger.error(f"error indexing doc {query_doc.doc_url}: {e}")
+    data_source.docs_not_processed.append(query_doc.doc_url)
+    return
+  if lexical_builder is not None:
+    for doc_chunk in doc_chunks:
+      lexical_builder.add(doc_chunk.index, doc_chunk.clean_text)
+  if unsaved_models is not None:
+    unsaved_models.extend([query_doc] + doc_chunks)
+
+def parse_documents(data_source: DataSource,
+                    data_source_files: Iterable[DataSourceFile]) -> \
+                    Generator[ParsedDocument, None, None]:
+  """
+  Parse documents in a process pool, yielding parsed documents in order.
+  At most twice QUERY_ENGINE_PARSE_WORKERS documents are parsed ahead of
+  the consumer. data_source_files may be a generator of files as they are
+  downloaded. A single document, or all documents if there is one parse
+  worker, is parsed in this process, extracting the pages of a large PDF
+  in a pool of PDF_EXTRACT_WORKERS processes.
+  """
+  data_source_files = iter(data_source_files)
+  first_files = list(islice(data_source_files, 2))
+  data_source_files = chain(first_files, data_source_files)
+  if QUERY_ENGINE_PARSE_WORKERS <= 1 or len(first_files) <= 1:
+    for data_source_file in data_source_files:
+      Logger.info(f"processing [{data_source_file.doc_name}]")
+      yield parse_document(data_source, data_source_file)
+    return
+
+  # spawn rather than fork, as forking a process with active grpc
+  # clients is unsafe
+  mp_context = multiprocessing.get_context("spawn")
+  max_pending = QUERY_ENGINE_PARSE_WORKERS * 2
+  with ProcessPoolExecutor(max_workers=QUERY_ENGINE_PARSE_WORKERS,
+                           mp_context=mp_context) as parse_executor:
+    parse_futures = deque()
+    for data_source_file in data_source_files:
+      if len(parse_futures) >= max_pending:
+        yield _parsed_document_result(parse_futures.popleft())
+      Logger.info(f"processing [{data_source_file.doc_name}]")
+      parse_futures.append((data_source_file, parse_executor.submit(
+          parse_document_in_worker, data_source, data_source_file)))
+    while parse_futures:
+      yield _parsed_document_result(parse_futures.popleft())
+
+def _parsed_document_result(parse_future) -> ParsedDocument:
+  data_source_file, future = parse_future
+  try:
+    return future.result()
+  except Exception as e:
+    # e.g. a worker process died parsing the document; skip it
+    Logger.error(f"error parsing doc {data_source_file.doc_name}: {e}")
+    return ParsedDocument(data_source_file,
+                          docs_not_processed=[data_source_file.src_url])
+
+def create_document_models(q_engine: QueryEngine,
+                           parsed_doc: ParsedDocument,
+                           index_base: int) -> \
+                           Tuple[QueryDocument, List[QueryDocumentChunk]]:
+  """
+  Create QueryDocument and QueryDocumentChunk models for a parsed document,
+  with ids assigned up front so they can be stored with the embeddings.
+  """
+  data_source_file = parsed_doc.data_source_file
+  query_doc = QueryDocument(query_engine_id=q_engine.id,
+                            query_engine=q_engine.name,
+                            doc_url=data_source_file.src_url,
+                            index_file=data_source_file.doc_id,
+                            index_start=index_base,
+                            content_hash=data_source_file.content_hash)
+  query_doc.id = QueryDocument.generate_id()
+
+  doc_chunks = []
+  for i, text in enumerate(parsed_doc.text_chunks):
+    query_doc_chunk = QueryDocumentChunk(
+                          query_engine_id=q_engine.id,
+                          query_document_id=query_doc.id,
+                          index=i+index_base,
+                          text=text,
+                          clean_text=parsed_doc.clean_texts[i],
+                          sentences=parsed_doc.sentences[i])
+    query_doc_chunk.id = QueryDocumentChunk.generate_id()
+    doc_chunks.append(query_doc_chunk)
+  return query_doc, doc_chunks
+
+def index_document_models(qe_vector_store: VectorStore,
+                          parsed_doc: ParsedDocument,
+                          query_doc: QueryDocument,
+                          doc_chunks: List[QueryDocumentChunk],
+                          save_models: bool = True) -> \
+                          QueryDocument:
+  """
+  Generate embeddings for a parsed document and store them in the vector
+  store, then save the document and chunk models, if save_models is set.
+  """
+  data_source_file = parsed_doc.data_source_file
+  doc_name = data_source_file.doc_name
+
+  chunk_metadata = [chunk_reference_metadata(query_doc, doc_chunk)
+                    for doc_chunk in doc_chunks]
 
-      Logger.info(f"doc successfully indexed [{doc_name}]")
+  # generate embedding data and store in vector store
+  new_index_base = \
+      qe_vector_store.index_document(doc_name, parsed_doc.text_chunks,
+                                     query_doc.index_start,
+                                     chunk_metadata=chunk_metadata)
 
-      # cleanup temp local file
-      os.remove(doc_filepath)
+  Logger.info(f"doc successfully indexed [{doc_name}]")
 
-      # store QueryDocument and QueryDocumentChunk models
-      query_doc = QueryDocument(query_engine_id=q_engine.id,
-                                query_engine=q_engine.name,
-                                doc_url=index_doc_url,
-                                index_file=data_source_file.doc_id,
-                                index_start=index_base,
-                                index_end=new_index_base)
-      query_doc.save()
+  # cleanup temp local file
+  if os.path.exists(data_source_file.local_path):
+    os.remove(data_source_file.local_path)
 
-      for i in range(0, len(text_chunks)):
-        # break chunks into sentences and store in chunk model
-        clean_text = data_source.clean_text(text_chunks[i])
-        sentences = data_source.text_to_sentence_list(text_chunks[i])
+  # store QueryDocument and QueryDocumentChunk models
+  query_doc.index_end = new_index_base
+  if save_models:
+    BaseModel.save_many([query_doc] + doc_chunks)
+    Logger.info(f"doc chunk models created for [{doc_name}]")
+  return query_doc
 
-        query_doc_chunk = QueryDocumentChunk(
-                              query_engine_id=q_engine.id,
-                              query_document_id=query_doc.id,
-                              index=i+index_base,
-                              text=text_chunks[i],
-                              clean_text=clean_text,
-                              sentences=sentences)
-        query_doc_chunk.save()
+class IndexAllocator():
+  """
+  Assigns chunk index ranges to the documents of a query engine. Ranges
+  not used by any document, i.e. left by removed documents, are reused
+  first fit before indexes past the end of the index are allocated.
+  """
+  def __init__(self, used_ranges: List[Tuple[int, int]] = None):
+    self.free_ranges = []
+    self.index_end = 0
+    for index_start, index_end in sorted(used_ranges or []):
+      if index_start > self.index_end:
+        self.free_ranges.append((self.index_end, index_start))
+      self.index_end = max(self.index_end, index_end)
+
+  def allocate(self, size: int) -> int:
+    """ allocate a range of size indexes, returning its start index """
+    for i, (range_start, range_end) in enumerate(self.free_ranges):
+      if range_end - range_start >= size:
+        if range_end - range_start == size:
+          del self.free_ranges[i]
+        else:
+          self.free_ranges[i] = (range_start + size, range_end)
+        return range_start
+    index_start = self.index_end
+    self.index_end += size
+    return index_start
+
+def batch_update_query_engine(request_body: Dict, job: BatchJobModel) -> Dict:
+  """
+  Handle a batch job request to add, update or remove documents in an
+  existing query engine.
 
-      Logger.info(f"doc chunk models created for [{doc_name}]")
+  Args:
+    request_body: dict with query_engine_id, and doc_url of documents to
+      add or update and/or remove_doc_urls, a list of document urls
+    job: BatchJobModel model object
+  Returns:
+    dict containing job meta data
+  Raises:
+    ConflictError if an earlier update job of the engine is running
+  """
+  query_engine_id = request_body.get("query_engine_id")
+  doc_url = request_body.get("doc_url")
+  remove_doc_urls = request_body.get("remove_doc_urls") or []
+
+  Logger.info(f"Starting batch job to update query engine "
+              f"[{query_engine_id}] job id [{job.id}], "
+              f"request_body=[{request_body}]")
+
+  q_engine = QueryEngine.find_by_id(query_engine_id)
+
+  # chunk index ranges are allocated from the documents saved when the
+  # update starts, so updates of an engine must not run concurrently. The
+  # earliest created update job runs; later ones fail.
+  earlier_jobs = [
+    update_job for update_job in active_update_jobs(query_engine_id)
+    if (update_job.created_time, update_job.id) < (job.created_time, job.id)
+  ]
+  if earlier_jobs:
+    raise ConflictError(
+        f"Query engine {q_engine.name} is being updated by job "
+        f"{earlier_jobs[0].name}")
+
+  docs_removed = []
+  if remove_doc_urls:
+    docs_removed = query_engine_remove_documents(q_engine, remove_doc_urls)
 
-      index_base = new_index_base
-      docs_processed.append(query_doc)
+  docs_processed = []
+  docs_unchanged = []
+  docs_not_processed = []
+  if doc_url:
+    docs_processed, docs_unchanged, docs_not_processed = \
+        query_engine_add_documents(q_engine, doc_url)
 
-  return docs_processed, data_source.docs_not_processed
+  result_data = {
+    "query_engine_id": q_engine.id,
+    "docs_processed": [doc.doc_url for doc in docs_processed],
+    "docs_unchanged": docs_unchanged,
+    "docs_not_processed": docs_not_processed,
+    "docs_removed": docs_removed
+  }
+  job.result_data = result_data
+  job.save(merge=True)
+
+  Logger.info(f"Completed batch job query engine update for {q_engine.name}")
+
+  return result_data
+
+def active_update_jobs(query_engine_id: str) -> List[BatchJobModel]:
+  """
+  Pending or active update jobs of a query engine, created in the last
+  BATCH_JOB_FETCH_TIME hours.
+  """
+  created_after = datetime.datetime.now() - \
+      datetime.timedelta(hours=BATCH_JOB_FETCH_TIME)
+  jobs = BatchJobModel.collection.filter(
+      "created_time", ">", created_after).filter(
+      "type", "==", JOB_TYPE_QUERY_ENGINE_UPDATE).filter(
+      "status", "in", [JobStatus.JOB_STATUS_PENDING.value,
+                       JobStatus.JOB_STATUS_ACTIVE.value]).fetch()
+  return [
+    job for job in jobs
+    if json.loads(job.input_data or "{}").get("query_engine_id") == \
+        query_engine_id
+  ]
+
+def query_engine_add_documents(q_engine: QueryEngine, doc_url: str) -> \
+    Tuple[List[QueryDocument], List[str], List[str]]:
+  """
+  Add new and changed documents at doc_url to an existing query engine.
+
+  Documents are matched to the engine's documents by url, and documents
+  with an unchanged content hash are skipped, so only new and changed
+  documents are parsed and embedded. A changed document replaces its
+  previous version once the vector store update is committed. Models of
+  new documents are held in memory until then.
+
+  Args:
+    q_engine: the query engine to update
+    doc_url: URL pointing to folder of documents
+
+  Returns:
+    Tuple of list of QueryDocument objects of docs processed,
+      list of urls of unchanged docs, list of urls of docs not processed
+
+  Raises:
+    ValidationError if the query engine documents cannot be updated
+  """
+  validate_updatable_engine(q_engine)
+  qe_vector_store = vector_store_from_query_engine(q_engine)
+
+  existing_docs = {
+    query_doc.doc_url: query_doc
+    for query_doc in QueryDocument.find_by_query_engine_id(q_engine.id,
+                                                           limit=None)
+  }
+  # ranges of replaced documents are only reused by a later update, so no
+  # index is both removed and added in one vector store update
+  index_allocator = IndexAllocator([
+    (int(query_doc.index_start), int(query_doc.index_end))
+    for query_doc in existing_docs.values()
+    if query_doc.index_start is not None and query_doc.index_end is not None
+  ])
+
+  storage_client = get_storage_client()
+  data_source = datasource_from_url(doc_url, q_engine, storage_client)
+
+  docs_unchanged = []
+  with tempfile.TemporaryDirectory() as temp_dir:
+    changed_files = []
+    for data_source_file in data_source.download_documents(doc_url,
+                                                           temp_dir):
+      query_doc = existing_docs.get(data_source_file.src_url)
+      if query_doc is not None and query_doc.content_hash and \
+          query_doc.content_hash == data_source_file.content_hash:
+        docs_unchanged.append(data_source_file.src_url)
+      else:
+        changed_files.append(data_source_file)
+
+    Logger.info(f"updating query engine {q_engine.name}: "
+                f"{len(changed_files)} new or changed docs, "
+                f"{len(docs_unchanged)} unchanged docs")
+
+    lexical_builder = lexical_index_builder(q_engine)
+    qe_vector_store.begin_update()
+    # models of new documents are saved, and models of replaced documents
+    # deleted, only once the vector store update is committed. A failed
+    # update leaves the engine documents unchanged, so it can be retried.
+    new_models = []
+    docs_processed = index_documents(data_source, changed_files,
+                                     qe_vector_store, q_engine,
+                                     index_allocator, lexical_builder,
+                                     unsaved_models=new_models)
+    replaced_docs = [existing_docs[query_doc.doc_url]
+                     for query_doc in docs_processed
+                     if query_doc.doc_url in existing_docs]
+    remove_document_indexes(qe_vector_store, replaced_docs, lexical_builder)
+    qe_vector_store.commit_update()
+    try:
+      BaseModel.save_many(new_models)
+    except Exception:
+      # models saved before the error would mark the new versions as
+      # indexed, so a retry would skip them
+      soft_delete_models(new_models)
+      raise
+    soft_delete_document_models(replaced_docs)
+    if lexical_builder is not None and docs_processed:
+      save_lexical_index(q_engine, lexical_builder.build(), storage_client)
+
+  return docs_processed, docs_unchanged, data_source.docs_not_processed
+
+def query_engine_remove_documents(q_engine: QueryEngine,
+                                  doc_urls: List[str]) -> List[str]:
+  """
+  Remove documents from an existing query engine.
+
+  Args:
+    q_engine: the query engine to update
+    doc_urls: urls of documents to remove
+
+  Returns:
+    list of urls of documents removed
+
+  Raises:
+    ValidationError if the query engine documents cannot be updated
+  """
+  validate_updatable_engine(q_engine)
+  query_docs = [QueryDocument.find_by_url(q_engine.id, doc_url)
+                for doc_url in doc_urls]
+  query_docs = [query_doc for query_doc in query_docs if query_doc is not None]
+  if not query_docs:
+    return []
+
+  qe_vector_store = vector_store_from_query_engine(q_engine)
+  lexical_builder = lexical_index_builder(q_engine)
+  qe_vector_store.begin_update()
+  remove_document_indexes(qe_vector_store, query_docs, lexical_builder)
+  qe_vector_store.commit_update()
+  soft_delete_document_models(query_docs)
+  if lexical_builder is not None:
+    save_lexical_index(q_engine, lexical_builder.build())
+
+  Logger.info(f"removed {len(query_docs)} docs from query engine "
+              f"{q_engine.name}")
+  return [query_doc.doc_url for query_doc in query_docs]
+
+def remove_document_indexes(qe_vector_store: VectorStore,
+                            query_docs: List[QueryDocument],
+                            lexical_builder: LexicalIndexBuilder = None):
+  """
+  Remove the chunks of documents from the vector store and lexical index.
+  """
+  for query_doc in query_docs:
+    if query_doc.index_start is not None and query_doc.index_end is not None:
+      qe_vector_store.remove_index_range(int(query_doc.index_start),
+                                         int(query_doc.index_end))
+      if lexical_builder is not None:
+        lexical_builder.remove_range(int(query_doc.index_start),
+                                     int(query_doc.index_end))
+
+def soft_delete_document_models(query_docs: List[QueryDocument]):
+  """ Soft delete the document and chunk models of documents """
+  deleted_time = datetime.datetime.utcnow()
+  for query_doc in query_docs:
+    doc_models = [query_doc] + \
+        QueryDocumentChunk.find_by_query_document_id(query_doc.id)
+    for doc_model in doc_models:
+      doc_model.deleted_at_timestamp = deleted_time
+    BaseModel.update_many(doc_models, input_datetime=deleted_time)
+
+def soft_delete_models(models: List[BaseModel]):
+  """
+  Soft delete models that may only be partly saved. Models are saved
+  whole, so models that were not saved are written already deleted.
+  """
+  deleted_time = datetime.datetime.utcnow()
+  for model in models:
+    model.deleted_at_timestamp = deleted_time
+  BaseModel.save_many(models, input_datetime=deleted_time)
+
+def lexical_index_builder(q_engine: QueryEngine) -> \
+    Optional[LexicalIndexBuilder]:
+  """
+  Builder for an update of an engine's lexical index, None for engines
+  built without one.
+  """
+  lexical_index = load_lexical_index(q_engine)
+  return None if lexical_index is None else LexicalIndexBuilder(lexical_index)
+
+def validate_updatable_engine(q_engine: QueryEngine):
+  if q_engine.query_engine_type not in (QE_TYPE_LLM_SERVICE, None, ""):
+    raise ValidationError(
+        f"Documents cannot be updated in {q_engine.query_engine_type} "
+        f"query engine {q_engine.name}")
 
 def vector_store_from_query_engine(q_engine: QueryEngine) -> VectorStore:
   """
@@ -764,6 +1501,7 @@ def delete_engine(q_engine: QueryEngine, hard_delete=False):
     else:
       qe_vector_store = vector_store_from_query_engine(q_engine)
       qe_vector_store.delete()
+      delete_lexical_index(q_engine)
   except Exception:
     # we make this error non-fatal as we want to delete the models
     Logger.error(
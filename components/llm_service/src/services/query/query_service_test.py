@@ -17,6 +17,8 @@
 """
 # disabling pylint rules that conflict with pytest fixtures
 # pylint: disable=unused-argument,redefined-outer-name,ungrouped-imports,unused-import
+import json
+import time
 from pathlib import Path
 import pytest
 from typing import List
@@ -37,17 +39,30 @@ from schemas.schema_examples import (QUERY_EXAMPLE,
 from config import get_model_config, ModelConfig, MODEL_CONFIG_PATH
 from common.models import (UserQuery, QueryResult, QueryEngine,
                            User, QueryDocument, QueryDocumentChunk,
-                           QueryReference)
+                           QueryReference, BatchJobModel)
 from common.models.llm_query import QE_TYPE_INTEGRATED_SEARCH
+from common.utils.config import JOB_TYPE_QUERY_ENGINE_UPDATE
+from common.utils.errors import ValidationError, ConflictError
+from utils.errors import EmbeddingsFailedException
 from common.utils.logging_handler import Logger
 from common.testing.firestore_emulator import firestore_emulator, clean_firestore
 from services.query.query_service import (query_generate,
                                           query_search,
+                                          query_search_many,
                                           query_engine_build,
                                           process_documents,
                                           build_doc_index,
-                                          retrieve_references)
-from services.query.vector_store import VectorStore
+                                          retrieve_references,
+                                          query_engine_add_documents,
+                                          query_engine_remove_documents,
+                                          batch_update_query_engine,
+                                          IndexAllocator)
+from services.query.vector_store import (VectorStore, VectorStoreMatch,
+                                         SearchFilter, NUM_MATCH_RESULTS,
+                                         METADATA_CHUNK_ID,
+                                         METADATA_DOCUMENT_ID,
+                                         METADATA_DOCUMENT_URL,
+                                         METADATA_CLEAN_TEXT)
 from services.query.data_source import DataSource, DataSourceFile
 
 Logger = Logger.get_logger(__file__)
@@ -152,13 +167,39 @@ class FakeVectorStore(VectorStore):
   def init_index(self):
     pass
   def index_document(self, doc_name: str, text_chunks: List[str],
-                          index_base: int) -> int:
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
     return 0
   def deploy(self):
     pass
   def similarity_search(self, q_engine: QueryEngine,
-                        query_embedding: List[float]) -> List[int]:
-    return [0,1,2]
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
+    return [VectorStoreMatch(0), VectorStoreMatch(1), VectorStoreMatch(2)]
+
+class FakeMetadataVectorStore(FakeVectorStore):
+  """ mock vector store class returning chunk metadata with matches """
+  def similarity_search(self, q_engine: QueryEngine,
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
+    return [
+      VectorStoreMatch(chunk["index"], 0.9, {
+        METADATA_CHUNK_ID: chunk["id"],
+        METADATA_DOCUMENT_ID: doc["id"],
+        METADATA_DOCUMENT_URL: doc["doc_url"],
+        METADATA_CLEAN_TEXT: chunk["clean_text"]
+      })
+      for chunk, doc in [
+        (QUERY_DOCUMENT_CHUNK_EXAMPLE_1, QUERY_DOCUMENT_EXAMPLE_1),
+        (QUERY_DOCUMENT_CHUNK_EXAMPLE_2, QUERY_DOCUMENT_EXAMPLE_2)
+      ]
+    ]
 
 class FakeDataSource(DataSource):
   """ mock data source class """
@@ -169,15 +210,15 @@ class FakeDataSource(DataSource):
         List[DataSourceFile]:
     return [DSF1, DSF2, DSF3]
 
-  def chunk_document(self, doc_name: str, doc_url: str,
-                     doc_filepath: str) -> List[str]:
+  def chunk_document_sentences(self, doc_name: str, doc_url: str,
+                               doc_filepath: str):
     if doc_url == QUERY_DOCUMENT_EXAMPLE_1["doc_url"]:
-      chunk_list = QUERY_DOCUMENT_CHUNK_EXAMPLE_1["text"]
+      chunk_list = [QUERY_DOCUMENT_CHUNK_EXAMPLE_1["text"]]
     elif doc_url == QUERY_DOCUMENT_EXAMPLE_2["doc_url"]:
-      chunk_list = QUERY_DOCUMENT_CHUNK_EXAMPLE_2["text"]
+      chunk_list = [QUERY_DOCUMENT_CHUNK_EXAMPLE_2["text"]]
     else:
-      chunk_list = None
-    return chunk_list
+      return None, None
+    return chunk_list, [[chunk] for chunk in chunk_list]
 
 @pytest.mark.asyncio
 @mock.patch("services.query.query_service.llm_chat")
@@ -199,10 +240,11 @@ async def test_query_generate(mock_query_search, mock_llm_chat,
   assert query_references[0] == create_query_reference
   assert query_references[1] == create_query_reference_2
 
+@pytest.mark.asyncio
 @mock.patch("services.query.query_service.embeddings.get_embeddings")
 @mock.patch("services.query.query_service.vector_store_from_query_engine")
 @mock.patch("services.query.query_service.get_top_relevant_sentences")
-def test_query_search(mock_get_top_relevant_sentences,
+async def test_query_search(mock_get_top_relevant_sentences,
                       mock_get_vector_store, mock_get_embeddings,
                       create_engine, create_user, create_query_docs,
                       create_query_doc_chunks):
@@ -219,6 +261,10 @@ def test_query_search(mock_get_top_relevant_sentences,
   assert query_references[0].chunk_id == qdoc_chunk1.id
   assert query_references[1].chunk_id == qdoc_chunk2.id
   assert query_references[2].chunk_id == qdoc_chunk3.id
+  # references are persisted by the batched write
+  for query_reference in query_references:
+    saved_ref = QueryReference.find_by_id(query_reference.id)
+    assert saved_ref.chunk_id == query_reference.chunk_id
 
   # test integrated search
   doc_url = ""
@@ -232,12 +278,81 @@ def test_query_search(mock_get_top_relevant_sentences,
 
   assert docs_processed == []
   assert docs_not_processed == []
-  query_references = retrieve_references(prompt, q_engine_2, create_user.id)
+  query_references = \
+      await retrieve_references(prompt, q_engine_2, create_user.id)
   assert len(query_references) == len(create_query_doc_chunks)
   assert query_references[0].chunk_id == qdoc_chunk1.id
   assert query_references[1].chunk_id == qdoc_chunk2.id
   assert query_references[2].chunk_id == qdoc_chunk3.id
 
+@pytest.mark.asyncio
+@mock.patch("services.query.query_service.CHILD_QUERY_TIMEOUT", 0.1)
+@mock.patch("services.query.query_service.QueryEngine.find_children")
+@mock.patch("services.query.query_service.query_search")
+async def test_retrieve_references_drops_failed_children(
+    mock_query_search, mock_find_children,
+    create_query_reference, create_query_reference_2):
+  # slow or failing child engines are dropped from integrated search
+  fast_engine = QueryEngine(name="fast", query_engine_type="")
+  slow_engine = QueryEngine(name="slow", query_engine_type="")
+  failing_engine = QueryEngine(name="failing", query_engine_type="")
+  mock_find_children.return_value = [fast_engine, slow_engine, failing_engine]
+
+  def fake_query_search(q_engine, prompt):
+    if q_engine.name == "slow":
+      time.sleep(0.5)
+    elif q_engine.name == "failing":
+      raise RuntimeError("child engine error")
+    return [create_query_reference, create_query_reference_2]
+  mock_query_search.side_effect = fake_query_search
+
+  q_engine = QueryEngine(name="integrated",
+                         query_engine_type=QE_TYPE_INTEGRATED_SEARCH)
+  query_references = await retrieve_references(QUERY_EXAMPLE["prompt"],
+                                               q_engine, "user_id")
+  assert query_references == [create_query_reference,
+                              create_query_reference_2]
+
+@mock.patch("services.query.query_service.embeddings.get_embeddings")
+@mock.patch("services.query.query_service.vector_store_from_query_engine")
+def test_query_search_with_metadata(mock_get_vector_store, mock_get_embeddings,
+                                    create_engine):
+  # chunk metadata from the vector store is used without datastore lookups
+  mock_get_embeddings.return_value = [True], [0]
+  mock_get_vector_store.return_value = FakeMetadataVectorStore()
+  prompt = QUERY_EXAMPLE["prompt"]
+  query_references = query_search(create_engine, prompt)
+  assert len(query_references) == 2
+  assert query_references[0].chunk_id == QUERY_DOCUMENT_CHUNK_EXAMPLE_1["id"]
+  assert query_references[0].document_url == \
+      QUERY_DOCUMENT_EXAMPLE_1["doc_url"]
+  assert query_references[0].document_text == \
+      QUERY_DOCUMENT_CHUNK_EXAMPLE_1["clean_text"]
+  assert query_references[1].document_id == QUERY_DOCUMENT_EXAMPLE_2["id"]
+
+
+@mock.patch("services.query.query_service.embeddings.get_embeddings")
+@mock.patch("services.query.query_service.vector_store_from_query_engine")
+def test_query_search_many(mock_get_vector_store, mock_get_embeddings,
+                           create_engine):
+  # prompts are embedded in one request and searched in one request
+  mock_get_embeddings.return_value = [True, True], [[0.0], [1.0]]
+  fake_vector_store = FakeMetadataVectorStore()
+  fake_vector_store.similarity_search_batch = mock.Mock(
+      wraps=fake_vector_store.similarity_search_batch)
+  mock_get_vector_store.return_value = fake_vector_store
+  prompts = [QUERY_EXAMPLE["prompt"], "other prompt"]
+  prompt_references = query_search_many(create_engine, prompts)
+  mock_get_embeddings.assert_called_once()
+  assert mock_get_embeddings.call_args.args[0] == prompts
+  fake_vector_store.similarity_search_batch.assert_called_once()
+  assert len(prompt_references) == 2
+  for query_references in prompt_references:
+    assert [ref.chunk_id for ref in query_references] == \
+        [QUERY_DOCUMENT_CHUNK_EXAMPLE_1["id"],
+         QUERY_DOCUMENT_CHUNK_EXAMPLE_2["id"]]
+    assert QueryReference.find_by_id(query_references[0].id) is not None
+
 
 @mock.patch("services.query.query_service.build_doc_index")
 @mock.patch("services.query.query_service.vector_store_from_query_engine")
@@ -286,8 +401,11 @@ def test_build_doc_index(mock_process_documents, create_engine,
   assert docs_processed == [create_query_docs[0], create_query_docs[1]]
   assert docs_not_processed == [create_query_docs[2]]
 
+@mock.patch("services.query.query_service.QUERY_ENGINE_PARSE_WORKERS", 1)
+@mock.patch("services.query.query_service.save_lexical_index")
 @mock.patch("services.query.query_service.datasource_from_url")
-def test_process_documents(mock_get_datasource, create_engine):
+def test_process_documents(mock_get_datasource, mock_save_lexical_index,
+                           create_engine):
   mock_get_datasource.return_value = FakeDataSource()
   doc_url = FAKE_GCS_PATH
   qe_vector_store = FakeVectorStore()
@@ -297,3 +415,205 @@ def test_process_documents(mock_get_datasource, create_engine):
       process_documents(doc_url, qe_vector_store, create_engine, None)
   assert {doc.doc_url for doc in docs_processed} == {DSF1.src_url, DSF2.src_url}
   assert set(docs_not_processed) == {DSF3.src_url}
+  # chunk index ranges are assigned in document order
+  assert docs_processed[0].index_start == 0
+  assert docs_processed[1].index_start == 1
+  # a lexical index of the chunks is saved with the engine
+  lexical_index = mock_save_lexical_index.call_args.args[1]
+  assert len(lexical_index) == 2
+
+class FailedEmbeddingsVectorStore(FakeVectorStore):
+  """ mock vector store failing to embed the chunks of DOC_NAME_2 """
+  def index_document(self, doc_name: str, text_chunks: List[str],
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
+    if doc_name == DOC_NAME_2:
+      raise EmbeddingsFailedException("failed to generate embeddings")
+    return index_base + len(text_chunks)
+
+@mock.patch("services.query.query_service.QUERY_ENGINE_PARSE_WORKERS", 1)
+@mock.patch("services.query.query_service.save_lexical_index")
+@mock.patch("services.query.query_service.datasource_from_url")
+def test_process_documents_embeddings_failed(mock_get_datasource,
+                                             mock_save_lexical_index,
+                                             create_engine):
+  mock_get_datasource.return_value = FakeDataSource()
+  Path(DSF1.local_path).touch()
+  Path(DSF2.local_path).touch()
+  docs_processed, docs_not_processed = \
+      process_documents(FAKE_GCS_PATH, FailedEmbeddingsVectorStore(),
+                        create_engine, None)
+  # a document that could not be embedded is reported, not partially indexed
+  assert [doc.doc_url for doc in docs_processed] == [DSF1.src_url]
+  assert set(docs_not_processed) == {DSF2.src_url, DSF3.src_url}
+  assert QueryDocument.find_by_url(create_engine.id, DSF2.src_url) is None
+  lexical_index = mock_save_lexical_index.call_args.args[1]
+  assert len(lexical_index) == 1
+
+def test_index_allocator():
+  index_allocator = IndexAllocator([(10, 20), (0, 4), (25, 30)])
+  # ranges left by removed documents are reused first fit
+  assert index_allocator.allocate(5) == 4
+  assert index_allocator.allocate(4) == 20
+  assert index_allocator.allocate(2) == 30
+  assert index_allocator.allocate(1) == 9
+  assert index_allocator.allocate(1) == 24
+  assert index_allocator.allocate(1) == 32
+
+@mock.patch("services.query.query_service.QUERY_ENGINE_PARSE_WORKERS", 1)
+@mock.patch("services.query.query_service.save_lexical_index")
+@mock.patch("services.query.query_service.vector_store_from_query_engine")
+@mock.patch("services.query.query_service.datasource_from_url")
+def test_query_engine_add_documents(mock_get_datasource, mock_get_vector_store,
+                                    mock_save_lexical_index, create_engine):
+  mock_get_datasource.side_effect = lambda *args: FakeDataSource()
+  qe_vector_store = FakeVectorStore()
+  mock_get_vector_store.return_value = qe_vector_store
+  Path(DSF1.local_path).touch()
+  Path(DSF2.local_path).touch()
+  docs_processed, _ = \
+      process_documents(FAKE_GCS_PATH, qe_vector_store, create_engine, None)
+  assert len(docs_processed) == 2
+
+  # unchanged documents are not processed again
+  with mock.patch("google.cloud.storage.Client"):
+    docs_processed, docs_unchanged, docs_not_processed = \
+        query_engine_add_documents(create_engine, FAKE_GCS_PATH)
+  assert docs_processed == []
+  assert set(docs_unchanged) == {DSF1.src_url, DSF2.src_url}
+  assert set(docs_not_processed) == {DSF3.src_url}
+
+class UpdateVectorStore(FakeVectorStore):
+  """ mock vector store recording removed ranges, failing commits if set """
+  def __init__(self, fail_commit=False):
+    self.fail_commit = fail_commit
+    self.removed_ranges = []
+  def index_document(self, doc_name: str, text_chunks: List[str],
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
+    return index_base + len(text_chunks)
+  def remove_index_range(self, index_start: int, index_end: int):
+    self.removed_ranges.append((index_start, index_end))
+  def commit_update(self):
+    if self.fail_commit:
+      raise RuntimeError("commit failed")
+
+@mock.patch("services.query.query_service.QUERY_ENGINE_PARSE_WORKERS", 1)
+@mock.patch("services.query.query_service.save_lexical_index")
+@mock.patch("services.query.query_service.vector_store_from_query_engine")
+@mock.patch("services.query.query_service.datasource_from_url")
+def test_query_engine_add_documents_commit_failed(mock_get_datasource,
+                                                  mock_get_vector_store,
+                                                  mock_save_lexical_index,
+                                                  create_engine):
+  mock_get_datasource.side_effect = lambda *args: FakeDataSource()
+  Path(DSF1.local_path).touch()
+  Path(DSF2.local_path).touch()
+  process_documents(FAKE_GCS_PATH, UpdateVectorStore(), create_engine, None)
+  old_doc = QueryDocument.find_by_url(create_engine.id, DSF1.src_url)
+
+  # the first document is changed
+  changed_path = f"/tmp/changed_{DOC_NAME_1}"
+  changed_dsf1 = DataSourceFile(DOC_NAME_1, DSF1.src_url, changed_path,
+                                DSF1.gcs_path)
+  def changed_data_source(*args):
+    data_source = FakeDataSource()
+    data_source.download_documents = \
+        lambda doc_url, temp_dir: [changed_dsf1, DSF2, DSF3]
+    return data_source
+  mock_get_datasource.side_effect = changed_data_source
+
+  # a failed commit leaves the engine documents unchanged
+  Path(changed_path).write_text("changed", encoding="utf-8")
+  mock_get_vector_store.return_value = UpdateVectorStore(fail_commit=True)
+  with mock.patch("google.cloud.storage.Client"):
+    with pytest.raises(RuntimeError):
+      query_engine_add_documents(create_engine, FAKE_GCS_PATH)
+  query_docs = QueryDocument.find_by_query_engine_id(create_engine.id,
+                                                     limit=None)
+  assert [query_doc.id for query_doc in query_docs
+          if query_doc.doc_url == DSF1.src_url] == [old_doc.id]
+
+  # so the update can be retried
+  Path(changed_path).write_text("changed", encoding="utf-8")
+  qe_vector_store = UpdateVectorStore()
+  mock_get_vector_store.return_value = qe_vector_store
+  with mock.patch("google.cloud.storage.Client"):
+    docs_processed, docs_unchanged, _ = \
+        query_engine_add_documents(create_engine, FAKE_GCS_PATH)
+  assert [doc.doc_url for doc in docs_processed] == [DSF1.src_url]
+  assert docs_unchanged == [DSF2.src_url]
+  assert qe_vector_store.removed_ranges == \
+      [(old_doc.index_start, old_doc.index_end)]
+  new_doc = QueryDocument.find_by_url(create_engine.id, DSF1.src_url)
+  assert new_doc.id != old_doc.id
+  assert new_doc.content_hash == changed_dsf1.content_hash
+  assert len(QueryDocumentChunk.find_by_query_document_id(new_doc.id)) == 1
+  assert QueryDocumentChunk.find_by_query_document_id(old_doc.id) == []
+
+@mock.patch("services.query.query_service.vector_store_from_query_engine")
+def test_query_engine_remove_documents_validation(mock_get_vector_store,
+                                                  create_engine):
+  q_engine = QueryEngine(name="integrated-engine",
+                         query_engine_type=QE_TYPE_INTEGRATED_SEARCH)
+  with pytest.raises(ValidationError):
+    query_engine_remove_documents(q_engine,
+                                  [QUERY_DOCUMENT_EXAMPLE_1["doc_url"]])
+  mock_get_vector_store.assert_not_called()
+
+@mock.patch("services.query.query_service.query_engine_add_documents")
+@mock.patch("services.query.query_service.query_engine_remove_documents")
+def test_batch_update_query_engine(mock_remove_documents, mock_add_documents,
+                                   create_engine):
+  mock_remove_documents.return_value = [DSF3.src_url]
+  mock_add_documents.return_value = ([], [DSF1.src_url], [DSF2.src_url])
+  job = mock.Mock(id="fake-job-id")
+  request_body = {
+    "query_engine_id": create_engine.id,
+    "doc_url": FAKE_GCS_PATH,
+    "remove_doc_urls": [DSF3.src_url]
+  }
+  result = batch_update_query_engine(request_body, job)
+
+  assert mock_remove_documents.call_args.args[0].id == create_engine.id
+  assert mock_remove_documents.call_args.args[1] == [DSF3.src_url]
+  assert mock_add_documents.call_args.args[1] == FAKE_GCS_PATH
+  assert job.result_data == {
+    "query_engine_id": create_engine.id,
+    "docs_processed": [],
+    "docs_unchanged": [DSF1.src_url],
+    "docs_not_processed": [DSF2.src_url],
+    "docs_removed": [DSF3.src_url]
+  }
+  assert result["query_engine_id"] == create_engine.id
+
+def create_update_job(name, query_engine_id, status="active"):
+  job = BatchJobModel(name=name, uuid=name,
+                      type=JOB_TYPE_QUERY_ENGINE_UPDATE, status=status,
+                      input_data=json.dumps(
+                          {"query_engine_id": query_engine_id}))
+  job.save()
+  return job
+
+@mock.patch("services.query.query_service.query_engine_add_documents")
+def test_batch_update_query_engine_conflict(mock_add_documents,
+                                            create_engine):
+  mock_add_documents.return_value = ([], [], [])
+  request_body = {
+    "query_engine_id": create_engine.id,
+    "doc_url": FAKE_GCS_PATH
+  }
+  first_job = create_update_job("update-job-1", create_engine.id)
+  second_job = create_update_job("update-job-2", create_engine.id,
+                                 status="pending")
+  create_update_job("other-engine-job", "other-engine-id")
+  create_update_job("finished-job", create_engine.id, status="succeeded")
+
+  # updates of an engine do not run concurrently: the later job fails
+  with pytest.raises(ConflictError):
+    batch_update_query_engine(request_body, second_job)
+  mock_add_documents.assert_not_called()
+
+  batch_update_query_engine(request_body, first_job)
+  mock_add_documents.assert_called_once()
+
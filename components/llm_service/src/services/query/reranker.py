@@ -0,0 +1,236 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Relevance scoring of query references with a ColBERT reranker model.
+
+The model is loaded on first use, or in the background at service startup
+(see warm_up_reranker), so processes that never rerank, such as batch
+jobs, never load it. Rerank requests are scored on one worker thread:
+requests arriving within RERANK_BATCH_WINDOW_MS of each other form a
+batch, and the texts of all requests for the same query are scored in one
+model call. Scores are cached by (query, text).
+"""
+# pylint: disable=broad-exception-caught
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+from common.utils.logging_handler import Logger
+from config import (RERANK_BATCH_WINDOW_MS, RERANK_MAX_BATCH_SIZE,
+                    RERANK_CACHE_SIZE, RERANK_CACHE_TTL)
+
+Logger = Logger.get_logger(__file__)
+
+RERANK_MODEL_NAME = "colbert"
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+  """ get the reranker model, loading it on first use """
+  global _reranker
+  if _reranker is None:
+    with _reranker_lock:
+      if _reranker is None:
+        # imported here, so processes that never rerank don't import torch
+        # pylint: disable=import-outside-toplevel
+        from rerankers import Reranker
+        start_time = time.monotonic()
+        _reranker = Reranker(RERANK_MODEL_NAME, verbose=0)
+        Logger.info(f"reranker model {RERANK_MODEL_NAME} loaded in "
+                    f"{time.monotonic() - start_time:.3f}s")
+  return _reranker
+
+def warm_up_reranker() -> threading.Thread:
+  """ load the reranker model in a background thread """
+  def warm_up():
+    try:
+      get_reranker()
+    except Exception as e:
+      Logger.error(f"failed to load reranker model {RERANK_MODEL_NAME}: {e}")
+
+  thread = threading.Thread(target=warm_up, name="reranker-warm-up",
+                            daemon=True)
+  thread.start()
+  return thread
+
+
+class RerankScoreCache():
+  """
+  Size-bounded LRU cache of reranker scores keyed by (query, text), with
+  a TTL.
+  """
+
+  def __init__(self, max_size: int = RERANK_CACHE_SIZE,
+               ttl: int = RERANK_CACHE_TTL):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._cache = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def cache_key(query: str, text: str) -> str:
+    return hashlib.sha256(
+        f"{query}\0{text}".encode("utf-8")).hexdigest()
+
+  def get(self, query: str, text: str) -> Optional[float]:
+    """ return the cached score of text for query, or None on a miss """
+    key = self.cache_key(query, text)
+    with self._lock:
+      entry = self._cache.get(key)
+      if entry is not None:
+        expiry, score = entry
+        if expiry > time.monotonic():
+          self._cache.move_to_end(key)
+          self.hits += 1
+          return score
+        del self._cache[key]
+      self.misses += 1
+      return None
+
+  def set(self, query: str, text: str, score: float) -> None:
+    key = self.cache_key(query, text)
+    with self._lock:
+      self._cache[key] = (time.monotonic() + self.ttl, score)
+      self._cache.move_to_end(key)
+      while len(self._cache) > self.max_size:
+        self._cache.popitem(last=False)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._cache.clear()
+
+  def stats(self) -> dict:
+    """ cache hit/miss counters """
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "size": len(self._cache),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0
+      }
+
+
+class RerankBatcher():
+  """
+  Scores rerank requests on a worker thread. Requests arriving within
+  batch_window seconds of the first request of a batch are scored
+  together, up to max_batch_size texts; the model scores one query per
+  call, so texts of requests for the same query share one call.
+  """
+
+  def __init__(self,
+               batch_window: float = RERANK_BATCH_WINDOW_MS / 1000,
+               max_batch_size: int = RERANK_MAX_BATCH_SIZE,
+               score_cache: RerankScoreCache = None):
+    self.batch_window = batch_window
+    self.max_batch_size = max_batch_size
+    self.score_cache = score_cache or RerankScoreCache()
+    self._queue = queue.Queue()
+    self._worker = None
+    self._worker_lock = threading.Lock()
+
+  def score(self, query: str, texts: List[str]) -> List[float]:
+    """ relevance scores of texts for query, blocking until scored """
+    cached_scores = [self.score_cache.get(query, text) for text in texts]
+    missing_texts = list(dict.fromkeys(
+        text for text, score in zip(texts, cached_scores) if score is None))
+    if not missing_texts:
+      return cached_scores
+
+    future = Future()
+    self._start_worker()
+    self._queue.put((query, missing_texts, future))
+    new_scores = future.result()
+    return [new_scores[text] if score is None else score
+            for text, score in zip(texts, cached_scores)]
+
+  def _start_worker(self):
+    if self._worker is None:
+      with self._worker_lock:
+        if self._worker is None:
+          self._worker = threading.Thread(target=self._run,
+                                          name="rerank-batcher",
+                                          daemon=True)
+          self._worker.start()
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      batch_size = len(batch[0][1])
+      deadline = time.monotonic() + self.batch_window
+      while batch_size < self.max_batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+          break
+        try:
+          request = self._queue.get(timeout=timeout)
+        except queue.Empty:
+          break
+        batch.append(request)
+        batch_size += len(request[1])
+      self._score_batch(batch)
+
+  def _score_batch(self, batch):
+    query_requests = {}
+    for query, texts, future in batch:
+      query_texts, futures = query_requests.setdefault(query, ({}, []))
+      query_texts.update(dict.fromkeys(texts))
+      futures.append(future)
+
+    num_texts = sum(len(texts) for texts, _ in query_requests.values())
+    Logger.info(f"reranking {num_texts} texts for {len(batch)} requests, "
+                f"{len(query_requests)} queries")
+    for query, (query_texts, futures) in query_requests.items():
+      try:
+        scores = self._rank(query, list(query_texts))
+      except Exception as e:
+        for future in futures:
+          future.set_exception(e)
+        continue
+      for text, score in scores.items():
+        self.score_cache.set(query, text, score)
+      for future in futures:
+        future.set_result(scores)
+
+  def _rank(self, query: str, texts: List[str]) -> Dict[str, float]:
+    ranked_results = get_reranker().rank(
+        query=query, docs=texts, doc_ids=list(range(len(texts))))
+    return {texts[result.doc_id]: float(result.score)
+            for result in ranked_results.top_k(len(texts))}
+
+
+_rerank_batcher = None
+_rerank_batcher_lock = threading.Lock()
+
+
+def get_rerank_batcher() -> RerankBatcher:
+  global _rerank_batcher
+  if _rerank_batcher is None:
+    with _rerank_batcher_lock:
+      if _rerank_batcher is None:
+        _rerank_batcher = RerankBatcher()
+  return _rerank_batcher
+
+def rerank_scores(query: str, texts: List[str]) -> List[float]:
+  """ reranker relevance scores of texts for query """
+  return get_rerank_batcher().score(query, texts)
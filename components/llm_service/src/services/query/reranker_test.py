@@ -0,0 +1,59 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for the reranker
+"""
+# pylint: disable=wrong-import-position
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.query.reranker import RerankBatcher
+
+
+class FakeReranker():
+  """ scores texts by length """
+  def __init__(self):
+    self.calls = []
+
+  def rank(self, query, docs, doc_ids):
+    self.calls.append((query, list(docs)))
+    results = [SimpleNamespace(doc_id=doc_id, score=float(len(doc)))
+               for doc, doc_id in zip(docs, doc_ids)]
+    results.sort(key=lambda result: result.score, reverse=True)
+    return SimpleNamespace(top_k=lambda k: results[:k])
+
+
+def test_rerank_batcher():
+  fake_reranker = FakeReranker()
+  batcher = RerankBatcher(batch_window=0.2, max_batch_size=100)
+  with mock.patch("services.query.reranker.get_reranker",
+                  return_value=fake_reranker):
+    # concurrent requests for a query are scored in one model call
+    with ThreadPoolExecutor(max_workers=3) as executor:
+      futures = [executor.submit(batcher.score, "query", texts)
+                 for texts in [["a", "bbb"], ["bbb", "cc"], ["dddd"]]]
+      scores = [future.result() for future in futures]
+    assert scores == [[1.0, 3.0], [3.0, 2.0], [4.0]]
+    assert len(fake_reranker.calls) == 1
+    assert sorted(fake_reranker.calls[0][1]) == ["a", "bbb", "cc", "dddd"]
+
+    # cached scores are not scored again
+    assert batcher.score("query", ["cc", "a"]) == [2.0, 1.0]
+    assert len(fake_reranker.calls) == 1
+    assert batcher.score("other query", ["cc", "eeeee"]) == [2.0, 5.0]
+    assert fake_reranker.calls[1] == ("other query", ["cc", "eeeee"])
@@ -17,29 +17,51 @@ Query Vector Store
 # pylint: disable=broad-exception-caught,ungrouped-imports
 
 from abc import ABC, abstractmethod
+import datetime
 import json
-import gc
+import math
 import os
 import shutil
 import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
 import numpy as np
 from pathlib import Path
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Optional
+import sqlalchemy
 from google.cloud import aiplatform, storage
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint \
+    import Namespace, NumericNamespace
 from common.models import QueryEngine
 from common.utils.logging_handler import Logger
+from common.utils.errors import ValidationError
 from common.utils.http_exceptions import InternalServerError
 from services import embeddings
 from config import PROJECT_ID, REGION
-from config.vector_store_config import (PG_HOST, PG_PORT,
-                                        PG_DBNAME, PG_USER, PG_PASSWD,
-                                        DEFAULT_VECTOR_STORE,
+from config.vector_store_config import (DEFAULT_VECTOR_STORE,
                                         VECTOR_STORE_LANGCHAIN_PGVECTOR,
-                                        VECTOR_STORE_MATCHING_ENGINE)
+                                        VECTOR_STORE_MATCHING_ENGINE,
+                                        VECTOR_STORE_LOCAL_NUMPY,
+                                        MATCHING_ENGINE_ENDPOINT_CACHE_TTL,
+                                        LOCAL_VECTOR_STORE_PATH,
+                                        LOCAL_VECTOR_STORE_MAX_OPEN_INDEXES,
+                                        PG_INDEX_HNSW, PG_INDEX_IVFFLAT,
+                                        PG_INDEX_NONE, PG_INDEX_TYPE,
+                                        PG_HNSW_M, PG_HNSW_EF_CONSTRUCTION,
+                                        PG_HNSW_EF_SEARCH)
 from langchain.schema.vectorstore import VectorStore as LCVectorStore
 from langchain.vectorstores.pgvector import PGVector as LangchainPGVector
 from langchain.docstore.document import Document
 from utils.gcs_helper import create_bucket
+from utils import vector_helper
+from services.query.matching_engine_export import (AvroEmbeddingWriter,
+                                                   EmbeddingFileUploader,
+                                                   AVRO_FILE_EXTENSION)
+from services.query.pg_pool import (get_connection_string, get_pg_engine,
+                                    pool_stats)
+from utils.errors import EmbeddingsFailedException
 
 Logger = Logger.get_logger(__file__)
 
@@ -52,6 +74,138 @@ NUM_MATCH_RESULTS = 5
 # number of text chunks to process into an embeddings file
 MAX_NUM_TEXT_CHUNK_PROCESS = 1000
 
+# metadata keys stored with each chunk embedding, so that query references
+# can be built from search results without datastore lookups
+METADATA_CHUNK_ID = "chunk_id"
+METADATA_DOCUMENT_ID = "document_id"
+METADATA_DOCUMENT_URL = "document_url"
+METADATA_CLEAN_TEXT = "clean_text"
+REFERENCE_METADATA_KEYS = [
+  METADATA_CHUNK_ID,
+  METADATA_DOCUMENT_ID,
+  METADATA_DOCUMENT_URL,
+  METADATA_CLEAN_TEXT
+]
+# time the document was indexed, in epoch seconds, used by search filters
+METADATA_DOCUMENT_TIME = "document_time"
+
+# vector stores without filter push down fetch this many times k matches
+# before filtering
+FILTER_OVERFETCH_FACTOR = 4
+
+
+class VectorStoreMatch():
+  """ a single match returned from a vector store similarity search """
+  def __init__(self,
+               index: int,
+               score: float = None,
+               metadata: dict = None):
+    self.index = index
+    self.score = score
+    self.metadata = metadata or {}
+
+  @property
+  def has_reference_metadata(self) -> bool:
+    """
+    True if the match carries the chunk metadata needed to build a query
+    reference. Matches from engines built before metadata was stored in
+    the vector store only have an index.
+    """
+    return all(self.metadata.get(key) is not None
+               for key in REFERENCE_METADATA_KEYS)
+
+
+class SearchFilter():
+  """
+  Restricts a similarity search to chunks of a set of documents, of
+  documents with urls starting with a prefix, and/or of documents indexed
+  in a time range. Conditions that are set must all match.
+  """
+  FILTER_KEYS = ["document_ids", "document_url_prefix",
+                 "indexed_after", "indexed_before"]
+
+  def __init__(self,
+               document_ids: List[str] = None,
+               document_url_prefix: str = None,
+               indexed_after: int = None,
+               indexed_before: int = None):
+    self.document_ids = document_ids
+    self.document_url_prefix = document_url_prefix
+    # epoch seconds, after is inclusive and before exclusive
+    self.indexed_after = indexed_after
+    self.indexed_before = indexed_before
+
+  @classmethod
+  def from_dict(cls, filter_dict: Optional[dict]) -> Optional["SearchFilter"]:
+    """
+    Parse a search filter from a query request. Times are ISO 8601 strings
+    (UTC unless a timezone is given) or epoch seconds.
+
+    Returns:
+      SearchFilter, or None if filter_dict is empty
+    Raises:
+      ValidationError if the filter is invalid
+    """
+    if not filter_dict:
+      return None
+    unknown_keys = set(filter_dict) - set(cls.FILTER_KEYS)
+    if unknown_keys:
+      raise ValidationError(f"Unknown search filters {sorted(unknown_keys)}")
+
+    document_ids = filter_dict.get("document_ids")
+    if document_ids is not None and (
+        not isinstance(document_ids, list) or not document_ids or
+        not all(isinstance(doc_id, str) for doc_id in document_ids)):
+      raise ValidationError(
+          "document_ids filter must be a non-empty list of ids")
+    document_url_prefix = filter_dict.get("document_url_prefix")
+    if document_url_prefix is not None and \
+        not isinstance(document_url_prefix, str):
+      raise ValidationError("document_url_prefix filter must be a string")
+    return cls(document_ids=document_ids,
+               document_url_prefix=document_url_prefix or None,
+               indexed_after=cls._parse_time(filter_dict, "indexed_after"),
+               indexed_before=cls._parse_time(filter_dict, "indexed_before"))
+
+  @staticmethod
+  def _parse_time(filter_dict: dict, key: str) -> Optional[int]:
+    value = filter_dict.get(key)
+    if value is None or value == "":
+      return None
+    if isinstance(value, (int, float)):
+      return int(value)
+    try:
+      filter_time = datetime.datetime.fromisoformat(str(value))
+    except ValueError as e:
+      raise ValidationError(f"{key} filter must be an ISO 8601 time") from e
+    if filter_time.tzinfo is None:
+      filter_time = filter_time.replace(tzinfo=datetime.timezone.utc)
+    return int(filter_time.timestamp())
+
+  def cache_key(self) -> tuple:
+    return (None if self.document_ids is None
+            else tuple(sorted(self.document_ids)),
+            self.document_url_prefix, self.indexed_after,
+            self.indexed_before)
+
+  def matches(self, metadata: dict) -> bool:
+    """ True if chunk metadata passes the filter """
+    if self.document_ids is not None and \
+        metadata.get(METADATA_DOCUMENT_ID) not in self.document_ids:
+      return False
+    if self.document_url_prefix is not None and \
+        not (metadata.get(METADATA_DOCUMENT_URL) or "").startswith(
+            self.document_url_prefix):
+      return False
+    document_time = metadata.get(METADATA_DOCUMENT_TIME)
+    if self.indexed_after is not None and (
+        document_time is None or document_time < self.indexed_after):
+      return False
+    if self.indexed_before is not None and (
+        document_time is None or document_time >= self.indexed_before):
+      return False
+    return True
+
 
 class VectorStore(ABC):
   """
@@ -75,16 +229,40 @@ class VectorStore(ABC):
 
   @abstractmethod
   def index_document(self, doc_name: str, text_chunks: List[str],
-                          index_base: int) -> int:
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
     """
     Generate index for a document in this vector store
     Args:
       doc_name (str): name of document to be indexed
       text_chunks (List[str]): list of text content chunks for document
       index_base (int): index to start from; each chunk gets its own index
+      chunk_metadata (List[dict]): optional metadata for each chunk
+        (see REFERENCE_METADATA_KEYS), stored where the backend supports it
     Returns:
       new_index_base: updated query engine index base
+    Raises:
+      EmbeddingsFailedException: if embeddings could not be generated for
+        all chunks, in which case no chunk of the document is indexed
+    """
+
+  def get_document_embeddings(self, doc_name: str,
+                              text_chunks: List[str]) -> np.ndarray:
+    """
+    Generate embeddings for the chunks of a document, one row per chunk.
+    A document is indexed with all its chunks or not at all, so a failure
+    for any chunk raises EmbeddingsFailedException.
     """
+    is_successful, chunk_embeddings = embeddings.get_embeddings(
+        text_chunks,
+        self.embedding_type
+    )
+    num_failed = len(text_chunks) - sum(is_successful)
+    if num_failed > 0:
+      raise EmbeddingsFailedException(
+          f"failed to generate embeddings for {num_failed} of "
+          f"{len(text_chunks)} chunks of {doc_name}")
+    return chunk_embeddings
 
   @abstractmethod
   def deploy(self):
@@ -94,17 +272,84 @@ class VectorStore(ABC):
     """ Delete vector store index for this query engine """
     raise NotImplementedError("Not implemented")
 
+  def begin_update(self):
+    """
+    Called before incremental changes (index_document, remove_index_range)
+    to an index that is already deployed.
+    """
+
+  def remove_index_range(self, index_start: int, index_end: int):
+    """
+    Remove embeddings for chunk indexes in [index_start, index_end), i.e.
+    the chunks of a removed document.
+    """
+    raise NotImplementedError(
+        f"{self.vector_store_type} does not support removing documents")
+
+  def commit_update(self):
+    """ Apply incremental changes made since begin_update """
+
   @abstractmethod
   def similarity_search(self, q_engine: QueryEngine,
-                        query_embedding: List[float]) -> List[int]:
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
     """
     Retrieve text matches for query embeddings.
     Args:
       q_engine: QueryEngine model
       query_embedding: single embedding array for query
+      search_params: optional vector store specific search params
+      search_filter: optional filter applied by the vector store search
+      k: number of matches to return
+    Returns:
+      list of up to k VectorStoreMatch
+    """
+
+  def similarity_search_batch(self, q_engine: QueryEngine,
+                              query_embeddings: List[List[float]],
+                              search_params: dict = None,
+                              search_filter: SearchFilter = None,
+                              k: int = NUM_MATCH_RESULTS) -> \
+                              List[List[VectorStoreMatch]]:
+    """
+    Retrieve text matches for several query embeddings. Vector stores
+    that can search many queries in one request override this; by default
+    each query is searched in turn.
     Returns:
-      list of indexes that are matched of length NUM_MATCH_RESULTS
+      list of up to k VectorStoreMatch per query embedding
     """
+    return [self.similarity_search(q_engine, query_embedding, search_params,
+                                   search_filter=search_filter, k=k)
+            for query_embedding in query_embeddings]
+
+# process-wide cache of Matching Engine index endpoint handles, keyed by
+# endpoint resource name. Creating a handle fetches the endpoint resource,
+# so handles are reused by queries for MATCHING_ENGINE_ENDPOINT_CACHE_TTL
+# seconds, and a query is a single find_neighbors request.
+_matching_engine_endpoints = {}
+_matching_engine_endpoints_lock = threading.Lock()
+
+def get_matching_engine_endpoint(resource_name: str) -> \
+    aiplatform.MatchingEngineIndexEndpoint:
+  """ Get a cached index endpoint handle for an endpoint resource name """
+  now = time.monotonic()
+  with _matching_engine_endpoints_lock:
+    cached = _matching_engine_endpoints.get(resource_name)
+    if cached is not None and cached[0] > now:
+      return cached[1]
+  # concurrent first queries may each create a handle, the last is kept
+  index_endpoint = aiplatform.MatchingEngineIndexEndpoint(resource_name)
+  with _matching_engine_endpoints_lock:
+    _matching_engine_endpoints[resource_name] = (
+        now + MATCHING_ENGINE_ENDPOINT_CACHE_TTL, index_endpoint)
+  return index_endpoint
+
+def evict_matching_engine_endpoint(resource_name: str) -> None:
+  with _matching_engine_endpoints_lock:
+    _matching_engine_endpoints.pop(resource_name, None)
 
 class MatchingEngineVectorStore(VectorStore):
   """
@@ -112,15 +357,26 @@ class MatchingEngineVectorStore(VectorStore):
   """
   def __init__(self, q_engine: QueryEngine, embedding_type:str=None) -> None:
     super().__init__(q_engine)
-    self.storage_client = storage.Client(project=PROJECT_ID)
+    # created on first use, as searches don't use GCS
+    self._storage_client = None
     self.bucket_name = f"{PROJECT_ID}-{self.q_engine.name}-data"
     self.bucket_uri = f"gs://{self.bucket_name}"
     self.index_name = self.q_engine.name.replace("-", "_") + "_MEindex"
     self.index_endpoint = None
     self.tree_ah_index = None
+    # embedding files are uploaded to the bucket root for a new index, and
+    # to an update directory for incremental updates
+    self.upload_prefix = ""
+    self.removed_ids = []
     self.index_description = ("Matching Engine index for LLM Service "
                               "query engine: " + self.q_engine.name)
 
+  @property
+  def storage_client(self) -> storage.Client:
+    if self._storage_client is None:
+      self._storage_client = storage.Client(project=PROJECT_ID)
+    return self._storage_client
+
   def init_index(self):
     # create bucket for ME index data
     create_bucket(self.storage_client, self.bucket_name, location=REGION)
@@ -130,98 +386,140 @@ class MatchingEngineVectorStore(VectorStore):
     return VECTOR_STORE_MATCHING_ENGINE
 
   def index_document(self, doc_name: str, text_chunks: List[str],
-                     index_base: int) -> int:
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
     """
     Generate matching engine index data files in a local directory.
     Args:
       doc_name (str): name of document to be indexed
       text_chunks (List[str]): list of text content chunks for document
       index_base (int): index to start from; each chunk gets its own index
+      chunk_metadata (List[dict]): stored as datapoint restricts, for search
+        filters. find_neighbors only returns datapoint ids, so matches are
+        resolved by index.
     """
-
-
-    chunk_index = 0
-    num_chunks = len(text_chunks)
-    embeddings_dir = None
-
-    # create a list of chunks to process
-    while chunk_index < num_chunks:
-      remaining_chunks = num_chunks - chunk_index
-      chunk_size = min(MAX_NUM_TEXT_CHUNK_PROCESS, remaining_chunks)
-      end_chunk_index = chunk_index + chunk_size
-      process_chunks = text_chunks[chunk_index:end_chunk_index]
-
-      Logger.info(f"processing {chunk_size} chunks for file {doc_name} "
-                  f"remaining chunks {remaining_chunks}")
-
-      # generate np array of chunk IDs starting from index base
-      ids = np.arange(index_base, index_base + len(process_chunks))
-
-      # Create temporary folder to write embeddings to
-      embeddings_dir = Path(tempfile.mkdtemp())
-
-      # Convert chunks to embeddings in batches, to manage API throttling
-      is_successful, chunk_embeddings = embeddings.get_embeddings(
-          process_chunks,
-          self.embedding_type
-      )
-
-      Logger.info(f"generated embeddings for chunks"
-                  f" {chunk_index} to {end_chunk_index}")
-
-      # create JSON
-      embeddings_formatted = [
-        json.dumps(
-          {
-            "id": str(idx),
-            "embedding": [str(value) for value in embedding],
-          }
-        )
-        + "\n"
-        for idx, embedding in zip(ids[is_successful], chunk_embeddings)
+    if chunk_metadata is None:
+      chunk_metadata = [{} for _ in text_chunks]
+
+    start_time = time.monotonic()
+    num_vectors = 0
+    doc_stem = Path(doc_name).stem
+    bucket = self.storage_client.bucket(self.bucket_name)
+    with tempfile.TemporaryDirectory() as embeddings_dir, \
+        EmbeddingFileUploader(bucket, self.upload_prefix) as uploader:
+      # each slice of chunks is embedded and written to a file, which is
+      # uploaded while the next slice is embedded
+      for chunk_index in range(0, len(text_chunks),
+                               MAX_NUM_TEXT_CHUNK_PROCESS):
+        process_chunks = text_chunks[
+            chunk_index:chunk_index + MAX_NUM_TEXT_CHUNK_PROCESS]
+        slice_index_base = index_base + chunk_index
+        Logger.info(f"processing {len(process_chunks)} chunks for file "
+                    f"{doc_name} remaining chunks "
+                    f"{len(text_chunks) - chunk_index}")
+
+        # Convert chunks to embeddings in batches, to manage API throttling
+        try:
+          chunk_embeddings = self.get_document_embeddings(doc_name,
+                                                          process_chunks)
+        except Exception:
+          # remove the slices already uploaded, so the document is not
+          # partially indexed
+          uploader.delete_uploaded()
+          raise
+
+        # generate np array of chunk IDs starting from index base
+        ids = np.arange(slice_index_base,
+                        slice_index_base + len(process_chunks))
+        process_metadata = chunk_metadata[
+            chunk_index:chunk_index + len(process_chunks)]
+        restricts = [self.datapoint_restricts(metadata)
+                     for metadata in process_metadata]
+        chunk_path = os.path.join(
+            embeddings_dir,
+            f"{doc_stem}_{slice_index_base}_index{AVRO_FILE_EXTENSION}")
+        with AvroEmbeddingWriter(chunk_path) as writer:
+          writer.write_batch(ids, chunk_embeddings, restricts)
+        uploader.upload(chunk_path)
+        num_vectors += writer.num_vectors
+
+      # files are uploaded before the temp dir is removed
+      uploader.wait()
+
+    elapsed_time = time.monotonic() - start_time
+    Logger.info(f"indexed {num_vectors} vectors for {doc_name} in "
+                f"{elapsed_time:.2f}s "
+                f"({num_vectors / max(elapsed_time, 1e-6):.0f} vectors/sec)")
+
+    return index_base + len(text_chunks)
+
+  @staticmethod
+  def datapoint_restricts(metadata: dict) -> dict:
+    """
+    Restricts of a datapoint, for search filters: the document id, every
+    directory prefix of the document url and the url itself, and the
+    document time.
+    """
+    restricts = []
+    document_id = metadata.get(METADATA_DOCUMENT_ID)
+    if document_id:
+      restricts.append({"namespace": METADATA_DOCUMENT_ID,
+                        "allow": [document_id]})
+    document_url = metadata.get(METADATA_DOCUMENT_URL)
+    if document_url:
+      path_start = document_url.find("://") + 3 \
+          if "://" in document_url else 0
+      url_prefixes = [document_url[:i + 1]
+                      for i in range(path_start, len(document_url))
+                      if document_url[i] == "/"]
+      restricts.append({"namespace": METADATA_DOCUMENT_URL,
+                        "allow": url_prefixes + [document_url]})
+    datapoint = {"restricts": restricts} if restricts else {}
+    document_time = metadata.get(METADATA_DOCUMENT_TIME)
+    if document_time is not None:
+      datapoint["numeric_restricts"] = [
+        {"namespace": METADATA_DOCUMENT_TIME, "value_int": int(document_time)}
       ]
-
-      # Create output file
-      doc_stem = Path(doc_name).stem
-      chunk_path = embeddings_dir.joinpath(
-          f"{doc_stem}_{index_base}_index.json")
-
-      # write embeddings for chunk to file
-      with open(chunk_path, "w", encoding="utf-8") as f:
-        f.writelines(embeddings_formatted)
-
-      Logger.info(f"wrote embeddings file for chunks {chunk_index} "
-                  f"to {end_chunk_index}")
-
-      # clean up any large data structures
-      gc.collect()
-
-      index_base = index_base + len(process_chunks)
-      chunk_index = chunk_index + len(process_chunks)
-
-    # copy data files up to bucket
-    bucket = self.storage_client.get_bucket(self.bucket_name)
-    for root, _, files in os.walk(embeddings_dir):
-      for filename in files:
-        local_path = os.path.join(root, filename)
-        blob = bucket.blob(filename)
-        blob.upload_from_filename(local_path)
-
-    Logger.info(f"data uploaded for {doc_name}")
-
-    # clean up tmp files
-    shutil.rmtree(embeddings_dir)
-
-    return index_base
+    return datapoint
 
   def delete(self):
     """ Delete vector store index for this query engine """
     Logger.info(f"deleting matching engine index {self.index_name}")
+    if self.q_engine.endpoint:
+      evict_matching_engine_endpoint(self.q_engine.endpoint)
     if self.index_endpoint:
       self.index_endpoint.delete(force=True)
     if self.tree_ah_index:
       self.tree_ah_index.delete()
 
+  def begin_update(self):
+    self.upload_prefix = f"updates/{int(time.time())}/"
+    self.removed_ids = []
+
+  def remove_index_range(self, index_start: int, index_end: int):
+    self.removed_ids.extend(range(index_start, index_end))
+
+  def commit_update(self):
+    """
+    Apply a batch update to the deployed index, from the embedding files
+    uploaded since begin_update and a delete file listing removed ids.
+    """
+    bucket = self.storage_client.get_bucket(self.bucket_name)
+    if self.removed_ids:
+      blob = bucket.blob(self.upload_prefix + "delete/ids.txt")
+      blob.upload_from_string("\n".join(str(i) for i in self.removed_ids))
+    if not any(True for _ in bucket.list_blobs(prefix=self.upload_prefix,
+                                                max_results=1)):
+      return
+
+    Logger.info(f"updating matching engine index {self.index_name} from "
+                f"{self.upload_prefix}")
+    tree_ah_index = aiplatform.MatchingEngineIndex(self.q_engine.index_id)
+    tree_ah_index.update_embeddings(
+        contents_delta_uri=f"{self.bucket_uri}/{self.upload_prefix}",
+        is_complete_overwrite=False)
+    Logger.info(f"Updated matching engine index {self.index_name}")
+
   def deploy(self):
     """ Create matching engine index and endpoint """
 
@@ -267,24 +565,449 @@ class MatchingEngineVectorStore(VectorStore):
       Logger.error(f"Error creating ME index or endpoint {e}")
 
   def similarity_search(self, q_engine: QueryEngine,
-                        query_embedding: List[float]) -> List[int]:
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
     """
-    Retrieve text matches for query embeddings.
-    Args:
-      q_engine: QueryEngine model
-      query_embedding: single embedding array for query
-    Returns:
-      list of indexes that are matched of length NUM_MATCH_RESULTS
+    Retrieve text matches for query embeddings. Search filters are applied
+    by the index, as restricts on the datapoint restricts written at index
+    time; url prefix filters match directory prefixes of document urls.
+    Engines indexed without restricts match no filtered searches.
     """
-    index_endpoint = aiplatform.MatchingEngineIndexEndpoint(q_engine.endpoint)
-
-    match_indexes_list = index_endpoint.find_neighbors(
-        queries=[query_embedding],
+    return self.similarity_search_batch(q_engine, [query_embedding],
+                                        search_params, search_filter, k)[0]
+
+  def similarity_search_batch(self, q_engine: QueryEngine,
+                              query_embeddings: List[List[float]],
+                              search_params: dict = None,
+                              search_filter: SearchFilter = None,
+                              k: int = NUM_MATCH_RESULTS) -> \
+                              List[List[VectorStoreMatch]]:
+    """ Search all query embeddings with one find_neighbors request """
+    index_endpoint = get_matching_engine_endpoint(q_engine.endpoint)
+    filters, numeric_filters = self.search_filter_namespaces(search_filter)
+    neighbors = index_endpoint.find_neighbors(
+        queries=[list(query_embedding) for query_embedding in query_embeddings],
         deployed_index_id=q_engine.deployed_index_name,
-        num_neighbors=NUM_MATCH_RESULTS
+        num_neighbors=k,
+        filter=filters,
+        numeric_filter=numeric_filters
     )
-    match_indexes = [int(match.id) for match in match_indexes_list[0]]
-    return match_indexes
+    return [[VectorStoreMatch(int(match.id), match.distance)
+             for match in query_neighbors]
+            for query_neighbors in neighbors]
+
+  @staticmethod
+  def search_filter_namespaces(search_filter: Optional[SearchFilter]) -> \
+      Tuple[List[Namespace], List[NumericNamespace]]:
+    """ restrict and numeric restrict filters for a search filter """
+    filters = []
+    numeric_filters = []
+    if search_filter is not None:
+      if search_filter.document_ids is not None:
+        filters.append(Namespace(METADATA_DOCUMENT_ID,
+                                 search_filter.document_ids, []))
+      if search_filter.document_url_prefix is not None:
+        filters.append(Namespace(METADATA_DOCUMENT_URL,
+                                 [search_filter.document_url_prefix], []))
+      if search_filter.indexed_after is not None:
+        numeric_filters.append(NumericNamespace(
+            name=METADATA_DOCUMENT_TIME,
+            value_int=search_filter.indexed_after, op="GREATER_EQUAL"))
+      if search_filter.indexed_before is not None:
+        numeric_filters.append(NumericNamespace(
+            name=METADATA_DOCUMENT_TIME,
+            value_int=search_filter.indexed_before, op="LESS"))
+    return filters, numeric_filters
+
+class LocalVectorIndex():
+  """
+  A local vector store index loaded for search: memory mapped float32
+  embeddings (L2 normalized, one row per chunk), the chunk index of each
+  row and the chunk metadata of each row.
+
+  Search filters are evaluated per document, over per row document codes
+  and times computed on the first filtered search, and the resulting row
+  bitmaps are cached per filter.
+  """
+  MAX_CACHED_FILTERS = 64
+
+  def __init__(self, index_dir: str):
+    with open(os.path.join(index_dir, LocalVectorStore.INDEX_INFO_FILE),
+              "r", encoding="utf-8") as f:
+      index_info = json.load(f)
+    count = index_info["count"]
+    dimension = index_info["dimension"]
+    if count > 0:
+      self.embeddings = np.memmap(
+          os.path.join(index_dir, LocalVectorStore.EMBEDDINGS_FILE),
+          dtype=np.float32, mode="r", shape=(count, dimension))
+      self.ids = np.memmap(
+          os.path.join(index_dir, LocalVectorStore.IDS_FILE),
+          dtype=np.int64, mode="r", shape=(count,))
+    else:
+      self.embeddings = np.zeros((0, dimension), dtype=np.float32)
+      self.ids = np.zeros((0,), dtype=np.int64)
+    with open(os.path.join(index_dir, LocalVectorStore.METADATA_FILE),
+              "r", encoding="utf-8") as f:
+      self.metadata = [json.loads(line) for line in f]
+    self._filter_lock = threading.Lock()
+    self._document_codes = None
+    self._filter_masks = OrderedDict()
+
+  def _load_filter_columns(self):
+    """ document code and time of each row, and id and url of documents """
+    document_codes = {}
+    self.document_urls = []
+    codes = np.empty(len(self.metadata), dtype=np.int32)
+    times = np.full(len(self.metadata), -1, dtype=np.int64)
+    for row, metadata in enumerate(self.metadata):
+      document_id = metadata.get(METADATA_DOCUMENT_ID)
+      if document_id not in document_codes:
+        document_codes[document_id] = len(document_codes)
+        self.document_urls.append(metadata.get(METADATA_DOCUMENT_URL) or "")
+      codes[row] = document_codes[document_id]
+      if metadata.get(METADATA_DOCUMENT_TIME) is not None:
+        times[row] = metadata[METADATA_DOCUMENT_TIME]
+    self.document_code_by_id = document_codes
+    self.document_times = times
+    self._document_codes = codes
+
+  def filter_mask(self, search_filter: SearchFilter) -> np.ndarray:
+    """ bitmap of the rows that pass a search filter """
+    key = search_filter.cache_key()
+    with self._filter_lock:
+      if self._document_codes is None:
+        self._load_filter_columns()
+      mask = self._filter_masks.get(key)
+      if mask is not None:
+        self._filter_masks.move_to_end(key)
+        return mask
+
+    # document conditions are evaluated once per document
+    allowed_documents = np.ones(len(self.document_urls), dtype=bool)
+    if search_filter.document_ids is not None:
+      allowed_documents[:] = False
+      allowed_documents[[self.document_code_by_id[document_id]
+                         for document_id in search_filter.document_ids
+                         if document_id in self.document_code_by_id]] = True
+    if search_filter.document_url_prefix is not None:
+      allowed_documents &= np.array(
+          [url.startswith(search_filter.document_url_prefix)
+           for url in self.document_urls], dtype=bool)
+    mask = allowed_documents[self._document_codes]
+    if search_filter.indexed_after is not None:
+      mask &= self.document_times >= search_filter.indexed_after
+    if search_filter.indexed_before is not None:
+      mask &= (self.document_times >= 0) & \
+          (self.document_times < search_filter.indexed_before)
+
+    with self._filter_lock:
+      self._filter_masks[key] = mask
+      while len(self._filter_masks) > self.MAX_CACHED_FILTERS:
+        self._filter_masks.popitem(last=False)
+    return mask
+
+  def search(self, query_embedding: List[float], k: int,
+             search_filter: SearchFilter = None) -> List[VectorStoreMatch]:
+    """ exact top k search by cosine similarity """
+    return self.search_batch([query_embedding], k, search_filter)[0]
+
+  def search_batch(self, query_embeddings: List[List[float]], k: int,
+                   search_filter: SearchFilter = None) -> \
+                   List[List[VectorStoreMatch]]:
+    """
+    exact top k search of several query embeddings, scored in one pass
+    over the embeddings
+    """
+    if search_filter is None:
+      rows = None
+      candidates = self.embeddings
+    else:
+      rows = np.flatnonzero(self.filter_mask(search_filter))
+      candidates = self.embeddings[rows]
+    results = []
+    for top_indexes, scores in vector_helper.top_k_similar_batch(
+        query_embeddings, candidates, k, normalized=True):
+      if rows is not None:
+        top_indexes = rows[top_indexes]
+      results.append([VectorStoreMatch(int(self.ids[i]), float(score),
+                                       self.metadata[i])
+                      for i, score in zip(top_indexes, scores)])
+    return results
+
+# process-wide LRU of open local vector indexes, keyed by index directory
+_local_indexes = OrderedDict()
+_local_indexes_lock = threading.Lock()
+# locks serializing downloads of each local vector index in this process
+_download_locks = {}
+
+class LocalVectorStore(VectorStore):
+  """
+  In-process vector store using exact NumPy search over memory mapped
+  embedding files. Suited to small and medium sized engines, where an
+  exact in-process search is faster than a network round-trip.
+
+  Embeddings are appended to local files as documents are indexed, and
+  uploaded to a GCS bucket on deploy. Query processes download an index
+  on first use and keep up to LOCAL_VECTOR_STORE_MAX_OPEN_INDEXES indexes
+  open.
+
+  Incremental updates write a new version of the index, recorded in the
+  query engine params, so query processes load the new version on their
+  next query while searches on the previous version complete.
+  """
+  EMBEDDINGS_FILE = "embeddings.f32"
+  IDS_FILE = "ids.i64"
+  METADATA_FILE = "metadata.jsonl"
+  INDEX_INFO_FILE = "index.json"
+  INDEX_FILES = [EMBEDDINGS_FILE, IDS_FILE, METADATA_FILE, INDEX_INFO_FILE]
+  INDEX_VERSION_PARAM = "local_index_version"
+
+  def __init__(self, q_engine: QueryEngine, embedding_type: str = None) -> None:
+    super().__init__(q_engine, embedding_type)
+    self.engine_dir = os.path.join(LOCAL_VECTOR_STORE_PATH, self.q_engine.id)
+    self.bucket_name = f"{PROJECT_ID}-{self.q_engine.name}-data"
+    self.version = int((self.q_engine.params or {}).get(
+        self.INDEX_VERSION_PARAM, 0))
+    self._storage_client = None
+    self._write_lock = threading.Lock()
+    self.count = 0
+    self.dimension = None
+    self.removed_ranges = []
+
+  @property
+  def vector_store_type(self):
+    return VECTOR_STORE_LOCAL_NUMPY
+
+  @property
+  def storage_client(self) -> storage.Client:
+    if self._storage_client is None:
+      self._storage_client = storage.Client(project=PROJECT_ID)
+    return self._storage_client
+
+  @property
+  def index_dir(self) -> str:
+    return os.path.join(self.engine_dir, str(self.version))
+
+  @property
+  def index_prefix(self) -> str:
+    return f"local_index/{self.version}/"
+
+  def init_index(self):
+    create_bucket(self.storage_client, self.bucket_name, location=REGION)
+    shutil.rmtree(self.index_dir, ignore_errors=True)
+    os.makedirs(self.index_dir)
+    for file_name in [self.EMBEDDINGS_FILE, self.IDS_FILE,
+                      self.METADATA_FILE]:
+      Path(self.index_dir, file_name).touch()
+    self.count = 0
+
+  def index_document(self, doc_name: str, text_chunks: List[str],
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
+    ids = np.arange(index_base, index_base + len(text_chunks),
+                    dtype=np.int64)
+
+    chunk_embeddings = vector_helper.normalize(
+        self.get_document_embeddings(doc_name, text_chunks))
+    if chunk_metadata is None:
+      chunk_metadata = [{} for _ in text_chunks]
+
+    # documents may be indexed concurrently, so appends to the index files
+    # are serialized to keep rows aligned
+    with self._write_lock:
+      with open(os.path.join(self.index_dir, self.EMBEDDINGS_FILE),
+                "ab") as f:
+        f.write(chunk_embeddings.tobytes())
+      with open(os.path.join(self.index_dir, self.IDS_FILE), "ab") as f:
+        f.write(ids.tobytes())
+      with open(os.path.join(self.index_dir, self.METADATA_FILE), "a",
+                encoding="utf-8") as f:
+        f.writelines(json.dumps(metadata) + "\n"
+                     for metadata in chunk_metadata)
+      self.count += len(chunk_metadata)
+      self.dimension = chunk_embeddings.shape[1]
+
+    Logger.info(f"indexed {len(chunk_metadata)} chunks for {doc_name}")
+    return index_base + len(text_chunks)
+
+  def deploy(self):
+    """ Write index info and upload index files to GCS """
+    with open(os.path.join(self.index_dir, self.INDEX_INFO_FILE), "w",
+              encoding="utf-8") as f:
+      json.dump({"count": self.count,
+                 "dimension": self.dimension or DIMENSIONS}, f)
+
+    bucket = self.storage_client.get_bucket(self.bucket_name)
+    for file_name in self.INDEX_FILES:
+      blob = bucket.blob(self.index_prefix + file_name)
+      blob.upload_from_filename(os.path.join(self.index_dir, file_name))
+    Logger.info(f"uploaded local vector index version {self.version} with "
+                f"{self.count} embeddings for {self.q_engine.name}")
+
+  def begin_update(self):
+    """ Start a new index version from a copy of the current version """
+    self._download_index()
+    with open(os.path.join(self.index_dir, self.INDEX_INFO_FILE), "r",
+              encoding="utf-8") as f:
+      index_info = json.load(f)
+    self.count = index_info["count"]
+    self.dimension = index_info["dimension"]
+
+    current_dir = self.index_dir
+    self.version += 1
+    shutil.rmtree(self.index_dir, ignore_errors=True)
+    shutil.copytree(current_dir, self.index_dir)
+    self.removed_ranges = []
+
+  def remove_index_range(self, index_start: int, index_end: int):
+    # rows are removed when the update is committed
+    self.removed_ranges.append((index_start, index_end))
+
+  def commit_update(self):
+    """
+    Remove rows of removed documents, upload the new index version and
+    record it in the query engine.
+    """
+    if self.removed_ranges:
+      self._remove_rows()
+    self.deploy()
+
+    previous_version = self.version - 1
+    self.q_engine.params = {**(self.q_engine.params or {}),
+                            self.INDEX_VERSION_PARAM: self.version}
+    self.q_engine.update()
+
+    # keep the previous version for queries that started before the
+    # update, and delete older versions
+    bucket = self.storage_client.bucket(self.bucket_name)
+    for blob in bucket.list_blobs(prefix="local_index/"):
+      blob_version = blob.name.split("/")[1]
+      if blob_version.isdigit() and int(blob_version) < previous_version:
+        blob.delete()
+
+  def _remove_rows(self):
+    ids_path = os.path.join(self.index_dir, self.IDS_FILE)
+    embeddings_path = os.path.join(self.index_dir, self.EMBEDDINGS_FILE)
+    metadata_path = os.path.join(self.index_dir, self.METADATA_FILE)
+
+    ids = np.fromfile(ids_path, dtype=np.int64)
+    if len(ids) == 0:
+      # an empty index has no rows to remove
+      self.removed_ranges = []
+      return
+    keep = np.ones(len(ids), dtype=bool)
+    for index_start, index_end in self.removed_ranges:
+      keep &= (ids < index_start) | (ids >= index_end)
+
+    chunk_embeddings = np.fromfile(embeddings_path, dtype=np.float32)
+    chunk_embeddings = chunk_embeddings.reshape(len(ids), -1)[keep]
+    with open(metadata_path, "r", encoding="utf-8") as f:
+      metadatas = [line for line, keep_row in zip(f, keep) if keep_row]
+
+    ids[keep].tofile(ids_path)
+    chunk_embeddings.tofile(embeddings_path)
+    with open(metadata_path, "w", encoding="utf-8") as f:
+      f.writelines(metadatas)
+    Logger.info(f"removed {len(ids) - int(keep.sum())} embeddings from "
+                f"local vector index for {self.q_engine.name}")
+    self.count = int(keep.sum())
+    self.removed_ranges = []
+
+  def delete(self):
+    """ Delete local and uploaded index files """
+    with _local_indexes_lock:
+      for index_dir in list(_local_indexes.keys()):
+        if os.path.dirname(index_dir) == self.engine_dir:
+          _local_indexes.pop(index_dir)
+      for index_dir in list(_download_locks.keys()):
+        if os.path.dirname(index_dir) == self.engine_dir:
+          _download_locks.pop(index_dir)
+    shutil.rmtree(self.engine_dir, ignore_errors=True)
+    bucket = self.storage_client.bucket(self.bucket_name)
+    for blob in bucket.list_blobs(prefix="local_index/"):
+      blob.delete()
+
+  def _download_index(self):
+    """
+    Download index files from GCS, if not present locally. Downloads are
+    serialized per index in this process; if another process sharing the
+    disk downloads the same index concurrently, the first copy moved into
+    place is used.
+    """
+    info_path = os.path.join(self.index_dir, self.INDEX_INFO_FILE)
+    if os.path.exists(info_path):
+      return
+    with _local_indexes_lock:
+      download_lock = _download_locks.setdefault(self.index_dir,
+                                                 threading.Lock())
+    with download_lock:
+      if os.path.exists(info_path):
+        return
+      Logger.info(f"downloading local vector index version {self.version} "
+                  f"for {self.q_engine.name}")
+      os.makedirs(self.engine_dir, exist_ok=True)
+      download_dir = tempfile.mkdtemp(dir=self.engine_dir)
+      try:
+        bucket = self.storage_client.bucket(self.bucket_name)
+        for file_name in self.INDEX_FILES:
+          blob = bucket.blob(self.index_prefix + file_name)
+          blob.download_to_filename(os.path.join(download_dir, file_name))
+        # move into place atomically, so concurrent loads never see a
+        # partially downloaded index
+        try:
+          os.rename(download_dir, self.index_dir)
+        except OSError:
+          # another process moved its download into place first
+          if not os.path.exists(info_path):
+            raise
+      finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+  def load_index(self) -> LocalVectorIndex:
+    """
+    Get the open index for this engine, loading it on first use. Other
+    versions of the index are closed, but left on disk for other processes
+    sharing it, until the engine is deleted.
+    """
+    with _local_indexes_lock:
+      index = _local_indexes.get(self.index_dir)
+      if index is not None:
+        _local_indexes.move_to_end(self.index_dir)
+        return index
+
+    self._download_index()
+    index = LocalVectorIndex(self.index_dir)
+
+    with _local_indexes_lock:
+      # close other versions of this index; searches in progress keep
+      # their references to them
+      for index_dir in list(_local_indexes.keys()):
+        if os.path.dirname(index_dir) == self.engine_dir:
+          _local_indexes.pop(index_dir)
+      _local_indexes[self.index_dir] = index
+      while len(_local_indexes) > LOCAL_VECTOR_STORE_MAX_OPEN_INDEXES:
+        _local_indexes.popitem(last=False)
+    return index
+
+  def similarity_search(self, q_engine: QueryEngine,
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
+    return self.load_index().search(query_embedding, k, search_filter)
+
+  def similarity_search_batch(self, q_engine: QueryEngine,
+                              query_embeddings: List[List[float]],
+                              search_params: dict = None,
+                              search_filter: SearchFilter = None,
+                              k: int = NUM_MATCH_RESULTS) -> \
+                              List[List[VectorStoreMatch]]:
+    return self.load_index().search_batch(query_embeddings, k, search_filter)
 
 class LangChainVectorStore(VectorStore):
   """
@@ -312,40 +1035,56 @@ class LangChainVectorStore(VectorStore):
     return lc_vectorstore
 
   def index_document(self, doc_name: str, text_chunks: List[str],
-                          index_base: int) -> int:
+                     index_base: int,
+                     chunk_metadata: List[dict] = None) -> int:
     # generate list of chunk IDs starting from index base
     ids = list(range(index_base, index_base + len(text_chunks)))
 
     # Convert chunks to embeddings
-    _, chunk_embeddings = embeddings.get_embeddings(
-        text_chunks,
-        self.embedding_type
-    )
+    chunk_embeddings = self.get_document_embeddings(doc_name, text_chunks)
+    if chunk_metadata is None:
+      chunk_metadata = [{} for _ in text_chunks]
 
     # add embeddings to vector store
     self.lc_vector_store.add_embeddings(texts=text_chunks,
                                         embeddings=chunk_embeddings,
+                                        metadatas=chunk_metadata,
                                         ids=ids)
     # return new index base
     new_index_base = index_base + len(text_chunks)
-    self.index_length = new_index_base
+    # documents may be indexed concurrently, in any order
+    self.index_length = max(self.index_length, new_index_base)
     return new_index_base
 
   def similarity_search(self, q_engine: QueryEngine,
-                       query_embedding: List[float]) -> List[int]:
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
+    """
+    Search the langchain vector store. Langchain filters are specific to
+    each store, so search filters are applied to an over-fetched result
+    set; stores that can push filters down override this.
+    """
+    fetch_k = k if search_filter is None else k * FILTER_OVERFETCH_FACTOR
     results = self.lc_vector_store.similarity_search_with_score_by_vector(
         embedding=query_embedding,
-        k=NUM_MATCH_RESULTS
+        k=fetch_k
     )
     processed_results = self.process_results(results)
-    return processed_results
+    if search_filter is not None:
+      processed_results = [match for match in processed_results
+                           if search_filter.matches(match.metadata)]
+    return processed_results[:k]
 
-  def process_results(self, results: List[Any]) -> List[int]:
+  def process_results(self, results: List[Any]) -> List[VectorStoreMatch]:
     """
-    Process langchain vector store results to return list of indexes.  The
+    Process langchain vector store results to return list of matches.  The
     default behavior for langchain is to return list of Documents, but we
     manage the documents separately in the LLM Service.  So we need the vector
-    store to return the list of matching indexes.
+    store to return the matching indexes, along with any chunk metadata
+    stored with them.
     """
     raise NotImplementedError(
       "Must implement process_results for Langchain vectorstore")
@@ -377,6 +1116,306 @@ class LLMServicePGVector(LangchainPGVector):
     ]
     return docs
 
+  # Embeddings for all collections are stored in one langchain table.
+  # Each collection gets its own ANN index, a partial index over the rows
+  # of the collection. The embedding column has no fixed dimension, so
+  # the index is on the embedding cast to the collection dimension, and
+  # searches order by the same expression so the planner can use it.
+  # Distances are cosine, the langchain PGVector default.
+  PG_COLLECTION_TABLE = "langchain_pg_collection"
+  PG_EMBEDDING_TABLE = "langchain_pg_embedding"
+
+  def collection_uuid(self, conn: sqlalchemy.engine.Connection) -> str:
+    """
+    uuid of this store's collection. The uuid is looked up on each use, as
+    the collection may be deleted and recreated by another process.
+    """
+    collection_uuid = conn.execute(
+        sqlalchemy.text(f"SELECT uuid FROM {self.PG_COLLECTION_TABLE} "
+                        "WHERE name = :name"),
+        {"name": self.collection_name}).scalar()
+    if collection_uuid is None:
+      raise InternalServerError(
+          f"pgvector collection {self.collection_name} not found")
+    # normalized, as the uuid is written into index DDL
+    return str(uuid.UUID(str(collection_uuid)))
+
+  @classmethod
+  def ann_index_name(cls, collection_uuid: str) -> str:
+    return f"{cls.PG_EMBEDDING_TABLE}_ann_" + uuid.UUID(collection_uuid).hex
+
+  def create_ann_index(self, index_type: str, build_params: dict) -> dict:
+    """
+    Create the ANN index for this collection, replacing any existing index.
+
+    The embedding table is shared by all engines, so the index is built
+    with CREATE INDEX CONCURRENTLY under a temporary name, which does not
+    block writes from other engines' builds and updates, then swapped in
+    for the existing index, which is dropped concurrently so queries are
+    not blocked.
+
+    Args:
+      index_type: PG_INDEX_HNSW, PG_INDEX_IVFFLAT or PG_INDEX_NONE to
+        only drop an existing index
+      build_params: "m" and "ef_construction" for HNSW, "lists" for
+        IVFFlat. If lists is not set it is derived from the row count.
+    Returns:
+      dict of build params used
+    """
+    if index_type not in [PG_INDEX_HNSW, PG_INDEX_IVFFLAT, PG_INDEX_NONE]:
+      raise InternalServerError(f"unsupported pgvector index {index_type}")
+
+    # concurrent index builds cannot run in a transaction
+    with get_pg_engine().connect() as conn:
+      conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+      collection_uuid = self.collection_uuid(conn)
+      index_name = self.ann_index_name(collection_uuid)
+      new_index_name = f"{index_name}_new"
+      num_rows, dimension = 0, None
+      if index_type != PG_INDEX_NONE:
+        row = conn.execute(
+            sqlalchemy.text(
+                "SELECT count(*), max(vector_dims(embedding)) "
+                f"FROM {self.PG_EMBEDDING_TABLE} "
+                "WHERE collection_id = :collection_id"),
+            {"collection_id": collection_uuid}).one()
+        num_rows, dimension = row[0], row[1]
+      if not num_rows:
+        conn.execute(sqlalchemy.text(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        return {}
+
+      build_params = self.ann_build_params(index_type, build_params, num_rows)
+      with_params = ", ".join(f"{k} = {v}" for k, v in build_params.items())
+      # an earlier failed concurrent build leaves an invalid index
+      conn.execute(sqlalchemy.text(
+          f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name}"))
+      try:
+        conn.execute(sqlalchemy.text(
+            f"CREATE INDEX CONCURRENTLY {new_index_name} "
+            f"ON {self.PG_EMBEDDING_TABLE} "
+            f"USING {index_type} "
+            f"((embedding::vector({int(dimension)})) vector_cosine_ops) "
+            f"WITH ({with_params}) "
+            f"WHERE collection_id = '{collection_uuid}'"))
+      except Exception:
+        conn.execute(sqlalchemy.text(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name}"))
+        raise
+      conn.execute(sqlalchemy.text(
+          f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+      conn.execute(sqlalchemy.text(
+          f"ALTER INDEX {new_index_name} RENAME TO {index_name}"))
+    return build_params
+
+  @classmethod
+  def ann_build_params(cls, index_type: str, build_params: dict,
+                       num_rows: int) -> dict:
+    """
+    Validated build params for an ANN index, as positive integers.
+
+    Raises:
+      ValidationError: if a build param is not a positive integer
+    """
+    if index_type == PG_INDEX_HNSW:
+      params = {"m": build_params.get("m"),
+                "ef_construction": build_params.get("ef_construction")}
+    else:
+      lists = build_params.get("lists")
+      if not lists:
+        # pgvector guidance: rows / 1000 lists up to 1M rows,
+        # sqrt(rows) beyond
+        lists = max(1, num_rows // 1000 if num_rows <= 1000000
+                    else int(math.sqrt(num_rows)))
+      params = {"lists": lists}
+    for key, value in params.items():
+      try:
+        if isinstance(value, bool) or int(value) != float(value):
+          raise ValueError()
+        params[key] = int(value)
+      except (TypeError, ValueError) as e:
+        raise ValidationError(
+            f"pgvector {index_type} {key} must be an integer") from e
+      if params[key] <= 0:
+        raise ValidationError(
+            f"pgvector {index_type} {key} must be positive")
+    return params
+
+  def delete_index_range(self, index_start: int, index_end: int) -> None:
+    """ delete embeddings with custom ids in [index_start, index_end) """
+    with get_pg_engine().begin() as conn:
+      conn.execute(
+          sqlalchemy.text(
+              f"DELETE FROM {self.PG_EMBEDDING_TABLE} "
+              "WHERE collection_id = (SELECT uuid "
+              f"FROM {self.PG_COLLECTION_TABLE} WHERE name = :name) "
+              "AND custom_id = ANY(:custom_ids)"),
+          {"name": self.collection_name,
+           "custom_ids": [str(i) for i in range(index_start, index_end)]})
+
+  def drop_ann_index(self) -> None:
+    self.create_ann_index(PG_INDEX_NONE, {})
+
+  _pgvector_version = None
+
+  def supports_iterative_scan(self) -> bool:
+    """
+    True if the pgvector extension (0.8 or later) can continue ANN index
+    scans until enough rows pass the search filters.
+    """
+    if LLMServicePGVector._pgvector_version is None:
+      with get_pg_engine().connect() as conn:
+        version = conn.execute(sqlalchemy.text(
+            "SELECT extversion FROM pg_extension "
+            "WHERE extname = 'vector'")).scalar() or "0"
+      LLMServicePGVector._pgvector_version = tuple(
+          int(part) for part in version.split(".")[:2] if part.isdigit())
+    return LLMServicePGVector._pgvector_version >= (0, 8)
+
+  @staticmethod
+  def filter_predicates(search_filter: SearchFilter) -> Tuple[List[str],
+                                                              dict]:
+    """ SQL predicates on chunk metadata, and their params """
+    predicates = []
+    params = {}
+    if search_filter.document_ids is not None:
+      predicates.append(
+          f"cmetadata->>'{METADATA_DOCUMENT_ID}' = ANY(:document_ids)")
+      params["document_ids"] = search_filter.document_ids
+    if search_filter.document_url_prefix is not None:
+      predicates.append(f"starts_with(cmetadata->>'{METADATA_DOCUMENT_URL}', "
+                        ":document_url_prefix)")
+      params["document_url_prefix"] = search_filter.document_url_prefix
+    if search_filter.indexed_after is not None:
+      predicates.append(f"(cmetadata->>'{METADATA_DOCUMENT_TIME}')::bigint "
+                        ">= :indexed_after")
+      params["indexed_after"] = search_filter.indexed_after
+    if search_filter.indexed_before is not None:
+      predicates.append(f"(cmetadata->>'{METADATA_DOCUMENT_TIME}')::bigint "
+                        "< :indexed_before")
+      params["indexed_before"] = search_filter.indexed_before
+    return predicates, params
+
+  def ann_search(self, embedding: List[float], k: int,
+                 ef_search: int = None, probes: int = None,
+                 search_filter: SearchFilter = None) -> \
+      List[VectorStoreMatch]:
+    """
+    Search this collection through its ANN index.
+
+    Args:
+      embedding: query embedding
+      k: number of matches to return
+      ef_search: HNSW candidate list size for this query
+      probes: number of IVFFlat lists searched for this query
+      search_filter: filter applied as predicates on chunk metadata
+    Returns:
+      list of VectorStoreMatch, with cosine distance as the score
+    """
+    return self.ann_search_batch([embedding], k, ef_search, probes,
+                                 search_filter)[0]
+
+  def ann_search_batch(self, query_embeddings: List[List[float]], k: int,
+                       ef_search: int = None, probes: int = None,
+                       search_filter: SearchFilter = None) -> \
+      List[List[VectorStoreMatch]]:
+    """
+    Search this collection through its ANN index for several query
+    embeddings in one statement, as a lateral join of the query embeddings
+    with a top k index scan for each.
+
+    Returns:
+      list of VectorStoreMatch per query embedding (see ann_search)
+    """
+    dimension = len(query_embeddings[0])
+    distance = (f"(embedding::vector({dimension})) <=> "
+                "queries.query_embedding")
+    predicates = ["collection_id = :collection_id"]
+    query_params = {"k": k}
+    query_values = []
+    for i, embedding in enumerate(query_embeddings):
+      query_values.append(
+          f"({i}, CAST(:embedding_{i} AS vector({dimension})))")
+      query_params[f"embedding_{i}"] = \
+          "[" + ",".join(str(float(x)) for x in embedding) + "]"
+    if search_filter is not None:
+      filter_predicates, filter_params = \
+          self.filter_predicates(search_filter)
+      predicates += filter_predicates
+      query_params.update(filter_params)
+    query = sqlalchemy.text(
+        "SELECT queries.query_index, matches.custom_id, matches.cmetadata, "
+        "matches.distance "
+        f"FROM (VALUES {', '.join(query_values)}) "
+        "AS queries(query_index, query_embedding) "
+        "CROSS JOIN LATERAL ("
+        f"SELECT custom_id, cmetadata, {distance} AS distance "
+        f"FROM {self.PG_EMBEDDING_TABLE} "
+        f"WHERE {' AND '.join(predicates)} "
+        f"ORDER BY {distance} LIMIT :k) AS matches")
+    # search params only apply to this transaction
+    with get_pg_engine().begin() as conn:
+      # the collection uuid is bound as a value rather than a subquery, so
+      # the planner can match the collection's partial ANN index
+      query_params["collection_id"] = self.collection_uuid(conn)
+      if ef_search:
+        conn.execute(sqlalchemy.text(
+            f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+      if probes:
+        conn.execute(sqlalchemy.text(
+            f"SET LOCAL ivfflat.probes = {int(probes)}"))
+      if search_filter is not None and self.supports_iterative_scan():
+        # otherwise filters apply to the ef_search or probes candidates
+        # only, and selective filters return fewer than k rows
+        conn.execute(sqlalchemy.text(
+            "SET LOCAL hnsw.iterative_scan = relaxed_order"))
+        conn.execute(sqlalchemy.text(
+            "SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+      rows = conn.execute(query, query_params).fetchall()
+    # relaxed order iterative scans may return rows slightly out of order
+    rows = sorted(rows, key=lambda row: (row.query_index, row.distance))
+    matches = [[] for _ in query_embeddings]
+    for row in rows:
+      matches[row.query_index].append(
+          VectorStoreMatch(int(row.custom_id), float(row.distance),
+                           row.cmetadata or {}))
+    return matches
+
+# process-wide cache of PGVector stores, keyed by query engine id.
+# Creating a store checks the pgvector extension, tables and collection
+# exist, so stores are created once per query engine and shared. An engine
+# deleted and recreated under the same name, e.g. by another pod, gets a
+# new id and so a new store.
+_pg_vector_stores = {}
+_pg_vector_stores_lock = threading.Lock()
+
+def get_pg_vector_store(query_engine_id: str,
+                        collection_name: str) -> LLMServicePGVector:
+  """ get the shared PGVector store for a query engine collection """
+  lc_vector_store = _pg_vector_stores.get(query_engine_id)
+  if lc_vector_store is None:
+    with _pg_vector_stores_lock:
+      lc_vector_store = _pg_vector_stores.get(query_engine_id)
+      if lc_vector_store is None:
+        # instantiate the langchain vector store object on the shared
+        # connection pool
+        lc_vector_store = LLMServicePGVector(
+            embedding_function=embeddings.LangchainEmbeddings,
+            connection_string=get_connection_string(),
+            collection_name=collection_name,
+            connection=get_pg_engine()
+            )
+        _pg_vector_stores[query_engine_id] = lc_vector_store
+  return lc_vector_store
+
+def evict_pg_vector_store(query_engine_id: str) -> None:
+  with _pg_vector_stores_lock:
+    _pg_vector_stores.pop(query_engine_id, None)
+
+def pg_vector_store_stats() -> dict:
+  """ shared connection pool stats and number of cached PGVector stores """
+  return {**pool_stats(), "cached_stores": len(_pg_vector_stores)}
+
 class PostgresVectorStore(LangChainVectorStore):
   """
   LLM Service interface for Postgres Vector Stores, based on langchain
@@ -387,37 +1426,128 @@ class PostgresVectorStore(LangChainVectorStore):
     return VECTOR_STORE_LANGCHAIN_PGVECTOR
 
   def _get_langchain_vector_store(self) -> LCVectorStore:
-
-    # get postgres connection string using LangchainPGVector utility method
-    connection_string = LangchainPGVector.connection_string_from_db_params(
-        driver="psycopg2",
-        host=PG_HOST,
-        port=PG_PORT,
-        database=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWD
-    )
-
     # Each query engine is stored in a different PGVector collection,
     # where the collection name is just the query engine name.
-    collection_name = self.q_engine.name
+    return get_pg_vector_store(self.q_engine.id, self.q_engine.name)
 
-    # instantiate the langchain vector store object
-    langchain_vector_store = LLMServicePGVector(
-        embedding_function=embeddings.LangchainEmbeddings,
-        connection_string=connection_string,
-        collection_name=collection_name
-        )
+  def delete(self):
+    """ Delete the PGVector collection for this query engine """
+    self.lc_vector_store.drop_ann_index()
+    self.lc_vector_store.delete_collection()
+    evict_pg_vector_store(self.q_engine.id)
+
+  def remove_index_range(self, index_start: int, index_end: int):
+    # the ANN index is maintained by postgres as rows are deleted
+    self.lc_vector_store.delete_index_range(index_start, index_end)
+
+  def index_type(self) -> str:
+    params = self.q_engine.params or {}
+    index_type = params.get("pg_index_type", PG_INDEX_TYPE)
+    if index_type not in [PG_INDEX_HNSW, PG_INDEX_IVFFLAT, PG_INDEX_NONE]:
+      raise InternalServerError(
+          f"pgvector index type {index_type} not supported")
+    return index_type
 
-    return langchain_vector_store
+  def deploy(self):
+    """
+    Create the ANN index for the query engine collection, with build
+    params from the query engine params. Params used are stored back in
+    the query engine, so searches can derive their defaults.
+    """
+    params = self.q_engine.params or {}
+    index_type = self.index_type()
+    build_params = {
+      "m": params.get("hnsw_m", PG_HNSW_M),
+      "ef_construction": params.get("hnsw_ef_construction",
+                                    PG_HNSW_EF_CONSTRUCTION),
+      "lists": params.get("ivfflat_lists")
+    }
+    start_time = time.time()
+    build_params = self.lc_vector_store.create_ann_index(index_type,
+                                                          build_params)
+    Logger.info(f"created {index_type} index {build_params} for "
+                f"{self.q_engine.name} in "
+                f"{time.time() - start_time:.2f} seconds")
+    if index_type == PG_INDEX_IVFFLAT and build_params:
+      self.q_engine.params = {**params,
+                              "ivfflat_lists": build_params["lists"]}
+      self.q_engine.update()
 
-  def process_results(self, results: List[Any]) -> List[int]:
+  def similarity_search(self, q_engine: QueryEngine,
+                        query_embedding: List[float],
+                        search_params: dict = None,
+                        search_filter: SearchFilter = None,
+                        k: int = NUM_MATCH_RESULTS) -> \
+                        List[VectorStoreMatch]:
+    """
+    Search through the collection ANN index. search_params may set
+    "ef_search" (HNSW) or "probes" (IVFFlat) for this query, otherwise
+    query engine params or defaults are used. Search filters are applied
+    in the database, as predicates on the chunk metadata.
+    """
+    index_type = self.index_type()
+    if index_type == PG_INDEX_NONE:
+      if search_filter is not None:
+        # an exact search, without an index to scan
+        return self.lc_vector_store.ann_search(query_embedding, k,
+                                               search_filter=search_filter)
+      return super().similarity_search(q_engine, query_embedding, k=k)
+
+    ef_search, probes = self.ann_search_params(q_engine, index_type,
+                                               search_params)
+    return self.lc_vector_store.ann_search(query_embedding, k,
+                                           ef_search=ef_search,
+                                           probes=probes,
+                                           search_filter=search_filter)
+
+  def similarity_search_batch(self, q_engine: QueryEngine,
+                              query_embeddings: List[List[float]],
+                              search_params: dict = None,
+                              search_filter: SearchFilter = None,
+                              k: int = NUM_MATCH_RESULTS) -> \
+                              List[List[VectorStoreMatch]]:
+    """
+    Search all query embeddings in one database statement. Without an
+    ANN index each query is an exact search.
+    """
+    if not query_embeddings:
+      return []
+    ef_search, probes = self.ann_search_params(q_engine, self.index_type(),
+                                               search_params)
+    return self.lc_vector_store.ann_search_batch(query_embeddings, k,
+                                                 ef_search=ef_search,
+                                                 probes=probes,
+                                                 search_filter=search_filter)
+
+  @staticmethod
+  def ann_search_params(q_engine: QueryEngine, index_type: str,
+                        search_params: dict = None) -> Tuple[Optional[int],
+                                                             Optional[int]]:
+    """ HNSW ef_search and IVFFlat probes for a search """
+    search_params = search_params or {}
+    params = q_engine.params or {}
+    ef_search = None
+    probes = None
+    if index_type == PG_INDEX_HNSW:
+      ef_search = search_params.get(
+          "ef_search", params.get("hnsw_ef_search", PG_HNSW_EF_SEARCH))
+    elif index_type == PG_INDEX_IVFFLAT:
+      lists = int(params.get("ivfflat_lists", 1))
+      probes = search_params.get(
+          "probes", params.get("ivfflat_probes",
+                               max(1, int(math.sqrt(lists)))))
+    return ef_search, probes
+
+  def process_results(self, results: List[Any]) -> List[VectorStoreMatch]:
     """
     Our overridden method _results_to_docs_and_scores returns a tuple of
-    (Document, distance, index). So return a list of indexes extracted from
-    result tuples.
+    (Document, distance, index). So return a list of matches with the index,
+    distance and document metadata extracted from result tuples.
     """
-    processed_results = [int(result[2]) for result in results]
+    processed_results = [
+      VectorStoreMatch(int(result[2]), result[1], result[0].metadata)
+      for result in results
+    ]
     return processed_results
 
 
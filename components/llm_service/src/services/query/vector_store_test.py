@@ -0,0 +1,533 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for vector stores
+"""
+# pylint: disable=wrong-import-position,protected-access,unused-argument
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+import fastavro
+import numpy as np
+import pytest
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from common.models import QueryEngine
+from common.utils.errors import ValidationError
+from services.query import vector_store
+from services.query.vector_store import LocalVectorStore, SearchFilter
+from utils.errors import EmbeddingsFailedException
+
+
+def fake_embeddings(text_chunks, embedding_type=None):
+  embeddings = np.array([[len(text), 1.0, 0.0] for text in text_chunks],
+                        dtype=np.float32)
+  return [True] * len(text_chunks), embeddings
+
+
+@mock.patch("services.query.vector_store.create_bucket")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_embeddings)
+def test_local_vector_store(mock_get_embeddings, mock_create_bucket, tmp_path):
+  q_engine = QueryEngine(id="local-engine", name="local-engine")
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         str(tmp_path)):
+    store = LocalVectorStore(q_engine)
+    store._storage_client = mock.Mock()
+    store._storage_client.bucket.return_value.list_blobs.return_value = []
+    store.init_index()
+
+    index_base = store.index_document(
+        "doc1", ["a", "bbbbbbbbbb"], 0,
+        [{"chunk_id": "c0"}, {"chunk_id": "c1"}])
+    index_base = store.index_document(
+        "doc2", ["bbbbbbbbbbbb"], index_base, [{"chunk_id": "c2"}])
+    assert index_base == 3
+    store.deploy()
+
+    matches = store.similarity_search(q_engine, [10.0, 1.0, 0.0])
+    assert [match.index for match in matches][:2] == [1, 2]
+    assert matches[0].metadata == {"chunk_id": "c1"}
+    assert matches[0].score > matches[-1].score
+
+    # several queries are searched in one pass
+    batch_matches = store.similarity_search_batch(
+        q_engine, [[10.0, 1.0, 0.0], [1.0, 1.0, 0.0]], k=2)
+    assert [[match.index for match in matches]
+            for matches in batch_matches] == [[1, 2], [0, 1]]
+
+    # the open index is reused across searches
+    assert store.load_index() is store.load_index()
+
+    store.delete()
+    assert not os.path.exists(store.index_dir)
+    assert store.index_dir not in vector_store._local_indexes
+
+
+def chunk_metadata(chunk_id, document_id, document_url, document_time):
+  return {"chunk_id": chunk_id, "document_id": document_id,
+          "document_url": document_url, "document_time": document_time}
+
+
+@mock.patch("services.query.vector_store.create_bucket")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_embeddings)
+def test_local_vector_store_filter(mock_get_embeddings, mock_create_bucket,
+                                   tmp_path):
+  q_engine = QueryEngine(id="filter-engine", name="filter-engine")
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         str(tmp_path)):
+    store = LocalVectorStore(q_engine)
+    store._storage_client = mock.Mock()
+    store._storage_client.bucket.return_value.list_blobs.return_value = []
+    store.init_index()
+    index_base = store.index_document(
+        "doc1", ["a", "bbbbbbbbbb"], 0,
+        [chunk_metadata("c0", "doc1", "gs://bucket/a/doc1.pdf", 100),
+         chunk_metadata("c1", "doc1", "gs://bucket/a/doc1.pdf", 100)])
+    index_base = store.index_document(
+        "doc2", ["bbbbbbbbbbbb"], index_base,
+        [chunk_metadata("c2", "doc2", "gs://bucket/b/doc2.pdf", 200)])
+    store.index_document(
+        "doc3", ["bbbbbbbbb"], index_base,
+        [chunk_metadata("c3", "doc3", "gs://bucket/a/doc3.pdf", 300)])
+    store.deploy()
+
+    def search(filter_dict, k=5):
+      matches = store.similarity_search(
+          q_engine, [10.0, 1.0, 0.0], k=k,
+          search_filter=SearchFilter.from_dict(filter_dict))
+      return [match.index for match in matches]
+
+    assert search(None, k=2) == [1, 3]
+    assert search({"document_ids": ["doc2", "doc3"]}) == [3, 2]
+    assert search({"document_ids": ["unknown"]}) == []
+    assert search({"document_url_prefix": "gs://bucket/a/"}, k=2) == [1, 3]
+    assert search({"indexed_after": 150, "indexed_before": 300}) == [2]
+    assert search({"document_url_prefix": "gs://bucket/a/",
+                   "indexed_after": "1970-01-01T00:02:30"}) == [3]
+
+
+
+def fake_index_bucket(remote_dir, on_download=None):
+  """ fake GCS bucket serving uploaded local index files from remote_dir """
+  downloads = []
+  def blob(name):
+    def download_to_filename(path):
+      downloads.append(name)
+      if on_download:
+        on_download(name)
+      shutil.copy(os.path.join(remote_dir, name), path)
+    return mock.Mock(download_to_filename=download_to_filename)
+  bucket = mock.Mock()
+  bucket.blob.side_effect = blob
+  bucket.list_blobs.return_value = []
+  return bucket, downloads
+
+
+@mock.patch("services.query.vector_store.create_bucket")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_embeddings)
+def test_local_vector_store_download(mock_get_embeddings, mock_create_bucket,
+                                     tmp_path):
+  q_engine = QueryEngine(id="download-engine", name="download-engine")
+  remote_dir = os.path.join(tmp_path, "remote")
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         os.path.join(tmp_path, "build")):
+    store = LocalVectorStore(q_engine)
+    store._storage_client = mock.Mock()
+    store.init_index()
+    store.index_document("doc1", ["a", "bbbbbbbbbb"], 0)
+    store.deploy()
+    shutil.copytree(store.index_dir,
+                    os.path.join(remote_dir, store.index_prefix))
+
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         os.path.join(tmp_path, "query")):
+    # concurrent first queries download the index once
+    bucket, downloads = fake_index_bucket(
+        remote_dir, on_download=lambda name: time.sleep(0.01))
+    stores = [LocalVectorStore(q_engine) for _ in range(4)]
+    errors = []
+    def search(store):
+      store._storage_client = mock.Mock()
+      store._storage_client.bucket.return_value = bucket
+      try:
+        store.similarity_search(q_engine, [10.0, 1.0, 0.0])
+      except Exception as e: # pylint: disable=broad-exception-caught
+        errors.append(e)
+    threads = [threading.Thread(target=search, args=(store,))
+               for store in stores]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assert not errors
+    assert len(downloads) == len(LocalVectorStore.INDEX_FILES)
+    stores[0].delete()
+
+    # another process moves its download into place first
+    store = LocalVectorStore(q_engine)
+    def other_process_download(name):
+      if name.endswith(LocalVectorStore.INDEX_INFO_FILE):
+        shutil.copytree(os.path.join(remote_dir, store.index_prefix),
+                        store.index_dir)
+    bucket, downloads = fake_index_bucket(remote_dir, other_process_download)
+    store._storage_client = mock.Mock()
+    store._storage_client.bucket.return_value = bucket
+    matches = store.similarity_search(q_engine, [10.0, 1.0, 0.0])
+    assert [match.index for match in matches] == [1, 0]
+    assert os.listdir(store.engine_dir) == [str(store.version)], \
+      "download directory removed"
+
+    # loading a new version leaves the previous version on disk
+    previous_dir = store.index_dir
+    shutil.copytree(os.path.join(remote_dir, store.index_prefix),
+                    os.path.join(remote_dir, "local_index", "1"))
+    q_engine.params = {LocalVectorStore.INDEX_VERSION_PARAM: 1}
+    new_store = LocalVectorStore(q_engine)
+    new_store._storage_client = mock.Mock()
+    new_store._storage_client.bucket.return_value = fake_index_bucket(
+        remote_dir)[0]
+    new_store.load_index()
+    assert previous_dir not in vector_store._local_indexes
+    assert os.path.exists(previous_dir)
+
+    new_store.delete()
+    assert not os.path.exists(previous_dir)
+
+
+def test_search_filter_from_dict():
+  assert SearchFilter.from_dict({}) is None
+  search_filter = SearchFilter.from_dict(
+      {"document_ids": ["doc1"],
+       "indexed_after": "2024-01-01T00:00:00+01:00"})
+  assert search_filter.indexed_after == 1704063600
+  assert search_filter.matches({"document_id": "doc1",
+                                "document_time": 1704063600})
+  assert not search_filter.matches({"document_id": "doc1"})
+  for filter_dict in [{"unknown": 1}, {"document_ids": []},
+                      {"document_ids": "doc1"},
+                      {"indexed_before": "yesterday"}]:
+    with pytest.raises(ValidationError):
+      SearchFilter.from_dict(filter_dict)
+
+
+@mock.patch("services.query.vector_store.get_pg_engine")
+@mock.patch("services.query.vector_store.get_connection_string",
+            return_value="postgresql+psycopg2://fake")
+@mock.patch("services.query.vector_store.LLMServicePGVector")
+def test_pg_vector_store_cache(mock_pgvector, mock_connection_string,
+                               mock_get_pg_engine):
+  mock_pgvector.side_effect = lambda **kwargs: mock.Mock()
+  q_engine = QueryEngine(id="pg-engine", name="pg-engine",
+                         vector_store="langchain_pgvector")
+  store_1 = vector_store.PostgresVectorStore(q_engine)
+  store_2 = vector_store.PostgresVectorStore(q_engine)
+
+  # stores for the same engine share one langchain store and the
+  # process-wide connection pool
+  assert store_1.lc_vector_store is store_2.lc_vector_store
+  mock_pgvector.assert_called_once()
+  assert mock_pgvector.call_args.kwargs["connection"] is \
+      mock_get_pg_engine.return_value
+  assert vector_store.pg_vector_store_stats()["cached_stores"] == 1
+
+  # an engine recreated under the same name gets its own store
+  new_q_engine = QueryEngine(id="new-pg-engine", name="pg-engine",
+                             vector_store="langchain_pgvector")
+  store_3 = vector_store.PostgresVectorStore(new_q_engine)
+  assert store_3.lc_vector_store is not store_1.lc_vector_store
+  assert vector_store.pg_vector_store_stats()["cached_stores"] == 2
+
+  store_1.delete()
+  store_1.lc_vector_store.delete_collection.assert_called_once()
+  assert vector_store.pg_vector_store_stats()["cached_stores"] == 1
+  vector_store.evict_pg_vector_store(new_q_engine.id)
+
+
+@mock.patch("services.query.vector_store.sqlalchemy.text",
+            side_effect=lambda sql: sql)
+@mock.patch("services.query.vector_store.get_pg_engine")
+def test_pg_vector_create_ann_index(mock_get_pg_engine, mock_text):
+  collection_uuid = "0f3c5d2e-8a4b-4c6d-9e1f-2a3b4c5d6e7f"
+  lc_store = vector_store.LLMServicePGVector.__new__(
+      vector_store.LLMServicePGVector)
+  lc_store.collection_name = "pg-engine"
+  conn = mock_get_pg_engine.return_value.connect.return_value.__enter__ \
+      .return_value.execution_options.return_value
+  conn.execute.return_value.scalar.return_value = collection_uuid
+  conn.execute.return_value.one.return_value = (5000, 768)
+  index_name = "langchain_pg_embedding_ann_" + collection_uuid.replace("-", "")
+
+  build_params = lc_store.create_ann_index(
+      "hnsw", {"m": "16", "ef_construction": 64})
+  assert build_params == {"m": 16, "ef_construction": 64}
+  mock_get_pg_engine.return_value.connect.return_value.__enter__ \
+      .return_value.execution_options.assert_called_with(
+          isolation_level="AUTOCOMMIT")
+  statements = [call.args[0] for call in conn.execute.call_args_list[2:]]
+  assert statements == [
+    f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}_new",
+    f"CREATE INDEX CONCURRENTLY {index_name}_new ON langchain_pg_embedding "
+    "USING hnsw ((embedding::vector(768)) vector_cosine_ops) "
+    "WITH (m = 16, ef_construction = 64) "
+    f"WHERE collection_id = '{collection_uuid}'",
+    f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}",
+    f"ALTER INDEX {index_name}_new RENAME TO {index_name}"
+  ]
+
+  # ivfflat lists are derived from the row count
+  assert lc_store.create_ann_index("ivfflat", {"lists": None}) == \
+      {"lists": 5}
+
+  # build params are validated before they are written into the DDL
+  conn.execute.reset_mock()
+  for bad_params in [{"m": "16) WITH (m = 4", "ef_construction": 64},
+                     {"m": 16.5, "ef_construction": 64},
+                     {"m": 0, "ef_construction": 64},
+                     {"m": 16}]:
+    with pytest.raises(ValidationError):
+      lc_store.create_ann_index("hnsw", bad_params)
+  assert not any("CREATE INDEX" in call.args[0]
+                 for call in conn.execute.call_args_list)
+
+  # a failed build drops the invalid new index, keeping the old index
+  conn.execute.reset_mock()
+  def execute(sql, *args):
+    if sql.startswith("CREATE INDEX"):
+      raise RuntimeError("build failed")
+    return mock.DEFAULT
+  conn.execute.side_effect = execute
+  with pytest.raises(RuntimeError):
+    lc_store.create_ann_index("hnsw", {"m": 16, "ef_construction": 64})
+  statements = [call.args[0] for call in conn.execute.call_args_list]
+  assert statements[-1] == f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}_new"
+  assert f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}" not in statements
+  conn.execute.side_effect = None
+
+  # malformed collection uuids are rejected
+  conn.execute.return_value.scalar.return_value = \
+      "x'; DROP TABLE langchain_pg_embedding; --"
+  with pytest.raises(ValueError):
+    lc_store.create_ann_index("none", {})
+
+
+@mock.patch("services.query.vector_store.sqlalchemy.text",
+            side_effect=lambda sql: sql)
+@mock.patch("services.query.vector_store.get_pg_engine")
+def test_pg_vector_collection_lookup(mock_get_pg_engine, mock_text):
+  lc_store = vector_store.LLMServicePGVector.__new__(
+      vector_store.LLMServicePGVector)
+  lc_store.collection_name = "pg-engine"
+  conn = mock_get_pg_engine.return_value.begin.return_value.__enter__ \
+      .return_value
+  conn.execute.return_value.fetchall.return_value = []
+
+  # the collection is looked up by name on each search, so a collection
+  # recreated by another process is found
+  for collection_uuid in ["0f3c5d2e-8a4b-4c6d-9e1f-2a3b4c5d6e7f",
+                          "1a2b3c4d-5e6f-4a7b-8c9d-0e1f2a3b4c5d"]:
+    conn.execute.reset_mock()
+    conn.execute.return_value.scalar.return_value = collection_uuid
+    assert lc_store.ann_search_batch([[0.1, 0.2]], 5) == [[]]
+    search_call = conn.execute.call_args_list[-1]
+    assert search_call.args[1]["collection_id"] == collection_uuid
+
+  # deletes look the collection up in the statement
+  conn.execute.reset_mock()
+  lc_store.delete_index_range(10, 12)
+  sql, params = conn.execute.call_args.args
+  assert "collection_id = (SELECT uuid FROM langchain_pg_collection " \
+      "WHERE name = :name)" in sql
+  assert params == {"name": "pg-engine", "custom_ids": ["10", "11"]}
+
+
+@mock.patch("services.query.vector_store.get_pg_vector_store")
+def test_pg_vector_store_ann_params(mock_get_pg_vector_store):
+  lc_store = mock_get_pg_vector_store.return_value
+  lc_store.create_ann_index.return_value = {"lists": 100}
+  q_engine = QueryEngine(id="pg-engine", name="pg-engine",
+                         vector_store="langchain_pgvector",
+                         params={"pg_index_type": "ivfflat"})
+  q_engine.update = mock.Mock()
+  store = vector_store.PostgresVectorStore(q_engine)
+
+  # index build params used are stored with the engine
+  store.deploy()
+  assert lc_store.create_ann_index.call_args.args[0] == "ivfflat"
+  assert q_engine.params["ivfflat_lists"] == 100
+
+  # probes default to sqrt(lists), and can be set per query
+  store.similarity_search(q_engine, [0.1, 0.2])
+  assert lc_store.ann_search.call_args.kwargs["probes"] == 10
+  store.similarity_search(q_engine, [0.1, 0.2], {"probes": 25})
+  assert lc_store.ann_search.call_args.kwargs["probes"] == 25
+
+  # filters are applied by the database search
+  search_filter = SearchFilter(document_ids=["doc1"])
+  store.similarity_search(q_engine, [0.1, 0.2], search_filter=search_filter,
+                          k=10)
+  assert lc_store.ann_search.call_args.args[1] == 10
+  assert lc_store.ann_search.call_args.kwargs["search_filter"] is \
+      search_filter
+
+
+@mock.patch("services.query.vector_store.storage")
+@mock.patch("services.query.vector_store.aiplatform")
+def test_matching_engine_similarity_search(mock_aiplatform,
+                                                 mock_storage):
+  q_engine = QueryEngine(id="me-engine", name="me-engine",
+                         endpoint="endpoint", index_name="index")
+  find_neighbors = \
+      mock_aiplatform.MatchingEngineIndexEndpoint.return_value.find_neighbors
+  find_neighbors.return_value = [
+    [SimpleNamespace(id="3", distance=0.9)],
+    [SimpleNamespace(id="1", distance=0.8),
+     SimpleNamespace(id="2", distance=0.7)]
+  ]
+  vector_store._matching_engine_endpoints.clear()
+  store = vector_store.MatchingEngineVectorStore(q_engine)
+
+  # all queries are searched with one request
+  batch_matches = store.similarity_search_batch(
+      q_engine, [[0.1, 0.2], [0.3, 0.4]], k=2,
+      search_filter=SearchFilter(document_ids=["doc1"]))
+  assert [[match.index for match in matches]
+          for matches in batch_matches] == [[3], [1, 2]]
+  find_neighbors.assert_called_once()
+  call_kwargs = find_neighbors.call_args.kwargs
+  assert call_kwargs["queries"] == [[0.1, 0.2], [0.3, 0.4]]
+  assert call_kwargs["num_neighbors"] == 2
+  assert call_kwargs["filter"][0].allow_tokens == ["doc1"]
+
+  # the endpoint handle is reused by later searches, which don't use GCS
+  store.similarity_search(q_engine, [0.1, 0.2])
+  vector_store.MatchingEngineVectorStore(q_engine).similarity_search(
+      q_engine, [0.1, 0.2])
+  mock_aiplatform.MatchingEngineIndexEndpoint.assert_called_once_with(
+      "endpoint")
+  assert find_neighbors.call_count == 3
+  mock_storage.Client.assert_not_called()
+
+  # the cached handle expires
+  with mock.patch.object(vector_store, "MATCHING_ENGINE_ENDPOINT_CACHE_TTL",
+                         0):
+    vector_store.evict_matching_engine_endpoint("endpoint")
+    store.similarity_search(q_engine, [0.1, 0.2])
+    store.similarity_search(q_engine, [0.1, 0.2])
+  assert mock_aiplatform.MatchingEngineIndexEndpoint.call_count == 3
+
+
+@mock.patch("services.query.vector_store.MAX_NUM_TEXT_CHUNK_PROCESS", 2)
+@mock.patch("services.query.vector_store.storage")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_embeddings)
+def test_matching_engine_index_document(mock_get_embeddings, mock_storage):
+  q_engine = QueryEngine(id="me-engine", name="me-engine")
+  uploaded_records = {}
+  def upload_from_filename(local_path, **kwargs):
+    with open(local_path, "rb") as f:
+      uploaded_records[os.path.basename(local_path)] = \
+          list(fastavro.reader(f))
+  bucket = mock_storage.Client.return_value.bucket.return_value
+  bucket.blob.return_value.upload_from_filename.side_effect = \
+      upload_from_filename
+
+  store = vector_store.MatchingEngineVectorStore(q_engine)
+  metadata = chunk_metadata("c0", "doc1", "gs://bucket/a/doc1.pdf", 100)
+  index_base = store.index_document("doc1.pdf", ["a", "bb", "ccc"], 10,
+                                    [metadata] * 3)
+
+  # each slice of chunks is written to an Avro file and uploaded
+  assert index_base == 13
+  assert sorted(uploaded_records) == ["doc1_10_index.avro",
+                                      "doc1_12_index.avro"]
+  records = uploaded_records["doc1_10_index.avro"] + \
+      uploaded_records["doc1_12_index.avro"]
+  assert [record["id"] for record in records] == ["10", "11", "12"]
+  assert records[2]["embedding"] == [3.0, 1.0, 0.0]
+  assert records[0]["restricts"][0] == \
+      {"namespace": "document_id", "allow": ["doc1"], "deny": None}
+  assert records[0]["numeric_restricts"][0]["value_int"] == 100
+
+
+
+def fake_failed_embeddings(text_chunks, embedding_type=None):
+  """ fake embeddings, failing chunks with text "fail" """
+  is_successful = [text != "fail" for text in text_chunks]
+  embeddings = np.array([[len(text), 1.0, 0.0] for text in text_chunks
+                         if text != "fail"], dtype=np.float32)
+  return is_successful, embeddings
+
+
+@mock.patch("services.query.vector_store.create_bucket")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_failed_embeddings)
+def test_local_vector_store_embeddings_failed(mock_get_embeddings,
+                                              mock_create_bucket, tmp_path):
+  q_engine = QueryEngine(id="failed-engine", name="failed-engine")
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         str(tmp_path)):
+    store = LocalVectorStore(q_engine)
+    store._storage_client = mock.Mock()
+    store.init_index()
+    index_base = store.index_document("doc1", ["a"], 0)
+
+    # a document is not partially indexed
+    with pytest.raises(EmbeddingsFailedException):
+      store.index_document("doc2", ["bb", "fail"], index_base)
+    with pytest.raises(EmbeddingsFailedException):
+      store.index_document("doc3", ["fail"], index_base + 2)
+    assert store.count == 1
+    ids = np.fromfile(os.path.join(store.index_dir, store.IDS_FILE),
+                      dtype=np.int64)
+    assert ids.tolist() == [0]
+
+
+@mock.patch("services.query.vector_store.create_bucket")
+def test_local_vector_store_remove_rows_empty(mock_create_bucket, tmp_path):
+  q_engine = QueryEngine(id="empty-engine", name="empty-engine")
+  with mock.patch.object(vector_store, "LOCAL_VECTOR_STORE_PATH",
+                         str(tmp_path)):
+    store = LocalVectorStore(q_engine)
+    store._storage_client = mock.Mock()
+    store.init_index()
+    # removing a document from an index without rows is a no-op
+    store.remove_index_range(0, 2)
+    store._remove_rows()
+    assert store.count == 0
+    assert store.removed_ranges == []
+
+
+@mock.patch("services.query.vector_store.MAX_NUM_TEXT_CHUNK_PROCESS", 2)
+@mock.patch("services.query.vector_store.storage")
+@mock.patch("services.query.vector_store.embeddings.get_embeddings",
+            side_effect=fake_failed_embeddings)
+def test_matching_engine_index_document_embeddings_failed(mock_get_embeddings,
+                                                          mock_storage):
+  q_engine = QueryEngine(id="me-engine", name="me-engine")
+  bucket = mock_storage.Client.return_value.bucket.return_value
+
+  store = vector_store.MatchingEngineVectorStore(q_engine)
+  with pytest.raises(EmbeddingsFailedException):
+    store.index_document("doc1.pdf", ["a", "bb", "fail"], 10)
+
+  # the slice uploaded before the failure is removed
+  bucket.blob.return_value.upload_from_filename.assert_called_once()
+  bucket.blob.return_value.delete.assert_called_once()
@@ -26,7 +26,8 @@ from google.api_core.client_options import ClientOptions
 from google.api_core.operation import Operation
 from google.cloud import discoveryengine_v1alpha as discoveryengine
 from config import PROJECT_ID, DEFAULT_WEB_DEPTH_LIMIT
-from common.models import QueryEngine, QueryDocument, QueryReference
+from common.models import (BaseModel, QueryEngine, QueryDocument,
+                           QueryReference)
 from common.utils.logging_handler import Logger
 from services.query.data_source import DataSourceFile
 from services.query.web_datasource import WebDataSource
@@ -62,6 +63,7 @@ def query_vertex_search(q_engine: QueryEngine,
 
   # create query document and reference models to store results
   query_references = []
+  new_query_documents = []
   n = 0
   for search_result in search_results:
     document_data = \
@@ -83,7 +85,8 @@ def query_vertex_search(q_engine: QueryEngine,
         doc_url=document_data["link"],
         index_file=document_data["link"]
       )
-      query_document.save()
+      query_document.id = QueryDocument.generate_id()
+      new_query_documents.append(query_document)
 
     # create query reference model
     Logger.info(
@@ -97,9 +100,11 @@ def query_vertex_search(q_engine: QueryEngine,
       chunk_id=str(n) # fake chunk id for ux's that dedup on chunk id
     )
     n += 1
-    query_reference.save()
     query_references.append(query_reference)
 
+  # save new document and reference models in batched writes
+  BaseModel.save_many(new_query_documents + query_references)
+
   return query_references
 
 def perform_vertex_search(data_store_id: str,
@@ -251,8 +256,8 @@ def build_vertex_search(q_engine: QueryEngine) -> \
         doc_url=doc.src_url,
         index_file=doc.gcs_path
       )
-      query_document.save()
       doc_models_processed.append(query_document)
+    QueryDocument.save_many(doc_models_processed)
 
   except Exception as e:
     Logger.error(f"Error building vertex search query engine [{str(e)}]")
@@ -520,6 +525,7 @@ def download_web_docs(q_engine: QueryEngine, data_url: str) -> \
   # download web docs to GCS
   Logger.info(f"downloading web docs to bucket [{bucket_name}]")
   with tempfile.TemporaryDirectory() as temp_dir:
-    downloaded_docs = web_data_source.download_documents(data_url, temp_dir)
+    downloaded_docs = list(
+        web_data_source.download_documents(data_url, temp_dir))
   gcs_url = f"gs://{bucket_name}"
   return gcs_url, downloaded_docs
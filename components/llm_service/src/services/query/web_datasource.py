@@ -19,26 +19,33 @@ Web data sources for Query Engines
 from datetime import datetime
 import importlib
 import multiprocessing
+import queue as queue_module
 import re
 import hashlib
 import os
 import sys
 import tempfile
 from pathlib import Path
-from typing import List
+from typing import Generator, List
 from scrapy import signals
 from scrapy.crawler import CrawlerProcess
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import CrawlSpider, Rule, Spider
 from scrapy.http import Response
 from google.cloud import storage
-from config import DEFAULT_WEB_DEPTH_LIMIT, PROJECT_ID
+from config import (DEFAULT_WEB_DEPTH_LIMIT, PROJECT_ID,
+                    WEB_CRAWL_CONCURRENT_REQUESTS,
+                    WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN,
+                    WEB_CRAWL_AUTOTHROTTLE,
+                    WEB_CRAWL_AUTOTHROTTLE_TARGET_CONCURRENCY,
+                    WEB_CRAWL_HTTPCACHE_DIR,
+                    WEB_CRAWL_HTTPCACHE_EXPIRATION_SECS,
+                    WEB_CRAWL_UPLOAD_WORKERS, PDF_EXTRACT_WORKERS)
 from common.utils.logging_handler import Logger
 from services.query.data_source import DataSource, DataSourceFile
-from utils.gcs_helper import create_bucket, upload_to_gcs
-from utils.html_helper import (html_trim_tags,
-                               html_to_text,
-                               html_to_sentence_list)
+from utils.gcs_helper import (create_bucket, get_storage_client,
+                              upload_to_gcs)
+from utils.html_helper import HtmlExtract, extract_html
 
 Logger = Logger.get_logger(__file__)
 
@@ -88,8 +95,12 @@ class WebDataSourceParser:
     self.crawled_urls.append(response.url)
 
     # Check if the content type is HTML
+    html_extract = None
     if "text/html" in content_type:
-      file_content = html_trim_tags(response.text)
+      # the page is parsed once: the trimmed html is saved, and its text
+      # and structure are cached next to it for indexing
+      html_extract = extract_html(response.text)
+      file_content = html_extract.html
     elif "application/pdf" in content_type:
       file_content = response.body
     else:
@@ -101,6 +112,10 @@ class WebDataSourceParser:
       }
 
     file_name = sanitize_url(response.url)
+    if self.storage_client and self.bucket_name \
+        and Path(file_name).suffix == ".htm":
+      # rename .htm files to .html for upload to GCS
+      file_name = Path(file_name).stem + ".html"
     item = {
       "url": response.url,
       "filename": file_name,
@@ -110,23 +125,100 @@ class WebDataSourceParser:
       "content": file_content
     }
     saved_path = save_content(self.filepath, file_name, file_content)
-    if self.storage_client and self.bucket_name:
-      # rename .htm files to .html for upload to GCS
-      file_extension = Path(file_name).suffix
-      if file_extension == ".htm":
-        new_filename = Path(file_name).stem + ".html"
-        new_filepath = str(Path.joinpath(
-          Path(saved_path).parent,
-          new_filename))
-        os.rename(saved_path, new_filepath)
-        saved_path = new_filepath
-        item["filename"] = new_filename
-      gcs_path = upload_to_gcs(self.storage_client, self.bucket_name,
-                               saved_path)
-      item.update({"gcs_path": gcs_path})
+    if html_extract is not None:
+      html_extract.save(saved_path)
+    # saved files are uploaded to GCS by GcsUploadPipeline
     return item
 
 
+class GcsUploadPipeline:
+  """
+  Scrapy item pipeline that uploads saved files to the GCS bucket of the
+  spider's parser. Uploads run in a thread pool off the Twisted reactor,
+  so the crawl continues while pages upload, and items are passed on when
+  their upload completes.
+  """
+
+  def __init__(self, max_workers: int = WEB_CRAWL_UPLOAD_WORKERS):
+    self.max_workers = max_workers
+    self.thread_pool = None
+
+  @classmethod
+  def from_crawler(cls, crawler):
+    return cls(crawler.settings.getint("GCS_UPLOAD_WORKERS",
+                                       WEB_CRAWL_UPLOAD_WORKERS))
+
+  def open_spider(self, spider):
+    # pylint: disable=import-outside-toplevel
+    from twisted.python.threadpool import ThreadPool
+    self.thread_pool = ThreadPool(maxthreads=self.max_workers,
+                                  name="gcs-upload")
+    self.thread_pool.start()
+
+  def close_spider(self, spider):
+    self.thread_pool.stop()
+
+  def process_item(self, item, spider):
+    parser = spider.parser
+    if item.get("content") is None \
+        or not (parser.storage_client and parser.bucket_name):
+      return item
+
+    # imported here, as scrapy installs the reactor when the crawl starts
+    # pylint: disable=import-outside-toplevel
+    from twisted.internet import reactor
+    from twisted.internet.threads import deferToThreadPool
+    saved_path = os.path.join(item["filepath"], item["filename"])
+    deferred = deferToThreadPool(reactor, self.thread_pool, upload_to_gcs,
+                                 parser.storage_client, parser.bucket_name,
+                                 saved_path)
+
+    def uploaded(gcs_path):
+      item["gcs_path"] = gcs_path
+      return item
+
+    def upload_failed(failure):
+      Logger.error(f"error uploading {saved_path} to GCS: {failure.value}")
+      return item
+
+    deferred.addCallbacks(uploaded, upload_failed)
+    return deferred
+
+
+def crawler_settings(depth_limit: int) -> dict:
+  """
+  Scrapy settings of a crawl. Requests run concurrently up to
+  WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN per domain, with AutoThrottle
+  adjusting the delay between requests to each domain to its latency.
+  """
+  settings = {
+    "ROBOTSTXT_OBEY": False,
+    "DEPTH_LIMIT": depth_limit,
+    "LOG_LEVEL": "INFO",
+    "CONCURRENT_REQUESTS": WEB_CRAWL_CONCURRENT_REQUESTS,
+    "CONCURRENT_REQUESTS_PER_DOMAIN":
+        WEB_CRAWL_CONCURRENT_REQUESTS_PER_DOMAIN,
+    # threads resolving DNS, as crawls may span many hosts
+    "REACTOR_THREADPOOL_MAXSIZE": 20,
+    "AUTOTHROTTLE_ENABLED": WEB_CRAWL_AUTOTHROTTLE,
+    "AUTOTHROTTLE_START_DELAY": 0.5,
+    "AUTOTHROTTLE_MAX_DELAY": 10.0,
+    "AUTOTHROTTLE_TARGET_CONCURRENCY":
+        WEB_CRAWL_AUTOTHROTTLE_TARGET_CONCURRENCY,
+    "ITEM_PIPELINES": {
+      "services.query.web_datasource.GcsUploadPipeline": 300
+    },
+    "GCS_UPLOAD_WORKERS": WEB_CRAWL_UPLOAD_WORKERS
+  }
+  if WEB_CRAWL_HTTPCACHE_DIR:
+    settings.update({
+      "HTTPCACHE_ENABLED": True,
+      "HTTPCACHE_DIR": WEB_CRAWL_HTTPCACHE_DIR,
+      "HTTPCACHE_EXPIRATION_SECS": WEB_CRAWL_HTTPCACHE_EXPIRATION_SECS
+    })
+  return settings
+
+
 class WebDataSourcePageSpider(Spider):
   """Scrapy spider to download individual webpages."""
   name = "web_data_source_page_spider"
@@ -203,7 +295,8 @@ class WebDataSource(DataSource):
   def __init__(self,
                storage_client,
                bucket_name=None,
-               depth_limit=DEFAULT_WEB_DEPTH_LIMIT):
+               depth_limit=DEFAULT_WEB_DEPTH_LIMIT,
+               results_queue=None):
     """
     Initialize the WebDataSource.
 
@@ -213,12 +306,20 @@ class WebDataSource(DataSource):
                          If None files will not be saved.
       depth_limit (int): depth limit to crawl. 0=don't crawl, just
                          download provided URLs
+      results_queue: multiprocessing.Queue that scraped files are put on
+                     as they are scraped, in the crawler process
     """
     super().__init__(storage_client)
     self.depth_limit = depth_limit
     self.bucket_name = bucket_name
+    self.results_queue = results_queue
     self.doc_data = []
 
+  def __getstate__(self):
+    state = super().__getstate__()
+    state["results_queue"] = None
+    return state
+
   def _item_scraped(self, item, response, spider):
     """Handler for the item_scraped signal."""
     Logger.info(f"Downloaded Response URL: {response.url}")
@@ -233,19 +334,24 @@ class WebDataSource(DataSource):
                                         local_path=filepath)
       if "gcs_path" in item:
         data_source_file.gcs_path = item["gcs_path"]
-      self.doc_data.append(data_source_file)
+      if self.results_queue is not None:
+        self.results_queue.put(data_source_file)
+      else:
+        self.doc_data.append(data_source_file)
 
   def download_documents(self, doc_url: str, temp_dir: str) -> \
-        List[DataSourceFile]:
+        Generator[DataSourceFile, None, None]:
     """
-    Download files from doc_url source to a local tmp directory
+    Download files from doc_url source to a local tmp directory. Files are
+    yielded as they are scraped, so they can be processed while the crawl
+    continues.
 
     Args:
         doc_url: url pointing to container of documents to be indexed
         temp_dir: Path to temporary directory to download files to
 
-    Returns:
-        list of DataSourceFile's
+    Yields:
+        DataSourceFile of each scraped file
     """
     # The scraped files won't be uploaded to GCS if the bucket_name is not set
     if self.bucket_name is None:
@@ -270,20 +376,52 @@ class WebDataSource(DataSource):
                     self.depth_limit, self.bucket_name)
     p = multiprocessing.Process(target=run_crawler, args=process_args)
     p.start()
-    p.join()
-    self.doc_data = queue.get()
+    self.doc_data = []
+    try:
+      for data_source_file in crawler_results(queue, p):
+        self.doc_data.append(data_source_file)
+        yield data_source_file
+    finally:
+      if p.is_alive():
+        p.terminate()
+      p.join()
 
     Logger.info(f"Scraped {len(self.doc_data)} links")
-    return self.doc_data
-
-  @classmethod
-  def text_to_sentence_list(cls, text: str) -> List[str]:
-    return html_to_sentence_list(text)
 
-  @classmethod
-  def clean_text(cls, text: str) -> List[str]:
-    html_text = html_to_text(text)
-    return super().clean_text(html_text)
+  @staticmethod
+  def read_doc(doc_name: str, doc_filepath: str,
+               pdf_extract_workers: int = PDF_EXTRACT_WORKERS) -> List[str]:
+    """
+    Read document and return content as a list of strings. Web pages are
+    read as the text of their extract cached when they were downloaded.
+    """
+    doc_extension = doc_name.split(".")[-1].lower()
+    if doc_extension not in ["html", "htm"]:
+      return DataSource.read_doc(doc_name, doc_filepath, pdf_extract_workers)
+
+    html_extract = HtmlExtract.load(doc_filepath)
+    if html_extract is None:
+      with open(doc_filepath, "r", encoding="utf-8") as f:
+        html_extract = extract_html(f.read())
+    return [html_extract.text]
+
+def crawler_results(queue, process: multiprocessing.Process) -> \
+    Generator[DataSourceFile, None, None]:
+  """
+  Get results from a crawler process as they are put on queue, until the
+  crawler puts None at the end of the crawl or the process exits.
+  """
+  while True:
+    try:
+      data_source_file = queue.get(timeout=1)
+    except queue_module.Empty:
+      if not process.is_alive():
+        Logger.error(f"crawler process exited with code {process.exitcode}")
+        return
+      continue
+    if data_source_file is None:
+      return
+    yield data_source_file
 
 def run_crawler(queue,
                 doc_url,
@@ -293,10 +431,11 @@ def run_crawler(queue,
                 bucket_name):
   """
   Method to run scrapy crawler in a subprocess.  Results will be put into
-  the provided multiprocess.queue.
+  the provided multiprocess.queue as they are scraped, followed by None at
+  the end of the crawl.
 
   Args:
-    queue: multiprocess.Queue for crawler results (list of DataSourceFile)
+    queue: multiprocess.Queue for crawler results (DataSourceFiles)
     doc_url: url to download
     spider_class_name: name of spider class to use for scrapy
     temp_dir: directory to download files
@@ -309,17 +448,12 @@ def run_crawler(queue,
   spider_class = getattr(module, spider_class_name)
 
   # create datasource class
-  storage_client = storage.Client()
-  data_source = WebDataSource(storage_client, bucket_name, depth_limit)
+  storage_client = get_storage_client()
+  data_source = WebDataSource(storage_client, bucket_name, depth_limit,
+                              results_queue=queue)
 
-  # define Scrapy settings
-  settings = {
-    "ROBOTSTXT_OBEY": False,
-    "DEPTH_LIMIT": depth_limit,
-    "LOG_LEVEL": "INFO"
-  }
   # create the Scrapy crawler process
-  process = CrawlerProcess(settings=settings)
+  process = CrawlerProcess(settings=crawler_settings(depth_limit))
   crawler = process.create_crawler(spider_class)
 
   # Connect the item_scraped signal to the handler
@@ -332,10 +466,11 @@ def run_crawler(queue,
                 storage_client=storage_client,
                 bucket_name=bucket_name,
                 filepath=temp_dir)
-  process.start()
-
-  # put results on queue
-  queue.put(data_source.doc_data)
+  try:
+    process.start()
+  finally:
+    # mark the end of results
+    queue.put(None)
 
 
 def main():
@@ -350,10 +485,10 @@ def main():
                                  bucket_name=bucket_name,
                                  depth_limit=depth)
   temp_dir = tempfile.mkdtemp()
-  doc_data = web_datasource.download_documents(url, temp_dir)
+  doc_data = list(web_datasource.download_documents(url, temp_dir))
   time_elapsed = datetime.now() - start_time
   Logger.info(f"Time elapsed (hh:mm:ss.ms) {time_elapsed}")
-  crawled_urls = [d[1] for d in doc_data]
+  crawled_urls = [d.src_url for d in doc_data]
   print(f"Crawled URLS = {crawled_urls}")
   print(f"*** Local pages stored at [{temp_dir}]")
 
@@ -15,9 +15,14 @@
 """ Unit tests for web data sources for Query Engines """
 
 import unittest
+import multiprocessing
 import os
+from unittest import mock
 from scrapy.http import TextResponse, Request
-from services.query.web_datasource import WebDataSource, WebDataSourceSpider
+from services.query.data_source import DataSourceFile
+from services.query.web_datasource import (WebDataSource, WebDataSourceSpider,
+                                           GcsUploadPipeline, crawler_results,
+                                           crawler_settings)
 
 class TestWebDataSource(unittest.TestCase):
   """ Unit tests for web data sources for Query Engines """
@@ -88,6 +93,56 @@ class TestWebDataSource(unittest.TestCase):
       content = f.read()
       self.assertEqual(content, self.cleaned_content)
 
+    # the page text is cached with the page, and read for indexing
+    self.assertTrue(os.path.exists(filename + ".extract.json"))
+    doc_text_list = WebDataSource.read_doc("example.com.html", filename)
+    self.assertEqual([text.strip() for text in doc_text_list],
+                     ["Mocked Response"])
+
+  def test_crawler_settings(self):
+    settings = crawler_settings(2)
+    self.assertEqual(settings["DEPTH_LIMIT"], 2)
+    self.assertTrue(settings["AUTOTHROTTLE_ENABLED"])
+    self.assertIn("services.query.web_datasource.GcsUploadPipeline",
+                  settings["ITEM_PIPELINES"])
+    self.assertNotIn("HTTPCACHE_ENABLED", settings)
+    with mock.patch("services.query.web_datasource.WEB_CRAWL_HTTPCACHE_DIR",
+                    "/tmp/httpcache"):
+      settings = crawler_settings(2)
+    self.assertTrue(settings["HTTPCACHE_ENABLED"])
+    self.assertEqual(settings["HTTPCACHE_DIR"], "/tmp/httpcache")
+
+  def test_upload_pipeline_without_bucket(self):
+    # items are passed on without upload when there is no bucket
+    spider = WebDataSourceSpider(start_urls=self.urls, filepath=self.filepath)
+    item = {"content": "<html></html>", "filepath": self.filepath,
+            "filename": "example.com.html"}
+    pipeline = GcsUploadPipeline(max_workers=2)
+    self.assertIs(pipeline.process_item(item, spider), item)
+
+  def test_crawler_results(self):
+    # scraped files are put on the queue one at a time, then None
+    # pylint: disable=protected-access
+    results_queue = multiprocessing.Queue()
+    data_source = WebDataSource(None, results_queue=results_queue)
+    item = {"content_type": "text/html", "content": "<html></html>",
+            "url": self.urls[0], "filepath": self.filepath,
+            "filename": "example.com.html", "gcs_path": "gs://bucket/x.html"}
+    data_source._item_scraped(item, mock.Mock(url=self.urls[0]), None)
+    data_source._item_scraped(dict(item, content=None),
+                              mock.Mock(url=self.urls[0]), None)
+    results_queue.put(None)
+    process = mock.Mock(spec=multiprocessing.Process)
+    process.is_alive.return_value = True
+    results = list(crawler_results(results_queue, process))
+    self.assertEqual(len(results), 1)
+    self.assertIsInstance(results[0], DataSourceFile)
+    self.assertEqual(results[0].gcs_path, "gs://bucket/x.html")
+
+    # results end if the crawler process exits without marking the end
+    process.is_alive.return_value = False
+    self.assertEqual(list(crawler_results(results_queue, process)), [])
+
   def tearDown(self):
     # Cleanup: Remove the test_downloads directory and its contents
     for filename in os.listdir(self.filepath):
@@ -0,0 +1,159 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Process-wide registry of Vertex model clients.
+
+Creating a Vertex model handle (e.g. TextEmbeddingModel.from_pretrained)
+resolves the model resource and builds a client, so handles are created once
+per process and shared across requests and threads.
+"""
+# pylint: disable=broad-exception-caught
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+from vertexai.preview.language_models import (ChatModel, TextGenerationModel,
+                                              TextEmbeddingModel)
+from vertexai.preview.generative_models import GenerativeModel
+from common.utils.logging_handler import Logger
+from config import (get_model_config, get_provider_models,
+                    get_provider_embedding_types,
+                    PROVIDER_VERTEX, KEY_MODEL_NAME, KEY_IS_CHAT)
+
+Logger = Logger.get_logger(__file__)
+
+MODEL_TYPE_GENERATIVE = "generative"
+MODEL_TYPE_CHAT = "chat"
+MODEL_TYPE_TEXT = "text"
+MODEL_TYPE_EMBEDDING = "embedding"
+
+
+class ModelRegistry():
+  """
+  Thread-safe cache of model clients keyed by model type, model name and
+  client construction params. Records the time taken to create each client.
+  """
+
+  def __init__(self):
+    self._models = {}
+    self._creation_times = {}
+    self._lock = threading.Lock()
+    self._key_locks = {}
+
+  @classmethod
+  def model_key(cls, model_type: str, model_name: str,
+                params: dict = None) -> Tuple[str, str, str]:
+    params_key = json.dumps(params or {}, sort_keys=True, default=str)
+    return model_type, model_name, params_key
+
+  def get(self, model_type: str, model_name: str,
+          factory: Callable[[], Any], params: dict = None) -> Any:
+    """
+    Return the cached client for a model, creating it with factory on first
+    use. Concurrent first requests for the same model create it only once.
+    """
+    key = self.model_key(model_type, model_name, params)
+    model = self._models.get(key)
+    if model is not None:
+      return model
+
+    with self._lock:
+      key_lock = self._key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+      model = self._models.get(key)
+      if model is None:
+        start_time = time.time()
+        model = factory()
+        creation_time = time.time() - start_time
+        Logger.info(f"created {model_type} model client for {model_name} "
+                    f"in {creation_time:.3f} seconds")
+        with self._lock:
+          self._models[key] = model
+          self._creation_times[key] = creation_time
+    return model
+
+  def clear(self) -> None:
+    with self._lock:
+      self._models.clear()
+      self._creation_times.clear()
+      self._key_locks.clear()
+
+  def stats(self) -> Dict[str, float]:
+    """ map of "model_type:model_name" to client creation time in seconds """
+    with self._lock:
+      return {
+        f"{model_type}:{model_name}": creation_time
+        for (model_type, model_name, _), creation_time
+        in self._creation_times.items()
+      }
+
+_model_registry = ModelRegistry()
+
+def get_model_registry() -> ModelRegistry:
+  return _model_registry
+
+def get_generative_model(model_name: str) -> GenerativeModel:
+  """ get the shared GenerativeModel (gemini) client """
+  return _model_registry.get(MODEL_TYPE_GENERATIVE, model_name,
+                             lambda: GenerativeModel(model_name))
+
+def get_chat_model(model_name: str) -> ChatModel:
+  """ get the shared ChatModel (palm2 chat) client """
+  return _model_registry.get(MODEL_TYPE_CHAT, model_name,
+                             lambda: ChatModel.from_pretrained(model_name))
+
+def get_text_model(model_name: str) -> TextGenerationModel:
+  """ get the shared TextGenerationModel client """
+  return _model_registry.get(
+      MODEL_TYPE_TEXT, model_name,
+      lambda: TextGenerationModel.from_pretrained(model_name))
+
+def get_embedding_model(model_name: str) -> TextEmbeddingModel:
+  """ get the shared TextEmbeddingModel client """
+  return _model_registry.get(
+      MODEL_TYPE_EMBEDDING, model_name,
+      lambda: TextEmbeddingModel.from_pretrained(model_name))
+
+def get_llm_model(model_name: str, is_chat: bool) -> Any:
+  """ get the shared client for a Vertex LLM """
+  if not is_chat:
+    return get_text_model(model_name)
+  # gemini uses the new "GenerativeModel" class
+  if "gemini" in model_name:
+    return get_generative_model(model_name)
+  return get_chat_model(model_name)
+
+def warm_up_models() -> Dict[str, float]:
+  """
+  Create clients for all enabled Vertex LLMs and embedding models, so the
+  first requests do not pay for client creation. Failures are logged and
+  the client is created on first use instead.
+
+  Returns:
+    dict of client creation times, as returned by ModelRegistry.stats
+  """
+  model_config = get_model_config()
+  for llm_type in get_provider_models(PROVIDER_VERTEX):
+    if not model_config.is_model_enabled(llm_type):
+      continue
+    model_name = model_config.get_config_value(llm_type, KEY_MODEL_NAME)
+    is_chat = model_config.get_config_value(llm_type, KEY_IS_CHAT, False)
+    try:
+      if llm_type in get_provider_embedding_types(PROVIDER_VERTEX):
+        get_embedding_model(model_name)
+      else:
+        get_llm_model(model_name, is_chat)
+    except Exception as e:
+      Logger.warning(f"failed to warm up model client for {llm_type}: {e}")
+  return _model_registry.stats()
@@ -0,0 +1,63 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for the Vertex model client registry
+"""
+# pylint: disable=wrong-import-position
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from services.vertex_models import (ModelRegistry, get_llm_model,
+                                    get_model_registry)
+
+
+def test_model_registry_creates_model_once():
+  registry = ModelRegistry()
+  factory = mock.Mock(return_value=object())
+
+  with ThreadPoolExecutor(max_workers=8) as executor:
+    models = list(executor.map(
+        lambda _: registry.get("chat", "chat-bison", factory), range(32)))
+
+  assert factory.call_count == 1
+  assert all(model is models[0] for model in models)
+  assert list(registry.stats().keys()) == ["chat:chat-bison"]
+
+  # different params create a different client
+  registry.get("chat", "chat-bison", factory, params={"temperature": 0.5})
+  assert factory.call_count == 2
+
+  registry.clear()
+  registry.get("chat", "chat-bison", factory)
+  assert factory.call_count == 3
+
+
+@mock.patch("services.vertex_models.GenerativeModel")
+@mock.patch("services.vertex_models.ChatModel")
+@mock.patch("services.vertex_models.TextGenerationModel")
+def test_get_llm_model(mock_text_model, mock_chat_model, mock_generative_model):
+  get_model_registry().clear()
+  assert get_llm_model("gemini-pro", True) is get_llm_model("gemini-pro", True)
+  mock_generative_model.assert_called_once_with("gemini-pro")
+
+  get_llm_model("chat-bison@002", True)
+  get_llm_model("chat-bison@002", True)
+  mock_chat_model.from_pretrained.assert_called_once_with("chat-bison@002")
+
+  get_llm_model("text-bison@002", False)
+  mock_text_model.from_pretrained.assert_called_once_with("text-bison@002")
+  get_model_registry().clear()
@@ -0,0 +1,161 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark query engine build throughput (docs/sec) of the pipelined
+process_documents against a serial parse-then-index loop, on a synthetic
+corpus of text documents.
+
+Embedding generation is simulated with a fixed latency per embedding
+request, and Firestore writes are stubbed out, so the benchmark measures
+document parsing and how well it overlaps with indexing.
+
+Run from the llm_service/src directory:
+
+  PYTHONPATH=.:../../common/src python testing/benchmark_engine_build.py
+"""
+# pylint: disable=wrong-import-position,unused-argument
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import List
+from unittest import mock
+
+os.environ.setdefault("PROJECT_ID", "fake-project")
+
+from common.models import QueryEngine
+from services.query import query_service
+from services.query.data_source import (DataSource, DataSourceFile,
+                                        parse_document)
+from services.query.vector_store import VectorStore
+
+WORDS = ["tax", "form", "income", "return", "deduction", "credit", "filing",
+         "status", "dependent", "refund", "payment", "schedule", "wages"]
+
+# embedding requests are batched by 5 text chunks
+EMBEDDING_BATCH_SIZE = 5
+
+
+class LocalDataSource(DataSource):
+  """ data source reading an already downloaded local corpus """
+  def __init__(self, corpus_dir: str):
+    super().__init__(None)
+    self.corpus_dir = corpus_dir
+
+  def download_documents(self, doc_url: str, temp_dir: str) -> \
+      List[DataSourceFile]:
+    files = []
+    for file_name in sorted(os.listdir(self.corpus_dir)):
+      local_path = os.path.join(temp_dir, file_name)
+      shutil.copy(os.path.join(self.corpus_dir, file_name), local_path)
+      files.append(DataSourceFile(doc_name=file_name,
+                                  src_url=f"gs://benchmark/{file_name}",
+                                  local_path=local_path))
+    return files
+
+
+class SimulatedVectorStore(VectorStore):
+  """ vector store simulating embedding request latency """
+  def __init__(self, embedding_latency: float):
+    self.embedding_latency = embedding_latency
+
+  def init_index(self):
+    pass
+
+  def index_document(self, doc_name: str, text_chunks: List[str],
+                     index_base: int, chunk_metadata: List[dict] = None) -> int:
+    num_requests = -(-len(text_chunks) // EMBEDDING_BATCH_SIZE)
+    time.sleep(num_requests * self.embedding_latency)
+    return index_base + len(text_chunks)
+
+  def deploy(self):
+    pass
+
+  def similarity_search(self, q_engine, query_embedding, search_params=None,
+                        search_filter=None, k=None):
+    return []
+
+
+def write_corpus(corpus_dir: str, num_docs: int, sentences_per_doc: int):
+  rng = random.Random(0)
+  for d in range(num_docs):
+    sentences = [
+      " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).title()
+      + "."
+      for _ in range(sentences_per_doc)
+    ]
+    with open(os.path.join(corpus_dir, f"doc_{d}.txt"), "w",
+              encoding="utf-8") as f:
+      f.write("\n".join(sentences))
+
+
+def serial_build(data_source, vector_store, q_engine):
+  """ parse then index each document in turn, as before pipelining """
+  with tempfile.TemporaryDirectory() as temp_dir:
+    index_base = 0
+    for data_source_file in data_source.download_documents(None, temp_dir):
+      parsed_doc = parse_document(data_source, data_source_file)
+      query_doc, doc_chunks = query_service.create_document_models(
+          q_engine, parsed_doc, index_base)
+      query_service.index_document_models(vector_store, parsed_doc,
+                                          query_doc, doc_chunks)
+      index_base += len(doc_chunks)
+
+
+def pipelined_build(data_source, vector_store, q_engine):
+  with mock.patch.object(query_service, "datasource_from_url",
+                         return_value=data_source), \
+       mock.patch.object(query_service, "save_lexical_index"):
+    query_service.process_documents("gs://benchmark", vector_store,
+                                    q_engine, None)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--docs", type=int, default=64)
+  parser.add_argument("--sentences-per-doc", type=int, default=200)
+  parser.add_argument("--embedding-latency", type=float, default=0.05,
+                      help="simulated seconds per embedding request")
+  args = parser.parse_args()
+
+  q_engine = QueryEngine(name="benchmark", id="benchmark")
+  vector_store = SimulatedVectorStore(args.embedding_latency)
+  corpus_dir = tempfile.mkdtemp()
+  try:
+    write_corpus(corpus_dir, args.docs, args.sentences_per_doc)
+    data_source = LocalDataSource(corpus_dir)
+    print(f"{args.docs} docs, {args.sentences_per_doc} sentences per doc, "
+          f"{query_service.QUERY_ENGINE_PARSE_WORKERS} parse workers, "
+          f"{query_service.QUERY_ENGINE_INDEX_WORKERS} index workers")
+
+    # ids are generated client side and models are not saved
+    with mock.patch("common.models.BaseModel.save_many"), \
+         mock.patch("common.models.BaseModel.generate_id",
+                    return_value="benchmark"):
+      for label, build in [("serial", serial_build),
+                           ("pipelined", pipelined_build)]:
+        start = time.perf_counter()
+        build(data_source, vector_store, q_engine)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>10}: {elapsed:8.2f} s  "
+              f"{args.docs / elapsed:8.2f} docs/sec")
+  finally:
+    shutil.rmtree(corpus_dir)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,108 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark HTML page extraction throughput (pages/sec) of the web ingest
+path.
+
+Compares a single extract_html pass per page, with the lxml and
+html.parser backends, against the previous path, which parsed a page
+with html.parser to trim tags when crawled, then again to get its text
+when chunked, and again to split it into sentences.
+
+The corpus is a directory of saved .html pages, or generated pages if no
+corpus is given. Run from the llm_service/src directory:
+
+  PYTHONPATH=.:../../common/src \
+      python testing/benchmark_html_extract.py --corpus <dir>
+"""
+import argparse
+import glob
+import os
+import random
+import time
+from bs4 import BeautifulSoup
+from w3lib.html import replace_escape_chars
+from utils.html_helper import TAGS_TO_REMOVE, _clean_soup, extract_html
+
+WORDS = ("department motor vehicles license registration renewal online "
+         "appointment office hours fees forms documents residents").split()
+
+
+def generated_page(rng: random.Random) -> str:
+  sections = []
+  for i in range(20):
+    paragraphs = "".join(
+        f"<p class=\"text\" style=\"margin: 0\">"
+        f"{' '.join(rng.choices(WORDS, k=40))}. "
+        f"<a href=\"/page/{rng.randint(0, 1000)}\" class=\"link\">more</a>"
+        f"</p>" for _ in range(5))
+    sections.append(f"<section id=\"s{i}\"><h2>Section {i}</h2>"
+                    f"{paragraphs}</section>")
+  return ("<html><head><title>Page</title>"
+          "<script>var data = {};</script><style>p { color: navy; }</style>"
+          "</head><body><nav><a href=\"/\">Home</a></nav>"
+          f"<div class=\"content\">{''.join(sections)}</div>"
+          "<footer>Footer</footer></body></html>")
+
+
+def old_clean_soup(html_content: str) -> BeautifulSoup:
+  soup = BeautifulSoup(html_content, "html.parser")
+  _clean_soup(soup, TAGS_TO_REMOVE)
+  return soup
+
+
+def old_extract(html_content: str) -> str:
+  """ previous path: trim when crawled, then get text twice to index """
+  trimmed_html = replace_escape_chars(str(old_clean_soup(html_content)))
+  text = replace_escape_chars(
+      old_clean_soup(trimmed_html).get_text(separator=" "))
+  _ = replace_escape_chars(old_clean_soup(trimmed_html).get_text(" "))
+  return text
+
+
+def run(extract, pages: list) -> float:
+  start_time = time.monotonic()
+  for page in pages:
+    extract(page)
+  return len(pages) / (time.monotonic() - start_time)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--corpus", help="directory of saved .html pages")
+  parser.add_argument("--num_pages", type=int, default=200)
+  args = parser.parse_args()
+
+  if args.corpus:
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.corpus, "*.htm*"))):
+      with open(path, "r", encoding="utf-8", errors="replace") as f:
+        pages.append(f.read())
+  else:
+    rng = random.Random(0)
+    pages = [generated_page(rng) for _ in range(args.num_pages)]
+
+  print(f"{len(pages)} pages, "
+        f"{sum(len(page) for page in pages) / len(pages) / 1024:.0f} KB/page")
+  for name, extract in [
+      ("html.parser, 3 parses", old_extract),
+      ("html.parser, 1 parse",
+       lambda page: extract_html(page, parser="html.parser")),
+      ("lxml, 1 parse", extract_html)]:
+    print(f"{name:<24} {run(extract, pages):10.1f} pages/sec")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,126 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark Matching Engine embedding export throughput (vectors/sec) of
+the Avro writer against the JSON lines files previously written, and
+the effect of parallel uploads.
+
+Uploads are simulated with a fixed latency per file plus a transfer time
+per MB, so the benchmark measures serialization and upload overlap.
+
+Run from the llm_service/src directory:
+
+  PYTHONPATH=.:../../common/src python testing/benchmark_me_export.py
+"""
+# pylint: disable=wrong-import-position,unused-argument
+import argparse
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+
+os.environ.setdefault("PROJECT_ID", "fake-project")
+
+from services.query.matching_engine_export import (AvroEmbeddingWriter,
+                                                   EmbeddingFileUploader)
+from services.query.vector_store import (DIMENSIONS,
+                                         MAX_NUM_TEXT_CHUNK_PROCESS,
+                                         MatchingEngineVectorStore)
+
+RESTRICTS = MatchingEngineVectorStore.datapoint_restricts({
+  "document_id": "benchmark-doc",
+  "document_url": "gs://benchmark/docs/benchmark-doc.pdf",
+  "document_time": 1704067200
+})
+
+
+def write_json(path: str, ids: np.ndarray, embeddings: np.ndarray):
+  """ JSON lines as written before Avro export """
+  lines = [
+    json.dumps({"id": str(idx),
+                "embedding": [str(value) for value in embedding],
+                **RESTRICTS}) + "\n"
+    for idx, embedding in zip(ids, embeddings)
+  ]
+  with open(path, "w", encoding="utf-8") as f:
+    f.writelines(lines)
+
+
+def write_avro(path: str, ids: np.ndarray, embeddings: np.ndarray):
+  with AvroEmbeddingWriter(path) as writer:
+    writer.write_batch(ids, embeddings, [RESTRICTS] * len(ids))
+
+
+def simulated_bucket(latency: float, mb_per_sec: float) -> mock.Mock:
+  def upload_from_filename(local_path, **kwargs):
+    size_mb = os.path.getsize(local_path) / (1024 * 1024)
+    time.sleep(latency + size_mb / mb_per_sec)
+  bucket = mock.Mock()
+  bucket.blob.return_value.upload_from_filename.side_effect = \
+      upload_from_filename
+  return bucket
+
+
+def run_export(write_file, extension: str, embeddings: np.ndarray,
+               bucket: mock.Mock, upload_workers: int) -> dict:
+  """ write and upload files of MAX_NUM_TEXT_CHUNK_PROCESS vectors """
+  num_vectors = len(embeddings)
+  total_bytes = 0
+  start_time = time.monotonic()
+  with tempfile.TemporaryDirectory() as temp_dir, \
+      EmbeddingFileUploader(bucket, max_workers=upload_workers) as uploader:
+    for start in range(0, num_vectors, MAX_NUM_TEXT_CHUNK_PROCESS):
+      end = min(start + MAX_NUM_TEXT_CHUNK_PROCESS, num_vectors)
+      path = os.path.join(temp_dir, f"embeddings_{start}{extension}")
+      write_file(path, np.arange(start, end), embeddings[start:end])
+      total_bytes += os.path.getsize(path)
+      uploader.upload(path)
+    uploader.wait()
+  elapsed_time = time.monotonic() - start_time
+  return {
+    "vectors_per_sec": num_vectors / elapsed_time,
+    "mb": total_bytes / (1024 * 1024)
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--num_vectors", type=int, default=20000)
+  parser.add_argument("--upload_latency", type=float, default=0.1)
+  parser.add_argument("--upload_mb_per_sec", type=float, default=50.0)
+  parser.add_argument("--upload_workers", type=int, default=4)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  embeddings = rng.normal(size=(args.num_vectors, DIMENSIONS)) \
+      .astype(np.float32)
+  bucket = simulated_bucket(args.upload_latency, args.upload_mb_per_sec)
+
+  print(f"{args.num_vectors} vectors of {DIMENSIONS} dimensions, files of "
+        f"{MAX_NUM_TEXT_CHUNK_PROCESS} vectors")
+  for name, write_file, extension, workers in [
+      ("json, serial uploads", write_json, ".json", 1),
+      ("avro, serial uploads", write_avro, ".avro", 1),
+      (f"avro, {args.upload_workers} upload workers", write_avro, ".avro",
+       args.upload_workers)]:
+    result = run_export(write_file, extension, embeddings, bucket, workers)
+    print(f"{name:<28} {result['vectors_per_sec']:10.0f} vectors/sec "
+          f"{result['mb']:8.1f} MB")
+
+
+if __name__ == "__main__":
+  main()
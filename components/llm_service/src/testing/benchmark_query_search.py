@@ -0,0 +1,178 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark Firestore round-trips and latency of query_search reference
+assembly, comparing the legacy per-match lookups, the batched lookups used
+for index-only matches, and matches carrying vector store metadata.
+
+Run against the Firestore emulator from the llm_service/src directory:
+
+  firebase emulators:start --only firestore --project fake-project &
+  FIRESTORE_EMULATOR_HOST=localhost:8080 PROJECT_ID=fake-project \\
+    PYTHONPATH=../../common/src python testing/benchmark_query_search.py
+"""
+# pylint: disable=wrong-import-position
+import argparse
+import os
+import time
+from collections import Counter
+from typing import List
+from unittest import mock
+
+assert os.environ.get("FIRESTORE_EMULATOR_HOST"), \
+    "FIRESTORE_EMULATOR_HOST must be set to run this benchmark"
+
+from google.cloud.firestore_v1.batch import WriteBatch
+from google.cloud.firestore_v1.document import DocumentReference
+from google.cloud.firestore_v1.query import Query
+from common.models import (QueryEngine, QueryDocument, QueryDocumentChunk,
+                           QueryReference)
+from services.query import query_service
+from services.query.vector_store import (NUM_MATCH_RESULTS,
+                                         VectorStoreMatch)
+
+round_trips = Counter()
+
+
+def _count(name, method):
+  def wrapper(*args, **kwargs):
+    round_trips[name] += 1
+    return method(*args, **kwargs)
+  return wrapper
+
+
+def instrument_firestore():
+  """ count the Firestore RPCs issued through the client library """
+  Query.stream = _count("query", Query.stream)
+  DocumentReference.get = _count("get", DocumentReference.get)
+  DocumentReference.set = _count("set", DocumentReference.set)
+  WriteBatch.commit = _count("commit", WriteBatch.commit)
+
+
+def seed_engine(num_docs: int, chunks_per_doc: int) -> QueryEngine:
+  q_engine = QueryEngine(name=f"benchmark-{int(time.time())}",
+                         created_by="benchmark",
+                         query_engine_type="qe_llm_service",
+                         embedding_type="benchmark")
+  q_engine.save()
+  index = 0
+  for d in range(num_docs):
+    query_doc = QueryDocument(query_engine_id=q_engine.id,
+                              query_engine=q_engine.name,
+                              doc_url=f"gs://benchmark/doc_{d}.txt",
+                              index_start=index,
+                              index_end=index + chunks_per_doc)
+    query_doc.save()
+    for _ in range(chunks_per_doc):
+      QueryDocumentChunk(query_engine_id=q_engine.id,
+                         query_document_id=query_doc.id,
+                         index=index,
+                         text=f"chunk {index}",
+                         clean_text=f"chunk {index}").save()
+      index += 1
+  return q_engine
+
+
+def legacy_query_search(q_engine: QueryEngine,
+                        match_indexes: List[int]) -> List[QueryReference]:
+  """ serial lookups as performed by query_search before batching """
+  query_references = []
+  for match in match_indexes:
+    doc_chunk = QueryDocumentChunk.find_by_index(q_engine.id, match)
+    query_doc = QueryDocument.find_by_id(doc_chunk.query_document_id)
+    query_reference = QueryReference(query_engine_id=q_engine.id,
+                                     query_engine=q_engine.name,
+                                     document_id=query_doc.id,
+                                     document_url=query_doc.doc_url,
+                                     chunk_id=doc_chunk.id,
+                                     document_text=doc_chunk.clean_text)
+    query_reference.save()
+    query_references.append(query_reference)
+  return query_references
+
+
+def stubbed_query_search(q_engine: QueryEngine,
+                         matches: List[VectorStoreMatch]) -> \
+                         List[QueryReference]:
+  """ query_search with embeddings and vector store stubbed out """
+  vector_store = mock.Mock()
+  vector_store.similarity_search_batch.return_value = [matches]
+  with mock.patch.object(query_service.embeddings, "get_embeddings",
+                         return_value=([True], [[0.0]])), \
+       mock.patch.object(query_service, "vector_store_from_query_engine",
+                         return_value=vector_store):
+    return query_service.query_search(q_engine, "benchmark prompt")
+
+
+def batched_query_search(q_engine: QueryEngine,
+                         match_indexes: List[int]) -> List[QueryReference]:
+  """ index-only matches, resolved with batched lookups """
+  matches = [VectorStoreMatch(index) for index in match_indexes]
+  return stubbed_query_search(q_engine, matches)
+
+
+def metadata_matches(q_engine: QueryEngine,
+                     match_indexes: List[int]) -> List[VectorStoreMatch]:
+  """ matches carrying chunk metadata, as returned by newer engines """
+  doc_chunks = QueryDocumentChunk.find_by_indexes(q_engine.id, match_indexes)
+  query_docs = QueryDocument.find_by_ids(
+      [doc_chunk.query_document_id for doc_chunk in doc_chunks.values()])
+  return [
+    VectorStoreMatch(index, 1.0, query_service.chunk_reference_metadata(
+        query_docs[doc_chunks[index].query_document_id], doc_chunks[index]))
+    for index in match_indexes
+  ]
+
+
+def run(label, search_fn, q_engine, matches, iterations):
+  round_trips.clear()
+  start = time.perf_counter()
+  for _ in range(iterations):
+    search_fn(q_engine, matches)
+  elapsed_ms = (time.perf_counter() - start) * 1000 / iterations
+  total = sum(round_trips.values()) / iterations
+  detail = {k: v / iterations for k, v in round_trips.items()}
+  print(f"{label:>8}: {elapsed_ms:8.2f} ms/query  "
+        f"{total:5.1f} round-trips/query  {detail}")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--docs", type=int, default=20)
+  parser.add_argument("--chunks-per-doc", type=int, default=10)
+  parser.add_argument("--matches", type=int, default=NUM_MATCH_RESULTS)
+  parser.add_argument("--iterations", type=int, default=20)
+  args = parser.parse_args()
+
+  q_engine = seed_engine(args.docs, args.chunks_per_doc)
+  num_chunks = args.docs * args.chunks_per_doc
+  step = max(1, num_chunks // args.matches)
+  match_indexes = list(range(0, num_chunks, step))[:args.matches]
+  print(f"engine {q_engine.name}: {num_chunks} chunks, "
+        f"{len(match_indexes)} matches per query")
+
+  instrument_firestore()
+  run("legacy", legacy_query_search, q_engine, match_indexes,
+      args.iterations)
+  run("batched", batched_query_search, q_engine, match_indexes,
+      args.iterations)
+  run("metadata", stubbed_query_search, q_engine,
+      metadata_matches(q_engine, match_indexes), args.iterations)
+
+  query_service.delete_engine(q_engine, hard_delete=True)
+
+
+if __name__ == "__main__":
+  main()
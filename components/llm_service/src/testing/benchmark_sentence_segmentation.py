@@ -0,0 +1,117 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark sentence segmentation of document chunks (chunks/sec).
+
+Compares segmenting each document once with split_sentences, and deriving
+chunk windows and chunk sentences from that pass, against the previous
+approach of splitting the document into windows and then running the full
+spacy pipeline again on every chunk.
+
+The corpus is a directory of .txt files, or generated text if no corpus
+is given. Run from the llm_service/src directory:
+
+  PYTHONPATH=.:../../common/src \
+      python testing/benchmark_sentence_segmentation.py --corpus <dir>
+"""
+# pylint: disable=wrong-import-position
+import argparse
+import glob
+import os
+import random
+import time
+
+os.environ.setdefault("PROJECT_ID", "fake-project")
+
+from services.query.data_source import CHUNK_SENTENCE_PADDING
+from utils.text_helper import clean_text, nlp, split_sentences
+
+WORDS = ("the query engine indexes documents from many sources and splits "
+         "each page into overlapping chunks of sentences that are embedded "
+         "for retrieval by users asking questions about policy").split()
+
+
+def generated_corpus(num_docs: int, sentences_per_doc: int) -> list:
+  rng = random.Random(0)
+  docs = []
+  for _ in range(num_docs):
+    sentences = []
+    for _ in range(sentences_per_doc):
+      words = rng.choices(WORDS, k=rng.randint(8, 25))
+      sentences.append(" ".join(words).capitalize() + ".")
+    # a line break every few sentences, as in extracted pages
+    docs.append("\n".join(" ".join(sentences[i:i + 5])
+                          for i in range(0, len(sentences), 5)))
+  return docs
+
+
+def windows(sentences: list) -> list:
+  return [" ".join(sentences[max(0, i - CHUNK_SENTENCE_PADDING):
+                             i + CHUNK_SENTENCE_PADDING + 1])
+          for i in range(len(sentences))]
+
+
+def segment_per_chunk(docs: list) -> int:
+  """ previous approach: window each document, then re-split every chunk """
+  num_chunks = 0
+  for doc_text in docs:
+    sentences = [str(s).strip() for s in nlp(doc_text).sents]
+    text_chunks = windows([s for s in sentences if s])
+    for text in text_chunks:
+      _ = [str(s) for s in nlp(clean_text(text)).sents]
+    num_chunks += len(text_chunks)
+  return num_chunks
+
+
+def segment_once(docs: list, n_process: int) -> int:
+  """ one split_sentences pass over all documents """
+  return sum(len(windows(sentences))
+             for sentences in split_sentences(docs, n_process=n_process))
+
+
+def run(segment, docs: list) -> float:
+  start_time = time.monotonic()
+  num_chunks = segment(docs)
+  return num_chunks / (time.monotonic() - start_time)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--corpus", help="directory of .txt files")
+  parser.add_argument("--num_docs", type=int, default=20)
+  parser.add_argument("--sentences_per_doc", type=int, default=500)
+  parser.add_argument("--n_process", type=int, default=2)
+  args = parser.parse_args()
+
+  if args.corpus:
+    docs = []
+    for path in sorted(glob.glob(os.path.join(args.corpus, "*.txt"))):
+      with open(path, "r", encoding="utf-8") as f:
+        docs.append(f.read())
+  else:
+    docs = generated_corpus(args.num_docs, args.sentences_per_doc)
+
+  print(f"{len(docs)} documents, {sum(len(doc) for doc in docs)} chars, "
+        f"spacy pipeline {nlp.pipe_names}")
+  for name, segment in [
+      ("per chunk", segment_per_chunk),
+      ("single pass", lambda docs: segment_once(docs, 1)),
+      (f"single pass, {args.n_process} processes",
+       lambda docs: segment_once(docs, args.n_process))]:
+    print(f"{name:<28} {run(segment, docs):10.0f} chunks/sec")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,101 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of the NumPy cosine similarity kernel in utils.vector_helper
+against the previous pandas iterrows implementation of get_similarity.
+
+Run from the llm_service/src directory:
+
+  PYTHONPATH=. python testing/benchmark_similarity.py
+"""
+import argparse
+import time
+from functools import partial
+import numpy as np
+import pandas as pd
+from numpy.linalg import norm
+from utils.vector_helper import normalize, top_k_similar
+
+# embedding dimensions generated by TextEmbeddingModel
+DIMENSIONS = 768
+
+CANDIDATE_COUNTS = [10, 1000, 100000]
+
+# the legacy implementation is too slow to run on very large inputs
+MAX_LEGACY_CANDIDATES = 10000
+
+
+def legacy_similarity(query_embeddings, candidate_embeddings) -> list:
+  """ previous get_similarity implementation """
+  query_df = pd.DataFrame(query_embeddings.transpose())
+  sentence_df = pd.DataFrame(candidate_embeddings)
+  cos_sim = []
+  for _, row in sentence_df.iterrows():
+    cosine = np.dot(row, query_df) / (norm(row) * norm(query_df))
+    cos_sim.append(cosine[0])
+  return cos_sim
+
+
+def legacy_top_k(query_embeddings, candidate_embeddings, k: int):
+  return np.argsort(legacy_similarity(query_embeddings,
+                                      candidate_embeddings))[-k:]
+
+
+def time_ms(fn, iterations: int) -> float:
+  start = time.perf_counter()
+  for _ in range(iterations):
+    fn()
+  return (time.perf_counter() - start) * 1000 / iterations
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--k", type=int, default=5)
+  parser.add_argument("--iterations", type=int, default=20)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  query_embeddings = rng.normal(size=(1, DIMENSIONS))
+
+  print(f"{'candidates':>10} {'legacy ms':>10} {'numpy ms':>10} "
+        f"{'prenorm ms':>10} {'speedup':>8}")
+  for num_candidates in CANDIDATE_COUNTS:
+    candidates = rng.normal(size=(num_candidates, DIMENSIONS))
+    normalized_candidates = normalize(candidates)
+
+    numpy_ms = time_ms(
+        partial(top_k_similar, query_embeddings, candidates, args.k),
+        args.iterations)
+    prenorm_ms = time_ms(
+        partial(top_k_similar, query_embeddings, normalized_candidates,
+                args.k, normalized=True),
+        args.iterations)
+
+    if num_candidates <= MAX_LEGACY_CANDIDATES:
+      legacy_ms = time_ms(
+          partial(legacy_top_k, query_embeddings, candidates, args.k),
+          max(1, args.iterations // 10))
+      legacy = f"{legacy_ms:10.3f}"
+      speedup = f"{legacy_ms / numpy_ms:7.0f}x"
+    else:
+      legacy = f"{'skipped':>10}"
+      speedup = f"{'-':>8}"
+
+    print(f"{num_candidates:>10} {legacy} {numpy_ms:10.3f} "
+          f"{prenorm_ms:10.3f} {speedup}")
+
+
+if __name__ == "__main__":
+  main()
@@ -29,3 +29,12 @@ class ContextWindowExceededException(Exception):
   def __init__(self, message="Context window length exceeded"):
     self.message = message
     super().__init__(self.message)
+
+class EmbeddingsFailedException(Exception):
+  """
+  Exception raised when embeddings could not be generated for all
+  chunks of a document
+  """
+  def __init__(self, message="Failed to generate embeddings"):
+    self.message = message
+    super().__init__(self.message)
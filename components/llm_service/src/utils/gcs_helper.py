@@ -16,13 +16,49 @@
 """
 Google Storage helper functions.
 """
+import os
+import threading
 from pathlib import Path
 from typing import List
 from common.utils.logging_handler import Logger
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from config import PROJECT_ID, GCS_DOWNLOAD_WORKERS
 
 Logger = Logger.get_logger(__file__)
 
+# connections kept open to GCS by the shared storage client
+GCS_MAX_CONNECTIONS = max(10, GCS_DOWNLOAD_WORKERS * 2)
+
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client() -> storage.Client:
+  """
+  Shared storage client of the process. Its HTTP connection pool is sized
+  for concurrent transfers, so threads reuse connections rather than
+  opening new ones.
+  """
+  global _storage_client
+  if _storage_client is None:
+    with _storage_client_lock:
+      if _storage_client is None:
+        client = storage.Client(project=PROJECT_ID)
+        adapter = HTTPAdapter(pool_connections=GCS_MAX_CONNECTIONS,
+                              pool_maxsize=GCS_MAX_CONNECTIONS)
+        # pylint: disable=protected-access
+        client._http.mount("https://", adapter)
+        _storage_client = client
+  return _storage_client
+
+def _reset_storage_client():
+  # connections of the parent process are not shared with forked children
+  global _storage_client
+  _storage_client = None
+
+os.register_at_fork(after_in_child=_reset_storage_client)
+
 def clear_bucket(storage_client: storage.Client, bucket_name: str) -> None:
   """
   Delete all the contents of the specified GCS bucket
@@ -15,30 +15,81 @@
 # pylint: disable=unused-argument,broad-exception-raised
 """
 HTML helper functions.
+
+Pages are parsed once with the lxml backend by extract_html, which
+produces the trimmed HTML, text, title, headings and links of a page.
+Extracts are cached as JSON next to downloaded pages, so pages are not
+parsed again when indexed.
 """
 
-from typing import List
+import json
+import os
+from typing import List, Optional, Tuple
 from w3lib.html import replace_escape_chars
 from bs4 import BeautifulSoup, Comment
-from utils.text_helper import nlp
+
+# lxml is several times faster than the pure python html.parser backend.
+# Its trimmed HTML differs from html.parser's: fragments are wrapped in
+# <html><body>, and malformed markup is re-nested as a browser would, e.g.
+# <div><p>a<p>b</div> becomes <div><p>a</p><p>b</p></div>, where
+# html.parser nests the second paragraph in the first.
+HTML_PARSER = "lxml"
 
 TAGS_TO_REMOVE = ["script", "style", "footer", "nav", "aside", "form", "meta",
                   "iframe", "header", "button", "input", "select", "textarea",
                   "noscript", "img", "figure", "figcaption", "link"]
 
+HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+
+# suffix of the cached extract of a downloaded page
+HTML_EXTRACT_SUFFIX = ".extract.json"
+
+
+class HtmlExtract():
+  """ trimmed HTML, text and structure of a HTML page """
+  def __init__(self,
+               html: str = "",
+               text: str = "",
+               title: str = None,
+               headings: List[str] = None,
+               links: List[str] = None):
+    self.html = html
+    self.text = text
+    self.title = title
+    self.headings = headings or []
+    self.links = links or []
+
+  @staticmethod
+  def cache_path(html_filepath: str) -> str:
+    return html_filepath + HTML_EXTRACT_SUFFIX
+
+  def save(self, html_filepath: str) -> str:
+    """ cache the extract, without the html, next to a saved page """
+    extract_filepath = self.cache_path(html_filepath)
+    with open(extract_filepath, "w", encoding="utf-8") as f:
+      json.dump({"text": self.text, "title": self.title,
+                 "headings": self.headings, "links": self.links}, f)
+    return extract_filepath
+
+  @classmethod
+  def load(cls, html_filepath: str) -> Optional["HtmlExtract"]:
+    """ the cached extract of a saved page, or None if not cached """
+    extract_filepath = cls.cache_path(html_filepath)
+    if not os.path.exists(extract_filepath):
+      return None
+    with open(extract_filepath, "r", encoding="utf-8") as f:
+      return cls(**json.load(f))
+
+
+def _clean_soup(soup: BeautifulSoup, tags_to_trim: list = None) -> \
+    Tuple[List[str], List[str]]:
+  """
+  Remove tags in tags_to_trim (TAGS_TO_REMOVE by default), comments, and
+  all attributes except href of <a> tags, in place.
 
-def get_clean_html_soup(
-    html_content:str, tags_to_trim:list = None) -> BeautifulSoup:
-  """Get BeautifulSoup object with cleaned tags and context.
-     It removes tags in TAGS_TO_REMOVE by default.
-
-  Args:
-      html_content (str): The HTML content.
-      tags_to_trim (str): List of tags to remove.
   Returns:
-      BeautifulSoup: Soup object for further operation.
+    the text of headings, and the hrefs of links, in document order
   """
-  soup = BeautifulSoup(html_content, "html.parser")
   if not tags_to_trim:
     tags_to_trim = TAGS_TO_REMOVE
 
@@ -53,28 +104,72 @@ def get_clean_html_soup(
 
   # Remove all attributes except href from <a> tags
   # and all attributes from other tags
+  headings = []
+  links = []
   for tag in soup.find_all(True):
     if tag.name == "a":
       href = tag.get("href")
       tag.attrs = {}
       if href:
         tag["href"] = href
+        links.append(href)
     else:
       tag.attrs = {}
+      if tag.name in HEADING_TAGS:
+        heading = tag.get_text(separator=" ", strip=True)
+        if heading:
+          headings.append(heading)
+
+  return headings, list(dict.fromkeys(links))
+
+def get_clean_html_soup(
+    html_content:str, tags_to_trim:list = None) -> BeautifulSoup:
+  """Get BeautifulSoup object with cleaned tags and context.
+     It removes tags in TAGS_TO_REMOVE by default.
 
+  Args:
+      html_content (str): The HTML content.
+      tags_to_trim (str): List of tags to remove.
+  Returns:
+      BeautifulSoup: Soup object for further operation.
+  """
+  soup = BeautifulSoup(html_content, HTML_PARSER)
+  _clean_soup(soup, tags_to_trim)
   return soup
 
+def extract_html(html_content: str, tags_to_trim: list = None,
+                 parser: str = HTML_PARSER) -> HtmlExtract:
+  """
+  Extract the trimmed HTML, text, title, headings and links of a page in
+  one parse.
+
+  Args:
+      html_content (str): The HTML content.
+      tags_to_trim (str): List of tags to remove.
+      parser (str): BeautifulSoup parser backend.
+  Returns:
+      HtmlExtract of the page.
+  """
+  soup = BeautifulSoup(html_content, parser)
+  title = soup.title.get_text(strip=True) if soup.title else None
+  headings, links = _clean_soup(soup, tags_to_trim)
+  return HtmlExtract(
+    html=replace_escape_chars(str(soup)),
+    text=replace_escape_chars(soup.get_text(separator=" ")),
+    title=title,
+    headings=headings,
+    links=links
+  )
+
 def html_to_text(html_content:str, tags_to_trim:list = None) -> str:
   """Return text from a html content.
 
   Args:
       html_content (str): The HTML content.
   Returns:
-      BeautifulSoup: Soup object for further operation.
+      str: The text of the HTML content.
   """
-  soup = get_clean_html_soup(html_content, tags_to_trim)
-  clean_text = replace_escape_chars(soup.get_text(separator=" "))
-  return clean_text
+  return extract_html(html_content, tags_to_trim).text
 
 
 def html_trim_tags(html_content:str, tags_to_trim:list = None) -> str:
@@ -87,18 +182,4 @@ def html_trim_tags(html_content:str, tags_to_trim:list = None) -> str:
   Returns:
       str: The HTML content without <script> tags and CSS references.
   """
-  # Parse the HTML content
-  soup = get_clean_html_soup(html_content, tags_to_trim)
-
-  # Replace HTML escape characters with their equivalents
-  clean_text = replace_escape_chars(str(soup))
-  return clean_text
-
-
-def html_to_sentence_list(text: str) -> List[str]:
-  # use spacy to split text into sentences
-  clean_text = html_to_text(text)
-  document = nlp(clean_text)
-  sentences = document.sents
-  sentences = [str(x) for x in sentences]
-  return sentences
+  return extract_html(html_content, tags_to_trim).html
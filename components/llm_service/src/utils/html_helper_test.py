@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for HTML helper functions
+"""
+import os
+from utils.html_helper import HtmlExtract, extract_html
+
+HTML_PAGE = """
+<html>
+<head><title>Page Title</title><script>var x = 1;</script></head>
+<body class="main">
+  <nav><a href="/menu">Menu</a></nav>
+  <h1 id="top">Main <b>Heading</b></h1>
+  <!-- a comment -->
+  <p style="color: red">First paragraph with a <a href="/next" class="x">link</a>.</p>
+  <h2>Second heading</h2>
+  <p>Second paragraph &amp; more. <a href="/next">Again</a></p>
+</body>
+</html>
+"""
+
+
+def test_extract_html(tmp_path):
+  html_extract = extract_html(HTML_PAGE)
+  assert html_extract.title == "Page Title"
+  assert html_extract.headings == ["Main Heading", "Second heading"]
+  # links of removed tags are dropped, and links are unique
+  assert html_extract.links == ["/next"]
+  assert "<body><h1>Main <b>Heading</b></h1>" in html_extract.html
+  assert '<a href="/next">link</a>' in html_extract.html
+  assert "script" not in html_extract.html
+  assert "comment" not in html_extract.html
+  text = " ".join(html_extract.text.split())
+  assert text == "Page Title Main Heading First paragraph with a link . " \
+      "Second heading Second paragraph & more. Again"
+
+  # extracts are cached next to the saved page, without the html
+  html_filepath = os.path.join(tmp_path, "page.html")
+  assert HtmlExtract.load(html_filepath) is None
+  html_extract.save(html_filepath)
+  cached_extract = HtmlExtract.load(html_filepath)
+  assert cached_extract.text == html_extract.text
+  assert cached_extract.headings == html_extract.headings
+  assert cached_extract.links == html_extract.links
+  assert cached_extract.html == ""
+
+
+def test_extract_html_lxml_markup():
+  # trimmed HTML is as parsed by lxml, so pages uploaded for search are
+  # well formed even if the crawled markup is not
+  html_extract = extract_html("<div><p>a<p>b</div>")
+  assert html_extract.html == \
+      "<html><body><div><p>a</p><p>b</p></div></body></html>"
+  assert html_extract.text == "a b"
+
+  html_extract = extract_html(
+      "<html><head><title>T</title></head>"
+      "<body><div><p>a<p>b</div><br>c</body></html>")
+  assert html_extract.html == "<html><head><title>T</title></head>" \
+      "<body><div><p>a</p><p>b</p></div><br/>c</body></html>"
@@ -0,0 +1,151 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+PDF text extraction.
+
+Pages of large PDFs are extracted in a pool of worker processes, each
+opening the file and extracting a range of pages. Page text is yielded in
+page order, and at most twice PDF_EXTRACT_WORKERS page ranges are
+extracted ahead of the consumer, so memory use is bounded by the range
+size rather than the document size. Pages that fail to extract, or take
+longer than PDF_EXTRACT_PAGE_TIMEOUT seconds, are skipped.
+"""
+# pylint: disable=broad-exception-caught
+
+import multiprocessing
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Generator, List, Optional
+from common.utils.logging_handler import Logger
+from pypdf import PdfReader
+from config import (PDF_EXTRACT_WORKERS, PDF_EXTRACT_PAGES_PER_TASK,
+                    PDF_EXTRACT_PAGE_TIMEOUT, PDF_PARALLEL_MIN_PAGES)
+
+Logger = Logger.get_logger(__file__)
+
+
+class PageTimeoutError(Exception):
+  """ page text extraction took longer than the page timeout """
+
+
+def _raise_page_timeout(signum, frame):
+  raise PageTimeoutError()
+
+def extract_page_text(reader: PdfReader, page: int,
+                      page_timeout: float) -> Optional[str]:
+  """
+  Extract the text of a page, or None if extraction fails or times out.
+  The timeout is only applied in the main thread of a process, where
+  signals are delivered.
+  """
+  use_alarm = page_timeout > 0 and \
+      threading.current_thread() is threading.main_thread()
+  if use_alarm:
+    previous_handler = signal.signal(signal.SIGALRM, _raise_page_timeout)
+    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+  try:
+    return reader.pages[page].extract_text()
+  except PageTimeoutError:
+    Logger.error(f"timed out extracting text of page {page}")
+  except Exception as e:
+    Logger.error(f"error extracting text of page {page}: {e}")
+  finally:
+    if use_alarm:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+      signal.signal(signal.SIGALRM, previous_handler)
+  return None
+
+def extract_page_range(doc_filepath: str, start: int, end: int,
+                       page_timeout: float) -> List[Optional[str]]:
+  """ text of pages start to end of a PDF, None for skipped pages """
+  reader = PdfReader(doc_filepath)
+  return [extract_page_text(reader, page, page_timeout)
+          for page in range(start, end)]
+
+def extract_pdf_pages(doc_name: str, doc_filepath: str,
+                      workers: int = PDF_EXTRACT_WORKERS,
+                      pages_per_task: int = PDF_EXTRACT_PAGES_PER_TASK,
+                      page_timeout: float = PDF_EXTRACT_PAGE_TIMEOUT) \
+    -> Generator[str, None, None]:
+  """
+  Extract the text of the pages of a PDF.
+
+  The file is opened when called, so unreadable files raise here. Page
+  text is extracted as the returned generator is consumed, in a pool of
+  worker processes for PDFs of at least PDF_PARALLEL_MIN_PAGES pages.
+
+  Args:
+    doc_name: name of document, for logging
+    doc_filepath: local file path
+    workers: worker processes, 1 to extract pages in this process
+    pages_per_task: pages extracted by a worker per task
+    page_timeout: seconds allowed to extract a page, 0 for no limit
+  Returns:
+    generator of the text of each page, in page order
+  """
+  reader = PdfReader(doc_filepath)
+  num_pages = len(reader.pages)
+  Logger.info(f"Reading pdf file {doc_name} with {num_pages} pages")
+  if workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES:
+    page_texts = (extract_page_text(reader, page, page_timeout)
+                  for page in range(num_pages))
+  else:
+    page_texts = _extract_pages_in_pool(doc_filepath, num_pages, workers,
+                                        pages_per_task, page_timeout)
+  return _log_pdf_pages(doc_name, num_pages, page_texts)
+
+def _extract_pages_in_pool(doc_filepath: str, num_pages: int, workers: int,
+                           pages_per_task: int, page_timeout: float) \
+    -> Generator[Optional[str], None, None]:
+  # spawn rather than fork, as forking a process with active grpc
+  # clients is unsafe
+  mp_context = multiprocessing.get_context("spawn")
+  max_pending = workers * 2
+  with ProcessPoolExecutor(max_workers=workers,
+                           mp_context=mp_context) as executor:
+    futures = deque()
+    for start in range(0, num_pages, pages_per_task):
+      end = min(start + pages_per_task, num_pages)
+      if len(futures) >= max_pending:
+        yield from _page_range_result(futures.popleft())
+      futures.append((start, end, executor.submit(
+          extract_page_range, doc_filepath, start, end, page_timeout)))
+    while futures:
+      yield from _page_range_result(futures.popleft())
+
+def _page_range_result(page_range_future) -> List[Optional[str]]:
+  start, end, future = page_range_future
+  try:
+    return future.result()
+  except Exception as e:
+    # e.g. a worker process died extracting the pages; skip them
+    Logger.error(f"error extracting text of pages {start} to {end}: {e}")
+    return [None] * (end - start)
+
+def _log_pdf_pages(doc_name: str, num_pages: int,
+                   page_texts) -> Generator[str, None, None]:
+  start_time = time.monotonic()
+  num_skipped = 0
+  for page_text in page_texts:
+    if page_text is None:
+      num_skipped += 1
+    else:
+      yield page_text
+  Logger.info(f"Finished reading pdf file {doc_name}: {num_pages} pages "
+              f"({num_skipped} skipped) in "
+              f"{time.monotonic() - start_time:.2f}s")
@@ -0,0 +1,92 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for PDF text extraction
+"""
+# pylint: disable=wrong-import-position
+import os
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from utils.pdf_helper import extract_page_text, extract_pdf_pages
+
+
+def write_pdf(path: str, page_texts: list):
+  """ write a PDF with a line of text on each page """
+  num_pages = len(page_texts)
+  page_ids = [3 + i * 2 for i in range(num_pages)]
+  objects = [
+    b"<< /Type /Catalog /Pages 2 0 R >>",
+    (f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] "
+     f"/Count {num_pages} >>").encode()
+  ]
+  font_id = 3 + num_pages * 2
+  for page_id, text in zip(page_ids, page_texts):
+    objects.append(
+        (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+         f"/Resources << /Font << /F1 {font_id} 0 R >> >> "
+         f"/Contents {page_id + 1} 0 R >>").encode())
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects.append(b"<< /Length %d >>\nstream\n%s\nendstream"
+                   % (len(stream), stream))
+  objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+  pdf = bytearray(b"%PDF-1.4\n")
+  offsets = []
+  for i, obj in enumerate(objects):
+    offsets.append(len(pdf))
+    pdf += b"%d 0 obj\n%s\nendobj\n" % (i + 1, obj)
+  xref_offset = len(pdf)
+  pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+  for offset in offsets:
+    pdf += b"%010d 00000 n \n" % offset
+  pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" \
+      % (len(objects) + 1, xref_offset)
+  with open(path, "wb") as f:
+    f.write(pdf)
+
+
+def test_extract_pdf_pages(tmp_path):
+  page_texts = [f"Text of page {i}." for i in range(7)]
+  path = os.path.join(tmp_path, "doc.pdf")
+  write_pdf(path, page_texts)
+
+  pages = extract_pdf_pages("doc.pdf", path, workers=1)
+  assert [page.strip() for page in pages] == page_texts
+
+  # page ranges extracted in worker processes are streamed in page order
+  with mock.patch("utils.pdf_helper.PDF_PARALLEL_MIN_PAGES", 2):
+    pages = extract_pdf_pages("doc.pdf", path, workers=2, pages_per_task=2)
+    assert [page.strip() for page in pages] == page_texts
+
+
+def test_extract_page_text_skips_pages():
+  def slow_extract_text():
+    time.sleep(5)
+    return "slow"
+  def failed_extract_text():
+    raise ValueError("bad page")
+  reader = SimpleNamespace(pages=[
+    SimpleNamespace(extract_text=lambda: "page"),
+    SimpleNamespace(extract_text=slow_extract_text),
+    SimpleNamespace(extract_text=failed_extract_text)
+  ])
+  assert extract_page_text(reader, 0, page_timeout=1) == "page"
+  start_time = time.monotonic()
+  assert extract_page_text(reader, 1, page_timeout=0.1) is None
+  assert time.monotonic() - start_time < 1
+  assert extract_page_text(reader, 2, page_timeout=1) is None
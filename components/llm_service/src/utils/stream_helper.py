@@ -0,0 +1,47 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Streaming response helper functions.
+
+Streamed responses are newline delimited JSON (NDJSON). Each line is an
+event object with a "type" and "data" field:
+
+  {"type": "references", "data": [...]}   query references, sent first
+  {"type": "token", "data": "..."}        a chunk of generated text
+  {"type": "done", "data": {...}}         the saved chat or query result
+  {"type": "error", "data": "..."}        generation failed, nothing saved
+"""
+import json
+from typing import Any, AsyncIterator
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+EVENT_REFERENCES = "references"
+EVENT_TOKEN = "token"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+
+
+def ndjson_event(event_type: str, data: Any) -> str:
+  """ serialize a stream event as a line of NDJSON """
+  return json.dumps({"type": event_type, "data": data}, default=str) + "\n"
+
+def ndjson_response(events: AsyncIterator[str]) -> StreamingResponse:
+  """ streaming response for an async iterator of NDJSON events """
+  return StreamingResponse(
+      events,
+      media_type=NDJSON_MEDIA_TYPE,
+      # disable proxy buffering so tokens reach the client as generated
+      headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
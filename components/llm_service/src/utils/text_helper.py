@@ -18,8 +18,9 @@ Text processing helper functions.
 # pylint: disable=broad-exception-caught
 
 import re
-from typing import List
+from typing import Generator, Iterable, List
 from common.utils.logging_handler import Logger
+from config import SENTENCE_SEGMENT_BATCH_SIZE, SENTENCE_SEGMENT_PROCESSES
 import spacy
 
 Logger = Logger.get_logger(__file__)
@@ -52,11 +53,113 @@ def clean_text(text):
 
   return cleaned_text
 
+# pipeline components not needed for sentence boundaries, which are set by
+# the dependency parser (or the sentencizer of the fallback pipeline)
+SENTENCE_SEGMENT_DISABLE = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+# texts are split on line breaks into segments of at most this many
+# characters, to stay well under the spacy max_length and batch long docs
+MAX_SEGMENT_LENGTH = 100000
+
+def split_segments(text: str,
+                   max_length: int = MAX_SEGMENT_LENGTH) -> List[str]:
+  """ split text on line breaks into segments of at most max_length chars """
+  if len(text) <= max_length:
+    return [text]
+  segments = []
+  segment = ""
+  for line in text.splitlines(keepends=True):
+    if segment and len(segment) + len(line) > max_length:
+      segments.append(segment)
+      segment = ""
+    # a line longer than a segment is split wherever it reaches max_length
+    while len(line) > max_length:
+      segments.append(line[:max_length])
+      line = line[max_length:]
+    segment += line
+  if segment:
+    segments.append(segment)
+  return segments
+
+def join_segments(texts: Iterable[str],
+                  max_length: int = MAX_SEGMENT_LENGTH) \
+    -> Generator[str, None, None]:
+  """
+  join texts with line breaks into segments of at most max_length chars,
+  splitting longer texts
+  """
+  segment = None
+  for text in texts:
+    for part in split_segments(text, max_length):
+      if segment is None:
+        segment = part
+      elif len(segment) + len(part) + 1 > max_length:
+        yield segment
+        segment = part
+      else:
+        segment += "\n" + part
+  if segment is not None:
+    yield segment
+
+def _pipe(segments: Iterable[str], batch_size: int, n_process: int):
+  disable = [name for name in SENTENCE_SEGMENT_DISABLE
+             if name in nlp.pipe_names]
+  return nlp.pipe(segments, batch_size=batch_size, n_process=n_process,
+                  disable=disable)
+
+def _document_sentences(document) -> List[str]:
+  return [sentence.text.strip() for sentence in document.sents
+          if sentence.text.strip()]
+
+def split_sentences(texts: List[str],
+                    batch_size: int = SENTENCE_SEGMENT_BATCH_SIZE,
+                    n_process: int = SENTENCE_SEGMENT_PROCESSES) \
+    -> List[List[str]]:
+  """
+  Split texts into sentences in one nlp.pipe pass, with the pipeline
+  components not needed for sentence boundaries disabled.
+
+  Args:
+    texts: texts to split
+    batch_size: texts processed per spacy batch
+    n_process: spacy worker processes, 1 to process in this process
+  Returns:
+    the list of non-empty sentences of each text
+  """
+  segments = []
+  text_indexes = []
+  for i, text in enumerate(texts):
+    for segment in split_segments(text):
+      segments.append(segment)
+      text_indexes.append(i)
+
+  sentences = [[] for _ in texts]
+  documents = _pipe(segments, batch_size, n_process)
+  for i, document in zip(text_indexes, documents):
+    sentences[i].extend(_document_sentences(document))
+  return sentences
+
+def iter_sentences(texts: Iterable[str],
+                   batch_size: int = SENTENCE_SEGMENT_BATCH_SIZE,
+                   n_process: int = SENTENCE_SEGMENT_PROCESSES) \
+    -> Generator[str, None, None]:
+  """
+  Split a stream of texts, such as the pages of a document, into
+  sentences. Texts are joined with line breaks into segments of up to
+  MAX_SEGMENT_LENGTH chars as they are read, so sentences may span texts
+  within a segment, and only a batch of segments is held in memory.
+
+  Args:
+    texts: texts to split, in order
+    batch_size: segments processed per spacy batch
+    n_process: spacy worker processes, 1 to process in this process
+  Yields:
+    non-empty sentences, in order
+  """
+  for document in _pipe(join_segments(texts), batch_size, n_process):
+    yield from _document_sentences(document)
+
 def text_to_sentence_list(text: str) -> List[str]:
   # use spacy to split text into sentences
-  cleaned_text = clean_text(text)
-  document = nlp(cleaned_text)
-  sentences = document.sents
-  sentences = [str(x) for x in list(sentences)]
-  return sentences
+  return split_sentences([clean_text(text)], n_process=1)[0]
 
@@ -0,0 +1,59 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for text helper functions
+"""
+# pylint: disable=wrong-import-position
+import os
+
+os.environ["PROJECT_ID"] = "fake-project"
+
+from utils.text_helper import (iter_sentences, join_segments, split_segments,
+                               split_sentences, text_to_sentence_list)
+
+
+def test_split_segments():
+  assert split_segments("short text", max_length=20) == ["short text"]
+  text = "line one\nline two\nline three\n"
+  segments = split_segments(text, max_length=20)
+  assert segments == ["line one\nline two\n", "line three\n"]
+  # lines longer than a segment are split
+  segments = split_segments("a" * 25 + "\nb\n", max_length=10)
+  assert segments == ["a" * 10, "a" * 10, "aaaaa\nb\n"]
+  assert "".join(segments) == "a" * 25 + "\nb\n"
+
+
+def test_split_sentences():
+  texts = ["This is one. This is two.", "", "Another text here."]
+  sentences = split_sentences(texts, batch_size=2)
+  assert sentences == [["This is one.", "This is two."], [],
+                       ["Another text here."]]
+
+  # long texts are segmented and sentences are returned in order
+  long_text = "\n".join(f"Sentence number {i}." for i in range(50))
+  sentences = split_sentences([long_text])[0]
+  assert sentences == [f"Sentence number {i}." for i in range(50)]
+
+  assert text_to_sentence_list("First one.\x00 Second one.") == \
+      ["First one.", "Second one."]
+
+
+def test_iter_sentences():
+  pages = ["Page one. Still page", "one.", "", "Page three."]
+  assert list(join_segments(pages, max_length=20)) == \
+      ["Page one. Still page", "one.\n\nPage three."]
+  # sentences may continue across pages of a segment
+  assert list(iter_sentences(iter(pages))) == \
+      ["Page one.", "Still page\none.", "Page three."]
+  assert not list(iter_sentences([]))
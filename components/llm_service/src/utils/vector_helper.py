@@ -0,0 +1,97 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Embedding vector similarity helper functions.
+"""
+from typing import List, Tuple
+import numpy as np
+
+
+def normalize(vectors) -> np.ndarray:
+  """
+  L2 normalize a vector or the rows of a matrix of vectors, as float32.
+  Zero vectors are left as zeros.
+  """
+  vectors = np.asarray(vectors, dtype=np.float32)
+  norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+  norms[norms == 0] = 1.0
+  return vectors / norms
+
+def cosine_similarity(query_embedding, embeddings,
+                      normalized: bool = False) -> np.ndarray:
+  """
+  Cosine similarity of a query embedding with each row of a matrix of
+  embeddings, computed as a single matrix-vector product.
+
+  Args:
+    query_embedding: single embedding vector
+    embeddings: 2D array of candidate embeddings, one per row
+    normalized: True if embeddings are already L2 normalized, e.g. when
+      they are normalized once at index time
+  Returns:
+    1D array of similarity scores, one per candidate
+  """
+  query_embedding = normalize(np.ravel(query_embedding))
+  if not normalized:
+    embeddings = normalize(embeddings)
+  return embeddings @ query_embedding
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+  """
+  Indexes of the k highest scores, in descending score order. Uses
+  argpartition so only the top k candidates are sorted.
+  """
+  num_scores = len(scores)
+  k = min(k, num_scores)
+  if k <= 0:
+    return np.array([], dtype=np.int64)
+  if k < num_scores:
+    top_indexes = np.argpartition(scores, -k)[-k:]
+  else:
+    top_indexes = np.arange(num_scores)
+  return top_indexes[np.argsort(-scores[top_indexes])]
+
+def top_k_similar(query_embedding, embeddings, k: int,
+                  normalized: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Find the k embeddings most similar to a query embedding.
+
+  Returns:
+    Tuple of (indexes of the top k embeddings, their similarity scores),
+    in descending score order
+  """
+  scores = cosine_similarity(query_embedding, embeddings, normalized)
+  top_indexes = top_k(scores, k)
+  return top_indexes, scores[top_indexes]
+
+def top_k_similar_batch(query_embeddings, embeddings, k: int,
+                        normalized: bool = False) -> \
+                        List[Tuple[np.ndarray, np.ndarray]]:
+  """
+  Find the k embeddings most similar to each of several query embeddings,
+  scoring all queries with a single matrix product.
+
+  Returns:
+    list of (indexes of the top k embeddings, their similarity scores) per
+    query embedding, in descending score order
+  """
+  query_embeddings = normalize(np.atleast_2d(query_embeddings))
+  if not normalized:
+    embeddings = normalize(embeddings)
+  batch_scores = query_embeddings @ np.asarray(embeddings).T
+  results = []
+  for scores in batch_scores:
+    top_indexes = top_k(scores, k)
+    results.append((top_indexes, scores[top_indexes]))
+  return results
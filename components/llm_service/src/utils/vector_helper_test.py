@@ -0,0 +1,64 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Unit tests for vector helper functions
+"""
+import numpy as np
+from utils.vector_helper import (normalize, cosine_similarity, top_k,
+                                 top_k_similar, top_k_similar_batch)
+
+
+def test_cosine_similarity():
+  query_embedding = [1.0, 0.0]
+  embeddings = np.array([[2.0, 0.0], [0.0, 3.0], [-1.0, 0.0], [1.0, 1.0],
+                         [0.0, 0.0]])
+  scores = cosine_similarity(query_embedding, embeddings)
+  expected = [1.0, 0.0, -1.0, 1 / np.sqrt(2), 0.0]
+  assert np.allclose(scores, expected)
+
+  # pre-normalized embeddings give the same scores
+  scores = cosine_similarity(query_embedding, normalize(embeddings),
+                             normalized=True)
+  assert np.allclose(scores, expected)
+
+
+def test_top_k():
+  scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+  assert top_k(scores, 3).tolist() == [1, 3, 2]
+  assert top_k(scores, 10).tolist() == [1, 3, 2, 4, 0]
+  assert top_k(scores, 0).tolist() == []
+
+
+def test_top_k_similar():
+  rng = np.random.default_rng(0)
+  embeddings = rng.normal(size=(1000, 16))
+  query_embedding = embeddings[42] * 2
+  indexes, scores = top_k_similar(query_embedding, embeddings, 5)
+  assert indexes[0] == 42
+  assert np.isclose(scores[0], 1.0)
+  assert all(scores[i] >= scores[i + 1] for i in range(len(scores) - 1))
+
+
+def test_top_k_similar_batch():
+  rng = np.random.default_rng(0)
+  embeddings = rng.normal(size=(1000, 16))
+  query_embeddings = [embeddings[42] * 2, embeddings[7], -embeddings[7]]
+  results = top_k_similar_batch(query_embeddings, embeddings, 5)
+  assert len(results) == 3
+  for query_embedding, (indexes, scores) in zip(query_embeddings, results):
+    expected_indexes, expected_scores = top_k_similar(query_embedding,
+                                                      embeddings, 5)
+    assert indexes.tolist() == expected_indexes.tolist()
+    assert np.allclose(scores, expected_scores)
+
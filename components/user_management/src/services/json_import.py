@@ -153,10 +153,15 @@ def json_import_non_user(json_file, json_schema, model_obj, object_name):
         json_schema(**contents)
 
       if isinstance(contents, list):
+        # assign ids up front so uuids are set in a single batched write
+        new_content_objs = []
         for content in contents:
-          new_content_obj = model_obj()
-          new_content_uuid = add_data_to_db(content, new_content_obj)
-          inserted_data.append(new_content_uuid)
+          new_content_obj = model_obj().from_dict(content)
+          new_content_obj.id = model_obj.generate_id()
+          new_content_obj.uuid = new_content_obj.id
+          new_content_objs.append(new_content_obj)
+        model_obj.save_many(new_content_objs)
+        inserted_data = [obj.uuid for obj in new_content_objs]
       else:
         new_content_obj = model_obj()
         new_content_uuid = add_data_to_db(contents, new_content_obj)